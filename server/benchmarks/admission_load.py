@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Load test of chat admission control with a fake agent.
+
+One heavy user fires a burst of chat requests while several light users send
+requests at a steady pace. The same traffic is run twice against a fake agent
+with fixed latency:
+
+- baseline: a plain semaphore bounding concurrency, as the container does today
+- admission: per-user token buckets and the round-robin fair queue
+
+Latencies (queue wait + agent time) are reported per user class. Run from the
+repository root:
+
+    python server/benchmarks/admission_load.py
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'functions'))
+
+from admission_control import AdmissionController, AdmissionPolicy, AdmissionRejected
+from bench_utils import percentile, quiet
+
+
+def fake_agent(latency_seconds: float) -> None:
+    """Stand-in for an agent run."""
+    time.sleep(latency_seconds)
+
+
+def run_traffic(
+    gate: Callable[[str, Callable[[], None]], None],
+    args: argparse.Namespace
+) -> Dict[str, dict]:
+    """
+    Replay the heavy/light traffic mix through a gate.
+
+    Args:
+        gate: Function running a request of a user through admission
+        args: Command line arguments
+
+    Returns:
+        Dict[str, dict]: Latencies and rejection counts per user class
+    """
+    results = {
+        'heavy': {'latencies': [], 'rejected': 0},
+        'light': {'latencies': [], 'rejected': 0},
+    }
+    lock = threading.Lock()
+    threads: List[threading.Thread] = []
+
+    def request(uid: str, user_class: str) -> None:
+        started = time.monotonic()
+        try:
+            gate(uid, lambda: fake_agent(args.agent_latency))
+        except AdmissionRejected:
+            with lock:
+                results[user_class]['rejected'] += 1
+            return
+        with lock:
+            results[user_class]['latencies'].append(time.monotonic() - started)
+
+    def spawn(uid: str, user_class: str) -> None:
+        thread = threading.Thread(target=request, args=(uid, user_class))
+        thread.start()
+        threads.append(thread)
+
+    # Heavy user bursts all requests at once
+    for _ in range(args.heavy_requests):
+        spawn('heavy-user', 'heavy')
+
+    # Light users send requests at a steady pace during the burst
+    for round_index in range(args.light_rounds):
+        for user_index in range(args.light_users):
+            spawn(f'light-user-{user_index}', 'light')
+        time.sleep(args.light_interval)
+
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def report(name: str, results: Dict[str, dict]) -> None:
+    """Print latency percentiles per user class."""
+    print(f"\n{name}")
+    print(f"{'class':<8}{'done':>6}{'rejected':>10}{'p50 (s)':>10}{'p95 (s)':>10}{'p99 (s)':>10}")
+    for user_class, data in results.items():
+        latencies = data['latencies']
+        print(
+            f"{user_class:<8}{len(latencies):>6}{data['rejected']:>10}"
+            f"{percentile(latencies, 50):>10.3f}{percentile(latencies, 95):>10.3f}{percentile(latencies, 99):>10.3f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--max-concurrent', type=int, default=4)
+    parser.add_argument('--agent-latency', type=float, default=0.2)
+    parser.add_argument('--heavy-requests', type=int, default=60)
+    parser.add_argument('--light-users', type=int, default=5)
+    parser.add_argument('--light-rounds', type=int, default=6)
+    parser.add_argument('--light-interval', type=float, default=0.3)
+    args = parser.parse_args()
+
+    semaphore = threading.Semaphore(args.max_concurrent)
+
+    def baseline_gate(uid: str, handler: Callable[[], None]) -> None:
+        with semaphore:
+            handler()
+
+    controller = AdmissionController(
+        'chat',
+        AdmissionPolicy(
+            bucket_capacity=10,
+            refill_per_second=2,
+            max_concurrent=args.max_concurrent,
+            max_queue_wait_seconds=10,
+            max_queued_per_user=8,
+        ),
+        backend='memory',
+    )
+
+    def admission_gate(uid: str, handler: Callable[[], None]) -> None:
+        with controller.admit(uid):
+            handler()
+
+    report('baseline (semaphore)', run_traffic(baseline_gate, args))
+    # Silence the per-request rejection logs of the controller
+    with quiet():
+        admission_results = run_traffic(admission_gate, args)
+    report('admission control (token bucket + fair queue)', admission_results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Compare ingesting a folder file by file with ingesting it as one archive.
+
+Uploads the same set of documents once as separate objects, each running its
+own vectorization pipeline, and once as a single .zip, against the in-memory
+fakes. Prints wall time, OpenAI calls and Firestore writes of both. The
+behaviour of archive ingestion is covered by
+server/tests/test_archive_ingestion.py. Run from the repository root:
+
+    python server/benchmarks/archive_fanout.py
+    python server/benchmarks/archive_fanout.py --files 200 --openai-latency-ms 50
+"""
+import argparse
+import io
+import sys
+import time
+import zipfile
+
+from bench_utils import quiet
+from fakes import FakeConfig, Fakes, install_fakes
+
+
+BUCKET = 'archive-bucket'
+USER_ID = 'archive-user'
+
+
+def document_bytes(index: int, size: int) -> bytes:
+    return b'%PDF-1.7\n' + str(index).encode() * (size // len(str(index)))
+
+
+def run_separate(fakes: Fakes, files: int, size: int) -> dict:
+    """Each document is its own upload and pipeline run."""
+    from vectorize_file import run_vectorize_file
+
+    fakes.reset()
+    for index in range(files):
+        fakes.storage.put(BUCKET, f'user-documents/{USER_ID}/doc{index}.pdf', document_bytes(index, size), 'application/pdf')
+    started = time.perf_counter()
+    with quiet():
+        for index in range(files):
+            run_vectorize_file(f'user-documents/{USER_ID}/doc{index}.pdf', BUCKET, '1')
+    return {
+        'wall_s': round(time.perf_counter() - started, 2),
+        'invocations': files,
+        'openai_calls': sum(fakes.openai.stats.calls.values()),
+        'firestore_writes': fakes.db.stats.writes,
+    }
+
+
+def run_archive(fakes: Fakes, files: int, size: int) -> dict:
+    """All documents in one .zip and one pipeline run."""
+    from vectorize_file import run_vectorize_file
+
+    fakes.reset()
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for index in range(files):
+            archive.writestr(f'folder/doc{index}.pdf', document_bytes(index, size))
+    fakes.storage.put(BUCKET, f'user-documents/{USER_ID}/folder.zip', buffer.getvalue(), 'application/zip')
+    started = time.perf_counter()
+    with quiet():
+        run_vectorize_file(f'user-documents/{USER_ID}/folder.zip', BUCKET, '1')
+    return {
+        'wall_s': round(time.perf_counter() - started, 2),
+        'invocations': 1,
+        'openai_calls': sum(fakes.openai.stats.calls.values()),
+        'firestore_writes': fakes.db.stats.writes,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=50)
+    parser.add_argument('--file-kb', type=int, default=64)
+    parser.add_argument('--firestore-latency-ms', type=float, default=5)
+    parser.add_argument('--openai-latency-ms', type=float, default=30)
+    args = parser.parse_args()
+
+    fakes = install_fakes(FakeConfig(
+        firestore_latency=args.firestore_latency_ms / 1000,
+        openai_latency=args.openai_latency_ms / 1000,
+    ))
+
+    size = args.file_kb * 1024
+    for name, scenario in (('separate uploads', run_separate), ('single archive', run_archive)):
+        result = scenario(fakes, args.files, size)
+        print(f"{name:<18} " + ' '.join(f"{key}={value}" for key, value in result.items()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
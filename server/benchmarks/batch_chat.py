@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Compare answering a list of questions through chat one at a time with one batch_chat call.
+
+Runs the same prompts against the in-memory fakes, once as sequential chat
+turns and once as a batch, and prints wall time, Firestore operations and the
+most agent runs in flight at once of both. The behaviour of batch_chat is
+covered by server/tests/test_batch_chat.py. Run from the repository root:
+
+    python server/benchmarks/batch_chat.py
+    python server/benchmarks/batch_chat.py --prompts 50 --agent-latency-ms 500
+"""
+import argparse
+import sys
+import time
+
+from bench_utils import quiet
+from fakes import FakeConfig, Fakes, install_fakes
+
+
+USER_ID = 'batch-user'
+
+
+def prompts_for(count: int) -> list:
+    return [f"What does section {index} of the contract say about termination fees?" for index in range(count)]
+
+
+def seed(fakes: Fakes) -> None:
+    fakes.reset()
+    fakes.db.documents[f'user_vector_stores/{USER_ID}'] = {'vector_store_ids': ['vs_batch']}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--prompts', type=int, default=30)
+    parser.add_argument('--agent-latency-ms', type=float, default=200)
+    parser.add_argument('--firestore-latency-ms', type=float, default=5)
+    args = parser.parse_args()
+
+    fakes = install_fakes(FakeConfig(
+        firestore_latency=args.firestore_latency_ms / 1000,
+        agent_latency=args.agent_latency_ms / 1000,
+    ))
+    from batch_chat import run_batch_chat, BATCH_CHAT_CONCURRENCY
+    from chat import run_chat
+
+    prompts = prompts_for(args.prompts)
+
+    seed(fakes)
+    started = time.perf_counter()
+    with quiet():
+        for prompt in prompts:
+            run_chat(USER_ID, prompt, 'review-session')
+    sequential_s = time.perf_counter() - started
+    print(f"sequential chat  wall_s={sequential_s:.2f} firestore_reads={fakes.db.stats.reads} "
+          f"firestore_writes={fakes.db.stats.writes} peak_runs_in_flight={fakes.runner.stats.peak_in_flight}")
+
+    seed(fakes)
+    started = time.perf_counter()
+    with quiet():
+        response = run_batch_chat(USER_ID, prompts)
+    batch_s = time.perf_counter() - started
+    print(f"batch_chat       wall_s={batch_s:.2f} firestore_reads={fakes.db.stats.reads} "
+          f"firestore_writes={fakes.db.stats.writes} peak_runs_in_flight={fakes.runner.stats.peak_in_flight} "
+          f"concurrency={BATCH_CHAT_CONCURRENCY} answers={len(response['data']['answers']) if response['success'] else 0}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
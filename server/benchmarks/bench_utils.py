@@ -0,0 +1,28 @@
+"""Shared helpers of the benchmark scripts."""
+import contextlib
+import io
+from typing import Dict, Iterator, List
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of values."""
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    """p50/p95/p99 of latencies given in seconds, reported in milliseconds."""
+    return {
+        f"p{pct}_ms": round(percentile(latencies, pct) * 1000, 2)
+        for pct in (50, 95, 99)
+    }
+
+
+@contextlib.contextmanager
+def quiet() -> Iterator[None]:
+    """Silence the print logs of the functions while a scenario runs."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Compare ingesting an oversized document as one file with ingesting it as split parts.
+
+Uploads the same large CSV once with splitting turned off, as a single OpenAI
+upload, and once split into parts uploaded concurrently, against the in-memory
+fakes with a bounded upload throughput. Prints wall time, OpenAI uploads and
+the most uploads in flight at once of both. The behaviour of the split is
+covered by server/tests/test_document_split.py. Run from the repository root:
+
+    python server/benchmarks/document_split.py
+    python server/benchmarks/document_split.py --rows 400000 --part-kb 1024
+"""
+import argparse
+import sys
+import time
+
+from bench_utils import quiet
+from fakes import FakeConfig, Fakes, install_fakes
+
+
+BUCKET = 'split-bucket'
+USER_ID = 'split-user'
+FILE_NAME = 'ledger.csv'
+FILE_PATH = f'user-documents/{USER_ID}/{FILE_NAME}'
+HEADER = b'date,account,description,amount\n'
+
+
+def ledger_bytes(rows: int) -> bytes:
+    lines = [HEADER] + [
+        f'2025-{index % 12 + 1:02d}-{index % 28 + 1:02d},ACC{index % 97:03d},"Invoice {index}, net 30",{index * 7 % 10000}.50\n'.encode()
+        for index in range(rows)
+    ]
+    return b''.join(lines)
+
+
+def ingest(fakes: Fakes, data: bytes, generation: str) -> tuple:
+    from vectorize_file import run_vectorize_file
+
+    fakes.storage.put(BUCKET, FILE_PATH, data, 'text/csv')
+    started = time.perf_counter()
+    with quiet():
+        message = run_vectorize_file(FILE_PATH, BUCKET, generation)
+    return message, time.perf_counter() - started
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--part-kb', type=int, default=1024)
+    parser.add_argument('--upload-mb-per-second', type=float, default=8)
+    parser.add_argument('--openai-latency-ms', type=float, default=30)
+    args = parser.parse_args()
+
+    fakes = install_fakes(FakeConfig(
+        openai_latency=args.openai_latency_ms / 1000,
+        openai_upload_bytes_per_second=args.upload_mb_per_second * 1024 * 1024,
+    ))
+    import document_splitter
+
+    data = ledger_bytes(args.rows)
+    for label, part_bytes in (('single file', len(data) + 1), ('split parts', args.part_kb * 1024)):
+        fakes.reset()
+        document_splitter.SPLIT_MAX_PART_BYTES = part_bytes
+        message, wall_s = ingest(fakes, data, '1')
+        print(f"{label:<12} wall_s={wall_s:.2f} size_mb={len(data) / 1024 / 1024:.1f} "
+              f"uploads={fakes.openai.stats.calls.get('files.create', 0)} "
+              f"peak_uploads_in_flight={fakes.openai.stats.peak_in_flight.get('files.create', 0)} "
+              f"limit={document_splitter.SPLIT_UPLOAD_CONCURRENCY} indexed={'successful' in message}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
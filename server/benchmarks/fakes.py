@@ -0,0 +1,1441 @@
+"""
+In-memory stand-ins for Firestore, Cloud Storage, OpenAI and the Agents SDK.
+
+install_fakes() registers fake modules in sys.modules under the names the
+functions import (firebase_admin, google.cloud.firestore, openai, agents...),
+so that the modules in server/functions run unchanged without any live
+service. Every fake service counts its operations and can add a configurable
+latency per call, which makes Firestore op counts and wall time measurable
+offline. The benchmarks here and the tests in server/tests run on them.
+
+Usage:
+    from fakes import install_fakes
+    fakes = install_fakes(FakeConfig(firestore_latency=0.002))
+    from chat import run_chat  # imports now resolve to the fakes
+"""
+import asyncio
+import copy
+import enum
+import io
+import itertools
+import os
+import sys
+import threading
+import time
+import types
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+FUNCTIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'functions')
+
+
+@dataclass
+class FakeConfig:
+    """Latencies (seconds) and behaviour of the fake services."""
+
+    firestore_latency: float = 0.0  # Per Firestore RPC (get, query, commit)
+    storage_latency: float = 0.0  # Per Cloud Storage call
+    storage_bytes_per_second: float = 0.0  # 0 disables transfer time
+    openai_latency: float = 0.0  # Per OpenAI API call
+    openai_upload_bytes_per_second: float = 0.0  # 0 disables transfer time
+    agent_latency: float = 0.0  # Per agent run
+    vector_store_polls_until_complete: int = 1  # retrieve() calls before 'completed'
+    openai_rate_limit_requests: int = 0  # OpenAI requests allowed per window (429 beyond), 0 disables
+    openai_rate_limit_window: float = 60.0  # Seconds of the rate limit window
+
+
+# ---------------------------------------------------------------------------
+# Firestore
+# ---------------------------------------------------------------------------
+
+class AlreadyExists(Exception):
+    """Raised by DocumentReference.create() when the document exists."""
+
+
+class NotFound(Exception):
+    """Raised by DocumentReference.update() when the document is missing."""
+
+
+class _Sentinel:
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+
+SERVER_TIMESTAMP = _Sentinel('SERVER_TIMESTAMP')
+DELETE_FIELD = _Sentinel('DELETE_FIELD')
+
+
+class Increment:
+    def __init__(self, value):
+        self.value = value
+
+
+class ArrayUnion:
+    def __init__(self, values):
+        self.values = list(values)
+
+
+class ArrayRemove:
+    def __init__(self, values):
+        self.values = list(values)
+
+
+@dataclass
+class FirestoreStats:
+    """Document operations counted by the fake database."""
+
+    reads: int = 0
+    writes: int = 0
+    deletes: int = 0
+    rpcs: int = 0
+
+    def snapshot(self) -> 'FirestoreStats':
+        return FirestoreStats(self.reads, self.writes, self.deletes, self.rpcs)
+
+    def __sub__(self, other: 'FirestoreStats') -> 'FirestoreStats':
+        return FirestoreStats(
+            self.reads - other.reads,
+            self.writes - other.writes,
+            self.deletes - other.deletes,
+            self.rpcs - other.rpcs,
+        )
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _get_path(data: dict, field_path: str) -> Tuple[bool, Any]:
+    """Look up a dotted field path, returning (found, value)."""
+    value: Any = data
+    for part in field_path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return False, None
+        value = value[part]
+    return True, value
+
+
+def _apply_value(target: dict, key: str, value: Any) -> None:
+    """Write a value into a map, resolving Firestore sentinels."""
+    if value is DELETE_FIELD:
+        target.pop(key, None)
+    elif value is SERVER_TIMESTAMP:
+        target[key] = _now()
+    elif isinstance(value, Increment):
+        current = target.get(key, 0)
+        target[key] = (current if isinstance(current, (int, float)) else 0) + value.value
+    elif isinstance(value, ArrayUnion):
+        current = list(target.get(key) or [])
+        target[key] = current + [item for item in value.values if item not in current]
+    elif isinstance(value, ArrayRemove):
+        target[key] = [item for item in (target.get(key) or []) if item not in value.values]
+    elif isinstance(value, datetime) and value.tzinfo is None:
+        # Like the Firestore client, naive datetimes are stored as UTC
+        target[key] = value.replace(tzinfo=timezone.utc)
+    elif isinstance(value, dict):
+        resolved: dict = {}
+        for sub_key, sub_value in value.items():
+            _apply_value(resolved, sub_key, sub_value)
+        target[key] = resolved
+    else:
+        target[key] = copy.deepcopy(value)
+
+
+def _merge(target: dict, data: dict) -> None:
+    """Deep merge used by set(merge=True)."""
+    for key, value in data.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            _apply_value(target, key, value)
+
+
+def _update_path(target: dict, field_path: str, value: Any) -> None:
+    """Apply an update() field path such as 'documents.a.status'."""
+    parts = field_path.split('.')
+    for part in parts[:-1]:
+        if not isinstance(target.get(part), dict):
+            target[part] = {}
+        target = target[part]
+    _apply_value(target, parts[-1], value)
+
+
+class FakeFirestore:
+    """In-memory Firestore database with op counting and RPC latency."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.documents: Dict[str, dict] = {}
+        self.stats = FirestoreStats()
+        self.lock = threading.RLock()
+        self._auto_ids = itertools.count()
+
+    # Client API --------------------------------------------------------
+    def collection(self, name: str) -> 'FakeCollectionReference':
+        return FakeCollectionReference(self, name)
+
+    def collection_group(self, name: str) -> 'FakeQuery':
+        return FakeQuery(self, None, collection_group=name)
+
+    def document(self, path: str) -> 'FakeDocumentReference':
+        return FakeDocumentReference(self, path)
+
+    def batch(self) -> 'FakeWriteBatch':
+        return FakeWriteBatch(self)
+
+    def transaction(self, **kwargs) -> 'FakeTransaction':
+        return FakeTransaction(self)
+
+    def get_all(self, references, transaction=None):
+        self._rpc()
+        with self.lock:
+            snapshots = [reference._snapshot() for reference in references]
+            self.stats.reads += len(snapshots)
+        return iter(snapshots)
+
+    # Internals ---------------------------------------------------------
+    def _rpc(self) -> None:
+        self.stats.rpcs += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _new_id(self) -> str:
+        return f"auto{next(self._auto_ids):08d}{uuid.uuid4().hex[:8]}"
+
+    def _apply_write(self, operation: str, path: str, data: Optional[dict] = None, merge: bool = False) -> None:
+        """Apply one write. Caller holds the lock."""
+        if operation == 'delete':
+            self.documents.pop(path, None)
+            self.stats.deletes += 1
+            return
+
+        self.stats.writes += 1
+        if operation == 'create':
+            if path in self.documents:
+                raise AlreadyExists(path)
+            operation = 'set'
+        if operation == 'set':
+            document: dict = {}
+            if merge:
+                document = copy.deepcopy(self.documents.get(path, {}))
+                _merge(document, data or {})
+            else:
+                for key, value in (data or {}).items():
+                    _apply_value(document, key, value)
+            self.documents[path] = document
+        elif operation == 'update':
+            if path not in self.documents:
+                raise NotFound(f"No document to update: {path}")
+            document = copy.deepcopy(self.documents[path])
+            for field_path, value in (data or {}).items():
+                _update_path(document, field_path, value)
+            self.documents[path] = document
+
+    def dump(self, prefix: str = '') -> Dict[str, dict]:
+        """Copy of the stored documents whose path starts with prefix."""
+        with self.lock:
+            return {path: copy.deepcopy(data) for path, data in self.documents.items() if path.startswith(prefix)}
+
+
+class FakeDocumentSnapshot:
+    def __init__(self, reference: 'FakeDocumentReference', data: Optional[dict]):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self) -> Optional[dict]:
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path: str) -> Any:
+        if self._data is None:
+            return None
+        found, value = _get_path(self._data, field_path)
+        if not found:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+
+class FakeDocumentReference:
+    def __init__(self, db: FakeFirestore, path: str):
+        self._db = db
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+
+    @property
+    def parent(self) -> 'FakeCollectionReference':
+        return FakeCollectionReference(self._db, self.path.rsplit('/', 1)[0])
+
+    def collection(self, name: str) -> 'FakeCollectionReference':
+        return FakeCollectionReference(self._db, f"{self.path}/{name}")
+
+    def _snapshot(self) -> FakeDocumentSnapshot:
+        return FakeDocumentSnapshot(self, self._db.documents.get(self.path))
+
+    def get(self, field_paths=None, transaction=None) -> FakeDocumentSnapshot:
+        if transaction is None:
+            self._db._rpc()
+        with self._db.lock:
+            self._db.stats.reads += 1
+            return self._snapshot()
+
+    def set(self, data: dict, merge: bool = False) -> None:
+        self._db._rpc()
+        with self._db.lock:
+            self._db._apply_write('set', self.path, data, merge)
+
+    def create(self, data: dict) -> None:
+        self._db._rpc()
+        with self._db.lock:
+            self._db._apply_write('create', self.path, data)
+
+    def update(self, data: dict) -> None:
+        self._db._rpc()
+        with self._db.lock:
+            self._db._apply_write('update', self.path, data)
+
+    def delete(self) -> None:
+        self._db._rpc()
+        with self._db.lock:
+            self._db._apply_write('delete', self.path)
+
+    def list_collections(self) -> List['FakeCollectionReference']:
+        self._db._rpc()
+        prefix = self.path + '/'
+        with self._db.lock:
+            names = {
+                path[len(prefix):].split('/', 1)[0]
+                for path in self._db.documents if path.startswith(prefix)
+            }
+        return [self.collection(name) for name in sorted(names)]
+
+
+class FakeAggregationResult:
+    def __init__(self, alias: str, value: Any):
+        self.alias = alias
+        self.value = value
+
+
+class FakeAggregationQuery:
+    def __init__(self, query: 'FakeQuery', alias: str):
+        self._query = query
+        self._alias = alias
+
+    def get(self, transaction=None):
+        self._query._db._rpc()
+        with self._query._db.lock:
+            count = len(self._query._matching())
+            # Count aggregations bill one read per 1000 index entries
+            self._query._db.stats.reads += max(1, (count + 999) // 1000)
+        return [[FakeAggregationResult(self._alias, count)]]
+
+
+class FakeQuery:
+    ASCENDING = 'ASCENDING'
+    DESCENDING = 'DESCENDING'
+
+    def __init__(self, db: FakeFirestore, collection_path: Optional[str], collection_group: Optional[str] = None):
+        self._db = db
+        self._collection_path = collection_path
+        self._collection_group = collection_group
+        self._filters: List[Tuple[str, str, Any]] = []
+        self._orders: List[Tuple[str, str]] = []
+        self._limit: Optional[int] = None
+        self._offset: int = 0
+        self._start_after: Optional[Any] = None
+
+    def _copy(self) -> 'FakeQuery':
+        query = FakeQuery(self._db, self._collection_path, self._collection_group)
+        query._filters = list(self._filters)
+        query._orders = list(self._orders)
+        query._limit = self._limit
+        query._offset = self._offset
+        query._start_after = self._start_after
+        return query
+
+    def where(self, field_path: str = None, op_string: str = None, value: Any = None, filter=None) -> 'FakeQuery':
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        query = self._copy()
+        query._filters.append((field_path, op_string, value))
+        return query
+
+    def order_by(self, field_path: str, direction: str = ASCENDING) -> 'FakeQuery':
+        query = self._copy()
+        query._orders.append((field_path, direction))
+        return query
+
+    def limit(self, count: int) -> 'FakeQuery':
+        query = self._copy()
+        query._limit = count
+        return query
+
+    def offset(self, count: int) -> 'FakeQuery':
+        query = self._copy()
+        query._offset = count
+        return query
+
+    def start_after(self, document_fields_or_snapshot) -> 'FakeQuery':
+        query = self._copy()
+        query._start_after = document_fields_or_snapshot
+        return query
+
+    def count(self, alias: str = 'count') -> FakeAggregationQuery:
+        return FakeAggregationQuery(self, alias)
+
+    def _in_scope(self, path: str) -> bool:
+        parent, _ = path.rsplit('/', 1)
+        if self._collection_group is not None:
+            return parent.rsplit('/', 1)[-1] == self._collection_group
+        return parent == self._collection_path
+
+    @staticmethod
+    def _matches(data: dict, field_path: str, op: str, value: Any) -> bool:
+        found, actual = _get_path(data, field_path)
+        if op == '!=' or op == 'not-in':
+            if not found:
+                return False
+            return actual != value if op == '!=' else actual not in value
+        if not found:
+            return False
+        try:
+            if op == '==':
+                return actual == value
+            if op == '<':
+                return actual < value
+            if op == '<=':
+                return actual <= value
+            if op == '>':
+                return actual > value
+            if op == '>=':
+                return actual >= value
+            if op == 'in':
+                return actual in value
+            if op == 'array_contains':
+                return isinstance(actual, list) and value in actual
+            if op == 'array_contains_any':
+                return isinstance(actual, list) and any(item in actual for item in value)
+        except TypeError:
+            return False
+        raise ValueError(f"Unsupported operator {op}")
+
+    def _sort_key(self, path: str, data: dict) -> tuple:
+        return tuple(self._order_value(path, data, field_path)[1] for field_path, _ in self._orders) + (path,)
+
+    @staticmethod
+    def _order_value(path: str, data: dict, field_path: str) -> Tuple[bool, Any]:
+        """Value of an ordering field, where '__name__' is the document path."""
+        if field_path == '__name__':
+            return True, path
+        return _get_path(data, field_path)
+
+    def _matching(self) -> List[Tuple[str, dict]]:
+        """Matching (path, data) pairs in query order. Caller holds the lock."""
+        results = [
+            (path, data) for path, data in self._db.documents.items()
+            if self._in_scope(path)
+            and all(self._matches(data, *flt) for flt in self._filters)
+            and all(self._order_value(path, data, field_path)[0] for field_path, _ in self._orders)
+        ]
+
+        # Stable multi-key sort, applied from the last key to the first
+        results.sort(key=lambda item: item[0].rsplit('/', 1)[-1])
+        for field_path, direction in reversed(self._orders):
+            results.sort(
+                key=lambda item: self._order_value(item[0], item[1], field_path)[1],
+                reverse=direction == self.DESCENDING,
+            )
+
+        if self._start_after is not None:
+            if isinstance(self._start_after, FakeDocumentSnapshot):
+                cursor_path = self._start_after.reference.path
+                paths = [path for path, _ in results]
+                if cursor_path in paths:
+                    results = results[paths.index(cursor_path) + 1:]
+                else:
+                    cursor_data = self._start_after._data or {}
+                    results = self._after_values(results, cursor_data)
+            else:
+                results = self._after_values(results, self._start_after)
+
+        results = results[self._offset:]
+        if self._limit is not None:
+            results = results[:self._limit]
+        return results
+
+    def _after_values(self, results, cursor_data: dict):
+        if not self._orders:
+            return results
+        cursor = tuple(
+            getattr(cursor_data.get('__name__'), 'path', cursor_data.get('__name__')) if field_path == '__name__'
+            else _get_path(cursor_data, field_path)[1]
+            for field_path, _ in self._orders
+        )
+        descending = self._orders[0][1] == self.DESCENDING
+        kept = []
+        for path, data in results:
+            values = tuple(self._order_value(path, data, field_path)[1] for field_path, _ in self._orders)
+            if (values < cursor) if descending else (values > cursor):
+                kept.append((path, data))
+        return kept
+
+    def stream(self, transaction=None):
+        if transaction is None:
+            self._db._rpc()
+        with self._db.lock:
+            results = self._matching()
+            # An empty query result is billed as one read
+            self._db.stats.reads += max(1, len(results))
+            snapshots = [
+                FakeDocumentSnapshot(FakeDocumentReference(self._db, path), copy.deepcopy(data))
+                for path, data in results
+            ]
+        return iter(snapshots)
+
+    def get(self, transaction=None):
+        return list(self.stream(transaction=transaction))
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, db: FakeFirestore, path: str):
+        super().__init__(db, path)
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+
+    def document(self, document_id: Optional[str] = None) -> FakeDocumentReference:
+        return FakeDocumentReference(self._db, f"{self.path}/{document_id or self._db._new_id()}")
+
+    def add(self, data: dict) -> Tuple[datetime, FakeDocumentReference]:
+        reference = self.document()
+        reference.set(data)
+        return _now(), reference
+
+    def list_documents(self, page_size: Optional[int] = None) -> List[FakeDocumentReference]:
+        self._db._rpc()
+        with self._db.lock:
+            return [
+                FakeDocumentReference(self._db, path)
+                for path in sorted(self._db.documents) if self._in_scope(path)
+            ]
+
+
+class FakeWriteBatch:
+    MAX_WRITES = 500
+
+    def __init__(self, db: FakeFirestore):
+        self._db = db
+        self._writes: List[tuple] = []
+
+    def _add(self, *write) -> None:
+        if len(self._writes) >= self.MAX_WRITES:
+            raise ValueError("Maximum 500 writes allowed per batch")
+        self._writes.append(write)
+
+    def set(self, reference: FakeDocumentReference, data: dict, merge: bool = False) -> None:
+        self._add('set', reference.path, data, merge)
+
+    def create(self, reference: FakeDocumentReference, data: dict) -> None:
+        self._add('create', reference.path, data, False)
+
+    def update(self, reference: FakeDocumentReference, data: dict) -> None:
+        self._add('update', reference.path, data, False)
+
+    def delete(self, reference: FakeDocumentReference) -> None:
+        self._add('delete', reference.path, None, False)
+
+    def __len__(self) -> int:
+        return len(self._writes)
+
+    def commit(self) -> list:
+        self._db._rpc()
+        with self._db.lock:
+            snapshot = copy.deepcopy(self._db.documents)
+            try:
+                for operation, path, data, merge in self._writes:
+                    self._db._apply_write(operation, path, data, merge)
+            except Exception:
+                self._db.documents = snapshot
+                raise
+        results = [None] * len(self._writes)
+        self._writes = []
+        return results
+
+
+class FakeTransaction(FakeWriteBatch):
+    """Transactions are serialized on the database lock by transactional()."""
+
+    def __init__(self, db: FakeFirestore):
+        super().__init__(db)
+        self.id = uuid.uuid4().hex
+
+
+def transactional(function: Callable) -> Callable:
+    """Fake of firestore.transactional: run the function atomically and commit its writes."""
+
+    def run(transaction: FakeTransaction, *args, **kwargs):
+        db = transaction._db
+        db._rpc()
+        with db.lock:
+            result = function(transaction, *args, **kwargs)
+            transaction.commit()
+            return result
+
+    return run
+
+
+class FieldFilter:
+    def __init__(self, field_path: str, op_string: str, value: Any):
+        self.field_path = field_path
+        self.op_string = op_string
+        self.value = value
+
+
+# ---------------------------------------------------------------------------
+# Cloud Storage
+# ---------------------------------------------------------------------------
+
+class FakeBlob:
+    def __init__(self, storage: 'FakeStorage', bucket_name: str, name: str):
+        self._storage = storage
+        self.bucket_name = bucket_name
+        self.name = name
+        self.size: Optional[int] = None
+        self.content_type: Optional[str] = None
+        self.generation: Optional[int] = None
+        self.updated: Optional[datetime] = None
+        self.time_created: Optional[datetime] = None
+        self._load()
+
+    def _key(self) -> Tuple[str, str]:
+        return self.bucket_name, self.name
+
+    def _load(self) -> None:
+        stored = self._storage.objects.get(self._key())
+        if stored:
+            self.size = len(stored['data'])
+            self.content_type = stored['content_type']
+            self.generation = stored['generation']
+            self.updated = stored['updated']
+            self.time_created = stored['time_created']
+
+    def reload(self) -> None:
+        self._storage._call(0)
+        self._load()
+
+    def exists(self) -> bool:
+        self._storage._call(0)
+        return self._key() in self._storage.objects
+
+    def download_as_bytes(self, start: Optional[int] = None, end: Optional[int] = None, **kwargs) -> bytes:
+        stored = self._storage.objects.get(self._key())
+        if stored is None:
+            raise NotFound(f"No such object: {self.bucket_name}/{self.name}")
+        data = stored['data']
+        if start is not None or end is not None:
+            # Like GCS, end is inclusive
+            data = data[start or 0:(end + 1) if end is not None else None]
+        self._storage._call(len(data))
+        self._storage.bytes_downloaded += len(data)
+        return data
+
+    def open(self, mode: str = 'rb', **kwargs) -> io.BytesIO:
+        return io.BytesIO(self.download_as_bytes())
+
+    def upload_from_string(self, data, content_type: Optional[str] = None) -> None:
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self._storage.put(self.bucket_name, self.name, data, content_type)
+        self._load()
+
+    def delete(self) -> None:
+        self._storage._call(0)
+        self._storage.objects.pop(self._key(), None)
+
+
+class FakeBucket:
+    def __init__(self, storage: 'FakeStorage', name: str):
+        self._storage = storage
+        self.name = name
+
+    def blob(self, name: str) -> FakeBlob:
+        return FakeBlob(self._storage, self.name, name)
+
+    def get_blob(self, name: str) -> Optional[FakeBlob]:
+        self._storage._call(0)
+        blob = FakeBlob(self._storage, self.name, name)
+        return blob if blob.size is not None else None
+
+    def list_blobs(self, prefix: str = '', max_results: Optional[int] = None, page_token: Optional[str] = None, **kwargs):
+        return self._storage.list_blobs(self.name, prefix=prefix, max_results=max_results, page_token=page_token)
+
+
+class FakeBlobPage(list):
+    next_page_token: Optional[str] = None
+
+
+class FakeStorage:
+    """In-memory Cloud Storage with transfer accounting."""
+
+    def __init__(self, latency: float = 0.0, bytes_per_second: float = 0.0):
+        self.latency = latency
+        self.bytes_per_second = bytes_per_second
+        self.objects: Dict[Tuple[str, str], dict] = {}
+        self.calls = 0
+        self.bytes_downloaded = 0
+        self._generations = itertools.count(1)
+
+    def _call(self, size: int) -> None:
+        self.calls += 1
+        delay = self.latency + (size / self.bytes_per_second if self.bytes_per_second else 0)
+        if delay:
+            time.sleep(delay)
+
+    def put(self, bucket_name: str, name: str, data: bytes, content_type: Optional[str] = None) -> dict:
+        now = _now()
+        self.objects[(bucket_name, name)] = {
+            'data': data,
+            'content_type': content_type or 'application/octet-stream',
+            'generation': next(self._generations),
+            'updated': now,
+            'time_created': now,
+        }
+        return self.objects[(bucket_name, name)]
+
+    def bucket(self, name: Optional[str] = None) -> FakeBucket:
+        return FakeBucket(self, name or 'fake-bucket')
+
+    def list_blobs(self, bucket_name: str, prefix: str = '', max_results: Optional[int] = None, page_token: Optional[str] = None):
+        self._call(0)
+        names = sorted(name for bucket, name in self.objects if bucket == bucket_name and name.startswith(prefix))
+        if page_token:
+            names = [name for name in names if name > page_token]
+        page_names = names[:max_results] if max_results else names
+        page = FakeBlobPage(FakeBlob(self, bucket_name, name) for name in page_names)
+        if max_results and len(names) > max_results:
+            page.next_page_token = page_names[-1]
+        return page
+
+
+# ---------------------------------------------------------------------------
+# OpenAI
+# ---------------------------------------------------------------------------
+
+class FakeObject(types.SimpleNamespace):
+    pass
+
+
+class FakePage:
+    def __init__(self, data: list, has_more: bool):
+        self.data = data
+        self.has_more = has_more
+        self.last_id = getattr(data[-1], 'id', None) if data else None
+
+    def __iter__(self):
+        return iter(self.data)
+
+
+class APIStatusError(Exception):
+    """openai.APIStatusError: an error response, with its status and headers."""
+
+    def __init__(self, message: str, status_code: int, headers: Optional[dict] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.response = FakeObject(status_code=status_code, headers=headers or {})
+
+
+class APIConnectionError(Exception):
+    """openai.APIConnectionError: no response was received."""
+
+
+class APITimeoutError(APIConnectionError):
+    """openai.APITimeoutError"""
+
+
+@dataclass
+class OpenAIStats:
+    calls: Dict[str, int] = field(default_factory=dict)
+    bytes_uploaded: int = 0
+    rate_limited: Dict[str, int] = field(default_factory=dict)  # Requests answered with a 429, by endpoint
+    in_flight: Dict[str, int] = field(default_factory=dict)  # Requests waiting out their latency, by endpoint
+    peak_in_flight: Dict[str, int] = field(default_factory=dict)  # Most requests in flight at once, by endpoint
+
+
+class FakeOpenAIBackend:
+    """State shared by every FakeOpenAI client instance."""
+
+    def __init__(self, config: FakeConfig):
+        self.config = config
+        self.files: Dict[str, FakeObject] = {}
+        self.file_contents: Dict[str, bytes] = {}
+        self.vector_stores: Dict[str, FakeObject] = {}
+        self.vector_store_files: Dict[Tuple[str, str], FakeObject] = {}
+        self.file_batches: Dict[str, FakeObject] = {}
+        self.stats = OpenAIStats()
+        self.lock = threading.RLock()
+        self.fault_injector: Optional[Callable[[str], None]] = None
+        self.response_hooks: List[Callable[[Any], None]] = []  # httpx response hooks of the clients
+        self.window_started = time.monotonic()
+        self.window_requests = 0
+        self._ids = itertools.count(1)
+
+    def call(self, endpoint: str, upload_bytes: int = 0, observed: bool = True) -> None:
+        with self.lock:
+            self.stats.calls[endpoint] = self.stats.calls.get(endpoint, 0) + 1
+            self.stats.bytes_uploaded += upload_bytes
+            headers = self._rate_limit_headers() if self.config.openai_rate_limit_requests else None
+        if headers is not None:
+            limited = 'retry-after-ms' in headers
+            if observed:
+                for hook in list(self.response_hooks):
+                    hook(FakeObject(status_code=429 if limited else 200, headers=headers))
+            if limited:
+                with self.lock:
+                    self.stats.rate_limited[endpoint] = self.stats.rate_limited.get(endpoint, 0) + 1
+                raise APIStatusError(f"Rate limit reached for requests on {endpoint}", 429, headers)
+        if self.fault_injector is not None:
+            self.fault_injector(endpoint)
+        delay = self.config.openai_latency
+        if upload_bytes and self.config.openai_upload_bytes_per_second:
+            delay += upload_bytes / self.config.openai_upload_bytes_per_second
+        if delay:
+            with self.lock:
+                in_flight = self.stats.in_flight[endpoint] = self.stats.in_flight.get(endpoint, 0) + 1
+                self.stats.peak_in_flight[endpoint] = max(self.stats.peak_in_flight.get(endpoint, 0), in_flight)
+            try:
+                time.sleep(delay)
+            finally:
+                with self.lock:
+                    self.stats.in_flight[endpoint] -= 1
+
+    def _rate_limit_headers(self) -> dict:
+        """Count a request in the fixed window and return the x-ratelimit headers of its response."""
+        now = time.monotonic()
+        window = self.config.openai_rate_limit_window
+        if now - self.window_started >= window:
+            self.window_started, self.window_requests = now, 0
+        self.window_requests += 1
+        limit = self.config.openai_rate_limit_requests
+        reset_seconds = max(self.window_started + window - now, 0)
+        headers = {
+            'x-ratelimit-limit-requests': str(limit),
+            'x-ratelimit-remaining-requests': str(max(limit - self.window_requests, 0)),
+            'x-ratelimit-reset-requests': f"{reset_seconds:.3f}s",
+        }
+        if self.window_requests > limit:
+            headers['retry-after-ms'] = str(round(reset_seconds * 1000))
+        return headers
+
+    def new_id(self, prefix: str) -> str:
+        return f"{prefix}-{next(self._ids):06d}"
+
+
+def _paginate(items: list, after: Optional[str], limit: int) -> FakePage:
+    if after:
+        ids = [item.id for item in items]
+        items = items[ids.index(after) + 1:] if after in ids else []
+    return FakePage(items[:limit], len(items) > limit)
+
+
+class _FakeFiles:
+    def __init__(self, backend: FakeOpenAIBackend):
+        self._backend = backend
+
+    def create(self, file, purpose: str, **kwargs) -> FakeObject:
+        name, handle = file if isinstance(file, tuple) else (getattr(file, 'name', 'upload'), file)
+        content = handle.read() if hasattr(handle, 'read') else bytes(handle)
+        self._backend.call('files.create', upload_bytes=len(content))
+        with self._backend.lock:
+            file_object = FakeObject(
+                id=self._backend.new_id('file'),
+                filename=name,
+                bytes=len(content),
+                purpose=purpose,
+                created_at=int(time.time()),
+                status='processed',
+            )
+            self._backend.files[file_object.id] = file_object
+            self._backend.file_contents[file_object.id] = content
+        return file_object
+
+    def retrieve(self, file_id: str, **kwargs) -> FakeObject:
+        self._backend.call('files.retrieve')
+        with self._backend.lock:
+            if file_id not in self._backend.files:
+                raise NotFound(f"No such file: {file_id}")
+            return self._backend.files[file_id]
+
+    def delete(self, file_id: str, **kwargs) -> FakeObject:
+        self._backend.call('files.delete')
+        with self._backend.lock:
+            if self._backend.files.pop(file_id, None) is None:
+                raise NotFound(f"No such file: {file_id}")
+            self._backend.file_contents.pop(file_id, None)
+        return FakeObject(id=file_id, deleted=True)
+
+    def list(self, purpose: Optional[str] = None, after: Optional[str] = None, limit: int = 100, order: str = 'asc', **kwargs) -> FakePage:
+        self._backend.call('files.list')
+        with self._backend.lock:
+            files = [item for item in self._backend.files.values() if purpose is None or item.purpose == purpose]
+        files.sort(key=lambda item: item.id, reverse=order == 'desc')
+        return _paginate(files, after, limit)
+
+
+class _FakeVectorStoreFiles:
+    def __init__(self, backend: FakeOpenAIBackend):
+        self._backend = backend
+
+    def create(self, vector_store_id: str, file_id: str, attributes: Optional[dict] = None, **kwargs) -> FakeObject:
+        self._backend.call('vector_stores.files.create')
+        with self._backend.lock:
+            if vector_store_id not in self._backend.vector_stores:
+                raise NotFound(f"No such vector store: {vector_store_id}")
+            vector_store_file = FakeObject(
+                id=file_id,
+                vector_store_id=vector_store_id,
+                status='in_progress',
+                attributes=attributes or {},
+                last_error=None,
+                polls=0,
+                created_at=int(time.time()),
+            )
+            self._backend.vector_store_files[(vector_store_id, file_id)] = vector_store_file
+        return vector_store_file
+
+    def retrieve(self, file_id: str, vector_store_id: str, **kwargs) -> FakeObject:
+        self._backend.call('vector_stores.files.retrieve')
+        with self._backend.lock:
+            vector_store_file = self._backend.vector_store_files.get((vector_store_id, file_id))
+            if vector_store_file is None:
+                raise NotFound(f"No such vector store file: {file_id}")
+            vector_store_file.polls += 1
+            if vector_store_file.polls >= self._backend.config.vector_store_polls_until_complete:
+                vector_store_file.status = 'completed'
+            return vector_store_file
+
+    def delete(self, file_id: str, vector_store_id: str, **kwargs) -> FakeObject:
+        self._backend.call('vector_stores.files.delete')
+        with self._backend.lock:
+            if self._backend.vector_store_files.pop((vector_store_id, file_id), None) is None:
+                raise NotFound(f"No such vector store file: {file_id}")
+        return FakeObject(id=file_id, deleted=True)
+
+    def content(self, file_id: str, vector_store_id: str, **kwargs) -> FakePage:
+        """Parsed text of an attached file, in chunks of 4000 characters."""
+        self._backend.call('vector_stores.files.content')
+        with self._backend.lock:
+            if (vector_store_id, file_id) not in self._backend.vector_store_files:
+                raise NotFound(f"No such vector store file: {file_id}")
+            text = self._backend.file_contents.get(file_id, b'').decode('utf-8', 'replace')
+        return FakePage([FakeObject(type='text', text=text[start:start + 4000])
+                         for start in range(0, len(text), 4000)], False)
+
+    def list(self, vector_store_id: str, after: Optional[str] = None, limit: int = 100, **kwargs) -> FakePage:
+        self._backend.call('vector_stores.files.list')
+        with self._backend.lock:
+            if vector_store_id not in self._backend.vector_stores:
+                raise NotFound(f"No such vector store: {vector_store_id}")
+            files = sorted(
+                (item for (store_id, _), item in self._backend.vector_store_files.items() if store_id == vector_store_id),
+                key=lambda item: item.id,
+            )
+        return _paginate(files, after, limit)
+
+
+class _FakeFileBatches:
+    def __init__(self, backend: FakeOpenAIBackend, files: _FakeVectorStoreFiles):
+        self._backend = backend
+        self._files = files
+
+    def create(self, vector_store_id: str, file_ids: Optional[List[str]] = None, files: Optional[List[dict]] = None,
+               attributes: Optional[dict] = None, **kwargs) -> FakeObject:
+        self._backend.call('vector_stores.file_batches.create')
+        entries = files if files is not None else [{'file_id': file_id, 'attributes': attributes} for file_id in file_ids or []]
+        with self._backend.lock:
+            if vector_store_id not in self._backend.vector_stores:
+                raise NotFound(f"No such vector store: {vector_store_id}")
+            batch = FakeObject(id=self._backend.new_id('vsfb'), vector_store_id=vector_store_id, status='in_progress',
+                               file_ids=[entry['file_id'] for entry in entries], polls=0, file_counts=None)
+            for entry in entries:
+                self._backend.vector_store_files[(vector_store_id, entry['file_id'])] = FakeObject(
+                    id=entry['file_id'], vector_store_id=vector_store_id, status='in_progress',
+                    attributes=entry.get('attributes') or {}, last_error=None, polls=0, created_at=int(time.time()),
+                )
+            self._backend.file_batches[batch.id] = batch
+        return batch
+
+    def retrieve(self, batch_id: str, vector_store_id: str, **kwargs) -> FakeObject:
+        self._backend.call('vector_stores.file_batches.retrieve')
+        with self._backend.lock:
+            batch = self._backend.file_batches.get(batch_id)
+            if batch is None:
+                raise NotFound(f"No such file batch: {batch_id}")
+            batch.polls += 1
+            if batch.polls >= self._backend.config.vector_store_polls_until_complete:
+                for file_id in batch.file_ids:
+                    vector_store_file = self._backend.vector_store_files.get((vector_store_id, file_id))
+                    if vector_store_file is not None and vector_store_file.status == 'in_progress':
+                        vector_store_file.status = 'completed'
+                batch.status = 'completed'
+            statuses = [
+                getattr(self._backend.vector_store_files.get((vector_store_id, file_id)), 'status', 'failed')
+                for file_id in batch.file_ids
+            ]
+            batch.file_counts = FakeObject(
+                completed=statuses.count('completed'), failed=statuses.count('failed'),
+                in_progress=statuses.count('in_progress'), cancelled=statuses.count('cancelled'), total=len(statuses),
+            )
+            return batch
+
+    def list_files(self, batch_id: str, vector_store_id: str, filter: Optional[str] = None,
+                   after: Optional[str] = None, limit: int = 100, **kwargs) -> FakePage:
+        self._backend.call('vector_stores.file_batches.list_files')
+        with self._backend.lock:
+            batch = self._backend.file_batches[batch_id]
+            files = [
+                self._backend.vector_store_files[(vector_store_id, file_id)] for file_id in batch.file_ids
+                if (vector_store_id, file_id) in self._backend.vector_store_files
+            ]
+        files = sorted((item for item in files if filter is None or item.status == filter), key=lambda item: item.id)
+        return _paginate(files, after, limit)
+
+    def create_and_poll(self, vector_store_id: str, file_ids: List[str], **kwargs) -> FakeObject:
+        self._backend.call('vector_stores.file_batches.create_and_poll')
+        with self._backend.lock:
+            for file_id in file_ids:
+                self._backend.vector_store_files[(vector_store_id, file_id)] = FakeObject(
+                    id=file_id, vector_store_id=vector_store_id, status='completed',
+                    attributes=kwargs.get('attributes') or {}, last_error=None, polls=0, created_at=int(time.time()),
+                )
+        return FakeObject(
+            id=self._backend.new_id('vsfb'),
+            status='completed',
+            file_counts=FakeObject(completed=len(file_ids), failed=0, in_progress=0, cancelled=0, total=len(file_ids)),
+        )
+
+
+class _FakeVectorStores:
+    def __init__(self, backend: FakeOpenAIBackend):
+        self._backend = backend
+        self.files = _FakeVectorStoreFiles(backend)
+        self.file_batches = _FakeFileBatches(backend, self.files)
+
+    def create(self, name: Optional[str] = None, **kwargs) -> FakeObject:
+        self._backend.call('vector_stores.create')
+        with self._backend.lock:
+            vector_store = FakeObject(id=self._backend.new_id('vs'), name=name, created_at=int(time.time()))
+            self._backend.vector_stores[vector_store.id] = vector_store
+        return vector_store
+
+    def retrieve(self, vector_store_id: str, **kwargs) -> FakeObject:
+        self._backend.call('vector_stores.retrieve')
+        with self._backend.lock:
+            if vector_store_id not in self._backend.vector_stores:
+                raise NotFound(f"No such vector store: {vector_store_id}")
+            return self._backend.vector_stores[vector_store_id]
+
+    def delete(self, vector_store_id: str, **kwargs) -> FakeObject:
+        self._backend.call('vector_stores.delete')
+        with self._backend.lock:
+            if self._backend.vector_stores.pop(vector_store_id, None) is None:
+                raise NotFound(f"No such vector store: {vector_store_id}")
+            for key in [key for key in self._backend.vector_store_files if key[0] == vector_store_id]:
+                del self._backend.vector_store_files[key]
+        return FakeObject(id=vector_store_id, deleted=True)
+
+    def list(self, after: Optional[str] = None, limit: int = 100, **kwargs) -> FakePage:
+        self._backend.call('vector_stores.list')
+        with self._backend.lock:
+            stores = sorted(self._backend.vector_stores.values(), key=lambda item: item.id)
+        return _paginate(stores, after, limit)
+
+
+class _FakeChatCompletions:
+    def __init__(self, backend: FakeOpenAIBackend):
+        self._backend = backend
+
+    def create(self, model: str, messages: list, **kwargs) -> FakeObject:
+        self._backend.call('chat.completions.create')
+        return FakeObject(
+            choices=[FakeObject(message=FakeObject(role='assistant', content=f"Fake completion from {model}"))],
+            usage=FakeObject(prompt_tokens=100, completion_tokens=20, total_tokens=120),
+        )
+
+
+class _FakeResponses:
+    def __init__(self, backend: FakeOpenAIBackend):
+        self._backend = backend
+
+    def create(self, model: str, input: Any, **kwargs) -> FakeObject:
+        self._backend.call('responses.create')
+        return FakeObject(output_text=f"Fake response from {model}", usage=FakeObject(input_tokens=100, output_tokens=20))
+
+
+class FakeOpenAI:
+    """Drop-in for openai.OpenAI backed by a shared FakeOpenAIBackend."""
+
+    backend: Optional[FakeOpenAIBackend] = None
+
+    def __init__(self, api_key: Optional[str] = None, http_client=None, **kwargs):
+        backend = type(self).backend
+        for hook in getattr(http_client, 'event_hooks', {}).get('response', []):
+            if hook not in backend.response_hooks:
+                backend.response_hooks.append(hook)
+        self.files = _FakeFiles(backend)
+        self.vector_stores = _FakeVectorStores(backend)
+        self.chat = FakeObject(completions=_FakeChatCompletions(backend))
+        self.responses = _FakeResponses(backend)
+
+
+class FakeHttpxClient:
+    """Drop-in for openai.DefaultHttpxClient, keeping the event hooks."""
+
+    def __init__(self, event_hooks: Optional[dict] = None, **kwargs):
+        self.event_hooks = event_hooks or {}
+
+
+# ---------------------------------------------------------------------------
+# Agents SDK
+# ---------------------------------------------------------------------------
+
+class FakeSession:
+    """Base class standing in for agents.memory.Session."""
+
+
+@dataclass
+class FakeModelSettings:
+    temperature: Optional[float] = None
+    max_tokens: Optional[int] = None
+
+
+class FakeFileSearchTool:
+    def __init__(self, vector_store_ids=None, max_num_results: Optional[int] = None, filters=None, **kwargs):
+        self.vector_store_ids = vector_store_ids
+        self.max_num_results = max_num_results
+        self.filters = filters
+
+
+class FakeFunctionTool:
+    def __init__(self, function: Callable):
+        self.function = function
+        self.name = function.__name__
+
+
+def fake_function_tool(function: Callable = None, **kwargs):
+    if function is None:
+        return lambda inner: FakeFunctionTool(inner)
+    return FakeFunctionTool(function)
+
+
+class FakeAgent:
+    def __init__(self, name: str, instructions: str = '', model: Optional[str] = None,
+                 model_settings=None, tools=None, **kwargs):
+        self.name = name
+        self.instructions = instructions
+        self.model = model
+        self.model_settings = model_settings
+        self.tools = tools or []
+
+
+class FakeRunResult:
+    def __init__(self, final_output: str, new_items: list):
+        self.final_output = final_output
+        self.new_items = new_items
+
+
+@dataclass
+class AgentStats:
+    runs: int = 0
+    history_items: List[int] = field(default_factory=list)
+    models: Dict[str, int] = field(default_factory=dict)
+    in_flight: int = 0  # Runs waiting out the agent latency
+    peak_in_flight: int = 0  # Most runs in flight at once
+
+
+class FakeRunner:
+    """Runs an agent turn against the session without calling a model."""
+
+    config: FakeConfig = FakeConfig()
+    stats: AgentStats = AgentStats()
+    lock = threading.Lock()
+    fault_injector: Optional[Callable[[str], None]] = None  # Called with 'agent_run' before each run
+    responder: Optional[Callable[[FakeAgent, str], Optional[str]]] = None  # Scripted answers, None for the default
+
+    @classmethod
+    async def run(cls, agent: FakeAgent, input: Any, session=None, **kwargs) -> FakeRunResult:
+        history: list = []
+        if session is not None:
+            history = await session.get_items()
+
+        with cls.lock:
+            cls.stats.runs += 1
+            cls.stats.history_items.append(len(history))
+            cls.stats.models[agent.model or 'default'] = cls.stats.models.get(agent.model or 'default', 0) + 1
+
+        if cls.fault_injector is not None:
+            cls.fault_injector('agent_run')
+        backend = FakeOpenAI.backend
+        if backend is not None and backend.config.openai_rate_limit_requests:
+            # Model calls share the rate limit of the key, through a client whose responses are not observed
+            backend.call('responses.create', observed=False)
+        if cls.config.agent_latency:
+            with cls.lock:
+                cls.stats.in_flight += 1
+                cls.stats.peak_in_flight = max(cls.stats.peak_in_flight, cls.stats.in_flight)
+            try:
+                await asyncio.sleep(cls.config.agent_latency)
+            finally:
+                with cls.lock:
+                    cls.stats.in_flight -= 1
+
+        prompt = input if isinstance(input, str) else str(input)
+        answer = cls.responder(agent, prompt) if cls.responder is not None else None
+        if answer is None:
+            answer = f"[{agent.name}] answer to: {prompt[:80]}"
+        new_items = [
+            {'role': 'user', 'content': prompt},
+            {
+                'role': 'assistant',
+                'type': 'message',
+                'content': [{'type': 'output_text', 'text': answer, 'annotations': []}],
+            },
+        ]
+        if session is not None:
+            await session.add_items(new_items)
+        return FakeRunResult(answer, new_items)
+
+    @classmethod
+    def run_sync(cls, agent: FakeAgent, input: Any, **kwargs) -> FakeRunResult:
+        return asyncio.run(cls.run(agent, input, **kwargs))
+
+
+# ---------------------------------------------------------------------------
+# Firebase Functions
+# ---------------------------------------------------------------------------
+
+def _identity_decorator(*args, **kwargs):
+    if len(args) == 1 and callable(args[0]) and not kwargs:
+        return args[0]
+    return lambda function: function
+
+
+@dataclass
+class FakeAuth:
+    uid: str
+    token: dict = field(default_factory=dict)
+
+
+@dataclass
+class FakeCallableRequest:
+    data: dict
+    auth: Optional[FakeAuth] = None
+
+
+@dataclass
+class FakeStorageObjectData:
+    name: str
+    bucket: str
+    size: Optional[int] = None
+    content_type: Optional[str] = None
+    generation: Optional[int] = None
+    metageneration: Optional[int] = None
+    time_created: Optional[datetime] = None
+
+
+@dataclass
+class FakeCloudEvent:
+    data: Any
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    params: Dict[str, str] = field(default_factory=dict)
+
+    def __class_getitem__(cls, item):
+        # main.py annotates handlers with CloudEvent[StorageObjectData]
+        return cls
+
+
+@dataclass
+class FakeChange:
+    before: Optional[FakeDocumentSnapshot]
+    after: Optional[FakeDocumentSnapshot]
+
+    def __class_getitem__(cls, item):
+        # main.py annotates handlers with Event[Change[DocumentSnapshot]]
+        return cls
+
+
+# ---------------------------------------------------------------------------
+# Installation
+# ---------------------------------------------------------------------------
+
+@dataclass
+class Fakes:
+    """Handles on the fake services installed by install_fakes()."""
+
+    config: FakeConfig
+    db: FakeFirestore
+    storage: FakeStorage
+    openai: FakeOpenAIBackend
+    runner: type
+
+    def reset(self) -> None:
+        """Drop all state and counters while keeping the modules installed."""
+        self.db.documents.clear()
+        self.db.stats = FirestoreStats()
+        self.storage.objects.clear()
+        self.storage.calls = 0
+        self.storage.bytes_downloaded = 0
+        backend = self.openai
+        backend.files.clear()
+        backend.file_contents.clear()
+        backend.vector_stores.clear()
+        backend.vector_store_files.clear()
+        backend.file_batches.clear()
+        backend.stats = OpenAIStats()
+        backend.fault_injector = None
+        backend.window_started, backend.window_requests = time.monotonic(), 0
+        self.runner.stats = AgentStats()
+        self.runner.fault_injector = None
+        self.runner.responder = None
+
+
+def _module(name: str, **attributes) -> types.ModuleType:
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+    return module
+
+
+def install_fakes(config: Optional[FakeConfig] = None) -> Fakes:
+    """
+    Register the fake services in sys.modules and put server/functions on sys.path.
+
+    Must be called before importing any module of server/functions.
+
+    Args:
+        config: Latencies and behaviour of the fake services
+
+    Returns:
+        Fakes: Handles on the installed fake services
+    """
+    config = config or FakeConfig()
+    db = FakeFirestore(latency=config.firestore_latency)
+    storage = FakeStorage(latency=config.storage_latency, bytes_per_second=config.storage_bytes_per_second)
+    backend = FakeOpenAIBackend(config)
+    FakeOpenAI.backend = backend
+    FakeRunner.config = config
+    FakeRunner.stats = AgentStats()
+
+    firestore_attributes = dict(
+        client=lambda app=None: db,
+        SERVER_TIMESTAMP=SERVER_TIMESTAMP,
+        DELETE_FIELD=DELETE_FIELD,
+        Increment=Increment,
+        ArrayUnion=ArrayUnion,
+        ArrayRemove=ArrayRemove,
+        Query=FakeQuery,
+        FieldFilter=FieldFilter,
+        transactional=transactional,
+        DocumentReference=FakeDocumentReference,
+        DocumentSnapshot=FakeDocumentSnapshot,
+        Transaction=FakeTransaction,
+    )
+
+    # firebase_admin
+    admin_firestore = _module('firebase_admin.firestore', **firestore_attributes)
+    admin_storage = _module('firebase_admin.storage', bucket=storage.bucket)
+    admin_auth = _module('firebase_admin.auth')
+    _module(
+        'firebase_admin',
+        initialize_app=lambda *args, **kwargs: object(),
+        firestore=admin_firestore,
+        storage=admin_storage,
+        auth=admin_auth,
+    )
+
+    # google.cloud and google.api_core
+    google = _module('google')
+    google.__path__ = []
+    cloud = _module('google.cloud')
+    cloud.__path__ = []
+    google.cloud = cloud
+    cloud.firestore = _module('google.cloud.firestore', **firestore_attributes)
+    cloud.storage = _module('google.cloud.storage', Client=lambda *args, **kwargs: storage)
+    api_core = _module('google.api_core')
+    api_core.__path__ = []
+    google.api_core = api_core
+    api_core.exceptions = _module('google.api_core.exceptions', AlreadyExists=AlreadyExists, NotFound=NotFound)
+    protobuf = _module('google.protobuf')
+    protobuf.__path__ = []
+    google.protobuf = protobuf
+    protobuf.timestamp_pb2 = _module('google.protobuf.timestamp_pb2', Timestamp=datetime)
+
+    # openai
+    _module(
+        'openai', OpenAI=FakeOpenAI, NotFoundError=NotFound, APIStatusError=APIStatusError,
+        APIConnectionError=APIConnectionError, APITimeoutError=APITimeoutError,
+        DefaultHttpxClient=FakeHttpxClient,
+    )
+
+    # agents
+    agents_memory = _module('agents.memory', Session=FakeSession)
+    _module(
+        'agents',
+        Agent=FakeAgent,
+        Runner=FakeRunner,
+        ModelSettings=FakeModelSettings,
+        FileSearchTool=FakeFileSearchTool,
+        function_tool=fake_function_tool,
+        memory=agents_memory,
+    )
+
+    # firebase_functions
+    https_fn = _module(
+        'firebase_functions.https_fn',
+        on_call=_identity_decorator,
+        on_request=_identity_decorator,
+        CallableRequest=FakeCallableRequest,
+    )
+    storage_fn = _module(
+        'firebase_functions.storage_fn',
+        on_object_finalized=_identity_decorator,
+        on_object_deleted=_identity_decorator,
+        CloudEvent=FakeCloudEvent,
+        StorageObjectData=FakeStorageObjectData,
+    )
+    scheduler_fn = _module(
+        'firebase_functions.scheduler_fn',
+        on_schedule=_identity_decorator,
+        ScheduledEvent=FakeObject,
+    )
+    firestore_fn = _module(
+        'firebase_functions.firestore_fn',
+        on_document_created=_identity_decorator,
+        on_document_written=_identity_decorator,
+        Event=FakeCloudEvent,
+        Change=FakeChange,
+        DocumentSnapshot=FakeDocumentSnapshot,
+    )
+    options = _module(
+        'firebase_functions.options',
+        set_global_options=lambda **kwargs: None,
+        MemoryOption=enum.IntEnum('MemoryOption', {f'GB_{size}': size * 1024 for size in (1, 2, 4, 8, 16, 32)}),
+    )
+    _module(
+        'firebase_functions',
+        https_fn=https_fn,
+        storage_fn=storage_fn,
+        scheduler_fn=scheduler_fn,
+        firestore_fn=firestore_fn,
+        options=options,
+    )
+
+    functions_dir = os.path.abspath(FUNCTIONS_DIR)
+    if functions_dir not in sys.path:
+        sys.path.insert(0, functions_dir)
+
+    return Fakes(config=config, db=db, storage=storage, openai=backend, runner=FakeRunner)
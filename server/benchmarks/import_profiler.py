@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Import-time profile and cold-start measurement of the functions entry point.
+
+Each module is imported in a fresh interpreter with `python -X importtime`, the
+way a new container loads it, and the self time of every imported module is
+summed per top-level package. The report shows what an import really costs and
+which packages dominate it:
+
+    module                  total ms   top packages
+    main                         ...   firebase_functions ..., firebase_admin ..., ...
+    chat                         ...   agents ..., openai ..., ...
+
+--cold-start N measures the wall time of N fresh interpreters importing the
+entry point (main by default), which is the import part of a cold start. Save
+the results with --save before a change and compare with --baseline after it.
+
+The functions dependencies (requirements.txt) must be installed. Run from the
+repository root:
+
+    python server/benchmarks/import_profiler.py
+    python server/benchmarks/import_profiler.py --cold-start 10 --save imports.json
+    python server/benchmarks/import_profiler.py --cold-start 10 --baseline imports.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+
+FUNCTIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'functions')
+DEFAULT_MODULES = [
+    'main', 'chat', 'vectorize_file', 'session_management', 'delete_file', 'image_to_description',
+]
+
+
+def run_python(code: str, importtime: bool = False) -> subprocess.CompletedProcess:
+    """Run code in a fresh interpreter with the functions directory on the path."""
+    command = [sys.executable]
+    if importtime:
+        command += ['-X', 'importtime']
+    command += ['-c', code]
+    env = dict(os.environ, PYTHONPATH=os.path.abspath(FUNCTIONS_DIR))
+    return subprocess.run(command, cwd=FUNCTIONS_DIR, env=env, capture_output=True, text=True)
+
+
+def parse_importtime(output: str) -> List[tuple]:
+    """(self us, cumulative us, module name) of each line of -X importtime output."""
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = (part.strip() for part in line[len('import time:'):].split('|'))
+        entries.append((int(self_us), int(cumulative_us), name))
+    return entries
+
+
+def profile_import(module: str, startup_modules: set) -> dict:
+    """
+    Import a module in a fresh interpreter and aggregate the cost per package.
+
+    Args:
+        module: Name of the module to import
+        startup_modules: Modules imported by the interpreter itself, left out of the report
+
+    Returns:
+        dict: total_ms, packages (self time per top-level package in ms) or error
+    """
+    process = run_python(f"import {module}", importtime=True)
+    if process.returncode != 0:
+        last_line = (process.stderr.strip().splitlines() or ['unknown error'])[-1]
+        return {'module': module, 'error': last_line}
+
+    packages: Dict[str, float] = {}
+    total_ms = 0.0
+    for self_us, cumulative_us, name in parse_importtime(process.stderr):
+        if name in startup_modules:
+            continue
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0) + self_us / 1000
+        if name == module:
+            total_ms = cumulative_us / 1000
+
+    return {
+        'module': module,
+        'total_ms': round(total_ms, 1),
+        'packages': {
+            package: round(ms, 1)
+            for package, ms in sorted(packages.items(), key=lambda item: item[1], reverse=True)
+        },
+    }
+
+
+def measure_cold_start(module: str, runs: int) -> dict:
+    """
+    Wall time of fresh interpreters importing a module.
+
+    Args:
+        module: Entry point to import
+        runs: Number of interpreters to start
+
+    Returns:
+        dict: p50/min/max in ms, or error
+    """
+    baseline_process = []
+    import_process = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        run_python('pass')
+        baseline_process.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        process = run_python(f"import {module}")
+        import_process.append(time.perf_counter() - started)
+        if process.returncode != 0:
+            return {'module': module, 'error': (process.stderr.strip().splitlines() or ['unknown error'])[-1]}
+
+    interpreter_ms = statistics.median(baseline_process) * 1000
+    return {
+        'module': module,
+        'runs': runs,
+        'p50_ms': round(statistics.median(import_process) * 1000 - interpreter_ms, 1),
+        'min_ms': round(min(import_process) * 1000 - interpreter_ms, 1),
+        'max_ms': round(max(import_process) * 1000 - interpreter_ms, 1),
+    }
+
+
+def print_report(profiles: List[dict], cold_start: Optional[dict], top: int) -> None:
+    """Print the import profile table and the cold-start measurement."""
+    print(f"{'module':<22}{'total ms':>10}   top packages")
+    print('-' * 100)
+    for profile in profiles:
+        if 'error' in profile:
+            print(f"{profile['module']:<22}{'-':>10}   import failed: {profile['error']}")
+            continue
+        packages = ', '.join(f"{name} {ms}" for name, ms in list(profile['packages'].items())[:top])
+        print(f"{profile['module']:<22}{profile['total_ms']:>10}   {packages}")
+
+    if cold_start:
+        print()
+        if 'error' in cold_start:
+            print(f"cold start of {cold_start['module']}: import failed: {cold_start['error']}")
+        else:
+            print(
+                f"cold start of {cold_start['module']} ({cold_start['runs']} runs, interpreter start excluded): "
+                f"p50 {cold_start['p50_ms']} ms, min {cold_start['min_ms']} ms, max {cold_start['max_ms']} ms"
+            )
+
+
+def compare_with_baseline(results: dict, baseline: dict) -> List[str]:
+    """Lines describing the change of each module and of the cold start against a baseline."""
+    lines = []
+    previous = {profile['module']: profile for profile in baseline.get('profiles', [])}
+    for profile in results['profiles']:
+        before = previous.get(profile['module'])
+        if before and 'total_ms' in before and 'total_ms' in profile:
+            lines.append(f"  {profile['module']}: {before['total_ms']} ms -> {profile['total_ms']} ms")
+    before_cold, after_cold = baseline.get('cold_start') or {}, results.get('cold_start') or {}
+    if 'p50_ms' in before_cold and 'p50_ms' in after_cold:
+        lines.append(f"  cold start p50: {before_cold['p50_ms']} ms -> {after_cold['p50_ms']} ms")
+    return lines
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modules', nargs='+', default=DEFAULT_MODULES)
+    parser.add_argument('--top', type=int, default=5, help='Packages listed per module')
+    parser.add_argument('--cold-start', type=int, default=0, metavar='N', help='Measure N cold imports')
+    parser.add_argument('--entry-point', default='main')
+    parser.add_argument('--save', help='Write the results as JSON to this path')
+    parser.add_argument('--baseline', help='Compare with results saved by --save')
+    args = parser.parse_args()
+
+    startup_modules = {name for _, _, name in parse_importtime(run_python('pass', importtime=True).stderr)}
+    results = {
+        'profiles': [profile_import(module, startup_modules) for module in args.modules],
+        'cold_start': measure_cold_start(args.entry_point, args.cold_start) if args.cold_start else None,
+    }
+    print_report(results['profiles'], results['cold_start'], args.top)
+
+    if args.save:
+        with open(args.save, 'w') as output:
+            json.dump(results, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            lines = compare_with_baseline(results, json.load(baseline_file))
+        print('\nChange against baseline:')
+        print('\n'.join(lines) if lines else '  nothing comparable')
+    return 0 if all('error' not in profile for profile in results['profiles']) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
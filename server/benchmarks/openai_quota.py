@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Measure chat turns during a bulk upload with and without the chat share of the OpenAI budget.
+
+The fake OpenAI backend enforces a requests-per-window rate limit shared by
+the ingestion pipeline and the chat agent runs, and answers with the
+x-ratelimit-* headers of the real API. A bulk upload runs on several threads
+while one user chats, first with OPENAI_CHAT_RESERVED_SHARE=0 (no reserve),
+then with the reserve. Prints chat latency percentiles and 429s, ingestion
+time, failures and budget waits of both, and the budget reported by
+get_budget_state. The behaviour of the budget tracker is covered by
+server/tests/test_openai_quota.py. Run from the repository root:
+
+    python server/benchmarks/openai_quota.py
+    python server/benchmarks/openai_quota.py --documents 60 --limit 30 --share 0.4
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_utils import latency_summary, quiet
+from fakes import FakeConfig, Fakes, install_fakes
+
+
+BUCKET = 'quota-bucket'
+UPLOADER_ID = 'bulk-user'
+CHAT_USER_ID = 'chat-user'
+
+
+def run_scenario(fakes: Fakes, documents: int, chat_turns: int, workers: int, share: float) -> dict:
+    import openai_quota
+    from chat import run_chat
+    from vectorize_file import run_vectorize_file
+
+    fakes.reset()
+    os.environ['OPENAI_CHAT_RESERVED_SHARE'] = str(share)
+    openai_quota._tracker = openai_quota.BudgetTracker()
+    fakes.db.documents[f'user_vector_stores/{CHAT_USER_ID}'] = {'vector_store_ids': ['vs_chat']}
+    paths = [f'user-documents/{UPLOADER_ID}/report{index}.pdf' for index in range(documents)]
+    for index, path in enumerate(paths):
+        fakes.storage.put(BUCKET, path, b'%PDF-1.7\n' + str(index).encode() * 2048, 'application/pdf')
+
+    chat_latencies, chat_failures = [], 0
+    uploading = threading.Event()
+
+    def chat() -> None:
+        nonlocal chat_failures
+        uploading.wait()
+        for turn in range(chat_turns):
+            started = time.perf_counter()
+            response = run_chat(CHAT_USER_ID, f'What does clause {turn} say?', 'quota-session')
+            chat_latencies.append(time.perf_counter() - started)
+            chat_failures += 0 if response['success'] else 1
+
+    started = time.perf_counter()
+    with quiet(), ThreadPoolExecutor(max_workers=workers + 1) as executor:
+        chat_future = executor.submit(chat)
+        uploads = [executor.submit(run_vectorize_file, path, BUCKET, '1') for path in paths]
+        uploading.set()
+        messages = [upload.result() for upload in uploads]
+        ingestion_s = time.perf_counter() - started
+        chat_future.result()
+
+    budget = openai_quota.get_budget_state()
+    return {
+        'chat': latency_summary(chat_latencies),
+        'chat_failures': chat_failures,
+        'chat_429s': fakes.openai.stats.rate_limited.get('responses.create', 0),
+        'ingestion_429s': sum(
+            count for endpoint, count in fakes.openai.stats.rate_limited.items() if endpoint != 'responses.create'),
+        'ingestion_failures': sum(1 for message in messages if 'successful' not in message),
+        'ingestion_s': round(ingestion_s, 2),
+        'budget': budget,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, default=40)
+    parser.add_argument('--chat-turns', type=int, default=15)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--limit', type=int, default=40, help='requests per window')
+    parser.add_argument('--window-s', type=float, default=1.0)
+    parser.add_argument('--share', type=float, default=0.3)
+    parser.add_argument('--openai-latency-ms', type=float, default=20)
+    parser.add_argument('--agent-latency-ms', type=float, default=100)
+    args = parser.parse_args()
+
+    fakes = install_fakes(FakeConfig(
+        openai_latency=args.openai_latency_ms / 1000,
+        agent_latency=args.agent_latency_ms / 1000,
+        openai_rate_limit_requests=args.limit,
+        openai_rate_limit_window=args.window_s,
+    ))
+    for label, share in (('no reserve', 0.0), (f'reserve {args.share:.0%}', args.share)):
+        result = run_scenario(fakes, args.documents, args.chat_turns, args.workers, share)
+        print(f"{label:<12} chat_p50_ms={result['chat']['p50_ms']} chat_p95_ms={result['chat']['p95_ms']} "
+              f"chat_429s={result['chat_429s']} chat_failures={result['chat_failures']} "
+              f"ingestion_s={result['ingestion_s']} ingestion_429s={result['ingestion_429s']} "
+              f"ingestion_failures={result['ingestion_failures']} "
+              f"budget_waits={result['budget']['background_waits']}")
+    print(f"budget       requests={result['budget']['requests']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
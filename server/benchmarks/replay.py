@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+Replay of recorded traffic against the main.py handlers and the in-memory fakes.
+
+Reads request captures written by server/functions/traffic_capture.py
+(TRAFFIC_CAPTURE=1), exported from Cloud Logging as a JSON array or as JSON
+lines, and replays them with their original inter-arrival times divided by
+--rate-scale. Each capture becomes a call of the corresponding main.py handler
+with synthetic content of the recorded shape: prompts of the recorded length,
+uploads of the recorded size and extension, deletes of the files uploaded
+earlier in the trace, and chat turns in the recorded sessions.
+
+Requests run on --instances x --concurrency worker slots, standing in for
+max_instances and the concurrency of each instance; requests arriving while
+every slot is busy wait in a FIFO queue. For every configuration, the report
+gives per endpoint the throughput, the queue wait and the total latency
+percentiles (p50/p95/p99), and the errors. Admission control still applies
+inside the handlers, as one container shared by all slots.
+
+Without --capture, a synthetic trace is generated with long chat sessions,
+bursts of uploads, deletes and the document list polling of the UI, and can be
+saved with --write-capture. Run from the repository root:
+
+    python server/benchmarks/replay.py
+    python server/benchmarks/replay.py --capture capture.json --rate-scale 4 --instances 1 2 4
+    python server/benchmarks/replay.py --users 30 --duration 60 --write-capture synthetic.jsonl
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from bench_utils import latency_summary, quiet
+from fakes import FakeAuth, FakeCallableRequest, FakeCloudEvent, FakeConfig, FakeStorageObjectData, Fakes, install_fakes
+
+
+BUCKET = 'replay-bucket'
+MAX_OBJECT_BYTES = 8 * 1024 * 1024  # Uploads are truncated to this size to bound memory
+EXTENSION_MIX = [('.pdf', 0.5), ('.docx', 0.2), ('.txt', 0.15), ('.md', 0.1), ('.png', 0.05)]
+
+# Leading bytes of replayed uploads, which the pipeline sniffs before accepting them
+FILE_HEADERS = {
+    '.pdf': b'%PDF-1.7\n', '.png': b'\x89PNG\r\n\x1a\n', '.jpg': b'\xff\xd8\xff\xe0', '.jpeg': b'\xff\xd8\xff\xe0',
+    '.docx': b'PK\x03\x04', '.xlsx': b'PK\x03\x04', '.pptx': b'PK\x03\x04',
+    '.doc': b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', '.xls': b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1',
+}
+
+
+# ---------------------------------------------------------------------------
+# Captures
+# ---------------------------------------------------------------------------
+
+def load_capture(path: str) -> List[dict]:
+    """
+    Read captures from a Cloud Logging export (JSON array), JSON lines or raw function logs.
+
+    Each entry may be a log entry (capture under jsonPayload or at the top level)
+    or a bare capture.
+
+    Returns:
+        List[dict]: Captures sorted by timestamp
+    """
+    with open(path) as file:
+        text = file.read().strip()
+    if text.startswith('['):
+        entries = json.loads(text)
+    else:
+        # Raw function logs mix captures with other lines
+        entries = [json.loads(line) for line in text.splitlines() if line.startswith('{')]
+
+    captures = []
+    for entry in entries:
+        payload = entry.get('jsonPayload', entry)
+        capture = payload.get('capture', payload)
+        if 'function' in capture and 'ts' in capture:
+            captures.append(capture)
+    return sorted(captures, key=lambda capture: capture['ts'])
+
+
+def synthesize_capture(users: int, duration: float, seed: int) -> List[dict]:
+    """
+    Generate a trace with the traffic mix of the application.
+
+    Users chat in sessions of very different lengths, some upload bursts of
+    files and delete part of them later, and every active user polls the
+    document list every 5 seconds like the documents page does.
+
+    Args:
+        users: Number of users
+        duration: Length of the trace in seconds
+        seed: Seed of the random generator
+
+    Returns:
+        List[dict]: Captures sorted by timestamp
+    """
+    rng = random.Random(seed)
+    base = 1_760_000_000.0
+    captures: List[dict] = []
+
+    def add(ts: float, function: str, user: str, **shape) -> None:
+        if ts < duration:
+            captures.append({'function': function, 'ts': round(base + ts, 3), 'user': user, **shape})
+
+    extensions, weights = zip(*EXTENSION_MIX)
+    for index in range(users):
+        user = f"user{index:03d}"
+        start = rng.uniform(0, duration * 0.5)
+        end = start
+        add(start, 'list_sessions', user)
+
+        # Chat sessions, most short and a few long ones
+        ts = start
+        for session_index in range(rng.randint(1, 3)):
+            session = f"{user}-s{session_index}"
+            add(ts, 'create_session', user, session=session)
+            turns = rng.choice([2, 3, 4, 6, 8, 12, 20, 40])
+            for _ in range(turns):
+                ts += rng.expovariate(1 / 4)
+                add(ts, 'chat', user, session=session, prompt_chars=int(rng.lognormvariate(4.5, 0.8)), documents=0)
+            end = max(end, ts)
+
+        # Upload bursts, with part of the files deleted later
+        if rng.random() < 0.3:
+            burst = rng.uniform(start, duration * 0.7)
+            for file_index in range(rng.randint(5, 30)):
+                upload_ts = burst + rng.uniform(0, 3)
+                extension = rng.choices(extensions, weights)[0]
+                file = f"{user}-f{file_index}"
+                size = min(int(rng.lognormvariate(12, 1.2)), MAX_OBJECT_BYTES)
+                add(upload_ts, 'vectorize_file', user, file=file, extension=extension, size_bytes=size)
+                if rng.random() < 0.3:
+                    add(upload_ts + rng.uniform(5, 30), 'delete_document', user, file=file, extension=extension)
+            end = max(end, burst + 30)
+
+        # Document list polling while the user is active
+        poll = start
+        while poll < end:
+            add(poll, 'list_documents', user, page_size=200, paged=False)
+            poll += 5
+
+    return sorted(captures, key=lambda capture: capture['ts'])
+
+
+# ---------------------------------------------------------------------------
+# Replay
+# ---------------------------------------------------------------------------
+
+class Replayer:
+    """Turns captures into calls of the main.py handlers."""
+
+    def __init__(self, fakes: Fakes):
+        import main
+
+        self.fakes = fakes
+        self.main = main
+        self.builders: Dict[str, Callable[[dict], Callable[[], object]]] = {
+            'chat': self.chat,
+            'batch_chat': self.batch_chat,
+            'vectorize_file': self.vectorize_file,
+            'delete_document': self.delete_document,
+            'list_documents': self.callable('list_documents', lambda capture: {'pageSize': capture.get('page_size') or 50}),
+            'list_sessions': self.callable('list_sessions', lambda capture: {}),
+            'create_session': self.callable('create_session', lambda capture: {}),
+            'delete_session': self.callable('delete_session', lambda capture: {'sessionId': f"s-{capture.get('session')}"}),
+        }
+
+    def request(self, capture: dict) -> Optional[Callable[[], object]]:
+        """Handler call of a capture, None for functions the replay does not know."""
+        builder = self.builders.get(capture['function'])
+        return builder(capture) if builder else None
+
+    def callable(self, name: str, data: Callable[[dict], dict]):
+        def build(capture: dict):
+            request = FakeCallableRequest(data=data(capture), auth=FakeAuth(uid=f"u-{capture['user']}"))
+            return lambda: getattr(self.main, name)(request)
+        return build
+
+    def chat(self, capture: dict):
+        prompt = ('how does the contract define ' * 64)[:max(1, capture.get('prompt_chars', 40))]
+        request = FakeCallableRequest(
+            data={'prompt': prompt, 'sessionId': f"s-{capture.get('session')}"},
+            auth=FakeAuth(uid=f"u-{capture['user']}"),
+        )
+        return lambda: self.main.chat(request)
+
+    def batch_chat(self, capture: dict):
+        count = max(1, capture.get('prompts', 1))
+        length = max(1, capture.get('prompt_chars', 40 * count) // count)
+        prompts = [(f"question {index} about the report " * 16)[:length] for index in range(count)]
+        request = FakeCallableRequest(data={'prompts': prompts}, auth=FakeAuth(uid=f"u-{capture['user']}"))
+        return lambda: self.main.batch_chat(request)
+
+    def vectorize_file(self, capture: dict):
+        path = self.object_path(capture)
+        extension = capture.get('extension') or ''
+        size = min(int(capture.get('size_bytes') or 1024), MAX_OBJECT_BYTES)
+        data = FILE_HEADERS.get(extension, b'') + b'0' * max(0, size - len(FILE_HEADERS.get(extension, b'')))
+
+        def run():
+            stored = self.fakes.storage.put(BUCKET, path, data)
+            event = FakeCloudEvent(FakeStorageObjectData(
+                name=path, bucket=BUCKET, size=size, generation=stored['generation']))
+            return self.main.vectorize_file(event)
+        return run
+
+    def delete_document(self, capture: dict):
+        path = self.object_path(capture)
+        request = FakeCallableRequest(data={'fileName': path.rsplit('/', 1)[-1]}, auth=FakeAuth(uid=f"u-{capture['user']}"))
+
+        def run():
+            response = self.main.delete_document(request)
+            # The client deletes the storage object after the callable
+            self.fakes.storage.objects.pop((BUCKET, path), None)
+            return response
+        return run
+
+    @staticmethod
+    def object_path(capture: dict) -> str:
+        return f"user-documents/u-{capture['user']}/{capture.get('file')}{capture.get('extension') or ''}"
+
+
+def is_error(result) -> bool:
+    """Whether a handler result reports a failure."""
+    if isinstance(result, dict):
+        return not result.get('success', True)
+    if isinstance(result, str):
+        return 'failed' in result.lower() or 'too many' in result.lower()
+    return False
+
+
+def replay(fakes: Fakes, captures: List[dict], rate_scale: float, slots: int) -> dict:
+    """
+    Replay captures on a bounded number of worker slots.
+
+    Args:
+        fakes: Installed fakes, reset before the replay
+        captures: Captures sorted by timestamp
+        rate_scale: Speed-up of the recorded arrival rate
+        slots: Requests handled at the same time
+
+    Returns:
+        dict: Per endpoint samples (queue wait, latency, errors) and the wall time
+    """
+    import admission_control
+
+    fakes.reset()
+    admission_control._controllers.clear()
+    replayer = Replayer(fakes)
+    samples: Dict[str, dict] = defaultdict(lambda: {'queue': [], 'latency': [], 'errors': 0})
+    samples_lock = threading.Lock()
+    skipped = defaultdict(int)
+    first_ts = captures[0]['ts'] if captures else 0
+
+    def run(function: str, call: Callable[[], object], scheduled: float) -> None:
+        started = time.perf_counter()
+        try:
+            failed = is_error(call())
+        except Exception:
+            failed = True
+        finished = time.perf_counter()
+        with samples_lock:
+            sample = samples[function]
+            sample['queue'].append(started - scheduled)
+            sample['latency'].append(finished - scheduled)
+            sample['errors'] += int(failed)
+
+    replay_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=slots) as executor:
+        for capture in captures:
+            scheduled = replay_started + (capture['ts'] - first_ts) / rate_scale
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            call = replayer.request(capture)
+            if call is None:
+                skipped[capture['function']] += 1
+                continue
+            executor.submit(run, capture['function'], call, scheduled)
+    return {
+        'wall_s': time.perf_counter() - replay_started,
+        'samples': dict(samples),
+        'skipped': dict(skipped),
+    }
+
+
+def report(instances: int, concurrency: int, result: dict) -> List[dict]:
+    """Print the per endpoint table of a configuration and return its rows."""
+    print(f"\ninstances={instances} concurrency={concurrency} wall_s={result['wall_s']:.2f}")
+    header = (f"{'endpoint':<18}{'requests':>9}{'req/s':>8}{'errors':>8}"
+              f"{'queue_p50':>11}{'queue_p95':>11}{'queue_p99':>11}{'p50_ms':>9}{'p95_ms':>9}{'p99_ms':>9}")
+    print(header)
+    rows = []
+    for function, sample in sorted(result['samples'].items()):
+        queue = latency_summary(sample['queue'])
+        latency = latency_summary(sample['latency'])
+        row = {
+            'endpoint': function,
+            'instances': instances,
+            'concurrency': concurrency,
+            'requests': len(sample['latency']),
+            'throughput_rps': round(len(sample['latency']) / result['wall_s'], 2),
+            'errors': sample['errors'],
+            **{f"queue_{key}": value for key, value in queue.items()},
+            **latency,
+        }
+        rows.append(row)
+        print(f"{function:<18}{row['requests']:>9}{row['throughput_rps']:>8}{row['errors']:>8}"
+              f"{queue['p50_ms']:>11}{queue['p95_ms']:>11}{queue['p99_ms']:>11}"
+              f"{latency['p50_ms']:>9}{latency['p95_ms']:>9}{latency['p99_ms']:>9}")
+    if result['skipped']:
+        print(f"skipped unknown functions: {result['skipped']}")
+    return rows
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--capture', help='Captures exported from Cloud Logging (JSON array or JSON lines)')
+    parser.add_argument('--write-capture', help='Save the synthetic trace as JSON lines')
+    parser.add_argument('--users', type=int, default=12, help='Users of the synthetic trace')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds of the synthetic trace')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--rate-scale', type=float, default=2, help='Speed-up of the recorded arrival rate')
+    parser.add_argument('--instances', type=int, nargs='+', default=[1, 2], help='max_instances values to compare')
+    parser.add_argument('--concurrency', type=int, default=4, help='Requests handled at the same time per instance')
+    parser.add_argument('--firestore-latency-ms', type=float, default=5)
+    parser.add_argument('--openai-latency-ms', type=float, default=40)
+    parser.add_argument('--agent-latency-ms', type=float, default=400)
+    parser.add_argument('--json', help='Save the report rows to this file')
+    args = parser.parse_args()
+
+    if args.capture:
+        captures = load_capture(args.capture)
+    else:
+        captures = synthesize_capture(args.users, args.duration, args.seed)
+        if args.write_capture:
+            with open(args.write_capture, 'w') as file:
+                file.writelines(json.dumps(capture) + '\n' for capture in captures)
+    counts = defaultdict(int)
+    for capture in captures:
+        counts[capture['function']] += 1
+    span_s = (captures[-1]['ts'] - captures[0]['ts']) if captures else 0
+    print(f"{len(captures)} requests over {span_s:.1f}s replayed at x{args.rate_scale}: {dict(sorted(counts.items()))}")
+
+    fakes = install_fakes(FakeConfig(
+        firestore_latency=args.firestore_latency_ms / 1000,
+        openai_latency=args.openai_latency_ms / 1000,
+        agent_latency=args.agent_latency_ms / 1000,
+    ))
+    rows = []
+    for instances in args.instances:
+        with quiet():
+            result = replay(fakes, captures, args.rate_scale, instances * args.concurrency)
+        rows += report(instances, args.concurrency, result)
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(rows, file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
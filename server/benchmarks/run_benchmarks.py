@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+"""
+Offline benchmarks of the functions hot paths.
+
+The functions run unchanged against the in-memory Firestore, Cloud Storage,
+OpenAI and Agents fakes of fakes.py, with configurable latency per call. Each
+scenario reports wall time percentiles and Firestore document operations per
+call:
+
+- firestore_session: FirestoreSession.get_items / add_items at several session lengths
+- run_chat: full chat turns at several session lengths and concurrency levels
+- run_vectorize_file: ingestion of several file sizes at several concurrency levels
+- delete_user_session / list_user_sessions: at several session and message counts
+
+Sessions are stored in the layout selected with --session-layout ("messages" or
+"segments"), so both layouts can be compared at the same session lengths.
+
+Results can be saved with --save and compared with --baseline. The comparison
+fails (exit code 1) when a scenario performs more Firestore operations per call
+than the baseline, or when its p50 wall time grows beyond --tolerance.
+
+Run from the repository root:
+
+    python server/benchmarks/run_benchmarks.py
+    python server/benchmarks/run_benchmarks.py --save bench.json
+    python server/benchmarks/run_benchmarks.py --baseline bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from bench_utils import latency_summary, quiet
+from fakes import FakeConfig, Fakes, install_fakes
+
+
+BUCKET = 'bench-bucket'
+
+
+# ---------------------------------------------------------------------------
+# Seeding helpers (write straight into the fake database, not counted)
+# ---------------------------------------------------------------------------
+
+def seed_session(fakes: Fakes, uid: str, session_id: str, message_count: int) -> None:
+    """Create a session with message_count alternating user/assistant messages."""
+    base = datetime.now(timezone.utc) - timedelta(hours=1)
+    fakes.db.documents[f"sessions/{session_id}"] = {
+        'sessionId': session_id,
+        'userId': uid,
+        'name': 'Benchmark session',
+        'createdAt': base,
+        'updatedAt': base,
+    }
+    for index in range(message_count):
+        role = 'user' if index % 2 == 0 else 'assistant'
+        message_id = f"m{index:06d}"
+        fakes.db.documents[f"sessions/{session_id}/messages/{message_id}"] = {
+            'id': message_id,
+            'sessionId': session_id,
+            'userId': uid,
+            'role': role,
+            'message': f"{role} message {index} " + 'lorem ipsum ' * 20,
+            'createdAt': base + timedelta(milliseconds=index * 2),
+        }
+
+    from firestore_session import LAYOUT_SEGMENTS, default_storage_layout, migrate_session_to_segments
+    if default_storage_layout() == LAYOUT_SEGMENTS:
+        with quiet():
+            migrate_session_to_segments(session_id)
+
+
+def seed_vector_store(fakes: Fakes, uid: str) -> None:
+    """Give a user an existing vector store."""
+    from openai import OpenAI
+
+    vector_store = OpenAI().vector_stores.create(name=f"Vector Store for {uid}")
+    fakes.db.documents[f"user_vector_stores/{uid}"] = {
+        'user_id': uid,
+        'vector_store_ids': [vector_store.id],
+    }
+
+
+# ---------------------------------------------------------------------------
+# Measurement
+# ---------------------------------------------------------------------------
+
+def measure(
+    fakes: Fakes,
+    name: str,
+    calls: List[Callable[[], object]],
+    concurrency: int = 1,
+    params: Optional[dict] = None
+) -> dict:
+    """
+    Run calls and collect wall time percentiles and Firestore ops per call.
+
+    Args:
+        fakes: Installed fake services
+        name: Scenario name
+        calls: Zero-argument callables, one per measured call
+        concurrency: Number of calls running at the same time
+        params: Scenario parameters recorded with the result
+
+    Returns:
+        dict: Scenario result
+    """
+    latencies: List[float] = []
+
+    def timed(call: Callable[[], object]) -> None:
+        started = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - started)
+
+    before = fakes.db.stats.snapshot()
+    started = time.perf_counter()
+    with quiet():
+        if concurrency == 1:
+            for call in calls:
+                timed(call)
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                list(executor.map(timed, calls))
+    wall_time = time.perf_counter() - started
+    ops = fakes.db.stats - before
+
+    count = max(1, len(calls))
+    return {
+        'scenario': name,
+        'params': params or {},
+        'calls': len(calls),
+        'concurrency': concurrency,
+        **latency_summary(latencies),
+        'throughput_per_s': round(len(calls) / wall_time, 2) if wall_time else None,
+        'reads_per_call': round(ops.reads / count, 2),
+        'writes_per_call': round(ops.writes / count, 2),
+        'deletes_per_call': round(ops.deletes / count, 2),
+    }
+
+
+# ---------------------------------------------------------------------------
+# Scenarios
+# ---------------------------------------------------------------------------
+
+def bench_firestore_session(fakes: Fakes, args: argparse.Namespace) -> List[dict]:
+    from firestore_session import FirestoreSession, default_storage_layout
+
+    results = []
+    for length in args.session_lengths:
+        fakes.reset()
+        seed_session(fakes, 'bench-user', 'bench-session', length)
+        session = FirestoreSession('bench-user', 'bench-session', storage_layout=default_storage_layout())
+
+        results.append(measure(
+            fakes, 'firestore_session.get_items',
+            [lambda: asyncio.run(session.get_items()) for _ in range(args.iterations)],
+            params={'session_length': length, 'layout': args.session_layout},
+        ))
+        results.append(measure(
+            fakes, 'firestore_session.add_items',
+            [
+                lambda: asyncio.run(session.add_items([
+                    {'role': 'user', 'content': 'question'},
+                    {'role': 'assistant', 'content': 'answer'},
+                ]))
+                for _ in range(args.iterations)
+            ],
+            params={'session_length': length, 'layout': args.session_layout},
+        ))
+    return results
+
+
+def bench_run_chat(fakes: Fakes, args: argparse.Namespace) -> List[dict]:
+    from chat import run_chat
+
+    results = []
+    for length in args.session_lengths:
+        fakes.reset()
+        seed_vector_store(fakes, 'bench-user')
+        seed_session(fakes, 'bench-user', 'bench-session', length)
+        results.append(measure(
+            fakes, 'run_chat',
+            [
+                lambda index=index: run_chat('bench-user', f"Question {index}?", 'bench-session', f"msg-{index}")
+                for index in range(args.iterations)
+            ],
+            params={'session_length': length},
+        ))
+
+    for concurrency in args.concurrency:
+        fakes.reset()
+        calls = []
+        for index in range(max(args.iterations, concurrency * 2)):
+            uid = f"bench-user-{index % concurrency}"
+            session_id = f"bench-session-{index % concurrency}"
+            if f"sessions/{session_id}" not in fakes.db.documents:
+                seed_vector_store(fakes, uid)
+                seed_session(fakes, uid, session_id, 20)
+            calls.append(lambda uid=uid, session_id=session_id, index=index:
+                         run_chat(uid, f"Question {index}?", session_id, f"msg-{index}"))
+        results.append(measure(
+            fakes, 'run_chat', calls, concurrency=concurrency,
+            params={'session_length': 20, 'concurrent_sessions': concurrency},
+        ))
+    return results
+
+
+def bench_run_vectorize_file(fakes: Fakes, args: argparse.Namespace) -> List[dict]:
+    from vectorize_file import run_vectorize_file
+
+    results = []
+    for size_kb in args.file_sizes_kb:
+        for concurrency in args.concurrency:
+            fakes.reset()
+            calls = []
+            for index in range(max(args.iterations // 2, concurrency)):
+                uid = f"bench-user-{index % concurrency}"
+                path = f"user-documents/{uid}/document-{index}.pdf"
+                fakes.storage.put(BUCKET, path, b'%PDF-1.7\n' + b'0' * (size_kb * 1024), 'application/pdf')
+                if f"user_vector_stores/{uid}" not in fakes.db.documents:
+                    seed_vector_store(fakes, uid)
+                calls.append(lambda path=path: run_vectorize_file(path, BUCKET))
+            results.append(measure(
+                fakes, 'run_vectorize_file', calls, concurrency=concurrency,
+                params={'file_size_kb': size_kb},
+            ))
+    return results
+
+
+def bench_session_management(fakes: Fakes, args: argparse.Namespace) -> List[dict]:
+    from session_management import delete_user_session, list_user_sessions
+
+    results = []
+    for length in args.session_lengths:
+        fakes.reset()
+        for index in range(args.iterations):
+            seed_session(fakes, 'bench-user', f"bench-session-{index}", length)
+        results.append(measure(
+            fakes, 'delete_user_session',
+            [
+                lambda index=index: delete_user_session('bench-user', f"bench-session-{index}")
+                for index in range(args.iterations)
+            ],
+            params={'session_length': length},
+        ))
+
+    for session_count in args.session_counts:
+        fakes.reset()
+        for index in range(session_count):
+            seed_session(fakes, 'bench-user', f"bench-session-{index}", 0)
+        results.append(measure(
+            fakes, 'list_user_sessions',
+            [lambda: list_user_sessions('bench-user') for _ in range(args.iterations)],
+            params={'session_count': session_count},
+        ))
+    return results
+
+
+SCENARIOS = {
+    'firestore_session': bench_firestore_session,
+    'run_chat': bench_run_chat,
+    'run_vectorize_file': bench_run_vectorize_file,
+    'session_management': bench_session_management,
+}
+
+
+# ---------------------------------------------------------------------------
+# Reporting
+# ---------------------------------------------------------------------------
+
+def result_key(result: dict) -> str:
+    params = ','.join(f"{key}={value}" for key, value in sorted(result['params'].items()))
+    return f"{result['scenario']}[{params}]x{result['concurrency']}"
+
+
+def print_report(results: List[dict]) -> None:
+    header = f"{'scenario':<62}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'ops/s':>8}{'reads':>8}{'writes':>8}{'deletes':>8}"
+    print(header)
+    print('-' * len(header))
+    for result in results:
+        print(
+            f"{result_key(result):<62}{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}"
+            f"{result['throughput_per_s'] or 0:>8.1f}{result['reads_per_call']:>8.1f}"
+            f"{result['writes_per_call']:>8.1f}{result['deletes_per_call']:>8.1f}"
+        )
+
+
+def compare_with_baseline(results: List[dict], baseline: List[dict], tolerance: float) -> List[str]:
+    """
+    Find regressions against a saved baseline.
+
+    Args:
+        results: Results of this run
+        baseline: Results of the baseline run
+        tolerance: Allowed relative growth of the p50 wall time
+
+    Returns:
+        List[str]: One message per regression
+    """
+    baseline_by_key = {result_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        previous = baseline_by_key.get(result_key(result))
+        if previous is None:
+            continue
+        for metric in ('reads_per_call', 'writes_per_call', 'deletes_per_call'):
+            if result[metric] > previous[metric]:
+                regressions.append(f"{result_key(result)}: {metric} {previous[metric]} -> {result[metric]}")
+        if result['p50_ms'] > previous['p50_ms'] * (1 + tolerance):
+            regressions.append(f"{result_key(result)}: p50_ms {previous['p50_ms']} -> {result['p50_ms']}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=sorted(SCENARIOS))
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--session-lengths', type=int, nargs='+', default=[0, 10, 50, 200])
+    parser.add_argument('--session-counts', type=int, nargs='+', default=[5, 50, 200])
+    parser.add_argument('--file-sizes-kb', type=int, nargs='+', default=[10, 1024, 8192])
+    parser.add_argument('--session-layout', choices=['messages', 'segments'], default='messages')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--firestore-latency-ms', type=float, default=2)
+    parser.add_argument('--storage-latency-ms', type=float, default=5)
+    parser.add_argument('--openai-latency-ms', type=float, default=20)
+    parser.add_argument('--agent-latency-ms', type=float, default=50)
+    parser.add_argument('--transfer-mb-per-s', type=float, default=50)
+    parser.add_argument('--save', help='Write the results as JSON to this path')
+    parser.add_argument('--baseline', help='Compare with results saved by --save')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative p50 growth')
+    args = parser.parse_args()
+    os.environ['SESSION_STORAGE_LAYOUT'] = args.session_layout
+
+    fakes = install_fakes(FakeConfig(
+        firestore_latency=args.firestore_latency_ms / 1000,
+        storage_latency=args.storage_latency_ms / 1000,
+        storage_bytes_per_second=args.transfer_mb_per_s * 1024 * 1024,
+        openai_latency=args.openai_latency_ms / 1000,
+        openai_upload_bytes_per_second=args.transfer_mb_per_s * 1024 * 1024,
+        agent_latency=args.agent_latency_ms / 1000,
+    ))
+
+    results: List[dict] = []
+    for name in args.scenarios:
+        results.extend(SCENARIOS[name](fakes, args))
+
+    print_report(results)
+
+    if args.save:
+        with open(args.save, 'w') as output:
+            json.dump(results, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare_with_baseline(results, json.load(baseline_file), args.tolerance)
+        if regressions:
+            print('\nRegressions against baseline:')
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print('\nNo regressions against baseline')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
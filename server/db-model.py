@@ -7,7 +7,7 @@ any runtime Python code.
 
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
 from typing import Dict, Any, Optional, Literal, List
 
@@ -23,7 +23,8 @@ class Session:
     messages retained.
 
     Storage path: sessions/{sessionId}
-    Subcollection: messages (the conversation turns within the session)
+    Subcollections: messages or transcript (the conversation turns within the
+    session, depending on storageLayout)
     """
 
     sessionId: str
@@ -31,6 +32,14 @@ class Session:
     name: Optional[str] = None
     createdAt: Optional[datetime] = None
     updatedAt: Optional[datetime] = None
+    storageLayout: Literal["messages", "segments"] = "messages"
+    messageCount: int = 0  # segments layout: sequence number of the next message
+    lastSegment: int = 0
+    lastSegmentMessages: int = 0
+    lastSegmentBytes: int = 0
+    migratedMessages: Optional[int] = None
+    migrationRequested: bool = False  # messages layout: waiting for migrate_idle_sessions
+    migrationError: Optional[str] = None  # messages layout: why the migration was refused
 
 
 @dataclass
@@ -54,6 +63,73 @@ class Message:
     clientMessageId: Optional[str] = None
 
 
+@dataclass
+class TranscriptSegment:
+    """Append-only chunk of up to 50 consecutive messages of a session.
+
+    Used by sessions whose storageLayout is "segments". Reading a long session
+    costs one read per segment instead of one per message. Each entry of
+    `messages` has the fields of Message plus `seq`, the position of the message
+    in the session.
+
+    Storage path: sessions/{sessionId}/transcript/{segment:06d}
+    Fields mirror writes in server/functions/firestore_session.py.
+    """
+
+    sessionId: str
+    userId: str
+    segment: int
+    startSeq: int
+    endSeq: int
+    messages: List[Dict[str, Any]]
+    updatedAt: Optional[datetime] = None
+
+
+@dataclass
+class SessionSummary:
+    """Rolling summary of the older turns of a session.
+
+    Written in the background by FirestoreSession compaction once the
+    unsummarized history passes a token threshold. The agent receives this
+    summary followed by the messages created after coveredUntil (coveredSeq in
+    the segments layout), which keeps the prompt size bounded for long sessions.
+
+    Storage path: sessions/{sessionId}/memory/summary
+    Fields mirror writes in server/functions/firestore_session.py.
+    """
+
+    summary: str
+    coveredUntil: datetime
+    coveredMessageCount: int
+    coveredSeq: Optional[int] = None
+    model: str
+    updatedAt: Optional[datetime] = None
+
+
+@dataclass
+class ChatExecution:
+    """Idempotency record of a single chat message execution.
+
+    Written by the chat callable when the client sends a clientMessageId. A retry
+    of the same message returns the stored response, or waits for the in-flight
+    execution, instead of running the agent again.
+
+    Storage path: sessions/{sessionId}/chat_executions/{clientMessageId}
+    Fields mirror writes in server/functions/chat_idempotency.py.
+    """
+
+    userId: str
+    sessionId: str
+    clientMessageId: str
+    status: Literal["in_flight", "completed", "failed"]
+    ownerId: str
+    response: Optional[Dict[str, Any]] = None
+    errorMessage: Optional[str] = None
+    startedAt: Optional[datetime] = None
+    updatedAt: Optional[datetime] = None
+    completedAt: Optional[datetime] = None
+
+
 @dataclass
 class VectorEmbedding:
     """Represents a vector embedding for a text chunk from a processed file.
@@ -107,6 +183,23 @@ class ProcessedFile:
     updated_at: Optional[datetime] = None
 
 
+@dataclass
+class ImageDescription:
+    """Cached vision model description of an uploaded image.
+
+    Images are indexed through a markdown description of their content. The
+    description is cached by the SHA-256 of the original image bytes so that
+    re-uploads of the same image do not call the vision model again.
+
+    Storage path: image_descriptions/{sha256}
+    Fields mirror writes in server/functions/image_to_description.py.
+    """
+
+    description: str
+    model: str
+    created_at: Optional[datetime] = None
+
+
 @dataclass
 class UserVectorStores:
     """Represents the OpenAI vector stores associated with a user.
@@ -130,12 +223,18 @@ class DocumentProcessingStatus:
     document processing progress.
 
     Storage path: document_processing_status/{userId}_{fileName}
-    Document ID format: {userId}_{fileName} (e.g., "user123_document.pdf")
+    Document ID format: {userId}_{fileName} (e.g., "user123_document.pdf"), with
+    "/" encoded as "%2F" (e.g., "user123_folder.zip%2Freports%2Fq1.pdf")
+
+    Members of an uploaded archive have their own status, with file_name
+    "{archiveName}/{memberPath}"; the status of the archive lists them. Parts of
+    an oversized document split by document_splitter.py are recorded the same
+    way, with file_name "{fileName}/{part}" (e.g., "report.pdf/pages-1-120.pdf").
     """
 
     user_id: str
     file_name: str
-    status: Literal["uploading", "processing", "vectorizing", "completed", "failed", "deleting"]
+    status: Literal["queued", "uploading", "processing", "vectorizing", "completed", "failed", "deleting"]
     error_message: Optional[str] = None
     progress_percentage: Optional[int] = None
     file_id: Optional[str] = None  # OpenAI file ID for deletion purposes
@@ -143,3 +242,217 @@ class DocumentProcessingStatus:
     started_at: Optional[datetime] = None
     completed_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
+    # Pipeline checkpoint of the storage generation being processed, used by
+    # retries to resume: {generation, downloaded, file_id, vector_store_id,
+    # attached, indexed, updated_at}; archives and split documents also store member_file_ids,
+    # saved while the members upload, and members_uploaded once all members are uploaded
+    checkpoint: Optional[Dict[str, Any]] = None
+    # Archives and split documents: file names of the ingested members (or parts)
+    # and number of members skipped
+    archive_members: Optional[List[str]] = None
+    skipped_members: Optional[int] = None
+    # Archive members and parts: file name of the archive (or split document) and its storage generation
+    archive: Optional[str] = None
+    generation: Optional[str] = None
+
+
+@dataclass
+class AdmissionBucket:
+    """Per-user token bucket shared by all function containers.
+
+    Only used when ADMISSION_BUCKET_BACKEND is set to "firestore". Each request
+    of a user takes one token; tokens refill at the rate of the request kind.
+
+    Storage path: admission_buckets/{kind}_{userId} (e.g., "chat_user123")
+    Fields mirror writes in server/functions/admission_control.py.
+    """
+
+    tokens: float
+    updated_at: Optional[datetime] = None
+
+
+@dataclass
+class ProcessingLease:
+    """Single-owner lease on a unit of background work.
+
+    Acquired by the vectorization pipeline for an object path and storage
+    generation before any work starts, renewed by a heartbeat while it runs and
+    released as completed or failed. Duplicate storage events exit while the
+    lease is live or completed, and report the outcome of a completed run.
+
+    Storage path: processing_leases/{sha256 of key}
+    Fields mirror writes in server/functions/leases.py.
+    """
+
+    key: str  # e.g. "user-documents/user123/document.pdf#1712345678901234"
+    owner: str
+    state: Literal["held", "completed", "failed"]
+    expires_at: datetime
+    acquired_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    outcome: Optional[str] = None  # Message of the run, set on release
+
+
+@dataclass
+class IngestionJob:
+    """Uploaded file waiting for, or going through, the vectorization pipeline.
+
+    Written by the storage trigger when INGESTION_MODE is "queue" and claimed by
+    the ingestion workers in priority order: interactive users first, then
+    smaller files first.
+
+    Storage path: ingestion_jobs/{sha256 of filePath and generation}
+    Fields mirror writes in server/functions/ingestion_queue.py.
+    """
+
+    job_id: str
+    user_id: str
+    file_path: str
+    bucket_name: str
+    generation: Optional[str]
+    size_bytes: int
+    interactive: bool
+    priority: float  # lower runs first
+    status: Literal["queued", "running", "completed", "failed"]
+    attempts: int = 0
+    worker: Optional[str] = None
+    error_message: Optional[str] = None
+    enqueued_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+
+@dataclass
+class OrphanReconcilerState:
+    """Position of the scheduled orphan reconciler between runs.
+
+    Each run handles a bounded number of pages of the current phase and saves
+    its cursor after every page; phases run in the order openai_files,
+    vector_store_files, status_docs, then the cycle starts over.
+
+    Storage path: maintenance/orphan_reconciler
+    Fields mirror writes in server/functions/reconcile_orphans.py.
+    """
+
+    phase: Literal["openai_files", "vector_store_files", "status_docs"]
+    # Per phase: {"after": id} for list cursors, plus user_id, user_after and
+    # vector_store_ids for vector_store_files
+    cursors: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    cycles: int = 0
+    last_cycle_completed_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+
+@dataclass
+class UserPurge:
+    """Progress of the purge of all data of a user.
+
+    The purge runs its stages in order (vector_stores, documents, sessions,
+    storage_objects, records) and saves its progress after every page; a call
+    that runs out of time or fails is continued by the next call.
+
+    Storage path: user_purges/{userId}
+    Fields mirror writes in server/functions/purge_user.py.
+    """
+
+    user_id: str
+    status: Literal["running", "completed", "failed"]
+    stage: Literal["vector_stores", "documents", "sessions", "storage_objects", "records"]
+    deleted: Dict[str, int] = field(default_factory=dict)  # items deleted per stage
+    error_message: Optional[str] = None
+    started_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+
+
+@dataclass
+class DocumentCatalogEntry:
+    """One uploaded document in the catalog of a user."""
+
+    name: str
+    status: Literal["queued", "uploading", "completed", "failed", "deleting"]
+    size: Optional[int] = None
+    content_type: Optional[str] = None
+    file_id: Optional[str] = None
+    uploaded_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+
+@dataclass
+class DocumentCatalog:
+    """Catalog of the documents uploaded by a user, served by list_documents.
+
+    Entries live in shard documents keyed by a hash of the file name; the
+    number of shards doubles when one of them grows past 2000 entries.
+
+    Storage path: document_catalogs/{userId}
+    Shards: document_catalogs/{userId}/shards/{index} with a documents map of DocumentCatalogEntry
+    Fields mirror writes in server/functions/document_catalog.py.
+    """
+
+    shard_count: int = 1
+    document_count: int = 0
+    updated_at: Optional[datetime] = None
+
+
+@dataclass
+class UserProcessingSummaryFile:
+    """Status of one file in the processing summary of a user."""
+
+    status: Literal["queued", "uploading", "processing", "vectorizing", "completed", "failed", "deleting"]
+    progress_percentage: Optional[int] = None
+    error_message: Optional[str] = None
+    updated_at: Optional[datetime] = None
+
+
+@dataclass
+class UserProcessingSummary:
+    """Files in flight, recently completed and failed files of a user, with counts per status.
+
+    Realtime clients listen to this document instead of querying
+    document_processing_status. Completed files are dropped after 10 minutes.
+
+    Storage path: user_processing_status/{userId}
+    Fields mirror writes in server/functions/processing_summary.py.
+    """
+
+    files: Dict[str, UserProcessingSummaryFile] = field(default_factory=dict)
+    counts: Dict[str, int] = field(default_factory=dict)
+    updated_at: Optional[datetime] = None
+
+
+@dataclass
+class DocumentOutlineSection:
+    """One section in the outline of a document summary."""
+
+    title: str
+    summary: str = ""
+
+
+@dataclass
+class DocumentSummary:
+    """Summary and section outline of an indexed document, read by the chat agent.
+
+    Marked pending by the pipeline once the document is indexed and generated
+    by the summarize_document trigger.
+
+    Storage path: document_summaries/{userId}_{fileName} ('/' in the file name encoded as '%2F')
+    Fields mirror writes in server/functions/document_summaries.py.
+    """
+
+    user_id: str
+    file_name: str
+    status: Literal["pending", "completed", "failed"]
+    generation: Optional[str] = None
+    vector_store_id: Optional[str] = None
+    summary: Optional[str] = None
+    outline: List[DocumentOutlineSection] = field(default_factory=list)
+    # Whether the summary leaves out part of the document (unreadable parts,
+    # failed windows, or more than SUMMARY_MAX_WINDOWS windows of text), and
+    # {files_read, files_total, windows_summarized, windows_total}
+    partial: bool = False
+    coverage: Optional[Dict[str, int]] = None
+    model: Optional[str] = None
+    error_message: Optional[str] = None
+    requested_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
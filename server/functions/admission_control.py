@@ -0,0 +1,326 @@
+"""
+Per-user admission control and fair queuing in front of chat and ingestion.
+
+The backend runs on at most two containers, so a single user firing many
+requests can starve everyone else. Every request goes through two gates:
+
+1. A per-user token bucket that bounds the sustained request rate of each user.
+   Counters live in memory (per container) or in Firestore (shared by all
+   containers), selected with the ADMISSION_BUCKET_BACKEND environment variable.
+2. A fair queue that bounds the number of requests running at the same time in
+   the container and hands free slots to waiting users in round-robin order, so
+   a burst from one user waits behind a single request of every other user.
+
+Requests that cannot be admitted raise AdmissionRejected, which carries the
+number of seconds after which the client should retry.
+"""
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, Iterator, Optional
+
+
+@dataclass(frozen=True)
+class AdmissionPolicy:
+    """Limits applied to one kind of request."""
+
+    bucket_capacity: float  # Burst size allowed per user
+    refill_per_second: float  # Sustained requests per second allowed per user
+    max_concurrent: int  # Requests running at the same time in a container
+    max_queue_wait_seconds: float  # Longest time a request waits for a free slot
+    max_queued_per_user: int  # Requests of one user allowed to wait at the same time
+
+
+ADMISSION_POLICIES: Dict[str, AdmissionPolicy] = {
+    'chat': AdmissionPolicy(
+        bucket_capacity=5,
+        refill_per_second=0.2,
+        max_concurrent=8,
+        max_queue_wait_seconds=15,
+        max_queued_per_user=2,
+    ),
+    # A batch holds up to 50 agent runs, so batches are admitted far less often than chat turns
+    'batch_chat': AdmissionPolicy(
+        bucket_capacity=2,
+        refill_per_second=1 / 60,
+        max_concurrent=2,
+        max_queue_wait_seconds=15,
+        max_queued_per_user=1,
+    ),
+    'vectorize': AdmissionPolicy(
+        bucket_capacity=30,
+        refill_per_second=0.5,
+        max_concurrent=4,
+        max_queue_wait_seconds=30,
+        max_queued_per_user=50,
+    ),
+}
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is not admitted."""
+
+    def __init__(self, message: str, retry_after_seconds: float):
+        super().__init__(message)
+        self.retry_after_seconds = max(1, math.ceil(retry_after_seconds))
+
+
+class InMemoryTokenBucket:
+    """Per-user token buckets kept in the memory of the current container."""
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, tuple] = {}  # key -> (tokens, last refill time)
+
+    def try_acquire(self, key: str) -> float:
+        """
+        Take one token from the bucket of a key.
+
+        Args:
+            key: Bucket key, usually the user ID
+
+        Returns:
+            float: 0 if a token was taken, otherwise seconds until one is available
+        """
+        with self._lock:
+            now = time.monotonic()
+            tokens, last_refill = self._buckets.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - last_refill) * self.refill_per_second)
+
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                return 0
+
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / self.refill_per_second
+
+
+class FirestoreTokenBucket:
+    """Per-user token buckets shared by all containers through Firestore.
+
+    Layout:
+      admission_buckets/{kind}_{key}
+        - tokens: float
+        - updated_at: datetime
+    """
+
+    def __init__(self, kind: str, capacity: float, refill_per_second: float):
+        self.kind = kind
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+
+    def try_acquire(self, key: str) -> float:
+        """
+        Take one token from the bucket of a key inside a Firestore transaction.
+
+        Args:
+            key: Bucket key, usually the user ID
+
+        Returns:
+            float: 0 if a token was taken, otherwise seconds until one is available
+        """
+        from firebase_admin import firestore
+
+        db_client = firestore.client()
+        bucket_ref = db_client.collection('admission_buckets').document(f"{self.kind}_{key}")
+
+        @firestore.transactional
+        def acquire(transaction) -> float:
+            snapshot = bucket_ref.get(transaction=transaction)
+            data = snapshot.to_dict() if snapshot.exists else {}
+            now = datetime.now(timezone.utc)
+
+            tokens = data.get('tokens', self.capacity)
+            updated_at = data.get('updated_at')
+            if updated_at is not None:
+                if updated_at.tzinfo is None:
+                    updated_at = updated_at.replace(tzinfo=timezone.utc)
+                elapsed = max(0.0, (now - updated_at).total_seconds())
+                tokens = min(self.capacity, tokens + elapsed * self.refill_per_second)
+
+            retry_after = 0 if tokens >= 1 else (1 - tokens) / self.refill_per_second
+            if tokens >= 1:
+                tokens -= 1
+            transaction.set(bucket_ref, {'tokens': tokens, 'updated_at': now})
+            return retry_after
+
+        return acquire(db_client.transaction())
+
+
+class FairQueue:
+    """Bounded concurrency with round-robin hand-off of free slots between users."""
+
+    def __init__(self, max_concurrent: int, max_queued_per_user: int):
+        self.max_concurrent = max_concurrent
+        self.max_queued_per_user = max_queued_per_user
+        self._condition = threading.Condition()
+        self._running = 0
+        self._waiting: Dict[str, deque] = {}  # user -> tickets waiting in arrival order
+        self._rotation: deque = deque()  # users with waiting tickets, in serving order
+
+    def acquire(self, key: str, timeout: float) -> bool:
+        """
+        Wait for a free slot.
+
+        Args:
+            key: Fairness key, usually the user ID
+            timeout: Maximum time to wait in seconds
+
+        Returns:
+            bool: True if a slot was granted, False if the wait timed out
+
+        Raises:
+            AdmissionRejected: If the user already has max_queued_per_user waiting requests
+        """
+        ticket = {'granted': False}
+        deadline = time.monotonic() + timeout
+
+        with self._condition:
+            if len(self._waiting.get(key, ())) >= self.max_queued_per_user:
+                raise AdmissionRejected('Too many queued requests', timeout)
+
+            user_tickets = self._waiting.setdefault(key, deque())
+            user_tickets.append(ticket)
+            if len(user_tickets) == 1:
+                self._rotation.append(key)
+            self._dispatch()
+
+            while not ticket['granted']:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._withdraw(key, ticket)
+                    return False
+                self._condition.wait(remaining)
+            return True
+
+    def release(self) -> None:
+        """Free a slot and hand it to the next user in the rotation."""
+        with self._condition:
+            self._running -= 1
+            self._dispatch()
+
+    def depth(self) -> int:
+        """Number of requests waiting for a slot."""
+        with self._condition:
+            return sum(len(tickets) for tickets in self._waiting.values())
+
+    def _dispatch(self) -> None:
+        """Grant free slots to waiting users in round-robin order. Caller holds the lock."""
+        granted = False
+        while self._running < self.max_concurrent and self._rotation:
+            key = self._rotation.popleft()
+            user_tickets = self._waiting[key]
+            user_tickets.popleft()['granted'] = True
+            self._running += 1
+            granted = True
+            if user_tickets:
+                self._rotation.append(key)
+            else:
+                del self._waiting[key]
+        if granted:
+            self._condition.notify_all()
+
+    def _withdraw(self, key: str, ticket: dict) -> None:
+        """Remove a ticket that gave up waiting. Caller holds the lock."""
+        user_tickets = self._waiting.get(key)
+        if user_tickets is None:
+            return
+        user_tickets.remove(ticket)
+        if not user_tickets:
+            del self._waiting[key]
+            self._rotation.remove(key)
+
+
+class AdmissionController:
+    """Token bucket and fair queue gates for one kind of request."""
+
+    def __init__(self, kind: str, policy: AdmissionPolicy, backend: Optional[str] = None):
+        self.kind = kind
+        self.policy = policy
+        backend = backend or os.getenv('ADMISSION_BUCKET_BACKEND', 'memory')
+        if backend == 'firestore':
+            self.bucket = FirestoreTokenBucket(kind, policy.bucket_capacity, policy.refill_per_second)
+        else:
+            self.bucket = InMemoryTokenBucket(policy.bucket_capacity, policy.refill_per_second)
+        self.queue = FairQueue(policy.max_concurrent, policy.max_queued_per_user)
+
+    @contextmanager
+    def admit(self, uid: str) -> Iterator[None]:
+        """
+        Hold an execution slot for a request of a user.
+
+        Args:
+            uid: ID of the user sending the request
+
+        Raises:
+            AdmissionRejected: If the user is over their rate or no slot frees up in time
+        """
+        retry_after = self.bucket.try_acquire(uid)
+        if retry_after > 0:
+            print(f"Admission rejected for {self.kind} request of user {uid}: rate limit")
+            raise AdmissionRejected('Too many requests', retry_after)
+
+        if not self.queue.acquire(uid, self.policy.max_queue_wait_seconds):
+            print(f"Admission rejected for {self.kind} request of user {uid}: queue timeout")
+            raise AdmissionRejected('Server is busy', self.policy.max_queue_wait_seconds)
+
+        try:
+            yield
+        finally:
+            self.queue.release()
+
+
+_controllers: Dict[str, AdmissionController] = {}
+_controllers_lock = threading.Lock()
+
+
+def get_admission_controller(kind: str) -> AdmissionController:
+    """
+    Get the admission controller of a kind of request, created on first use.
+
+    Args:
+        kind: Kind of request, a key of ADMISSION_POLICIES
+
+    Returns:
+        AdmissionController: The controller shared by the container
+    """
+    with _controllers_lock:
+        if kind not in _controllers:
+            _controllers[kind] = AdmissionController(kind, ADMISSION_POLICIES[kind])
+        return _controllers[kind]
+
+
+def admit(uid: str, kind: str):
+    """
+    Hold an execution slot for a request of a user (see AdmissionController.admit).
+
+    Args:
+        uid: ID of the user sending the request
+        kind: Kind of request, a key of ADMISSION_POLICIES
+    """
+    return get_admission_controller(kind).admit(uid)
+
+
+def overloaded_response(error: AdmissionRejected) -> dict:
+    """
+    Build the callable response returned for a rejected request.
+
+    Args:
+        error: The rejection
+
+    Returns:
+        dict: Failure response carrying retryAfterSeconds in its meta
+    """
+    return {
+        'success': False,
+        'message': f'{str(error)}, please retry in {error.retry_after_seconds} seconds',
+        'data': None,
+        'meta': {'retryAfterSeconds': error.retry_after_seconds}
+    }
@@ -0,0 +1,672 @@
+"""
+Ingestion of archives (.zip, .tar.gz, .tgz, .tar) uploaded to user-documents/{uid}/.
+
+A folder uploaded as one archive is ingested by a single pipeline run instead of
+one storage trigger per file:
+
+1. the members are listed first, from the central directory of a zip or from
+   a first pass over the headers of a tar stream, and the member count and
+   total size limits are checked before anything is uploaded;
+2. the archive is read from Cloud Storage as a stream, members are extracted one
+   at a time and only members with a FileSearch extension, or images, are kept;
+3. kept members are uploaded to OpenAI concurrently, with at most
+   ARCHIVE_UPLOAD_CONCURRENCY uploads in flight and a bounded number of
+   extracted members held in memory; images are described by the vision model
+   MAX_CONCURRENT_DESCRIPTIONS at a time and their description is uploaded instead;
+4. the uploaded files are attached to the user's vector store in file batches,
+   each file with its own attributes, so chat retrieval can be scoped to a member.
+
+Every member gets its own row in document_processing_status, named
+'{archive name}/{member path}', and the row of the archive lists its members
+so that deleting the archive deletes all of them. File IDs are checkpointed in
+the archive row while the members upload (every CHECKPOINT_INTERVAL_SECONDS,
+and when the extraction ends or fails), so a retry of the same generation
+never uploads a member twice, and only redoes the attach once all members
+were uploaded.
+"""
+import contextvars
+import io
+import tarfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from firebase_admin import firestore, storage
+from openai import OpenAI
+
+from document_catalog import document_metadata
+from file_handling import MAX_IMAGE_BYTES, SUPPORTED_EXTENSIONS, get_file_extension, detect_file_type
+from image_to_description import MAX_CONCURRENT_DESCRIPTIONS, build_image_markdown, describe_images, image_to_description
+from path_handling import get_user_id, get_file_name, get_status_document_id
+from openai_calls import call_openai
+from openai_quota import create_openai_client
+from tracing import span, add_bytes, count_firestore, current_trace
+from vectorize_file import (
+    build_file_attributes,
+    get_vector_store,
+    load_checkpoint,
+    save_checkpoint,
+    update_firestore_vector_store,
+    update_processing_status,
+    upload_file_to_openai,
+)
+
+
+ARCHIVE_UPLOAD_CONCURRENCY = 8  # Member uploads to OpenAI running at the same time
+MAX_ARCHIVE_MEMBERS = 1000  # Supported members ingested from one archive
+MAX_MEMBER_BYTES = 100 * 1024 * 1024  # Larger members fail
+MAX_EXTRACTED_BYTES = 2 * 1024 * 1024 * 1024  # Guard against archive bombs
+ATTACH_BATCH_SIZE = 500  # Files per vector store file batch
+ARCHIVE_AWAIT_MAX_SECONDS = 300  # Maximum wait for the file batches
+STREAM_CHUNK_BYTES = 8 * 1024 * 1024  # Read size of the archive stream
+STATUS_BATCH_LIMIT = 500  # Firestore batch limit
+CHECKPOINT_INTERVAL_SECONDS = 2  # Minimum time between two checkpoints of the uploaded members
+
+
+def ingest_archive(
+    file_path: str,
+    bucket_name: str,
+    archive_format: str,
+    generation: Optional[str],
+    size_bytes: Optional[int] = None,
+    content_type: Optional[str] = None
+) -> str:
+    """
+    Extract an archive and ingest its supported members.
+
+    Args:
+        file_path: Path to the archive in storage (e.g., 'user-documents/user123/folder.zip')
+        bucket_name: Name of the Firebase Storage bucket
+        archive_format: 'zip' or 'tar' (see file_handling.get_archive_format)
+        generation: Storage generation of the archive
+        size_bytes: Size of the archive from the storage event, if known
+        content_type: Content type of the archive from the storage event, if known
+
+    Returns:
+        str: Success/failure message
+    """
+    user_id = get_user_id(file_path)
+    archive_name = get_file_name(file_path)
+    current_trace().set_attribute('archive_format', archive_format)
+
+    db_client = firestore.client()
+    checkpoint = load_checkpoint(db_client, user_id, archive_name, generation)
+    if checkpoint.get('indexed'):
+        print(f"{archive_name} generation {generation} is already indexed, skipping")
+        current_trace().set_attribute('resumed_from', 'indexed')
+        return f"{archive_name} (ARCHIVE) - Already vectorized and stored in OpenAI Vector Store."
+
+    try:
+        openai_client = create_openai_client()
+
+        with span('vector_stores_load'):
+            user_vector_stores_ref = db_client.collection('user_vector_stores').document(user_id)
+            user_vector_stores_doc = user_vector_stores_ref.get()
+            count_firestore(reads=1)
+
+        # Members uploaded by a previous attempt of the same generation
+        uploaded: Dict[str, str] = dict(checkpoint.get('member_file_ids') or {})
+        failed: Dict[str, str] = {}
+        skipped = 0
+        if checkpoint.get('members_uploaded'):
+            print(f"Resuming {archive_name} from checkpoint with {len(uploaded)} uploaded members")
+            current_trace().set_attribute('resumed_from', 'uploaded')
+            update_processing_status(db_client, user_id, archive_name, 'vectorizing', progress_percentage=60)
+        else:
+            if uploaded:
+                print(f"Resuming the extraction of {archive_name}, {len(uploaded)} members already uploaded")
+                current_trace().set_attribute('resumed_from', 'extracting')
+                update_processing_status(db_client, user_id, archive_name, 'processing', progress_percentage=10)
+            else:
+                update_processing_status(
+                    db_client, user_id, archive_name, 'uploading', progress_percentage=0, checkpoint=checkpoint,
+                    metadata=document_metadata(file_path, size_bytes, content_type))
+                update_processing_status(db_client, user_id, archive_name, 'processing', progress_percentage=10)
+            checkpoint['member_file_ids'] = uploaded
+            with span('archive_extract_upload') as span_attributes:
+                uploaded, failed, skipped = extract_and_upload_members(
+                    openai_client, file_path, bucket_name, archive_format, db_client, checkpoint
+                )
+                span_attributes.update(uploaded=len(uploaded), failed=len(failed), skipped=skipped)
+
+            checkpoint['downloaded'] = True
+            checkpoint['members_uploaded'] = True
+            checkpoint['member_file_ids'] = uploaded
+            write_member_statuses(
+                db_client, user_id, archive_name, generation,
+                {
+                    **{name: ('vectorizing', None, file_id) for name, file_id in uploaded.items()},
+                    **{name: ('failed', error, None) for name, error in failed.items()},
+                },
+                skipped=skipped
+            )
+            update_processing_status(
+                db_client, user_id, archive_name, 'vectorizing', progress_percentage=60, checkpoint=checkpoint)
+
+        if not uploaded:
+            error_msg = (
+                f"No supported documents found in archive ({len(failed)} failed, {skipped} skipped). "
+                f"Supported types: {', '.join(sorted(SUPPORTED_EXTENSIONS))}"
+            )
+            update_processing_status(db_client, user_id, archive_name, 'failed', error_msg)
+            current_trace().status = 'failed'
+            return f"{archive_name} (ARCHIVE) - {error_msg}"
+
+        indexed, attach_failures, vector_store_id = index_members(
+            db_client, openai_client, user_id, archive_name, generation, uploaded, checkpoint,
+            user_vector_stores_ref, user_vector_stores_doc
+        )
+
+        failed_count = len(failed) + len(attach_failures)
+        summary = f"{len(indexed)} documents indexed, {failed_count} failed, {skipped} skipped"
+        current_trace().set_attribute('archive_members', {
+            'indexed': len(indexed), 'failed': failed_count, 'skipped': skipped
+        })
+        if not indexed:
+            update_processing_status(db_client, user_id, archive_name, 'failed', f"Archive ingestion failed: {summary}")
+            current_trace().status = 'failed'
+            return f"{archive_name} (ARCHIVE) - Archive ingestion failed: {summary}"
+
+        checkpoint['attached'] = True
+        checkpoint['indexed'] = True
+        update_processing_status(
+            db_client, user_id, archive_name, 'completed',
+            error_message=summary if failed_count else None, progress_percentage=100,
+            vector_store_id=vector_store_id, checkpoint=checkpoint)
+        return f"{archive_name} (ARCHIVE) - OpenAI Vector Store pipeline successful! {summary}."
+
+    except Exception as e:
+        error_msg = f"Archive processing failed: {str(e)}"
+        print(f"Error during archive processing: {str(e)}")
+        current_trace().status = 'failed'
+        update_processing_status(db_client, user_id, archive_name, 'failed', error_msg)
+        return f"{archive_name} (ARCHIVE) - {error_msg}"
+
+
+def is_supported_member(member_path: str) -> bool:
+    """
+    Check whether an archive member should be ingested.
+
+    Args:
+        member_path: Path of the member inside the archive (e.g., 'reports/q1.pdf')
+
+    Returns:
+        bool: True for documents with a FileSearch extension and for images,
+            False for hidden files, macOS resource forks and other file types
+    """
+    parts = [part for part in member_path.split('/') if part]
+    if not parts or any(part.startswith('.') or part == '__MACOSX' for part in parts):
+        return False
+    extension = get_file_extension(parts[-1])
+    return extension in SUPPORTED_EXTENSIONS or detect_file_type(extension) == 'IMAGE'
+
+
+def normalize_member_path(member_path: str) -> str:
+    """Path of a member relative to the archive root (tar members may start with './' or '/')."""
+    member_path = member_path[2:] if member_path.startswith('./') else member_path
+    return member_path.lstrip('/')
+
+
+def list_archive_members(archive_file, archive_format: str) -> List[Tuple[str, int]]:
+    """
+    List the file members of an archive without extracting them.
+
+    Args:
+        archive_file: Readable file object of the archive (seekable for zip)
+        archive_format: 'zip' or 'tar'
+
+    Returns:
+        List[Tuple[str, int]]: Path and uncompressed size of each file member, read
+            from the central directory of a zip, or from the headers of a tar stream,
+            which has no directory and is read through once
+    """
+    if archive_format == 'zip':
+        with zipfile.ZipFile(archive_file) as archive:
+            return [(info.filename, info.file_size) for info in archive.infolist() if not info.is_dir()]
+    with tarfile.open(fileobj=archive_file, mode='r|*') as archive:
+        return [(member.name, member.size) for member in archive if member.isfile()]
+
+
+def plan_archive_members(
+    archive_name: str,
+    members: List[Tuple[str, int]]
+) -> Tuple[Dict[str, int], Dict[str, str], int]:
+    """
+    Choose the members to ingest from the listing of an archive.
+
+    Args:
+        archive_name: File name of the archive
+        members: Path and uncompressed size of each file member (see list_archive_members)
+
+    Returns:
+        Tuple: Size of the members to extract by normalized member path, errors of
+            the members that are too large by member file name, and the number of
+            skipped members
+
+    Raises:
+        Exception: If the members to extract expand to more than MAX_EXTRACTED_BYTES
+    """
+    accepted: Dict[str, int] = {}
+    failed: Dict[str, str] = {}
+    skipped = 0
+    for member_path, member_size in members:
+        member_path = normalize_member_path(member_path)
+        if not is_supported_member(member_path) or len(accepted) + len(failed) >= MAX_ARCHIVE_MEMBERS:
+            skipped += 1
+            continue
+        is_image = detect_file_type(get_file_extension(member_path)) == 'IMAGE'
+        max_bytes = MAX_IMAGE_BYTES if is_image else MAX_MEMBER_BYTES
+        if member_size > max_bytes:
+            failed[f"{archive_name}/{member_path}"] = f"File is larger than {max_bytes // (1024 * 1024)} MB"
+            continue
+        accepted[member_path] = member_size
+
+    extracted_bytes = sum(accepted.values())
+    if extracted_bytes > MAX_EXTRACTED_BYTES:
+        raise Exception(f"Archive expands to more than {MAX_EXTRACTED_BYTES // (1024 ** 3)} GB")
+    return accepted, failed, skipped
+
+
+def iter_archive_members(archive_file, archive_format: str) -> Iterator[Tuple[str, int, Optional[io.BufferedIOBase]]]:
+    """
+    Walk the file members of an archive without extracting the whole archive.
+
+    Args:
+        archive_file: Readable file object of the archive (seekable for zip)
+        archive_format: 'zip' or 'tar'
+
+    Yields:
+        Tuple: Member path, uncompressed size, and a reader of the member content
+            that is only valid until the next member is requested
+    """
+    if archive_format == 'zip':
+        with zipfile.ZipFile(archive_file) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                with archive.open(info) as member_file:
+                    yield info.filename, info.file_size, member_file
+    else:
+        # Stream mode reads members in order and never seeks back
+        with tarfile.open(fileobj=archive_file, mode='r|*') as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                yield member.name, member.size, archive.extractfile(member)
+
+
+def extract_and_upload_members(
+    openai_client: OpenAI,
+    file_path: str,
+    bucket_name: str,
+    archive_format: str,
+    db_client=None,
+    checkpoint: Optional[dict] = None
+) -> Tuple[Dict[str, str], Dict[str, str], int]:
+    """
+    Stream the archive from storage and upload its supported members to OpenAI concurrently.
+
+    The members are listed and checked against the archive limits before the
+    first upload. Image members are collected in groups of
+    MAX_CONCURRENT_DESCRIPTIONS, which are described concurrently before their
+    markdown descriptions are uploaded.
+
+    Args:
+        openai_client: OpenAI client instance
+        file_path: Path to the archive in storage
+        bucket_name: Name of the Firebase Storage bucket
+        archive_format: 'zip' or 'tar'
+        db_client: Firestore client instance used for the image description cache and the checkpoint
+        checkpoint: Checkpoint of the archive, whose member_file_ids lists the members already
+            uploaded, which are not uploaded again. It is updated and saved as members upload
+
+    Returns:
+        Tuple: File IDs of the uploaded members and errors of the failed members,
+            both by member file name, and the number of skipped members
+
+    Raises:
+        Exception: If the archive cannot be read, or exceeds MAX_EXTRACTED_BYTES
+    """
+    user_id = get_user_id(file_path)
+    archive_name = get_file_name(file_path)
+    blob = storage.bucket(bucket_name).blob(file_path)
+
+    with span('archive_list'), blob.open('rb', chunk_size=STREAM_CHUNK_BYTES) as archive_file:
+        members = list_archive_members(archive_file, archive_format)
+    accepted, failed, skipped = plan_archive_members(archive_name, members)
+
+    uploaded: Dict[str, str] = dict((checkpoint or {}).get('member_file_ids') or {})
+    lock = threading.Lock()
+    last_checkpoint = {'at': time.monotonic(), 'uploaded': len(uploaded)}
+    # Extracted members waiting for, or going through, an upload
+    in_memory = threading.BoundedSemaphore(ARCHIVE_UPLOAD_CONCURRENCY * 2)
+
+    # Image members waiting for their description
+    images: List[Tuple[str, bytes]] = []
+
+    def save_uploads(force: bool) -> None:
+        # Checkpoint the uploaded members, at most every CHECKPOINT_INTERVAL_SECONDS unless forced
+        if checkpoint is None or db_client is None:
+            return
+        with lock:
+            now = time.monotonic()
+            if len(uploaded) == last_checkpoint['uploaded'] or (
+                    not force and now - last_checkpoint['at'] < CHECKPOINT_INTERVAL_SECONDS):
+                return
+            last_checkpoint.update(at=now, uploaded=len(uploaded))
+            checkpoint['member_file_ids'] = dict(uploaded)
+            saved = dict(checkpoint)
+        try:
+            save_checkpoint(db_client, user_id, archive_name, saved)
+        except Exception as e:
+            print(f"Error checkpointing the uploaded members of {archive_name}: {str(e)}")
+
+    def upload_member(member_name: str, data: bytes, upload_name: str) -> None:
+        try:
+            file_id = upload_file_to_openai(io.BytesIO(data), openai_client, upload_name)
+            with lock:
+                uploaded[member_name] = file_id
+        except Exception as e:
+            print(f"Error uploading archive member {member_name}: {str(e)}")
+            with lock:
+                failed[member_name] = f"Upload to OpenAI failed: {str(e)}"
+        finally:
+            in_memory.release()
+        save_uploads(force=False)
+
+    def describe_and_upload(executor: ThreadPoolExecutor) -> None:
+        with span('image_description', images=len(images)):
+            try:
+                descriptions = describe_images(openai_client, [data for _, data in images], db_client)
+            except Exception as e:
+                # Successful descriptions are cached, describe again one by one to isolate the failure
+                print(f"Error describing archive images, retrying one by one: {str(e)}")
+                descriptions = []
+                for _, data in images:
+                    try:
+                        descriptions.append(image_to_description(openai_client, data, db_client))
+                    except Exception as image_error:
+                        descriptions.append(image_error)
+
+        for (member_name, _), description in zip(images, descriptions):
+            image_name = member_name.rsplit('/', 1)[-1]
+            if isinstance(description, Exception):
+                with lock:
+                    failed[member_name] = f"Image description failed: {str(description)}"
+                in_memory.release()
+                continue
+            executor.submit(
+                contextvars.copy_context().run, upload_member, member_name,
+                build_image_markdown(image_name, description), f"{image_name}.md")
+        images.clear()
+
+    print(f"Streaming archive from Firebase Storage: {file_path}")
+    try:
+        with blob.open('rb', chunk_size=STREAM_CHUNK_BYTES) as archive_file, \
+                ThreadPoolExecutor(max_workers=ARCHIVE_UPLOAD_CONCURRENCY) as executor:
+            for member_path, _, member_file in iter_archive_members(archive_file, archive_format):
+                member_path = normalize_member_path(member_path)
+                member_name = f"{archive_name}/{member_path}"
+                if member_path not in accepted or member_name in uploaded:
+                    continue
+                is_image = detect_file_type(get_file_extension(member_path)) == 'IMAGE'
+                max_bytes = MAX_IMAGE_BYTES if is_image else MAX_MEMBER_BYTES
+
+                in_memory.acquire()
+                # The listed size is not trusted, a member is never truncated to the limit
+                data = member_file.read(max_bytes + 1)
+                add_bytes('in', len(data))
+                if len(data) > max_bytes:
+                    with lock:
+                        failed[member_name] = f"File is larger than {max_bytes // (1024 * 1024)} MB"
+                    in_memory.release()
+                    continue
+                if is_image:
+                    images.append((member_name, data))
+                    if len(images) >= MAX_CONCURRENT_DESCRIPTIONS:
+                        describe_and_upload(executor)
+                    continue
+                # Each upload runs in a copy of the context, so its spans land in the request trace
+                executor.submit(
+                    contextvars.copy_context().run, upload_member, member_name, data, member_name.rsplit('/', 1)[-1])
+
+            if images:
+                describe_and_upload(executor)
+    finally:
+        # Members uploaded before a failure are not uploaded again by the retry
+        save_uploads(force=True)
+
+    print(f"Archive {archive_name}: {len(uploaded)} members uploaded, {len(failed)} failed, {skipped} skipped")
+    return uploaded, failed, skipped
+
+
+def index_members(
+    db_client,
+    openai_client: OpenAI,
+    user_id: str,
+    parent_name: str,
+    generation: Optional[str],
+    uploaded: Dict[str, str],
+    checkpoint: dict,
+    user_vector_stores_ref,
+    user_vector_stores_doc,
+    attributes_name: Optional[str] = None
+) -> Tuple[Dict[str, str], Dict[str, str], str]:
+    """
+    Attach uploaded members to the vector store of the user and record their statuses.
+
+    Args:
+        db_client: Firestore client instance
+        openai_client: OpenAI client instance
+        user_id: ID of the user
+        parent_name: File name of the archive (or split document) the members belong to
+        generation: Storage generation of the parent
+        uploaded: OpenAI file IDs by member file name
+        checkpoint: Checkpoint of the parent, updated with the vector store ID
+        user_vector_stores_ref: Reference to the user's vector stores document
+        user_vector_stores_doc: Snapshot of the user's vector stores document
+        attributes_name: File name given to all members in the vector store attributes,
+            None to give each member its own name
+
+    Returns:
+        Tuple: File IDs of the indexed members, errors of the members that could
+            not be indexed, both by member file name, and the vector store ID
+    """
+    vector_store_id = checkpoint.get('vector_store_id')
+    if not vector_store_id:
+        with span('vector_store_lookup'):
+            vector_store_id = get_vector_store(user_id, user_vector_stores_doc, openai_client)
+        checkpoint['vector_store_id'] = vector_store_id
+        update_processing_status(
+            db_client, user_id, parent_name, 'vectorizing', progress_percentage=70,
+            vector_store_id=vector_store_id, checkpoint=checkpoint)
+
+    # Attach all members in file batches and wait for them
+    with span('vector_store_batch_attach', files=len(uploaded)):
+        attach_failures = attach_members(openai_client, vector_store_id, uploaded, attributes_name)
+
+    with span('vector_stores_save'):
+        update_firestore_vector_store(user_vector_stores_ref, user_vector_stores_doc, user_id, vector_store_id)
+
+    indexed = {name: file_id for name, file_id in uploaded.items() if name not in attach_failures}
+    write_member_statuses(
+        db_client, user_id, parent_name, generation,
+        {
+            **{name: ('completed', None, file_id) for name, file_id in indexed.items()},
+            **{name: ('failed', attach_failures[name], uploaded[name]) for name in attach_failures},
+        },
+        vector_store_id=vector_store_id
+    )
+    return indexed, attach_failures, vector_store_id
+
+
+def attach_members(
+    openai_client: OpenAI,
+    vector_store_id: str,
+    uploaded: Dict[str, str],
+    attributes_name: Optional[str] = None
+) -> Dict[str, str]:
+    """
+    Attach uploaded members to a vector store in file batches and wait for the batches.
+
+    Args:
+        openai_client: OpenAI client instance
+        vector_store_id: ID of the vector store
+        uploaded: OpenAI file IDs by member file name
+        attributes_name: File name given to all members in their attributes, with the
+            member name in 'part', so retrieval scoped to the parent finds them.
+            None to give each member its own name
+
+    Returns:
+        Dict[str, str]: Errors of the members that could not be indexed, by member file name
+    """
+    names_by_file_id = {file_id: name for name, file_id in uploaded.items()}
+    file_ids = list(names_by_file_id)
+    failures: Dict[str, str] = {}
+
+    for start in range(0, len(file_ids), ATTACH_BATCH_SIZE):
+        batch_file_ids = file_ids[start:start + ATTACH_BATCH_SIZE]
+        batch = call_openai(
+            'vector_stores.file_batches.create', openai_client.vector_stores.file_batches.create,
+            vector_store_id=vector_store_id,
+            files=[
+                {'file_id': file_id, 'attributes': member_attributes(names_by_file_id[file_id], attributes_name)}
+                for file_id in batch_file_ids
+            ]
+        )
+        print(f"Created file batch {batch.id} with {len(batch_file_ids)} files")
+
+        batch = await_file_batch(openai_client, vector_store_id, batch.id)
+        if batch.status != 'completed' or batch.file_counts.failed or batch.file_counts.cancelled:
+            indexed_file_ids = {
+                batch_file.id for batch_file in call_openai(
+                    'vector_stores.file_batches.list_files', openai_client.vector_stores.file_batches.list_files,
+                    batch_id=batch.id, vector_store_id=vector_store_id, filter='completed', hedge=True
+                )
+            }
+            for file_id in batch_file_ids:
+                if file_id not in indexed_file_ids:
+                    failures[names_by_file_id[file_id]] = f"Vector store indexing {batch.status}"
+
+    return failures
+
+
+def member_attributes(member_name: str, attributes_name: Optional[str] = None) -> dict:
+    """
+    Vector store attributes of a member.
+
+    Args:
+        member_name: File name of the member (e.g., 'folder.zip/reports/q1.pdf')
+        attributes_name: File name shared by all members of the parent, if any
+
+    Returns:
+        dict: Attributes built by build_file_attributes, with 'part' when attributes_name is given,
+            otherwise with the name of the archive in 'archive' so that chat can be scoped to it
+    """
+    if attributes_name is None:
+        attributes = build_file_attributes(member_name, detect_file_type(get_file_extension(member_name)))
+        attributes['archive'] = member_name.split('/', 1)[0]
+        return attributes
+    attributes = build_file_attributes(attributes_name, detect_file_type(get_file_extension(attributes_name)))
+    attributes['part'] = member_name.rsplit('/', 1)[-1]
+    return attributes
+
+
+def await_file_batch(openai_client: OpenAI, vector_store_id: str, batch_id: str):
+    """
+    Wait for a vector store file batch to finish.
+
+    Args:
+        openai_client: OpenAI client instance
+        vector_store_id: ID of the vector store
+        batch_id: ID of the file batch
+
+    Returns:
+        The finished file batch
+
+    Raises:
+        Exception: If the batch does not finish within ARCHIVE_AWAIT_MAX_SECONDS
+    """
+    elapsed_seconds = 0
+    while elapsed_seconds < ARCHIVE_AWAIT_MAX_SECONDS:
+        batch = call_openai(
+            'vector_stores.file_batches.retrieve', openai_client.vector_stores.file_batches.retrieve,
+            batch_id=batch_id, vector_store_id=vector_store_id, hedge=True
+        )
+        current_trace().add('vector_store_polls')
+        if batch.status in ('completed', 'failed', 'cancelled'):
+            print(f"File batch {batch_id} {batch.status}: {batch.file_counts}")
+            return batch
+
+        print(f"File batch status: {batch.status}")
+        time.sleep(1)
+        elapsed_seconds += 1
+    raise Exception(f"Timeout: File batch did not complete within {ARCHIVE_AWAIT_MAX_SECONDS} seconds")
+
+
+def write_member_statuses(
+    db_client,
+    user_id: str,
+    archive_name: str,
+    generation: Optional[str],
+    members: Dict[str, Tuple[str, Optional[str], Optional[str]]],
+    vector_store_id: Optional[str] = None,
+    skipped: Optional[int] = None
+) -> None:
+    """
+    Write the processing status rows of archive members in Firestore batches.
+
+    The row of the archive is updated in the same batches with the list of its
+    members, which delete_file uses to delete them with the archive.
+
+    Args:
+        db_client: Firestore client instance
+        user_id: ID of the user
+        archive_name: File name of the archive
+        generation: Storage generation of the archive
+        members: Status, error message and OpenAI file ID by member file name
+        vector_store_id: Vector store the members are attached to
+        skipped: Number of members that were not ingested
+    """
+    now = datetime.now()
+    collection = db_client.collection('document_processing_status')
+    writes: List[Tuple[object, dict]] = []
+
+    for member_name, (status, error_message, file_id) in members.items():
+        update_data = {
+            'user_id': user_id,
+            'file_name': member_name,
+            'archive': archive_name,
+            'generation': generation,
+            'status': status,
+            'progress_percentage': 100 if status in ('completed', 'failed') else 60,
+            'updated_at': now,
+        }
+        if error_message:
+            update_data['error_message'] = error_message
+        if file_id:
+            update_data['file_id'] = file_id
+        if vector_store_id:
+            update_data['vector_store_id'] = vector_store_id
+        if status in ('completed', 'failed'):
+            update_data['completed_at'] = now
+        writes.append((collection.document(get_status_document_id(user_id, member_name)), update_data))
+
+    archive_data = {'archive_members': firestore.ArrayUnion(list(members)), 'updated_at': now}
+    if skipped is not None:
+        archive_data['skipped_members'] = skipped
+    writes.append((collection.document(get_status_document_id(user_id, archive_name)), archive_data))
+
+    try:
+        for start in range(0, len(writes), STATUS_BATCH_LIMIT):
+            batch = db_client.batch()
+            for reference, data in writes[start:start + STATUS_BATCH_LIMIT]:
+                batch.set(reference, data, merge=True)
+            batch.commit()
+            count_firestore(writes=len(writes[start:start + STATUS_BATCH_LIMIT]))
+        print(f"Updated processing status of {len(members)} members of {archive_name}")
+    except Exception as e:
+        print(f"Error updating member processing statuses: {str(e)}")
@@ -0,0 +1,198 @@
+"""
+Batch question answering over the documents of a user.
+
+Document reviews send 20 to 50 questions about the same documents. Sent one
+by one through chat, each question repeats the Firestore setup and the agent
+construction in its own invocation. run_batch_chat answers a list of prompts
+in a single call: the vector stores of the user are loaded once, one agent is
+built per routing tier, and the agent runs execute concurrently on one event
+loop, at most BATCH_CHAT_CONCURRENCY at a time.
+
+Each prompt is answered on its own, without the conversation history. When a
+session is given, the questions and answers are appended to its transcript in
+the order of the prompts once all runs are done.
+"""
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+from firebase_admin import firestore as admin_firestore
+
+from chat import build_agent, load_vector_store_ids
+from chat_routing import route_prompt
+from firestore_session import FirestoreSession
+from openai_calls import call_openai_async
+from session_layout import LAYOUT_MESSAGES, default_storage_layout
+from tracing import start_trace, span, count_firestore, current_trace
+
+
+MAX_BATCH_PROMPTS = 50
+BATCH_CHAT_CONCURRENCY = 5  # Agent runs in flight at the same time
+
+
+def run_batch_chat(
+    uid: str,
+    prompts: List[str],
+    session_id: Optional[str] = None,
+    documents: Optional[List[str]] = None,
+    max_num_results: Optional[int] = None,
+    include_timings: bool = False
+) -> dict:
+    """
+    Answer a list of prompts about the documents of a user.
+
+    Args:
+        uid: ID of the user
+        prompts: Prompts to answer, at most MAX_BATCH_PROMPTS
+        session_id: Session whose transcript receives the questions and answers; None to skip the transcript
+        documents: File names that scope retrieval, if any
+        max_num_results: Number of chunks retrieved by FileSearch for each prompt
+        include_timings: Whether to return the timing breakdown in meta.timings
+
+    Returns:
+        dict: Success/failure message, with one answer per prompt in order in data.answers.
+        Each answer has success, answer, error, tier and latency_ms.
+    """
+    with start_trace('batch_chat', uid=uid, session_id=session_id, prompts=len(prompts)) as trace:
+        response = _run_batch_chat(uid, prompts, session_id, documents, max_num_results)
+        if not response.get('success'):
+            trace.status = 'failed'
+        if include_timings:
+            response['meta'] = {**(response.get('meta') or {}), 'timings': trace.timings()}
+        return response
+
+
+def _run_batch_chat(
+    uid: str,
+    prompts: List[str],
+    session_id: Optional[str],
+    documents: Optional[List[str]],
+    max_num_results: Optional[int]
+) -> dict:
+    """Run the batch stages inside the request trace."""
+    try:
+        db = admin_firestore.client()
+
+        session = None
+        if session_id:
+            session = open_session(db, uid, session_id)
+            if session is None:
+                return {
+                    'success': False,
+                    'message': f'Session {session_id} belongs to another user',
+                    'data': None
+                }
+
+        # Routing decides the agent of each prompt, agents are shared by prompts of the same tier
+        with span('routing'):
+            routes = [route_prompt(prompt, documents) for prompt in prompts]
+        vector_store_ids = None
+        if any(route.use_retrieval for route in routes):
+            vector_store_ids = load_vector_store_ids(db, uid)
+        agents = {}
+        for route in routes:
+            if (route.tier, route.use_retrieval) not in agents:
+                agents[(route.tier, route.use_retrieval)] = build_agent(
+                    route, vector_store_ids, documents, max_num_results, db=db, uid=uid)
+
+        print(f"Starting {len(prompts)} agent runs for user {uid}")
+        with span('agent_runs', prompts=len(prompts), concurrency=BATCH_CHAT_CONCURRENCY):
+            answers = asyncio.run(run_agents(
+                [agents[(route.tier, route.use_retrieval)] for route in routes], prompts
+            ))
+        for answer, route in zip(answers, routes):
+            answer['tier'] = route.tier
+
+        if session is not None:
+            with span('transcript_append'):
+                items = []
+                for prompt, answer in zip(prompts, answers):
+                    if answer['success']:
+                        items += [
+                            {'role': 'user', 'content': prompt},
+                            {'role': 'assistant', 'content': answer['answer']},
+                        ]
+                asyncio.run(session.add_items(items))
+
+        answered = sum(1 for answer in answers if answer['success'])
+        current_trace().set_attribute('answered', answered)
+        return {
+            'success': True,
+            'message': f'Answered {answered} of {len(prompts)} prompts',
+            'data': {'answers': answers},
+            'meta': {'sessionId': session_id}
+        }
+
+    except Exception as e:
+        print(f"Error processing batch chat: {str(e)}")
+        return {
+            'success': False,
+            'message': f'Error processing batch chat: {str(e)}',
+            'data': None
+        }
+
+
+async def run_agents(agents: List, prompts: List[str]) -> List[Dict]:
+    """
+    Run one agent per prompt, at most BATCH_CHAT_CONCURRENCY at a time.
+
+    Args:
+        agents: Agent of each prompt
+        prompts: Prompts, in the same order
+
+    Returns:
+        List[Dict]: success, answer, error and latency_ms of each prompt, in order
+    """
+    from agents import Runner
+
+    semaphore = asyncio.Semaphore(BATCH_CHAT_CONCURRENCY)
+
+    async def run(agent, prompt: str) -> Dict:
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                result = await call_openai_async('agent_run', Runner.run, agent, prompt)
+                answer = {'success': True, 'answer': result.final_output or "", 'error': None}
+            except Exception as e:
+                print(f"Error answering prompt: {str(e)}")
+                answer = {'success': False, 'answer': None, 'error': str(e)}
+            answer['latency_ms'] = round((time.perf_counter() - started) * 1000)
+            return answer
+
+    return list(await asyncio.gather(*(run(agent, prompt) for agent, prompt in zip(agents, prompts))))
+
+
+def open_session(db, uid: str, session_id: str) -> Optional[FirestoreSession]:
+    """
+    Session that receives the transcript of the batch, created if missing.
+
+    Args:
+        db: Firestore client instance
+        uid: ID of the user
+        session_id: ID of the session
+
+    Returns:
+        Optional[FirestoreSession]: The session, None if it belongs to another user
+    """
+    with span('session_upsert'):
+        session_ref = db.collection('sessions').document(session_id)
+        snapshot = session_ref.get()
+        session_data = snapshot.to_dict() if snapshot.exists else {}
+        if snapshot.exists and session_data.get('userId') != uid:
+            count_firestore(reads=1)
+            return None
+        if snapshot.exists:
+            session_ref.update({'updatedAt': admin_firestore.SERVER_TIMESTAMP})
+        else:
+            session_data = {
+                'userId': uid,
+                'createdAt': admin_firestore.SERVER_TIMESTAMP,
+                'updatedAt': admin_firestore.SERVER_TIMESTAMP,
+                'sessionId': session_id,
+                'name': 'Batch questions',
+                'storageLayout': default_storage_layout(),
+            }
+            session_ref.set(session_data)
+        count_firestore(reads=1, writes=1)
+
+    return FirestoreSession(uid, session_id, storage_layout=session_data.get('storageLayout') or LAYOUT_MESSAGES)
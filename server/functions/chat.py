@@ -1,95 +1,285 @@
 import asyncio
-from typing import Optional
+import uuid
+from typing import List, Optional
 from firebase_admin import firestore as admin_firestore
-from firestore_session import FirestoreSession
+from firestore_session import FirestoreSession, LAYOUT_SEGMENTS, default_storage_layout
 from session_management import generate_session_name
+from chat_idempotency import begin_chat_execution, complete_chat_execution, fail_chat_execution
+from chat_routing import route_prompt
+from document_summaries import build_overview_tool, summaries_enabled
+from file_handling import get_archive_format
+from openai_calls import call_openai_async
+from tracing import start_trace, span, count_firestore, current_trace
 
 
-def run_chat(uid: str, prompt: str, session_id: str, client_message_id: Optional[str] = None) -> dict:
-    """Core chat processing logic."""
+DEFAULT_MAX_NUM_RESULTS = 3  # Chunks retrieved by FileSearch when the request does not set it
+MAX_NUM_RESULTS_LIMIT = 50  # Highest value accepted by FileSearch
+
+
+def run_chat(
+    uid: str,
+    prompt: str,
+    session_id: str,
+    client_message_id: Optional[str] = None,
+    include_timings: bool = False,
+    documents: Optional[List[str]] = None,
+    max_num_results: Optional[int] = None
+) -> dict:
+    """Core chat processing logic.
+
+    When documents is provided, retrieval is restricted to the files with those
+    names. max_num_results sets the number of chunks retrieved by FileSearch.
+
+    When client_message_id is provided the execution is idempotent: a retry of the
+    same message returns the stored response, or waits for the running attempt,
+    instead of running the agent a second time.
+
+    Every call emits a structured trace log with the duration of each stage. When
+    include_timings is True the timing breakdown is also returned in meta.timings.
+    """
+    with start_trace('chat', uid=uid, session_id=session_id, prompt_chars=len(prompt)) as trace:
+        response = _run_chat(uid, prompt, session_id, client_message_id, documents, max_num_results)
+        if not response.get('success'):
+            trace.status = 'failed'
+        if include_timings:
+            response['meta'] = {**(response.get('meta') or {}), 'timings': trace.timings()}
+        return response
+
+
+def _run_chat(
+    uid: str,
+    prompt: str,
+    session_id: str,
+    client_message_id: Optional[str],
+    documents: Optional[List[str]],
+    max_num_results: Optional[int]
+) -> dict:
+    """Run the chat stages inside the request trace."""
+    owns_execution = False
+    owner_id = str(uuid.uuid4())
     try:
         print(f"Processing chat for session {session_id} with prompt {prompt}")
 
+        db = admin_firestore.client()
+
+        # Resolve retries of the same message before doing any work
+        if client_message_id:
+            with span('idempotency_check'):
+                previous_response = begin_chat_execution(db, uid, session_id, client_message_id, owner_id)
+            if previous_response is not None:
+                return previous_response
+            owns_execution = True
+
         # Lazy import to avoid deployment timeout
-        from agents import Agent, Runner, ModelSettings, FileSearchTool
+        from agents import Runner
 
-        db = admin_firestore.client()
+        # Pick the model tier and whether the turn needs retrieval
+        with span('routing') as span_attributes:
+            route = route_prompt(prompt, documents)
+            span_attributes.update(tier=route.tier, router=route.router)
+        current_trace().set_attribute('route', route.to_dict())
 
-        # Reads the list of vector_store_ids for the user
-        user_vector_stores_ref = db.collection('user_vector_stores').document(uid)
-        user_vector_stores_doc = user_vector_stores_ref.get()
-        vector_store_ids = user_vector_stores_doc.get('vector_store_ids')
-
-        # Create the AI agent
-        agent = Agent(
-            name="Chat Assistant",
-            instructions=(
-                "You are a helpful assistant specialized in answering questions about the user's documents. "
-                "You have access to the tool: FileSearchTool. "
-                "Use this tool to search for information in the user's vector stores. "
-                "Prioritize using the FileSearchTool to answer the user's question. "
-                "Provide clear, accurate, and concise responses. "
-                "Provide the source of your information in the format: [Source: <file_name>, page number]."
-            ),
-            model="gpt-4.1",
-            model_settings=ModelSettings(temperature=0.1),
-            tools=[
-                FileSearchTool(
-                    max_num_results=3,
-                    vector_store_ids=vector_store_ids,
-                ),
-            ],
-        )
+        vector_store_ids = load_vector_store_ids(db, uid) if route.use_retrieval else None
+        agent = build_agent(route, vector_store_ids, documents, max_num_results, db=db, uid=uid)
 
         # Create session if missing. Otherwise update only updatedAt
-        session_ref = db.collection('sessions').document(session_id)
-        sessionSnap = session_ref.get()                
-        if sessionSnap.exists:
-            session_ref.update({'updatedAt': admin_firestore.SERVER_TIMESTAMP})
-        else:
-            session_ref.set(
-                {
+        with span('session_upsert'):
+            session_ref = db.collection('sessions').document(session_id)
+            sessionSnap = session_ref.get()                
+            session_data = sessionSnap.to_dict() if sessionSnap.exists else {}
+            storage_layout = session_data.get('storageLayout') or 'messages'
+            if sessionSnap.exists:
+                session_update = {'updatedAt': admin_firestore.SERVER_TIMESTAMP}
+                # Legacy sessions are moved to transcript segments in the background once idle
+                if storage_layout != LAYOUT_SEGMENTS and default_storage_layout() == LAYOUT_SEGMENTS \
+                        and not session_data.get('migrationRequested') and not session_data.get('migrationError'):
+                    session_update['migrationRequested'] = True
+                session_ref.update(session_update)
+            else:
+                session_data = {
                     'userId': uid,
                     'createdAt': admin_firestore.SERVER_TIMESTAMP,
                     'updatedAt': admin_firestore.SERVER_TIMESTAMP,
                     'sessionId': session_id,
                     'name': None,
+                    'storageLayout': default_storage_layout(),
                 }
-            )
+                session_ref.set(session_data)
+                storage_layout = session_data['storageLayout']
+            count_firestore(reads=1, writes=1)
 
         # Prepare a persistent session class to be managed by the AI Agent
-        session = FirestoreSession(uid, session_id)
+        session = FirestoreSession(
+            uid, session_id, client_message_id, compaction=True, storage_layout=storage_layout
+        )
 
         # Check if this is the first message in the session
-        messages_ref = session_ref.collection('messages')
-        message_count = len(list(messages_ref.stream()))
+        with span('message_count'):
+            if storage_layout == LAYOUT_SEGMENTS:
+                is_first_message = not session_data.get('messageCount') and not session_data.get('migratedMessages')
+            else:
+                is_first_message = not list(session_ref.collection('messages').limit(1).stream())
+                count_firestore(reads=1)
         
         # Run the agent asynchronously with Firestore session
         print(f"Starting agent ...")
-        result = asyncio.run(Runner.run(agent, prompt, session=session))
-        assistant_response: str = result.final_output or ""
+        with span('agent_run'):
+            result = asyncio.run(call_openai_async('agent_run', Runner.run, agent, prompt, session=session))
+            assistant_response: str = result.final_output or ""
 
         # If this was the first message, generate a session name
-        if message_count == 0:
-            try:
-                session_name = generate_session_name(prompt)
-                session_ref.update({'name': session_name})
-                print(f"Generated session name: {session_name}")
-            except Exception as e:
-                print(f"Error generating session name: {str(e)}")
-                session_ref.update({'name': 'New Chat'})
+        if is_first_message:
+            with span('title_generation'):
+                try:
+                    session_name = generate_session_name(prompt)
+                    session_ref.update({'name': session_name})
+                    print(f"Generated session name: {session_name}")
+                except Exception as e:
+                    print(f"Error generating session name: {str(e)}")
+                    session_ref.update({'name': 'New Chat'})
+                count_firestore(writes=1)
 
-        return {
+        response = {
             'success': True,
             'message': 'Agent run completed successfully',
             "data": assistant_response,
             "meta": { "sessionId": session_id }
         }
+        if owns_execution:
+            complete_chat_execution(db, session_id, client_message_id, owner_id, response)
+        return response
         
     except Exception as e:
         print(f"Error processing chat: {str(e)}")
+        if owns_execution:
+            fail_chat_execution(db, session_id, client_message_id, owner_id, str(e))
         return {
             'success': False,
             'message': f'Error processing chat: {str(e)}',
             'data': None
         }
+
+
+def load_vector_store_ids(db, uid: str) -> Optional[List[str]]:
+    """
+    Read the vector store IDs of a user.
+
+    Args:
+        db: Firestore client instance
+        uid: ID of the user
+
+    Returns:
+        Optional[List[str]]: Vector store IDs of the user
+    """
+    # Reads the list of vector_store_ids for the user
+    with span('vector_stores_load'):
+        user_vector_stores_doc = db.collection('user_vector_stores').document(uid).get()
+        count_firestore(reads=1)
+        return user_vector_stores_doc.get('vector_store_ids')
+
+
+def build_agent(
+    route,
+    vector_store_ids: Optional[List[str]],
+    documents: Optional[List[str]] = None,
+    max_num_results: Optional[int] = None,
+    db=None,
+    uid: Optional[str] = None
+):
+    """
+    Build the chat agent for a routing decision.
+
+    Args:
+        route: RouteDecision of the prompt
+        vector_store_ids: Vector stores searched when the route uses retrieval
+        documents: File names that scope retrieval, if any
+        max_num_results: Number of chunks retrieved by FileSearch
+        db: Firestore client instance, read by the document overview tool
+        uid: ID of the user, whose document overviews the agent can read
+
+    Returns:
+        Agent: The agent, with FileSearch, and the document overview tool when
+            summaries are enabled, attached when the route uses retrieval
+    """
+    # Lazy import to avoid deployment timeout
+    from agents import Agent, ModelSettings, FileSearchTool
+
+    tools = []
+    if route.use_retrieval:
+        tools.append(
+            FileSearchTool(
+                max_num_results=clamp_max_num_results(max_num_results),
+                vector_store_ids=vector_store_ids,
+                filters=build_document_filter(documents),
+            )
+        )
+        overview = db is not None and uid is not None and summaries_enabled()
+        if overview:
+            tools.append(build_overview_tool(db, uid, documents))
+        instructions = (
+            "You are a helpful assistant specialized in answering questions about the user's documents. "
+            "You have access to the tool: FileSearchTool. "
+            "Use this tool to search for information in the user's vector stores. "
+            "Prioritize using the FileSearchTool to answer the user's question. "
+            "Provide clear, accurate, and concise responses. "
+            "Provide the source of your information in the format: [Source: <file_name>, page number]."
+        )
+        if overview:
+            instructions += (
+                " For questions about what a document is about, or to summarize a document or one of its "
+                "sections, first call get_document_overview, which returns precomputed summaries and section "
+                "outlines. Use the FileSearchTool when the overview is missing or lacks the details asked for."
+            )
+    else:
+        instructions = (
+            "You are a helpful assistant specialized in answering questions about the user's documents. "
+            "Reply briefly and naturally to the user's message. "
+            "If the user asks about their documents, invite them to ask their question."
+        )
+
+    return Agent(
+        name="Chat Assistant",
+        instructions=instructions,
+        model=route.model,
+        model_settings=ModelSettings(temperature=0.1),
+        tools=tools,
+    )
+
+
+def clamp_max_num_results(max_num_results: Optional[int]) -> int:
+    """
+    Number of chunks to retrieve, within the range accepted by FileSearch.
+
+    Args:
+        max_num_results: Value requested by the client, if any
+
+    Returns:
+        int: DEFAULT_MAX_NUM_RESULTS when not set, otherwise the value clamped to 1..MAX_NUM_RESULTS_LIMIT
+    """
+    if max_num_results is None:
+        return DEFAULT_MAX_NUM_RESULTS
+    return max(1, min(MAX_NUM_RESULTS_LIMIT, int(max_num_results)))
+
+
+def build_document_filter(documents: Optional[List[str]]) -> Optional[dict]:
+    """
+    Build a FileSearch attribute filter that matches the given documents.
+
+    Parts of a split document carry the name of the document in 'file_name',
+    members of an archive carry their own name there and the name of the
+    archive in 'archive', so an archive matches all of its members.
+
+    Args:
+        documents: File names to search in; None or empty searches every document
+
+    Returns:
+        Optional[dict]: Comparison filter for one document, compound 'or' filter for several
+    """
+    names = [name for name in dict.fromkeys(documents or []) if name]
+    if not names:
+        return None
+    filters = [{'type': 'eq', 'key': 'file_name', 'value': name} for name in names]
+    filters += [{'type': 'eq', 'key': 'archive', 'value': name} for name in names if get_archive_format(name)]
+    if len(filters) == 1:
+        return filters[0]
+    return {'type': 'or', 'filters': filters}
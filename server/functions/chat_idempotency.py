@@ -0,0 +1,242 @@
+"""
+Idempotent chat execution keyed by (session, clientMessageId).
+
+A client that times out and retries the same chat message must not trigger a
+second agent run. Each execution is recorded in a Firestore document that
+tracks whether the run is in flight, completed or failed, together with the
+response that was returned to the client.
+
+Layout:
+  sessions/{session_id}/chat_executions/{client_message_id}
+    - userId: str
+    - sessionId: str
+    - clientMessageId: str
+    - status: "in_flight" | "completed" | "failed"
+    - ownerId: str (id of the invocation running the agent)
+    - response: dict (only when completed)
+    - startedAt, updatedAt, completedAt: datetime
+"""
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from firebase_admin import firestore as admin_firestore
+from tracing import count_firestore
+
+
+IN_FLIGHT_TIMEOUT_SECONDS = 120  # After this an in-flight execution is considered abandoned
+WAIT_MAX_SECONDS = 45  # Maximum time a retry waits for the running execution
+WAIT_POLL_SECONDS = 1  # Interval between status polls while waiting
+
+
+def get_execution_ref(db, session_id: str, client_message_id: str):
+    """
+    Get the Firestore reference of the execution record for a chat message.
+
+    Args:
+        db: Firestore client instance
+        session_id: ID of the chat session
+        client_message_id: Client generated ID of the chat message
+
+    Returns:
+        DocumentReference: Reference to the execution document
+    """
+    return (
+        db.collection('sessions')
+        .document(session_id)
+        .collection('chat_executions')
+        .document(client_message_id)
+    )
+
+
+def begin_chat_execution(
+    db,
+    uid: str,
+    session_id: str,
+    client_message_id: str,
+    owner_id: str
+) -> Optional[dict]:
+    """
+    Claim the execution of a chat message or resolve it from a previous attempt.
+
+    The claim is made inside a transaction so that two concurrent attempts of the
+    same message cannot both run the agent. Failed executions and in-flight
+    executions older than IN_FLIGHT_TIMEOUT_SECONDS can be claimed again.
+
+    Args:
+        db: Firestore client instance
+        uid: ID of the user sending the message
+        session_id: ID of the chat session
+        client_message_id: Client generated ID of the chat message
+        owner_id: ID of the invocation, which must be passed again to
+            complete_chat_execution or fail_chat_execution
+
+    Returns:
+        Optional[dict]: None if the caller owns the execution and must run the
+            agent, otherwise the response to return to the client
+    """
+    execution_ref = get_execution_ref(db, session_id, client_message_id)
+
+    @admin_firestore.transactional
+    def claim(transaction) -> dict:
+        snapshot = execution_ref.get(transaction=transaction)
+        data = snapshot.to_dict() if snapshot.exists else None
+        now = datetime.now(timezone.utc)
+
+        if data:
+            if data.get('userId') != uid:
+                return {'state': 'forbidden'}
+            if data.get('status') == 'completed':
+                return {'state': 'completed', 'response': data.get('response')}
+            if data.get('status') == 'in_flight' and not _is_abandoned(data, now):
+                return {'state': 'in_flight'}
+
+        transaction.set(execution_ref, {
+            'userId': uid,
+            'sessionId': session_id,
+            'clientMessageId': client_message_id,
+            'status': 'in_flight',
+            'ownerId': owner_id,
+            'startedAt': now,
+            'updatedAt': now,
+        })
+        return {'state': 'claimed'}
+
+    outcome = claim(db.transaction())
+    count_firestore(reads=1, writes=1 if outcome['state'] == 'claimed' else 0)
+
+    if outcome['state'] == 'claimed':
+        return None
+    if outcome['state'] == 'forbidden':
+        return {
+            'success': False,
+            'message': 'Unauthorized to replay this message',
+            'data': None
+        }
+    if outcome['state'] == 'completed':
+        print(f"Returning stored response for message {client_message_id} in session {session_id}")
+        return _mark_deduplicated(outcome['response'])
+
+    print(f"Message {client_message_id} in session {session_id} is already running, waiting for it")
+    return wait_for_chat_execution(db, session_id, client_message_id)
+
+
+def wait_for_chat_execution(db, session_id: str, client_message_id: str) -> dict:
+    """
+    Wait for an in-flight execution started by another attempt to finish.
+
+    Args:
+        db: Firestore client instance
+        session_id: ID of the chat session
+        client_message_id: Client generated ID of the chat message
+
+    Returns:
+        dict: The stored response, or a failure response if the execution failed
+            or did not finish within WAIT_MAX_SECONDS
+    """
+    execution_ref = get_execution_ref(db, session_id, client_message_id)
+
+    elapsed_seconds = 0
+    while elapsed_seconds < WAIT_MAX_SECONDS:
+        time.sleep(WAIT_POLL_SECONDS)
+        elapsed_seconds += WAIT_POLL_SECONDS
+
+        snapshot = execution_ref.get()
+        count_firestore(reads=1)
+        data = snapshot.to_dict() if snapshot.exists else {}
+        status = data.get('status')
+
+        if status == 'completed':
+            return _mark_deduplicated(data.get('response'))
+        if status == 'failed':
+            return {
+                'success': False,
+                'message': data.get('errorMessage') or 'Previous attempt of this message failed',
+                'data': None
+            }
+
+    return {
+        'success': False,
+        'message': 'This message is still being processed, please retry shortly',
+        'data': None,
+        'meta': {'sessionId': session_id, 'inFlight': True}
+    }
+
+
+def complete_chat_execution(db, session_id: str, client_message_id: str, owner_id: str, response: dict) -> None:
+    """
+    Record the response of a finished execution so retries can replay it.
+
+    Args:
+        db: Firestore client instance
+        session_id: ID of the chat session
+        client_message_id: Client generated ID of the chat message
+        owner_id: ID of the invocation that claimed the execution
+        response: Response returned to the client
+    """
+    try:
+        _finish_execution(db, session_id, client_message_id, owner_id, {'status': 'completed', 'response': response})
+    except Exception as e:
+        print(f"Error recording chat execution result: {str(e)}")
+
+
+def fail_chat_execution(db, session_id: str, client_message_id: str, owner_id: str, error_message: str) -> None:
+    """
+    Mark an execution as failed so that the next retry runs the agent again.
+
+    Args:
+        db: Firestore client instance
+        session_id: ID of the chat session
+        client_message_id: Client generated ID of the chat message
+        owner_id: ID of the invocation that claimed the execution
+        error_message: Error message of the failed execution
+    """
+    try:
+        _finish_execution(db, session_id, client_message_id, owner_id, {'status': 'failed', 'errorMessage': error_message})
+    except Exception as e:
+        print(f"Error recording chat execution failure: {str(e)}")
+
+
+def _finish_execution(db, session_id: str, client_message_id: str, owner_id: str, fields: dict) -> bool:
+    """
+    Write the outcome of an execution if the caller still owns its claim.
+
+    A caller whose claim was taken over after IN_FLIGHT_TIMEOUT_SECONDS must
+    not overwrite the outcome of the new owner.
+
+    Returns:
+        bool: Whether the outcome was written
+    """
+    execution_ref = get_execution_ref(db, session_id, client_message_id)
+
+    @admin_firestore.transactional
+    def finish(transaction) -> bool:
+        snapshot = execution_ref.get(transaction=transaction)
+        data = snapshot.to_dict() if snapshot.exists else {}
+        if data.get('ownerId') != owner_id or data.get('status') != 'in_flight':
+            return False
+        now = datetime.now(timezone.utc)
+        transaction.update(execution_ref, {**fields, 'updatedAt': now, 'completedAt': now})
+        return True
+
+    written = finish(db.transaction())
+    count_firestore(reads=1, writes=1 if written else 0)
+    if not written:
+        print(f"Execution of message {client_message_id} was taken over, its outcome is not recorded")
+    return written
+
+
+def _is_abandoned(data: dict, now: datetime) -> bool:
+    """Whether an in-flight execution has outlived IN_FLIGHT_TIMEOUT_SECONDS."""
+    started_at = data.get('startedAt')
+    if not started_at:
+        return True
+    if started_at.tzinfo is None:
+        started_at = started_at.replace(tzinfo=timezone.utc)
+    return now - started_at > timedelta(seconds=IN_FLIGHT_TIMEOUT_SECONDS)
+
+
+def _mark_deduplicated(response: Optional[dict]) -> dict:
+    """Flag a stored response as a replay in its meta."""
+    response = dict(response or {})
+    response['meta'] = {**(response.get('meta') or {}), 'deduplicated': True}
+    return response
@@ -0,0 +1,170 @@
+"""
+Model routing ahead of the chat agent.
+
+Every turn used to run on the largest model with FileSearch attached, including
+turns like "thanks!" that need neither. route_prompt() picks a model tier and
+decides whether retrieval is needed before the agent is built:
+
+- trivial: greetings, thanks and acknowledgements, answered by the smallest
+  model without retrieval. Short replies such as "yes", "no", "sure" or "ok"
+  usually answer a question of the assistant ("Should I list the fees?"), so
+  they are not trivial and keep retrieval
+- standard: short single questions, answered by a mid-size model with retrieval
+- complex: long, multi-part, comparative or multi-document questions, answered
+  by the full model with retrieval
+
+The decision comes from a keyword heuristic by default. Setting CHAT_ROUTER to
+"model" asks a small model to classify the prompt instead (falling back to the
+heuristic on errors), and "off" sends every turn to the complex tier.
+"""
+import json
+import os
+import re
+from dataclasses import asdict, dataclass
+from typing import List, Optional
+
+
+ROUTE_MODELS = {
+    'trivial': 'gpt-4.1-nano',
+    'standard': 'gpt-4.1-mini',
+    'complex': 'gpt-4.1',
+}
+CLASSIFIER_MODEL = 'gpt-4.1-nano'
+COMPLEX_MIN_WORDS = 40  # Prompts longer than this go to the complex tier
+TRIVIAL_MAX_WORDS = 6  # Only prompts up to this length can be trivial
+
+_TRIVIAL_PATTERN = re.compile(
+    r"^(hi|hello|hey|good (morning|afternoon|evening)|thanks?( you)?( so much| a lot)?|thank you|thx|ty|"
+    r"cool|great|nice|perfect|awesome|got it|understood|bye|goodbye|see you)\b[\s!.,:)]*$",
+    re.IGNORECASE,
+)
+_COMPLEX_KEYWORDS = re.compile(
+    r"\b(compare|comparison|contrast|difference|differences|versus|vs\.?|analy[sz]e|analysis|"
+    r"summari[sz]e|summary|explain why|step by step|pros and cons|across|all (the )?documents|"
+    r"each document|timeline|relationship)\b",
+    re.IGNORECASE,
+)
+
+
+@dataclass(frozen=True)
+class RouteDecision:
+    """Model tier and retrieval choice for one chat turn."""
+
+    tier: str  # 'trivial' | 'standard' | 'complex'
+    model: str
+    use_retrieval: bool
+    reason: str
+    router: str  # 'heuristic' | 'model' | 'off'
+
+    def to_dict(self) -> dict:
+        """Decision as a JSON serializable dict."""
+        return asdict(self)
+
+
+def route_prompt(prompt: str, documents: Optional[List[str]] = None) -> RouteDecision:
+    """
+    Choose the model tier and whether retrieval is needed for a prompt.
+
+    Args:
+        prompt: Text prompt of the user
+        documents: File names the user scoped the question to, if any
+
+    Returns:
+        RouteDecision: The routing decision
+    """
+    router = os.getenv('CHAT_ROUTER', 'heuristic')
+    if router == 'off':
+        return _decision('complex', 'routing disabled', 'off')
+
+    if router == 'model':
+        try:
+            tier = classify_prompt(prompt)
+            if documents and tier == 'trivial':
+                tier = 'standard'
+            return _decision(tier, 'classified by model', 'model')
+        except Exception as e:
+            print(f"Error classifying prompt, using heuristic: {str(e)}")
+
+    return heuristic_route(prompt, documents)
+
+
+def heuristic_route(prompt: str, documents: Optional[List[str]] = None) -> RouteDecision:
+    """
+    Route a prompt with keyword and length rules.
+
+    Args:
+        prompt: Text prompt of the user
+        documents: File names the user scoped the question to, if any
+
+    Returns:
+        RouteDecision: The routing decision
+    """
+    text = prompt.strip()
+    words = len(text.split())
+
+    if documents and len(documents) > 1:
+        return _decision('complex', 'several documents selected', 'heuristic')
+    if not documents and words <= TRIVIAL_MAX_WORDS and _TRIVIAL_PATTERN.match(text):
+        return _decision('trivial', 'small talk', 'heuristic')
+    if words > COMPLEX_MIN_WORDS:
+        return _decision('complex', 'long prompt', 'heuristic')
+    if text.count('?') > 1:
+        return _decision('complex', 'several questions', 'heuristic')
+    if _COMPLEX_KEYWORDS.search(text):
+        return _decision('complex', 'analytical question', 'heuristic')
+    return _decision('standard', 'short question', 'heuristic')
+
+
+def classify_prompt(prompt: str) -> str:
+    """
+    Ask a small model for the tier of a prompt.
+
+    Args:
+        prompt: Text prompt of the user
+
+    Returns:
+        str: 'trivial', 'standard' or 'complex'
+
+    Raises:
+        ValueError: If the model answers with an unknown tier
+    """
+    from openai_calls import call_openai
+    from openai_quota import create_openai_client
+
+    openai_client = create_openai_client()
+    completion = call_openai(
+        'chat.completions.create',
+        openai_client.chat.completions.create,
+        policy='interactive',
+        model=CLASSIFIER_MODEL,
+        temperature=0,
+        max_tokens=20,
+        response_format={'type': 'json_object'},
+        messages=[
+            {
+                'role': 'system',
+                'content': (
+                    "Classify the user's message to a document assistant. Answer with JSON "
+                    '{"tier": "trivial" | "standard" | "complex"}. trivial: greetings, thanks, '
+                    "acknowledgements, nothing to look up. standard: one simple question about the "
+                    "documents. complex: multi-part, comparative, analytical or multi-document questions."
+                ),
+            },
+            {'role': 'user', 'content': prompt[:2000]},
+        ],
+    )
+    tier = json.loads(completion.choices[0].message.content or '{}').get('tier')
+    if tier not in ROUTE_MODELS:
+        raise ValueError(f"Unknown tier: {tier}")
+    return tier
+
+
+def _decision(tier: str, reason: str, router: str) -> RouteDecision:
+    """Build the decision of a tier."""
+    return RouteDecision(
+        tier=tier,
+        model=ROUTE_MODELS[tier],
+        use_retrieval=tier != 'trivial',
+        reason=reason,
+        router=router,
+    )
@@ -3,11 +3,29 @@
 Delete file from OpenAI storage and vector stores.
 This module handles the cleanup of files when they are deleted from Firebase Storage.
 """
+from concurrent.futures import ThreadPoolExecutor
 from firebase_admin import firestore
-from openai import OpenAI
-import os
+from openai import NotFoundError
 from datetime import datetime
 
+from document_catalog import upsert_catalog_entry, remove_catalog_entry
+from document_summaries import delete_document_summary
+from path_handling import get_status_document_id
+from openai_calls import call_openai
+from openai_quota import create_openai_client
+from processing_summary import update_processing_summary
+from tracing import start_trace, span, count_firestore
+
+
+# Reasons of failed deletions, in the 'reason' field of the response
+REASON_NO_STATUS = 'no_status'  # The file has no processing status
+REASON_NO_FILE_ID = 'no_file_id'  # The file was never uploaded to OpenAI
+REASON_OPENAI_DELETE_FAILED = 'openai_delete_failed'
+REASON_MEMBERS_FAILED = 'members_failed'  # Some members of an archive or split document remain
+REASON_ERROR = 'error'
+NOTHING_TO_DELETE_REASONS = (REASON_NO_STATUS, REASON_NO_FILE_ID)
+
+MEMBER_DELETE_CONCURRENCY = 8  # Archive members deleted at the same time
 
 def delete_file_from_openai(
     user_id: str, 
@@ -16,33 +34,62 @@ def delete_file_from_openai(
     """
     Delete a file from OpenAI storage and vector stores.
     
+    The document is removed from the catalog and the processing summary of the
+    user, and its summary is deleted, once there is nothing left to delete; a
+    failed deletion leaves it in the catalog and processing summary as 'deleting'.
+    
     Args:
         user_id: ID of the user
         file_name: Name of the file to delete
         
     Returns:
-        dict: Success/failure message
+        dict: Success/failure message; a failure also has a 'reason' (one of the REASON_* constants)
     """
+    with start_trace('delete_file', uid=user_id, file_name=file_name) as trace:
+        response = _delete_file_from_openai(user_id, file_name)
+        if response.get('success') or is_nothing_to_delete(response):
+            db_client = firestore.client()
+            remove_catalog_entry(db_client, user_id, file_name)
+            update_processing_summary(db_client, user_id, file_name, None)
+            delete_document_summary(db_client, user_id, file_name)
+        else:
+            trace.status = 'failed'
+        return response
+
+
+def is_nothing_to_delete(response: dict) -> bool:
+    """Whether a deletion failed only because the file was never uploaded to OpenAI."""
+    return not response.get('success') and response.get('reason') in NOTHING_TO_DELETE_REASONS
+
+
+def _delete_file_from_openai(user_id: str, file_name: str) -> dict:
+    """Run the deletion stages inside the request trace."""
     try:
         # Initialize clients
         db_client = firestore.client()
-        openai_client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+        openai_client = create_openai_client()
         
         # Set deletion status immediately
-        document_id = f"{user_id}_{file_name}"
+        document_id = get_status_document_id(user_id, file_name)
         update_deletion_status(db_client, user_id, file_name, 'deleting')
         
         # Get the document processing status to find file_id and vector_store_id
-        status_doc = db_client.collection('document_processing_status').document(document_id).get()
+        with span('status_load'):
+            status_doc = db_client.collection('document_processing_status').document(document_id).get()
+            count_firestore(reads=1)
         
         if not status_doc.exists:
             return {
                 'success': False,
                 'message': f'No processing status found for file: {file_name}',
+                'reason': REASON_NO_STATUS,
                 'data': None
             }
         
         status_data = status_doc.to_dict()
+        if status_data.get('archive_members'):
+            return delete_archive_members(db_client, user_id, file_name, document_id, status_data)
+
         file_id = status_data.get('file_id')
         vector_store_id = status_data.get('vector_store_id')
         
@@ -50,6 +97,7 @@ def delete_file_from_openai(
             return {
                 'success': False,
                 'message': f'No OpenAI file ID found for: {file_name}',
+                'reason': REASON_NO_FILE_ID,
                 'data': None
             }
         
@@ -57,10 +105,12 @@ def delete_file_from_openai(
         if vector_store_id:
             try:
                 # Delete the file from the vector store
-                openai_client.vector_stores.files.delete(
-                    vector_store_id=vector_store_id,
-                    file_id=file_id
-                )
+                with span('vector_store_detach'):
+                    call_openai(
+                        'vector_stores.files.delete', openai_client.vector_stores.files.delete,
+                        vector_store_id=vector_store_id,
+                        file_id=file_id
+                    )
                 print(f"Deleted file {file_id} from vector store {vector_store_id}")
             except Exception as e:
                 print(f"Error deleting from vector store: {str(e)}")
@@ -68,19 +118,26 @@ def delete_file_from_openai(
         
         # Delete the file from OpenAI storage
         try:
-            openai_client.files.delete(file_id=file_id)
+            with span('openai_file_delete'):
+                call_openai('files.delete', openai_client.files.delete, file_id=file_id)
             print(f"Deleted file {file_id} from OpenAI storage")
+        except NotFoundError:
+            # A retried delete whose first attempt went through
+            print(f"File {file_id} no longer exists in OpenAI storage")
         except Exception as e:
             print(f"Error deleting from OpenAI storage: {str(e)}")
             return {
                 'success': False,
                 'message': f'Failed to delete file from OpenAI storage: {str(e)}',
+                'reason': REASON_OPENAI_DELETE_FAILED,
                 'data': None
             }
         
         # Delete the processing status document
         try:
-            db_client.collection('document_processing_status').document(document_id).delete()
+            with span('status_delete'):
+                db_client.collection('document_processing_status').document(document_id).delete()
+                count_firestore(deletes=1)
             print(f"Deleted processing status for {file_name}")
         except Exception as e:
             print(f"Error deleting processing status: {str(e)}")
@@ -101,10 +158,72 @@ def delete_file_from_openai(
         return {
             'success': False,
             'message': error_msg,
+            'reason': REASON_ERROR,
             'data': None
         }
 
 
+def delete_archive_members(
+    db_client,
+    user_id: str,
+    file_name: str,
+    document_id: str,
+    status_data: dict
+) -> dict:
+    """
+    Delete every ingested member of an archive, then the status of the archive.
+
+    Members are deleted MEMBER_DELETE_CONCURRENCY at a time.
+
+    Args:
+        db_client: Firestore client instance
+        user_id: ID of the user
+        file_name: Name of the archive
+        document_id: ID of the processing status document of the archive
+        status_data: Processing status of the archive
+
+    Returns:
+        dict: Success/failure message, with the members that could not be deleted
+    """
+    members = status_data.get('archive_members', [])
+
+    def delete_member(member_name: str) -> bool:
+        response = _delete_file_from_openai(user_id, member_name)
+        # Members that failed before upload have no file to delete
+        if is_nothing_to_delete(response):
+            db_client.collection('document_processing_status').document(
+                get_status_document_id(user_id, member_name)).delete()
+            count_firestore(deletes=1)
+            return True
+        return bool(response.get('success'))
+
+    with span('archive_members_delete', members=len(members)), \
+            ThreadPoolExecutor(max_workers=MEMBER_DELETE_CONCURRENCY) as executor:
+        deleted = list(executor.map(delete_member, members))
+    failed_members = [member_name for member_name, ok in zip(members, deleted) if not ok]
+
+    if failed_members:
+        return {
+            'success': False,
+            'message': f'Failed to delete {len(failed_members)} documents of {file_name}',
+            'reason': REASON_MEMBERS_FAILED,
+            'data': {'failed_members': failed_members}
+        }
+
+    with span('status_delete'):
+        db_client.collection('document_processing_status').document(document_id).delete()
+        count_firestore(deletes=1)
+    print(f"Deleted {len(members)} members and processing status of {file_name}")
+
+    return {
+        'success': True,
+        'message': f'Successfully deleted {file_name} and its {len(members)} documents from OpenAI storage and vector stores',
+        'data': {
+            'members': members
+        }
+    }
+
+
 def update_deletion_status(
     db_client, 
     user_id: str, 
@@ -122,7 +241,7 @@ def update_deletion_status(
     """
     try:
         # Create a unique document ID that combines user_id and file_name
-        document_id = f"{user_id}_{file_name}"
+        document_id = get_status_document_id(user_id, file_name)
         status_ref = db_client.collection('document_processing_status').document(document_id)
         
         update_data = {
@@ -136,6 +255,9 @@ def update_deletion_status(
             update_data['started_at'] = datetime.now()
             
         status_ref.set(update_data, merge=True)
+        count_firestore(writes=1)
+        update_processing_summary(db_client, user_id, file_name, status)
+        upsert_catalog_entry(db_client, user_id, file_name, {'status': status})
         print(f"Updated deletion status for {file_name}: {status}")
         
     except Exception as e:
@@ -157,11 +279,14 @@ def delete_vector_store_from_openai(
     """
     try:
         # Initialize clients
-        openai_client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+        openai_client = create_openai_client()
         
-        # Delete the entire vector store
-        openai_client.vector_stores.delete(vector_store_id=vector_store_id)
-        print(f"Deleted vector store {vector_store_id}")
+        # Delete the entire vector store, a store that expired is already gone
+        try:
+            call_openai('vector_stores.delete', openai_client.vector_stores.delete, vector_store_id=vector_store_id)
+            print(f"Deleted vector store {vector_store_id}")
+        except NotFoundError:
+            print(f"Vector store {vector_store_id} no longer exists")
         
         # Update Firestore to remove the vector store ID from user's list
         db_client = firestore.client()
@@ -0,0 +1,364 @@
+"""
+Per-user catalog of uploaded documents, maintained by the backend.
+
+The documents page used to list the user's storage folder and fetch the
+metadata of every object, then join it with the processing statuses. The
+catalog keeps one entry per uploaded document (name, size, content type,
+status, OpenAI file ID, upload and update times) in a handful of Firestore
+documents. The documents page listens to the shards, so it loads with
+shard_count reads and a status change sends it the one shard it rewrote;
+list_documents serves the same entries a page at a time.
+
+Entries are written by the pipeline through update_processing_status (on the
+status changes listed in CATALOG_STATUSES) and removed by the deletion. Entries
+are spread over shards by a hash of the file name; when a shard grows past
+MAX_SHARD_ENTRIES the number of shards doubles and entries are redistributed,
+which keeps every shard far below the Firestore document size limit. The root
+document is only written when the document count or the shards change, so the
+status updates of a document only write its shard. A failed write is logged as
+an error with the file and the status.
+
+Catalogs of users who uploaded before the catalog existed are built from
+storage and the processing statuses on their first listing.
+
+Layout:
+  document_catalogs/{uid}
+    - shard_count: int
+    - document_count: int
+    - updated_at: datetime (last change of document_count or shard_count)
+  document_catalogs/{uid}/shards/{index}
+    - documents: {file name: {name, size, content_type, status, file_id, uploaded_at, updated_at}}
+    - updated_at: datetime
+"""
+import base64
+import json
+import mimetypes
+import zlib
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from firebase_admin import firestore
+
+from tracing import count_firestore, log_event
+
+
+MAX_SHARD_ENTRIES = 2000  # About 500 KB of entries, half the Firestore document limit
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# Status changes copied to the catalog; progress within the pipeline is not
+CATALOG_STATUSES = {'queued', 'uploading', 'completed', 'failed', 'deleting'}
+ENTRY_FIELDS = ('name', 'size', 'content_type', 'status', 'file_id', 'uploaded_at', 'updated_at')
+
+
+def shard_index(file_name: str, shard_count: int) -> int:
+    """Shard of a file name, stable for a given shard count."""
+    return zlib.crc32(file_name.encode('utf-8')) % shard_count
+
+
+def catalog_reference(db_client, user_id: str):
+    """Root document of the catalog of a user."""
+    return db_client.collection('document_catalogs').document(user_id)
+
+
+def document_metadata(file_path: str, size_bytes: Optional[int], content_type: Optional[str]) -> dict:
+    """
+    Size, content type and upload time of an uploaded object, as catalog fields.
+
+    The fields come from the storage event, so the pipeline does not read the
+    object metadata again.
+
+    Args:
+        file_path: Path to the file in storage (e.g., 'user-documents/user123/document.pdf')
+        size_bytes: Size of the object from the storage event, None if unknown
+        content_type: Content type of the object from the storage event, guessed from the name if unknown
+
+    Returns:
+        dict: Catalog fields, None for the unknown ones
+    """
+    return {
+        'size': size_bytes,
+        'content_type': content_type or mimetypes.guess_type(file_path)[0],
+        'uploaded_at': datetime.now(timezone.utc),
+    }
+
+
+def upsert_catalog_entry(db_client, user_id: str, file_name: str, fields: dict) -> None:
+    """
+    Create or update the catalog entry of a document.
+
+    Archive members ('{archive}/{path}') are not catalog entries: the catalog
+    lists what the user uploaded, and the archive has its own entry.
+
+    Args:
+        db_client: Firestore client instance
+        user_id: ID of the user
+        file_name: Name of the uploaded file
+        fields: Entry fields to set (see ENTRY_FIELDS), None values are ignored
+    """
+    if '/' in file_name:
+        return
+    update = {key: value for key, value in fields.items() if key in ENTRY_FIELDS and value is not None}
+    update['updated_at'] = update.get('updated_at') or datetime.now(timezone.utc)
+
+    try:
+        _write_entry(db_client, user_id, file_name, update)
+    except Exception as e:
+        log_event('document_catalog_update_failed', severity='ERROR',
+                  user_id=user_id, file_name=file_name, status=update.get('status'), error=str(e))
+
+
+def remove_catalog_entry(db_client, user_id: str, file_name: str) -> None:
+    """
+    Remove the catalog entry of a deleted document.
+
+    Args:
+        db_client: Firestore client instance
+        user_id: ID of the user
+        file_name: Name of the uploaded file
+    """
+    if '/' in file_name:
+        return
+    try:
+        _write_entry(db_client, user_id, file_name, None)
+    except Exception as e:
+        log_event('document_catalog_update_failed', severity='ERROR',
+                  user_id=user_id, file_name=file_name, status=None, error=str(e))
+
+
+def _write_entry(db_client, user_id: str, file_name: str, update: Optional[dict]) -> None:
+    """
+    Merge an entry into its shard (or remove it when update is None) in a transaction.
+
+    The root document is written only when the document count or the shard
+    count changes; updating an existing entry writes its shard alone.
+    """
+    root_ref = catalog_reference(db_client, user_id)
+    shards = root_ref.collection('shards')
+
+    @firestore.transactional
+    def write(transaction) -> int:
+        root = root_ref.get(transaction=transaction)
+        root_data = (root.to_dict() or {}) if root.exists else {}
+        shard_count = root_data.get('shard_count', 1)
+        shard_ref = shards.document(str(shard_index(file_name, shard_count)))
+        shard = shard_ref.get(transaction=transaction)
+        documents = dict(((shard.to_dict() or {}) if shard.exists else {}).get('documents', {}))
+
+        existed = file_name in documents
+        if update is None:
+            if not existed:
+                return 0
+            documents.pop(file_name)
+        else:
+            documents[file_name] = {**documents.get(file_name, {'name': file_name}), **update}
+
+        now = datetime.now(timezone.utc)
+        resharded = update is not None and not existed and len(documents) > MAX_SHARD_ENTRIES
+        if resharded:
+            _reshard(transaction, shards, shard_count, file_name, documents[file_name])
+            shard_count *= 2
+        else:
+            transaction.set(shard_ref, {'documents': documents, 'updated_at': now})
+        if existed == (update is not None) and not resharded and root.exists:
+            return 1
+        document_count = root_data.get('document_count', 0) + (
+            0 if existed == (update is not None) else (1 if update is not None else -1))
+        transaction.set(root_ref, {
+            'shard_count': shard_count,
+            'document_count': max(0, document_count),
+            'updated_at': now,
+        }, merge=True)
+        return 2
+
+    writes = write(db_client.transaction())
+    count_firestore(reads=2, writes=writes)
+
+
+def _reshard(transaction, shards, shard_count: int, file_name: str, entry: dict) -> None:
+    """Double the number of shards and redistribute every entry, inside the transaction."""
+    entries: Dict[str, dict] = {file_name: entry}
+    for index in range(shard_count):
+        snapshot = shards.document(str(index)).get(transaction=transaction)
+        entries.update(((snapshot.to_dict() or {}) if snapshot.exists else {}).get('documents', {}))
+        entries[file_name] = entry
+
+    new_count = shard_count * 2
+    redistributed: List[Dict[str, dict]] = [{} for _ in range(new_count)]
+    for name, value in entries.items():
+        redistributed[shard_index(name, new_count)][name] = value
+    now = datetime.now(timezone.utc)
+    for index, documents in enumerate(redistributed):
+        transaction.set(shards.document(str(index)), {'documents': documents, 'updated_at': now})
+    count_firestore(reads=shard_count, writes=new_count)
+    print(f"Document catalog resharded from {shard_count} to {new_count} shards")
+
+
+def load_catalog(db_client, user_id: str) -> Optional[List[dict]]:
+    """
+    Read all entries of the catalog of a user.
+
+    Returns:
+        Optional[List[dict]]: The entries, or None if the user has no catalog yet
+    """
+    root = catalog_reference(db_client, user_id).get()
+    count_firestore(reads=1)
+    if not root.exists:
+        return None
+    shard_count = (root.to_dict() or {}).get('shard_count', 1)
+    shard_refs = [
+        catalog_reference(db_client, user_id).collection('shards').document(str(index))
+        for index in range(shard_count)
+    ]
+    entries: List[dict] = []
+    for snapshot in db_client.get_all(shard_refs):
+        if snapshot.exists:
+            entries.extend(((snapshot.to_dict() or {}).get('documents') or {}).values())
+    count_firestore(reads=shard_count)
+    return entries
+
+
+def build_catalog(db_client, user_id: str, bucket_name: str) -> List[dict]:
+    """
+    Build the catalog of a user from their storage objects and processing statuses.
+
+    Used once for users who uploaded documents before the catalog existed. The
+    shards are written in a transaction that merges the entries written by the
+    pipeline in the meantime, which are newer than the listing.
+
+    Returns:
+        List[dict]: The entries written to the catalog
+    """
+    from firebase_admin import storage
+
+    prefix = f"user-documents/{user_id}/"
+    entries: Dict[str, dict] = {}
+    for blob in storage.bucket(bucket_name).list_blobs(prefix=prefix):
+        name = blob.name[len(prefix):]
+        if not name or '/' in name:
+            continue
+        entries[name] = {
+            'name': name,
+            'size': blob.size,
+            'content_type': blob.content_type or mimetypes.guess_type(name)[0],
+            'status': 'completed',
+            'uploaded_at': blob.time_created,
+            'updated_at': blob.updated or blob.time_created,
+        }
+
+    statuses = list(db_client.collection('document_processing_status').where('user_id', '==', user_id).stream())
+    count_firestore(reads=max(1, len(statuses)))
+    for snapshot in statuses:
+        data = snapshot.to_dict() or {}
+        entry = entries.get(data.get('file_name'))
+        if entry is not None:
+            entry['status'] = data.get('status') or entry['status']
+            entry['file_id'] = data.get('file_id')
+            entry['updated_at'] = data.get('updated_at') or entry['updated_at']
+
+    root_ref = catalog_reference(db_client, user_id)
+    shards_ref = root_ref.collection('shards')
+
+    @firestore.transactional
+    def write(transaction) -> tuple:
+        # Entries the pipeline wrote since the listing started are newer than the built ones
+        root = root_ref.get(transaction=transaction)
+        existing_shards = ((root.to_dict() or {}) if root.exists else {}).get('shard_count', 0)
+        merged = {name: {key: value for key, value in entry.items() if value is not None}
+                  for name, entry in entries.items()}
+        for index in range(existing_shards):
+            snapshot = shards_ref.document(str(index)).get(transaction=transaction)
+            for name, entry in (((snapshot.to_dict() or {}) if snapshot.exists else {}).get('documents') or {}).items():
+                merged[name] = {**merged.get(name, {}), **entry}
+
+        shard_count = max(1, existing_shards)
+        while len(merged) > shard_count * MAX_SHARD_ENTRIES // 2:
+            shard_count *= 2
+        shards: List[Dict[str, dict]] = [{} for _ in range(shard_count)]
+        for name, entry in merged.items():
+            shards[shard_index(name, shard_count)][name] = entry
+
+        now = datetime.now(timezone.utc)
+        for index, documents in enumerate(shards):
+            transaction.set(shards_ref.document(str(index)), {'documents': documents, 'updated_at': now})
+        transaction.set(root_ref, {'shard_count': shard_count, 'document_count': len(merged), 'updated_at': now})
+        return merged, existing_shards, shard_count
+
+    merged, existing_shards, shard_count = write(db_client.transaction())
+    count_firestore(reads=1 + existing_shards, writes=shard_count + 1)
+    print(f"Built document catalog of {user_id} with {len(merged)} documents in {shard_count} shards")
+    return list(merged.values())
+
+
+def list_documents(
+    user_id: str,
+    bucket_name: str,
+    page_size: Optional[int] = None,
+    page_token: Optional[str] = None
+) -> dict:
+    """
+    Serve a page of the document catalog of a user, most recent uploads first.
+
+    Args:
+        user_id: ID of the user
+        bucket_name: Name of the Firebase Storage bucket, used to build a missing catalog
+        page_size: Number of documents per page (default DEFAULT_PAGE_SIZE, at most MAX_PAGE_SIZE)
+        page_token: nextPageToken of the previous page
+
+    Returns:
+        dict: Success/failure message, with the documents and the nextPageToken in data
+    """
+    try:
+        db_client = firestore.client()
+        page_size = max(1, min(page_size or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+
+        entries = load_catalog(db_client, user_id)
+        if entries is None:
+            entries = build_catalog(db_client, user_id, bucket_name)
+
+        entries.sort(key=_sort_key)
+        if page_token:
+            cursor = tuple(json.loads(base64.urlsafe_b64decode(page_token.encode('ascii'))))
+            entries = [entry for entry in entries if _sort_key(entry) > cursor]
+        page = entries[:page_size]
+        next_page_token = None
+        if len(entries) > page_size:
+            next_page_token = base64.urlsafe_b64encode(json.dumps(_sort_key(page[-1])).encode('utf-8')).decode('ascii')
+
+        return {
+            'success': True,
+            'message': 'Documents retrieved successfully',
+            'data': {
+                'documents': [_serialize(entry) for entry in page],
+                'nextPageToken': next_page_token,
+            }
+        }
+
+    except Exception as e:
+        print(f"Error listing documents: {str(e)}")
+        return {
+            'success': False,
+            'message': f'Error listing documents: {str(e)}',
+            'data': None
+        }
+
+
+def _timestamp(value) -> float:
+    """Seconds since the epoch of a stored datetime, 0 when missing."""
+    if not isinstance(value, datetime):
+        return 0.0
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def _sort_key(entry: dict) -> tuple:
+    """Most recent uploads first, then by name."""
+    return (-_timestamp(entry.get('uploaded_at') or entry.get('updated_at')), entry.get('name', ''))
+
+
+def _serialize(entry: dict) -> dict:
+    """Catalog entry as returned by the callable, with ISO 8601 times."""
+    return {
+        key: value.isoformat() if isinstance(value, datetime) else value
+        for key, value in entry.items()
+    }
@@ -0,0 +1,548 @@
+"""
+Splitting of oversized documents into parts ingested in parallel.
+
+A very large PDF or spreadsheet can exceed the OpenAI per-file limits, and even
+below them one file takes longer to index than the pipeline waits for it. A
+document larger than SPLIT_MAX_PART_BYTES with an extension of
+file_handling.SPLIT_EXTENSIONS is cut at page, sheet or row boundaries into
+parts under that size, which is why such documents are accepted up to
+MAX_SPLIT_DOCUMENT_BYTES instead of the OpenAI limit of MAX_DOCUMENT_BYTES:
+
+- .pdf: runs of at most SPLIT_MAX_PART_PAGES pages, sized from the average page, 'report.pdf/pages-1-120.pdf';
+- .xlsx: each sheet as CSV, repeating the header row, 'book.xlsx/Sales-rows-2-90000.csv';
+- .csv, .tsv: runs of rows, repeating the header row, 'data.csv/rows-2-400000.csv';
+- .txt, .md, .markdown: runs of lines, 'log.txt/lines-1-250000.txt'.
+
+Parts are ingested like the members of an archive (see archive_ingestion.py):
+they are uploaded to OpenAI concurrently, attached in file batches with the
+name of the parent document in their attributes, so chat scoped to the parent
+retrieves from its parts, and each part gets its own row in
+document_processing_status named '{file name}/{part}'. The row of the parent
+lists its parts in archive_members, so delete_file deletes all of them with
+the parent. The parts are first planned from the page count or the sizes of the
+records, so a document that cannot be read or makes too many parts fails
+before anything is uploaded; each part is then cut once, while the parts
+upload, and the file IDs of the uploaded parts are checkpointed, so a retry
+cuts and uploads only the missing parts, or only redoes the attach.
+
+pypdf and openpyxl are imported only when a document of their type is split.
+"""
+import contextvars
+import csv
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from openai import OpenAI
+
+from archive_ingestion import index_members, write_member_statuses
+from document_summaries import request_document_summary
+from file_handling import SPLIT_EXTENSIONS, get_file_extension, detect_file_type
+from leases import Lease, LeaseLost, check_lease
+from openai_quota import create_openai_client
+from path_handling import get_user_id, get_file_name
+from tracing import span, add_bytes, count_firestore, current_trace
+from vectorize_file import (
+    download_file_to_memory, save_checkpoint, update_processing_status, upload_file_to_openai
+)
+
+
+SPLIT_MAX_PART_BYTES = int(os.getenv('SPLIT_MAX_PART_BYTES', str(10 * 1024 * 1024)))  # Larger documents are split
+SPLIT_MAX_PART_PAGES = int(os.getenv('SPLIT_MAX_PART_PAGES', '200'))  # Pages of a PDF part
+SPLIT_MAX_PARTS = 200  # Parts of one document
+SPLIT_UPLOAD_CONCURRENCY = 8  # Part uploads to OpenAI running at the same time
+CHECKPOINT_INTERVAL_SECONDS = 2  # Minimum time between two checkpoints of the uploaded parts
+
+# Member file name of a part, sheet of a workbook part, and its first and last page or record
+PartPlan = Tuple[str, Optional[str], int, int]
+
+
+def needs_split(file_name: str, size_bytes: int) -> bool:
+    """
+    Check whether a document is split into parts before ingestion.
+
+    Args:
+        file_name: Name of the file (e.g., 'report.pdf')
+        size_bytes: Size of the file
+
+    Returns:
+        bool: True for documents of a splittable type larger than SPLIT_MAX_PART_BYTES
+    """
+    return get_file_extension(file_name) in SPLIT_EXTENSIONS and size_bytes > SPLIT_MAX_PART_BYTES
+
+
+def plan_parts(
+    file_name: str,
+    source: io.BytesIO,
+    max_part_bytes: int = SPLIT_MAX_PART_BYTES
+) -> List[PartPlan]:
+    """
+    Plan the parts of a document from its page count or the sizes of its records, without cutting them.
+
+    Args:
+        file_name: Name of the file (e.g., 'report.pdf')
+        source: Content of the file
+        max_part_bytes: Target maximum size of a part. A single page or row
+            larger than this makes a part of its own
+
+    Returns:
+        List: Parts in document order, as (member file name, sheet or None, first, last), where
+            first and last are 1-based page or record numbers (e.g., ('report.pdf/pages-1-120.pdf', None, 1, 120))
+
+    Raises:
+        ValueError: If the file type cannot be split or the document makes more than SPLIT_MAX_PARTS parts
+        Exception: If the document cannot be read
+    """
+    extension = get_file_extension(file_name)
+    source.seek(0)
+    if extension == '.pdf':
+        runs = plan_pdf(source, max_part_bytes)
+    elif extension == '.xlsx':
+        runs = plan_workbook(source, max_part_bytes)
+    elif extension in ('.csv', '.tsv'):
+        runs = [
+            (part_name, None, first, last) for part_name, first, last in plan_records(
+                (len(record) for record in iter_csv_records(source)), 'rows', extension, max_part_bytes, True)
+        ]
+    elif extension in SPLIT_EXTENSIONS:
+        runs = [
+            (part_name, None, first, last) for part_name, first, last in plan_records(
+                (len(line) for line in source), 'lines', extension, max_part_bytes, False)
+        ]
+    else:
+        raise ValueError(f"Documents of type {extension or 'unknown'} cannot be split")
+
+    if len(runs) > SPLIT_MAX_PARTS:
+        raise ValueError(f"Document makes more than {SPLIT_MAX_PARTS} parts")
+    return [(f"{file_name}/{part_name}", sheet, first, last) for part_name, sheet, first, last in runs]
+
+
+def cut_parts(file_name: str, source: io.BytesIO, plan: List[PartPlan]) -> Iterator[Tuple[str, bytes]]:
+    """
+    Cut planned parts out of a document.
+
+    Parts are produced one at a time, so only the parts being uploaded are held
+    in memory next to the document.
+
+    Args:
+        file_name: Name of the file (e.g., 'report.pdf')
+        source: Content of the file
+        plan: Parts to cut, in document order (see plan_parts); parts left out of the plan are skipped
+
+    Yields:
+        Tuple: Member file name of the part (e.g., 'report.pdf/pages-1-120.pdf') and its content
+    """
+    extension = get_file_extension(file_name)
+    source.seek(0)
+    if extension == '.pdf':
+        yield from cut_pdf(source, plan)
+    elif extension == '.xlsx':
+        yield from cut_workbook(source, plan)
+    elif extension in ('.csv', '.tsv'):
+        yield from cut_records(iter_csv_records(source), plan, with_header=True)
+    else:
+        yield from cut_records(source, plan, with_header=False)
+
+
+def plan_pdf(source: io.BytesIO, max_part_bytes: int) -> List[PartPlan]:
+    """
+    Plan a PDF as runs of pages.
+
+    The number of pages of a part is estimated from the average page size, so
+    parts of a PDF whose pages differ a lot in size can exceed max_part_bytes.
+
+    Args:
+        source: Content of the PDF
+        max_part_bytes: Target maximum size of a part
+
+    Returns:
+        List: Runs of pages, named 'pages-{first}-{last}.pdf'
+    """
+    from pypdf import PdfReader
+
+    total_bytes = source.getbuffer().nbytes
+    page_count = len(PdfReader(source).pages)
+    pages_per_part = max(1, min(SPLIT_MAX_PART_PAGES, page_count * max_part_bytes // max(total_bytes, 1)))
+    return [
+        (f"pages-{start + 1}-{min(start + pages_per_part, page_count)}.pdf", None,
+         start + 1, min(start + pages_per_part, page_count))
+        for start in range(0, page_count, pages_per_part)
+    ]
+
+
+def cut_pdf(source: io.BytesIO, plan: List[PartPlan]) -> Iterator[Tuple[str, bytes]]:
+    """Write each planned run of pages of a PDF to a new PDF."""
+    from pypdf import PdfReader
+
+    reader = PdfReader(source)
+    for part_name, _, first, last in plan:
+        yield part_name, _write_pages(reader, first - 1, last - first + 1)
+
+
+def _write_pages(reader, start: int, count: int) -> bytes:
+    """Write pages [start, start + count) of a PDF to a new PDF."""
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    for page_index in range(start, start + count):
+        writer.add_page(reader.pages[page_index])
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def plan_workbook(source: io.BytesIO, max_part_bytes: int) -> List[PartPlan]:
+    """
+    Plan each sheet of an Excel workbook as CSV runs of rows.
+
+    Args:
+        source: Content of the .xlsx workbook
+        max_part_bytes: Target maximum size of a part
+
+    Returns:
+        List: Runs of rows, named '{sheet}-rows-{first}-{last}.csv'
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        return [
+            (part_name, sheet.title, first, last)
+            for sheet in workbook.worksheets
+            for part_name, first, last in plan_records(
+                (len(record) for record in iter_sheet_records(sheet)),
+                f"{sheet.title}-rows", '.csv', max_part_bytes, with_header=True)
+        ]
+    finally:
+        workbook.close()
+
+
+def cut_workbook(source: io.BytesIO, plan: List[PartPlan]) -> Iterator[Tuple[str, bytes]]:
+    """Write the planned runs of rows of each sheet of an Excel workbook as CSV."""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            sheet_plan = [part for part in plan if part[1] == sheet.title]
+            if sheet_plan:
+                yield from cut_records(iter_sheet_records(sheet), sheet_plan, with_header=True)
+    finally:
+        workbook.close()
+
+
+def iter_csv_records(source: io.BytesIO) -> Iterator[bytes]:
+    """
+    Read the records of a CSV or TSV document without parsing their fields.
+
+    A line break inside a quoted field leaves an odd number of quotes on the
+    line, so lines are joined until the quotes of the record are balanced.
+
+    Args:
+        source: Content of the document
+
+    Yields:
+        bytes: Each record, with its line break
+    """
+    pending = []
+    quotes = 0
+    for line in source:
+        pending.append(line)
+        quotes += line.count(b'"')
+        if quotes % 2 == 0:
+            yield b''.join(pending)
+            pending, quotes = [], 0
+    if pending:
+        yield b''.join(pending)
+
+
+def iter_sheet_records(sheet) -> Iterator[bytes]:
+    """Rows of a worksheet as CSV records."""
+    for row in sheet.iter_rows(values_only=True):
+        line = io.StringIO()
+        csv.writer(line, lineterminator='\n').writerow(['' if value is None else value for value in row])
+        yield line.getvalue().encode('utf-8')
+
+
+def plan_records(
+    sizes: Iterable[int],
+    prefix: str,
+    extension: str,
+    max_part_bytes: int,
+    with_header: bool
+) -> List[Tuple[str, int, int]]:
+    """
+    Group consecutive records (rows or lines) into parts from their sizes.
+
+    Args:
+        sizes: Sizes of the records of the document, with their line breaks
+        prefix: Start of the part names (e.g., 'rows', 'Sales-rows', 'lines')
+        extension: Extension of the parts
+        max_part_bytes: Target maximum size of a part
+        with_header: Whether the first record is a header row repeated at the start of every part
+
+    Returns:
+        List: Part name ('{prefix}-{first}-{last}{extension}') with the 1-based numbers of its first and last record
+    """
+    sizes = iter(sizes)
+    base_size = 0
+    if with_header:
+        base_size = next(sizes, None)
+        if base_size is None:
+            return []
+
+    runs = []
+    size = base_size
+    first = last = None
+    for number, record_size in enumerate(sizes, start=2 if with_header else 1):
+        if first is None:
+            first = number
+        elif size + record_size > max_part_bytes:
+            runs.append((f"{prefix}-{first}-{last}{extension}", first, last))
+            size, first = base_size, number
+        size += record_size
+        last = number
+    if first is not None:
+        runs.append((f"{prefix}-{first}-{last}{extension}", first, last))
+    return runs
+
+
+def cut_records(records: Iterable[bytes], plan: List[PartPlan], with_header: bool) -> Iterator[Tuple[str, bytes]]:
+    """
+    Join the planned runs of records (see plan_records), skipping the records of the runs left out.
+
+    Args:
+        records: Records of the document, with their line breaks
+        plan: Runs to cut, in document order
+        with_header: Whether the first record is a header row repeated at the start of every part
+
+    Yields:
+        Tuple: Member file name of the part and its content
+    """
+    records = iter(records)
+    base = [next(records)] if with_header and plan else []
+    number = len(base)
+    for part_name, _, first, last in plan:
+        chunk = list(base)
+        while number < last:
+            record = next(records)
+            number += 1
+            if number >= first:
+                chunk.append(record)
+        yield part_name, b''.join(chunk)
+
+
+def split_and_upload_parts(
+    openai_client: OpenAI,
+    file_name: str,
+    source: io.BytesIO,
+    db_client=None,
+    user_id: Optional[str] = None,
+    checkpoint: Optional[dict] = None,
+    lease: Optional[Lease] = None
+) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """
+    Split a document and upload its parts to OpenAI concurrently.
+
+    The parts are planned (see plan_parts) before the first upload, then each
+    part is cut once, while the parts upload.
+
+    Args:
+        openai_client: OpenAI client instance
+        file_name: Name of the document
+        source: Content of the document
+        db_client: Firestore client instance used for the checkpoint
+        user_id: ID of the user owning the document
+        checkpoint: Checkpoint of the document, whose member_file_ids lists the parts already
+            uploaded, which are not uploaded again. It is updated and saved as parts upload
+        lease: Lease of the pipeline, checked before each part is cut
+
+    Returns:
+        Tuple: File IDs of the uploaded parts and errors of the failed parts, both by member file name
+
+    Raises:
+        ValueError: If the file type cannot be split or the document makes more than SPLIT_MAX_PARTS parts
+        Exception: If the document cannot be read
+        LeaseLost: If the lease was taken over while the parts upload
+    """
+    with span('document_split_plan') as span_attributes:
+        plan = plan_parts(file_name, source, SPLIT_MAX_PART_BYTES)
+        span_attributes.update(parts=len(plan))
+    part_names = {part[0] for part in plan}
+
+    uploaded: Dict[str, str] = {
+        name: file_id for name, file_id in ((checkpoint or {}).get('member_file_ids') or {}).items()
+        if name in part_names
+    }
+    failed: Dict[str, str] = {}
+    lock = threading.Lock()
+    last_checkpoint = {'at': time.monotonic(), 'uploaded': len(uploaded)}
+    # Parts waiting for, or going through, an upload
+    in_memory = threading.BoundedSemaphore(SPLIT_UPLOAD_CONCURRENCY * 2)
+
+    def save_uploads(force: bool) -> None:
+        # Checkpoint the uploaded parts, at most every CHECKPOINT_INTERVAL_SECONDS unless forced
+        if checkpoint is None or db_client is None or (lease is not None and lease.lost):
+            return
+        with lock:
+            now = time.monotonic()
+            if len(uploaded) == last_checkpoint['uploaded'] or (
+                    not force and now - last_checkpoint['at'] < CHECKPOINT_INTERVAL_SECONDS):
+                return
+            last_checkpoint.update(at=now, uploaded=len(uploaded))
+            checkpoint['member_file_ids'] = dict(uploaded)
+            saved = dict(checkpoint)
+        try:
+            save_checkpoint(db_client, user_id, file_name, saved)
+        except Exception as e:
+            print(f"Error checkpointing the uploaded parts of {file_name}: {str(e)}")
+
+    def upload_part(part_name: str, data: bytes) -> None:
+        try:
+            file_id = upload_file_to_openai(io.BytesIO(data), openai_client, part_name.rsplit('/', 1)[-1])
+            with lock:
+                uploaded[part_name] = file_id
+        except Exception as e:
+            print(f"Error uploading part {part_name}: {str(e)}")
+            with lock:
+                failed[part_name] = f"Upload to OpenAI failed: {str(e)}"
+        finally:
+            in_memory.release()
+        save_uploads(force=False)
+
+    try:
+        with ThreadPoolExecutor(max_workers=SPLIT_UPLOAD_CONCURRENCY) as executor:
+            missing = [part for part in plan if part[0] not in uploaded]
+            for part_name, data in cut_parts(file_name, source, missing):
+                check_lease(lease)
+                in_memory.acquire()
+                add_bytes('in', len(data))
+                # Each upload runs in a copy of the context, so its spans land in the request trace
+                executor.submit(contextvars.copy_context().run, upload_part, part_name, data)
+    finally:
+        # Parts uploaded before a failure are not uploaded again by the retry
+        save_uploads(force=True)
+
+    print(f"Document {file_name}: {len(uploaded)} parts uploaded, {len(failed)} failed")
+    return uploaded, failed
+
+
+def ingest_split_document(
+    db_client,
+    file_path: str,
+    bucket_name: str,
+    generation: Optional[str],
+    checkpoint: dict,
+    source: Optional[io.BytesIO] = None,
+    lease: Optional[Lease] = None
+) -> str:
+    """
+    Ingest an oversized document as parts, or finish the ingestion of its uploaded parts.
+
+    Args:
+        db_client: Firestore client instance
+        file_path: Path to the file in storage (e.g., 'user-documents/user123/report.pdf')
+        bucket_name: Name of the Firebase Storage bucket
+        generation: Storage generation of the file
+        checkpoint: Checkpoint of the file, with member_file_ids while the parts upload
+            and members_uploaded once they are all uploaded
+        source: Content of the file when already downloaded
+        lease: Lease of the pipeline, checked between the uploads, the attach and the status writes
+
+    Returns:
+        str: Success/failure message
+
+    Raises:
+        LeaseLost: If the lease was taken over, the status then belongs to the new owner
+    """
+    user_id = get_user_id(file_path)
+    file_name = get_file_name(file_path)
+    file_type = detect_file_type(get_file_extension(file_name))
+
+    try:
+        openai_client = create_openai_client()
+
+        with span('vector_stores_load'):
+            user_vector_stores_ref = db_client.collection('user_vector_stores').document(user_id)
+            user_vector_stores_doc = user_vector_stores_ref.get()
+            count_firestore(reads=1)
+
+        # Parts uploaded by a previous attempt of the same generation
+        uploaded: Dict[str, str] = dict(checkpoint.get('member_file_ids') or {})
+        failed: Dict[str, str] = {}
+        if checkpoint.get('members_uploaded'):
+            print(f"Resuming {file_name} from checkpoint with {len(uploaded)} uploaded parts")
+            current_trace().set_attribute('resumed_from', 'uploaded')
+            update_processing_status(db_client, user_id, file_name, 'vectorizing', progress_percentage=60)
+        else:
+            if uploaded:
+                print(f"Resuming the split of {file_name}, {len(uploaded)} parts already uploaded")
+                current_trace().set_attribute('resumed_from', 'splitting')
+            if source is None:
+                source = download_file_to_memory(file_path, bucket_name, get_file_extension(file_name))
+            check_lease(lease)
+            update_processing_status(db_client, user_id, file_name, 'processing', progress_percentage=30)
+            checkpoint['member_file_ids'] = uploaded
+            with span('document_split_upload') as span_attributes:
+                uploaded, failed = split_and_upload_parts(
+                    openai_client, file_name, source, db_client, user_id, checkpoint, lease)
+                span_attributes.update(uploaded=len(uploaded), failed=len(failed))
+
+            check_lease(lease)
+
+            checkpoint['downloaded'] = True
+            checkpoint['members_uploaded'] = True
+            checkpoint['member_file_ids'] = uploaded
+            write_member_statuses(
+                db_client, user_id, file_name, generation,
+                {
+                    **{name: ('vectorizing', None, file_id) for name, file_id in uploaded.items()},
+                    **{name: ('failed', error, None) for name, error in failed.items()},
+                }
+            )
+            update_processing_status(
+                db_client, user_id, file_name, 'vectorizing', progress_percentage=60, checkpoint=checkpoint)
+
+        if not uploaded:
+            error_msg = f"No part of the document could be uploaded ({len(failed)} failed)"
+            update_processing_status(db_client, user_id, file_name, 'failed', error_msg)
+            current_trace().status = 'failed'
+            return f"{file_name} ({file_type}) - {error_msg}"
+
+        check_lease(lease)
+        indexed, attach_failures, vector_store_id = index_members(
+            db_client, openai_client, user_id, file_name, generation, uploaded, checkpoint,
+            user_vector_stores_ref, user_vector_stores_doc, attributes_name=file_name
+        )
+
+        failed_count = len(failed) + len(attach_failures)
+        summary = f"{len(indexed)} parts indexed, {failed_count} failed"
+        current_trace().set_attribute('document_parts', {'indexed': len(indexed), 'failed': failed_count})
+        if not indexed:
+            update_processing_status(db_client, user_id, file_name, 'failed', f"Document ingestion failed: {summary}")
+            current_trace().status = 'failed'
+            return f"{file_name} ({file_type}) - Document ingestion failed: {summary}"
+
+        check_lease(lease)
+        checkpoint['attached'] = True
+        checkpoint['indexed'] = True
+        update_processing_status(
+            db_client, user_id, file_name, 'completed',
+            error_message=summary if failed_count else None, progress_percentage=100,
+            vector_store_id=vector_store_id, checkpoint=checkpoint)
+        request_document_summary(db_client, user_id, file_name, generation, vector_store_id)
+        return f"{file_name} ({file_type}) - OpenAI Vector Store pipeline successful! {summary}."
+
+    except LeaseLost:
+        # The status belongs to the new owner of the lease
+        raise
+
+    except Exception as e:
+        error_msg = f"Document splitting failed: {str(e)}"
+        print(f"Error during document splitting: {str(e)}")
+        current_trace().status = 'failed'
+        update_processing_status(db_client, user_id, file_name, 'failed', error_msg)
+        return f"{file_name} ({file_type}) - {error_msg}"
@@ -0,0 +1,574 @@
+"""
+Per-document summaries and section outlines, precomputed after indexing.
+
+"What is this document about?" and "summarize section 3" are the most common
+prompts, and each one made the chat agent run FileSearch and read many chunks.
+Once a document is indexed, the pipeline marks its summary as pending; the
+summarize_document trigger then reads the full text of the document from its
+vector store files, summarizes it window by window and combines the window
+summaries into a compact summary and an outline of its sections (map-reduce).
+The chat agent reads them with the get_document_overview tool, a single small
+document read (or one query for all documents of the user), and falls back to
+FileSearch for details or when no overview is ready yet.
+
+Documents longer than SUMMARY_MAX_WINDOWS windows, and documents of which a
+part or a window could not be read or summarized, get an overview marked
+partial, with the share of the document it covers.
+
+Summaries are generated in the background, outside the upload: a failed or
+slow summary never fails the ingestion. Re-uploading a document marks its
+summary pending again for the new generation, and a result computed for an
+older generation is dropped. Archive members are not summarized; split
+documents are summarized once, over all their parts. Set DOCUMENT_SUMMARIES=0
+to turn summaries off.
+
+Layout:
+  document_summaries/{userId}_{fileName}   (same ID as document_processing_status)
+    - user_id: str
+    - file_name: str
+    - generation: str, storage generation that was summarized
+    - vector_store_id: str
+    - status: "pending" | "completed" | "failed"
+    - summary: str
+    - outline: [{title: str, summary: str}]
+    - partial: bool, whether the summary covers only part of the document
+    - coverage: {files_read, files_total, windows_summarized, windows_total}
+    - model: str
+    - error_message: str
+    - requested_at, updated_at: datetime
+"""
+import asyncio
+import json
+import os
+import re
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from firebase_admin import firestore
+
+from leases import acquire_lease
+from openai_calls import call_openai, call_openai_async
+from openai_quota import create_openai_client
+from path_handling import get_status_document_id
+from tracing import start_trace, span, count_firestore, current_trace
+
+
+SUMMARIES_COLLECTION = 'document_summaries'
+SUMMARY_MODEL = 'gpt-4.1-mini'
+SUMMARY_WINDOW_CHARS = 40000  # Text of the document summarized by one agent run
+SUMMARY_MAX_WINDOWS = 32  # Longer documents get a partial summary of their first windows
+SUMMARY_CONCURRENCY = 4  # Window summaries running at the same time
+SUMMARY_REDUCE_FANIN = 8  # Summaries combined by one agent run
+SUMMARY_MAX_CHARS = 1200  # Longest stored summary
+OUTLINE_MAX_SECTIONS = 30  # Longest stored outline
+SECTION_SUMMARY_MAX_CHARS = 300  # Longest summary of a section
+OVERVIEW_MAX_DOCUMENTS = 50  # Documents listed by an overview of all documents
+
+
+def summaries_enabled() -> bool:
+    """Whether indexed documents get a summary and the chat agent the overview tool."""
+    return os.getenv('DOCUMENT_SUMMARIES', '1') == '1'
+
+
+def summary_reference(db_client, user_id: str, file_name: str):
+    """Reference to the summary document of a file."""
+    return db_client.collection(SUMMARIES_COLLECTION).document(get_status_document_id(user_id, file_name))
+
+
+def request_document_summary(
+    db_client,
+    user_id: str,
+    file_name: str,
+    generation: Optional[str],
+    vector_store_id: Optional[str]
+) -> None:
+    """
+    Mark the summary of an indexed document as pending, which starts the summarize_document trigger.
+
+    Failures are logged and never fail the ingestion.
+
+    Args:
+        db_client: Firestore client instance
+        user_id: ID of the user
+        file_name: Name of the indexed file
+        generation: Storage generation that was indexed
+        vector_store_id: Vector store holding the chunks of the file
+    """
+    if not summaries_enabled() or not vector_store_id or '/' in file_name:
+        return
+    try:
+        now = datetime.now()
+        summary_reference(db_client, user_id, file_name).set({
+            'user_id': user_id,
+            'file_name': file_name,
+            'generation': generation,
+            'vector_store_id': vector_store_id,
+            'status': 'pending',
+            'error_message': None,
+            'requested_at': now,
+            'updated_at': now,
+        }, merge=True)
+        count_firestore(writes=1)
+    except Exception as e:
+        print(f"Error requesting the summary of {file_name}: {str(e)}")
+
+
+def generate_document_summary(summary_id: str) -> str:
+    """
+    Summarize a document whose summary is pending, and store the summary and outline.
+
+    Duplicate deliveries of the trigger are kept out by a lease on the
+    summary and generation.
+
+    Args:
+        summary_id: ID of the summary document ('{userId}_{fileName}')
+
+    Returns:
+        str: Outcome message
+    """
+    db_client = firestore.client()
+    reference = db_client.collection(SUMMARIES_COLLECTION).document(summary_id)
+    snapshot = reference.get()
+    count_firestore(reads=1)
+    data = (snapshot.to_dict() or {}) if snapshot.exists else {}
+    if data.get('status') != 'pending':
+        return f"Summary {summary_id} is not pending"
+
+    file_name = data['file_name']
+    generation = data.get('generation')
+    with start_trace('summarize_document', uid=data.get('user_id'), file_name=file_name) as trace:
+        lease = acquire_lease(db_client, f"summary:{summary_id}#{generation}")
+        if lease is None:
+            trace.set_attribute('duplicate', True)
+            return f"Summary of {file_name} generation {generation} is already handled"
+        lease.start_heartbeat()
+        try:
+            with span('document_summary') as span_attributes:
+                summary, outline, coverage = summarize_document(
+                    db_client, create_openai_client(), data['user_id'], file_name, data['vector_store_id'])
+                span_attributes.update(summary_chars=len(summary), sections=len(outline), coverage=coverage)
+            fields = {
+                'status': 'completed',
+                'summary': summary,
+                'outline': outline,
+                'partial': is_partial(coverage),
+                'coverage': coverage,
+                'model': SUMMARY_MODEL,
+                'error_message': None,
+            }
+        except Exception as e:
+            print(f"Error summarizing {file_name}: {str(e)}")
+            trace.status = 'failed'
+            fields = {'status': 'failed', 'error_message': f"Summary failed: {str(e)}"}
+        finally:
+            lease.release(completed=trace.status == 'ok')
+
+        if not save_summary(db_client, reference, generation, fields):
+            trace.set_attribute('superseded', True)
+            return f"Summary of {file_name} generation {generation} was superseded"
+        return f"Summary of {file_name} {fields['status']}"
+
+
+def summarize_document(
+    db_client,
+    openai_client,
+    user_id: str,
+    file_name: str,
+    vector_store_id: str
+) -> Tuple[str, List[Dict], Dict]:
+    """
+    Summarize the full text of one document, window by window, then combine the window summaries.
+
+    Args:
+        db_client: Firestore client instance
+        openai_client: OpenAI client instance
+        user_id: ID of the user
+        file_name: Name of the document
+        vector_store_id: Vector store holding the files of the document
+
+    Returns:
+        Tuple[str, List[Dict], Dict]: Summary, outline as a list of {title, summary},
+            and coverage ({files_read, files_total, windows_summarized, windows_total})
+
+    Raises:
+        Exception: If no text of the document could be read or summarized
+    """
+    file_ids, files_total = document_file_ids(db_client, user_id, file_name)
+    texts = []
+    for file_id in file_ids:
+        try:
+            texts.append(read_file_text(openai_client, vector_store_id, file_id))
+        except Exception as e:
+            print(f"Error reading file {file_id} of {file_name}: {str(e)}")
+    windows = split_windows('\n\n'.join(text for text in texts if text))
+    if not windows:
+        raise Exception(f"No text of {file_name} could be read")
+
+    summary, outline, summarized = asyncio.run(map_reduce(file_name, windows[:SUMMARY_MAX_WINDOWS]))
+    coverage = {
+        'files_read': len(texts),
+        'files_total': files_total,
+        'windows_summarized': summarized,
+        'windows_total': len(windows),
+    }
+    return summary, outline, coverage
+
+
+def is_partial(coverage: Dict) -> bool:
+    """Whether a summary leaves out part of the document."""
+    return (coverage['files_read'] < coverage['files_total']
+            or coverage['windows_summarized'] < coverage['windows_total'])
+
+
+def document_file_ids(db_client, user_id: str, file_name: str) -> Tuple[List[str], int]:
+    """
+    OpenAI file IDs holding the text of a document, from its processing status.
+
+    A split document is read from its parts, in the order of their names with
+    page and row numbers compared as numbers.
+
+    Args:
+        db_client: Firestore client instance
+        user_id: ID of the user
+        file_name: Name of the document
+
+    Returns:
+        Tuple[List[str], int]: File IDs in document order, and the number of files
+            (or parts, uploaded or not) the document is made of
+    """
+    snapshot = db_client.collection('document_processing_status').document(
+        get_status_document_id(user_id, file_name)).get()
+    count_firestore(reads=1)
+    data = (snapshot.to_dict() or {}) if snapshot.exists else {}
+    if data.get('file_id'):
+        return [data['file_id']], 1
+
+    member_file_ids = (data.get('checkpoint') or {}).get('member_file_ids') or {}
+    parts = sorted(set(data.get('archive_members') or []) | set(member_file_ids), key=natural_sort_key)
+    return [member_file_ids[part] for part in parts if part in member_file_ids], len(parts)
+
+
+def natural_sort_key(name: str) -> list:
+    """Sort key comparing the numbers in a name as numbers ('pages-9' before 'pages-10')."""
+    return [int(piece) if piece.isdigit() else piece for piece in re.split(r'(\d+)', name)]
+
+
+def read_file_text(openai_client, vector_store_id: str, file_id: str) -> str:
+    """Parsed text of a vector store file."""
+    page = call_openai(
+        'vector_stores.files.content', openai_client.vector_stores.files.content,
+        file_id, vector_store_id=vector_store_id)
+    return '\n'.join(item.text for item in page.data if item.text)
+
+
+def split_windows(text: str, window_chars: Optional[int] = None) -> List[str]:
+    """
+    Cut the text of a document into windows, at a line break when there is one in the second half of a window.
+
+    Args:
+        text: Full text of the document
+        window_chars: Longest window, SUMMARY_WINDOW_CHARS by default
+
+    Returns:
+        List[str]: Windows in order
+    """
+    window_chars = window_chars or SUMMARY_WINDOW_CHARS
+    windows = []
+    start = 0
+    while start < len(text):
+        end = min(start + window_chars, len(text))
+        if end < len(text):
+            line_break = text.rfind('\n', start + window_chars // 2, end)
+            if line_break != -1:
+                end = line_break + 1
+        if text[start:end].strip():
+            windows.append(text[start:end])
+        start = end
+    return windows
+
+
+async def map_reduce(file_name: str, windows: List[str]) -> Tuple[str, List[Dict], int]:
+    """
+    Summarize the windows of a document, then combine their summaries SUMMARY_REDUCE_FANIN at a time until one is left.
+
+    Args:
+        file_name: Name of the document
+        windows: Text of each window, in order
+
+    Returns:
+        Tuple[str, List[Dict], int]: Summary, outline, and number of windows summarized
+
+    Raises:
+        Exception: If no window could be summarized
+    """
+    summaries = [result for result in await summarize_windows(file_name, windows) if result is not None]
+    if not summaries:
+        raise Exception(f"No window of {file_name} could be summarized")
+    summarized = len(summaries)
+
+    async def combine(group: List[Tuple[str, List[Dict]]]) -> Tuple[str, List[Dict]]:
+        return group[0] if len(group) == 1 else await combine_summaries(file_name, group)
+
+    while len(summaries) > 1:
+        groups = [summaries[start:start + SUMMARY_REDUCE_FANIN]
+                  for start in range(0, len(summaries), SUMMARY_REDUCE_FANIN)]
+        summaries = list(await asyncio.gather(*(combine(group) for group in groups)))
+    summary, outline = summaries[0]
+    return summary, outline, summarized
+
+
+async def summarize_windows(file_name: str, windows: List[str]) -> List[Optional[Tuple[str, List[Dict]]]]:
+    """
+    Summarize the windows of a document, at most SUMMARY_CONCURRENCY at a time.
+
+    Args:
+        file_name: Name of the document
+        windows: Text of each window, in order
+
+    Returns:
+        List: Summary and outline of each window, in order; None for a window whose summary failed
+    """
+    # Lazy import to avoid deployment timeout
+    from agents import Agent, ModelSettings, Runner
+
+    agent = Agent(
+        name="Document Summarizer",
+        instructions=(
+            "You summarize one part of a document for later questions about it. "
+            "Reply with JSON only, in the form "
+            '{"summary": "...", "outline": [{"title": "...", "summary": "..."}]}. '
+            "The summary states what this part covers and its main points in at most 150 words. "
+            f"The outline lists the sections of this part in order, at most {OUTLINE_MAX_SECTIONS}, "
+            "each with its title as written in the document (numbering included) and one or two sentences. "
+            "A section continued from the previous part keeps its title."
+        ),
+        model=SUMMARY_MODEL,
+        model_settings=ModelSettings(temperature=0.1),
+    )
+    semaphore = asyncio.Semaphore(SUMMARY_CONCURRENCY)
+
+    async def summarize(index: int, text: str) -> Optional[Tuple[str, List[Dict]]]:
+        prompt = f"Summarize part {index + 1} of {len(windows)} of the document {file_name}:\n\n{text}"
+        async with semaphore:
+            try:
+                result = await call_openai_async('agent_run', Runner.run, agent, prompt, policy='background')
+            except Exception as e:
+                print(f"Error summarizing part {index + 1} of {file_name}: {str(e)}")
+                return None
+        return parse_summary_output(result.final_output or "")
+
+    return list(await asyncio.gather(*(summarize(index, text) for index, text in enumerate(windows))))
+
+
+async def combine_summaries(file_name: str, summaries: List[Tuple[str, List[Dict]]]) -> Tuple[str, List[Dict]]:
+    """
+    Combine the summaries and outlines of consecutive parts of a document into one.
+
+    Args:
+        file_name: Name of the document
+        summaries: Summary and outline of each part, in order
+
+    Returns:
+        Tuple[str, List[Dict]]: Summary and outline of the parts together
+    """
+    # Lazy import to avoid deployment timeout
+    from agents import Agent, ModelSettings, Runner
+
+    agent = Agent(
+        name="Summary Combiner",
+        instructions=(
+            "You combine the summaries of consecutive parts of one document into the summary of the whole. "
+            "Reply with JSON only, in the form "
+            '{"summary": "...", "outline": [{"title": "...", "summary": "..."}]}. '
+            "The summary states what the document is and its main points in at most 150 words. "
+            f"The outline lists the sections of all parts in order, at most {OUTLINE_MAX_SECTIONS}: "
+            "merge a section continued across parts into one entry, keep titles as given, "
+            "and merge minor sections into their parent when there are too many."
+        ),
+        model=SUMMARY_MODEL,
+        model_settings=ModelSettings(temperature=0.1),
+    )
+    parts = [{'part': index + 1, 'summary': summary, 'outline': outline}
+             for index, (summary, outline) in enumerate(summaries)]
+    prompt = f"Combine the summaries of the parts of the document {file_name}:\n\n{json.dumps(parts)}"
+    result = await call_openai_async('agent_run', Runner.run, agent, prompt, policy='background')
+    return parse_summary_output(result.final_output or "")
+
+
+def parse_summary_output(text: str) -> Tuple[str, List[Dict]]:
+    """
+    Read the summary and outline from the output of the summarizer agent.
+
+    Args:
+        text: Output of the agent, JSON possibly wrapped in a code fence
+
+    Returns:
+        Tuple[str, List[Dict]]: Summary and outline, within the stored limits; the
+            whole text as summary with an empty outline when it is not JSON
+    """
+    body = text.strip()
+    if body.startswith('```'):
+        body = body.strip('`').split('\n', 1)[-1]
+    try:
+        parsed = json.loads(body[body.index('{'):body.rindex('}') + 1])
+    except ValueError:
+        return text.strip()[:SUMMARY_MAX_CHARS], []
+    if not isinstance(parsed, dict):
+        return text.strip()[:SUMMARY_MAX_CHARS], []
+
+    outline = []
+    for section in parsed.get('outline') or []:
+        if isinstance(section, dict) and section.get('title'):
+            outline.append({
+                'title': str(section['title'])[:200],
+                'summary': str(section.get('summary') or '')[:SECTION_SUMMARY_MAX_CHARS],
+            })
+    return str(parsed.get('summary') or '')[:SUMMARY_MAX_CHARS], outline[:OUTLINE_MAX_SECTIONS]
+
+
+def save_summary(db_client, reference, generation: Optional[str], fields: dict) -> bool:
+    """
+    Store the outcome of a summary unless the document was re-uploaded in the meantime.
+
+    Args:
+        db_client: Firestore client instance
+        reference: Summary document
+        generation: Generation that was summarized
+        fields: Fields to write
+
+    Returns:
+        bool: Whether the fields were written
+    """
+    @firestore.transactional
+    def save(transaction) -> bool:
+        snapshot = reference.get(transaction=transaction)
+        if not snapshot.exists or (snapshot.to_dict() or {}).get('generation') != generation:
+            return False
+        transaction.set(reference, {**fields, 'updated_at': datetime.now()}, merge=True)
+        return True
+
+    saved = save(db_client.transaction())
+    count_firestore(reads=1, writes=1 if saved else 0)
+    return saved
+
+
+def delete_document_summary(db_client, user_id: str, file_name: str) -> None:
+    """
+    Delete the summary of a deleted document.
+
+    Args:
+        db_client: Firestore client instance
+        user_id: ID of the user
+        file_name: Name of the deleted file
+    """
+    try:
+        summary_reference(db_client, user_id, file_name).delete()
+        count_firestore(deletes=1)
+    except Exception as e:
+        print(f"Error deleting the summary of {file_name}: {str(e)}")
+
+
+def load_document_overview(
+    db_client,
+    user_id: str,
+    file_name: Optional[str] = None,
+    documents: Optional[List[str]] = None
+) -> dict:
+    """
+    Summary and outline of one document, or the summaries of the documents of a user.
+
+    Args:
+        db_client: Firestore client instance
+        user_id: ID of the user
+        file_name: Document whose summary and full outline are returned; None for all documents
+        documents: File names the chat is scoped to, if any
+
+    Returns:
+        dict: For one document, file_name, status, summary, outline and whether it
+            is 'partial'. For all documents, 'documents' with the file_name, summary,
+            section titles and 'partial' flag of each summarized document, and whether
+            the list was 'truncated'.
+    """
+    with span('document_overview_load'):
+        if file_name:
+            snapshot = summary_reference(db_client, user_id, file_name).get()
+            count_firestore(reads=1)
+            data = (snapshot.to_dict() or {}) if snapshot.exists else {}
+            if data.get('status') != 'completed':
+                return {
+                    'file_name': file_name,
+                    'status': data.get('status') or 'missing',
+                    'message': 'No overview is available for this document, use the FileSearchTool instead.',
+                }
+            overview = {
+                'file_name': file_name,
+                'status': 'completed',
+                'summary': data.get('summary'),
+                'outline': data.get('outline') or [],
+                'partial': bool(data.get('partial')),
+            }
+            if overview['partial']:
+                overview['message'] = (
+                    'This overview covers only part of the document, use the FileSearchTool for the rest.')
+            return overview
+
+        if documents:
+            names = list(dict.fromkeys(documents))[:OVERVIEW_MAX_DOCUMENTS]
+            snapshots = list(db_client.get_all([summary_reference(db_client, user_id, name) for name in names]))
+            count_firestore(reads=len(names))
+            truncated = len(set(documents)) > len(names)
+        else:
+            snapshots = list(
+                db_client.collection(SUMMARIES_COLLECTION)
+                .where('user_id', '==', user_id)
+                .limit(OVERVIEW_MAX_DOCUMENTS + 1)
+                .stream()
+            )
+            count_firestore(reads=max(1, len(snapshots)))
+            truncated = len(snapshots) > OVERVIEW_MAX_DOCUMENTS
+            snapshots = snapshots[:OVERVIEW_MAX_DOCUMENTS]
+
+        entries = []
+        for snapshot in snapshots:
+            data = (snapshot.to_dict() or {}) if snapshot.exists else {}
+            if data.get('status') == 'completed':
+                entries.append({
+                    'file_name': data.get('file_name'),
+                    'summary': data.get('summary'),
+                    'sections': [section.get('title') for section in data.get('outline') or []],
+                    'partial': bool(data.get('partial')),
+                })
+        return {'documents': entries, 'truncated': truncated}
+
+
+def build_overview_tool(db_client, user_id: str, documents: Optional[List[str]] = None):
+    """
+    Function tool giving the chat agent the precomputed overviews of the user's documents.
+
+    Args:
+        db_client: Firestore client instance
+        user_id: ID of the user
+        documents: File names the chat is scoped to, if any
+
+    Returns:
+        FunctionTool: The get_document_overview tool
+    """
+    # Lazy import to avoid deployment timeout
+    from agents import function_tool
+
+    @function_tool
+    def get_document_overview(file_name: str) -> str:
+        """
+        Get the precomputed summary and section outline of the user's documents.
+
+        Args:
+            file_name: Name of one document to get its summary and full outline, or an
+                empty string to get the summary and section titles of all documents
+        """
+        if documents and file_name and file_name not in documents:
+            return json.dumps({'file_name': file_name, 'message': 'This document is not part of the conversation.'})
+        overview = load_document_overview(db_client, user_id, file_name or None, documents)
+        current_trace().add('document_overview_calls')
+        return json.dumps(overview, default=str)
+
+    return get_document_overview
@@ -1,3 +1,82 @@
+import codecs
+import os
+from typing import Optional, Set
+
+
+# Extensions indexed by OpenAI FileSearch
+SUPPORTED_EXTENSIONS = {
+    '.pdf', '.docx', '.doc', '.pptx', '.ppt', '.xlsx', '.xls', '.txt', '.rtf', 
+    '.odt', '.ods', '.odp', '.csv', '.tsv', '.json', '.xml', '.html', '.htm',
+    '.md', '.markdown', '.tex', '.latex', '.epub', '.mobi', '.azw3'
+}
+
+# Archive formats whose members are extracted and ingested one by one
+ARCHIVE_SUFFIXES = {
+    '.zip': 'zip',
+    '.tar.gz': 'tar',
+    '.tgz': 'tar',
+    '.tar': 'tar',
+}
+
+# Formats that document_splitter can cut into parts at page, sheet or row boundaries
+SPLIT_EXTENSIONS = {'.pdf', '.xlsx', '.csv', '.tsv', '.txt', '.md', '.markdown'}
+
+# Upload limits checked against the size of the storage event, before any download
+MAX_DOCUMENT_BYTES = int(os.getenv('MAX_DOCUMENT_BYTES', str(512 * 1024 * 1024)))  # OpenAI file size limit
+# Splittable documents are ingested as parts under the OpenAI limit. The pipeline holds the
+# whole document in memory while it is split, so this stays well below the memory of the
+# vectorize_file and ingestion worker instances (see main.py)
+MAX_SPLIT_DOCUMENT_BYTES = int(os.getenv('MAX_SPLIT_DOCUMENT_BYTES', str(1024 * 1024 * 1024)))
+MAX_IMAGE_BYTES = 20 * 1024 * 1024  # Largest image sent to the vision model
+MAX_ARCHIVE_BYTES = 2 * 1024 * 1024 * 1024
+
+# Content types of the upload that are never documents
+REJECTED_CONTENT_TYPE_PREFIXES = ('audio/', 'video/')
+REJECTED_CONTENT_TYPES = {
+    'application/x-msdownload', 'application/x-dosexec', 'application/x-executable',
+    'application/x-sharedlib', 'application/x-mach-binary', 'application/vnd.microsoft.portable-executable',
+}
+
+SNIFF_BYTES = 512  # Leading bytes read to detect the format; the tar magic sits at offset 257
+
+# Formats detected by sniff_format that each extension may contain
+EXPECTED_FORMATS = {
+    '.pdf': {'pdf'},
+    '.docx': {'zip'}, '.pptx': {'zip'}, '.xlsx': {'zip'},
+    '.odt': {'zip'}, '.ods': {'zip'}, '.odp': {'zip'}, '.epub': {'zip'},
+    # Legacy Office files; Word and Excel also save RTF and HTML under these names
+    '.doc': {'ole', 'rtf'}, '.xls': {'ole', 'text'}, '.ppt': {'ole'},
+    '.rtf': {'rtf'},
+    '.txt': {'text'}, '.csv': {'text'}, '.tsv': {'text'}, '.json': {'text'}, '.xml': {'text'},
+    '.html': {'text'}, '.htm': {'text'}, '.md': {'text'}, '.markdown': {'text'},
+    '.tex': {'text'}, '.latex': {'text'},
+    '.mobi': {'mobi'}, '.azw3': {'mobi'},
+    '.png': {'png'}, '.jpg': {'jpeg'}, '.jpeg': {'jpeg'}, '.gif': {'gif'}, '.bmp': {'bmp'},
+    '.tiff': {'tiff'}, '.webp': {'webp'},
+    '.zip': {'zip'}, '.tar.gz': {'gzip'}, '.tgz': {'gzip'}, '.tar': {'tar'},
+}
+
+# Leading bytes of the binary formats, checked in order
+MAGIC_SIGNATURES = [
+    (b'%PDF-', 'pdf'),
+    (b'PK\x03\x04', 'zip'),
+    (b'PK\x05\x06', 'zip'),  # Empty archive
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'ole'),
+    (b'{\\rtf', 'rtf'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'II*\x00', 'tiff'),
+    (b'MM\x00*', 'tiff'),
+    (b'\x1f\x8b', 'gzip'),
+    (b'\x7fELF', 'executable'),
+    (b'\xcf\xfa\xed\xfe', 'executable'),  # Mach-O
+    (b'\xfe\xed\xfa\xcf', 'executable'),
+    (b'\xca\xfe\xba\xbe', 'executable'),
+]
+
+
 def get_file_extension(file_name: str) -> str:
     """
     Extract file extension from file name.
@@ -24,7 +103,8 @@ def detect_file_type(file_extension: str) -> str:
         file_extension: File extension (e.g., '.pdf', '.png', '.jpg')
         
     Returns:
-        str: File type ('PDF', 'IMAGE', or 'UNSUPPORTED')
+        str: File type ('PDF', 'IMAGE', the upper-cased extension of the other
+            supported documents such as 'DOCX' or 'CSV', or 'UNSUPPORTED')
     """
     # PDF files
     if file_extension == '.pdf':
@@ -35,5 +115,156 @@ def detect_file_type(file_extension: str) -> str:
     if file_extension in image_extensions:
         return 'IMAGE'
     
+    # Other documents OpenAI indexes
+    if file_extension in SUPPORTED_EXTENSIONS:
+        return file_extension[1:].upper()
+    
     # Unsupported files
     return 'UNSUPPORTED'
+
+
+def get_archive_format(file_name: str) -> Optional[str]:
+    """
+    Detect whether a file is an archive from its name.
+    
+    Args:
+        file_name: Name of the file (e.g., 'folder.zip', 'folder.tar.gz')
+        
+    Returns:
+        Optional[str]: 'zip' or 'tar', or None if the file is not an archive
+    """
+    lower_name = file_name.lower()
+    for suffix, archive_format in ARCHIVE_SUFFIXES.items():
+        if lower_name.endswith(suffix):
+            return archive_format
+    return None
+
+
+def get_upload_suffix(file_name: str) -> str:
+    """
+    Suffix that decides how an upload is handled, '.tar.gz' included.
+
+    Args:
+        file_name: Name of the file
+
+    Returns:
+        str: Archive suffix of the file if any, otherwise its extension
+    """
+    lower_name = file_name.lower()
+    for suffix in ARCHIVE_SUFFIXES:
+        if lower_name.endswith(suffix):
+            return suffix
+    return get_file_extension(file_name)
+
+
+def sniff_format(header: bytes) -> str:
+    """
+    Detect the real format of a file from its leading bytes.
+
+    Args:
+        header: First SNIFF_BYTES bytes of the file (fewer for smaller files)
+
+    Returns:
+        str: 'pdf', 'zip', 'ole', 'rtf', 'png', 'jpeg', 'gif', 'tiff', 'gzip', 'webp',
+            'bmp', 'tar', 'mobi', 'executable', 'text', or 'binary' when unknown
+    """
+    for signature, detected in MAGIC_SIGNATURES:
+        if header.startswith(signature):
+            return detected
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    if header[257:262] == b'ustar':
+        return 'tar'
+    if header[60:68] in (b'BOOKMOBI', b'TEXtREAd'):
+        return 'mobi'
+    if is_text(header):
+        return 'text'
+    # Two-letter signatures, only trusted for binary content
+    if header[:2] == b'BM' and header[6:10] == b'\x00\x00\x00\x00':
+        return 'bmp'
+    if header[:2] == b'MZ':
+        return 'executable'
+    return 'binary'
+
+
+def is_text(header: bytes) -> bool:
+    """
+    Whether the leading bytes of a file are text.
+
+    UTF-16 with a byte order mark, UTF-8 and single-byte encodings (e.g.,
+    Windows-1252 CSV exports) are text; NUL bytes or many control characters
+    are not.
+
+    Args:
+        header: Leading bytes of the file
+
+    Returns:
+        bool: True for text
+    """
+    if header.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return True
+    if not header:
+        return True
+    if b'\x00' in header:
+        return False
+    controls = sum(1 for byte in header if byte < 32 and byte not in b'\t\n\r\f\x0b\x1b\x08')
+    return controls <= len(header) // 100
+
+
+def check_upload_metadata(file_name: str, size_bytes: Optional[int], content_type: Optional[str]) -> Optional[str]:
+    """
+    Reject an upload from its name, size and content type.
+
+    Args:
+        file_name: Name of the file
+        size_bytes: Size of the object, None if unknown
+        content_type: Content type of the object, None if unknown
+
+    Returns:
+        Optional[str]: Reason of the rejection, None if the upload passes
+    """
+    suffix = get_upload_suffix(file_name)
+    is_archive = suffix in ARCHIVE_SUFFIXES
+    is_image = detect_file_type(suffix) == 'IMAGE'
+    if not is_archive and not is_image and suffix not in SUPPORTED_EXTENSIONS:
+        return f"File type not supported by OpenAI FileSearch. Supported types: {', '.join(SUPPORTED_EXTENSIONS)}"
+
+    if size_bytes is not None:
+        if is_archive:
+            max_bytes = MAX_ARCHIVE_BYTES
+        elif is_image:
+            max_bytes = MAX_IMAGE_BYTES
+        elif suffix in SPLIT_EXTENSIONS:
+            max_bytes = MAX_SPLIT_DOCUMENT_BYTES
+        else:
+            max_bytes = MAX_DOCUMENT_BYTES
+        if size_bytes == 0:
+            return "File is empty"
+        if size_bytes > max_bytes:
+            return f"File is larger than {max_bytes // (1024 * 1024)} MB"
+
+    media_type = (content_type or '').split(';')[0].strip().lower()
+    if media_type.startswith(REJECTED_CONTENT_TYPE_PREFIXES) or media_type in REJECTED_CONTENT_TYPES:
+        return f"Content type {media_type} is not supported"
+    return None
+
+
+def check_upload_content(file_name: str, header: bytes) -> Optional[str]:
+    """
+    Reject an upload whose leading bytes do not match its extension (e.g., a renamed binary).
+
+    Args:
+        file_name: Name of the file
+        header: First SNIFF_BYTES bytes of the file
+
+    Returns:
+        Optional[str]: Reason of the rejection, None if the content matches
+    """
+    suffix = get_upload_suffix(file_name)
+    expected: Optional[Set[str]] = EXPECTED_FORMATS.get(suffix)
+    if expected is None:
+        return None
+    detected = sniff_format(header)
+    if detected in expected:
+        return None
+    return f"File content ({detected}) does not match its extension {suffix}"
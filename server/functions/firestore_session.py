@@ -1,18 +1,58 @@
+import asyncio
+import json
 import time
 from typing import List, Optional
 from firebase_admin import firestore as admin_firestore
 from google.protobuf.timestamp_pb2 import Timestamp
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from agents.memory import Session
+from openai_calls import call_openai_async
+from tracing import span, count_firestore, start_trace, log_event
+from session_layout import (
+    LAYOUT_MESSAGES, LAYOUT_SEGMENTS, SEGMENT_MAX_MESSAGES, SEGMENT_MAX_BYTES, default_storage_layout
+)
+
+
+COMPACTION_TOKEN_THRESHOLD = 6000  # Estimated history tokens that trigger a compaction
+COMPACTION_KEEP_RECENT_MESSAGES = 6  # Most recent messages that are never summarized
+COMPACTION_MAX_MESSAGES = 200  # Messages summarized by one compaction, the rest wait for the next one
+COMPACTION_REQUEST_TIMEOUT_SECONDS = 300  # After this a pending compaction request can be written again
+COMPACTION_MODEL = "gpt-4.1-mini"
+CHARS_PER_TOKEN = 4  # Rough token estimate used to decide when to compact
+
+MAX_BATCH_WRITES = 500  # Firestore limit of writes per batch
+MIGRATION_IDLE_MINUTES = 15  # Sessions are migrated once no turn touched them for this long (above any function timeout)
+MIGRATION_BATCH_LIMIT = 50  # Sessions migrated per run of migrate_idle_sessions
 
 
 class FirestoreSession(Session):
     """Custom session backed by Firestore for persistent agent memory.
-    
-    Implements the Session protocol using the existing messages sub-collection
-    to maintain conversation history for the OpenAI Agents SDK.
-    
+
+    Implements the Session protocol for the OpenAI Agents SDK with one of two
+    storage layouts, recorded in the storageLayout field of the session:
+
+    - "messages": one document per message in the messages sub-collection,
+      ordered by createdAt. Reading a session costs one read per message.
+    - "segments": append-only transcript segments, each holding up to
+      SEGMENT_MAX_MESSAGES messages ordered by an explicit sequence number.
+      Reading a session costs one read per segment. Sessions in the messages
+      layout are flagged with migrationRequested by chat and moved to this
+      layout by migrate_idle_sessions() once idle.
+
+    With compaction enabled, once the unsummarized history passes
+    COMPACTION_TOKEN_THRESHOLD estimated tokens, the turn writes a compaction
+    request and the compact_session trigger of main.py summarizes the older turns
+    into the summary document, so the chat response never waits for the
+    summarizer and no work is left running once it is sent. get_items then
+    returns the summary followed by the turns that are not covered by it, which
+    keeps the prompt size bounded for sessions of any length.
+
     Layout:
+      sessions/{session_id}
+        - storageLayout: "messages" | "segments" (missing means "messages")
+        - migrationRequested: bool, migrationError: str (messages layout waiting for, or refused, a migration)
+        - messageCount: int (segments layout, next sequence number)
+        - lastSegment: int, lastSegmentMessages: int, lastSegmentBytes: int (segments layout)
       sessions/{session_id}/messages/{message_id}
         - id: str
         - sessionId: str
@@ -21,109 +61,692 @@ class FirestoreSession(Session):
         - message: str
         - createdAt: server timestamp
         - clientMessageId: str (optional)
+      sessions/{session_id}/transcript/{segment:06d}
+        - sessionId: str
+        - userId: str
+        - segment: int
+        - startSeq: int
+        - endSeq: int
+        - messages: list of {id, seq, role, message, createdAt, clientMessageId}
+        - updatedAt: datetime
+      sessions/{session_id}/memory/summary
+        - summary: str
+        - coveredUntil: createdAt of the last summarized message
+        - coveredSeq: seq of the last summarized message (segments layout)
+        - coveredMessageCount: int
+        - model: str
+        - updatedAt: datetime
+      sessions/{session_id}/memory/compaction (deleted once the compaction ran)
+        - status: "pending"
+        - requestedAt: datetime
     """
 
-    def __init__(self, user_id: str, session_id: str):
+    def __init__(
+        self,
+        user_id: str,
+        session_id: str,
+        client_message_id: Optional[str] = None,
+        compaction: bool = False,
+        storage_layout: str = LAYOUT_MESSAGES
+    ):
         self.user_id = user_id
         self.session_id = session_id
+        self.client_message_id = client_message_id
+        self.compaction = compaction
+        self.storage_layout = storage_layout
+        self._history_tokens: Optional[int] = None
         self.client = admin_firestore.client()
-        self._messages_collection = (
-            self.client.collection("sessions")
-            .document(self.session_id)
-            .collection("messages")
-        )
+        self._session_ref = self.client.collection("sessions").document(self.session_id)
+        self._messages_collection = self._session_ref.collection("messages")
+        self._transcript_collection = self._session_ref.collection("transcript")
+        self._summary_ref = self._session_ref.collection("memory").document("summary")
+        self._compaction_ref = self._session_ref.collection("memory").document("compaction")
 
     async def get_items(self, limit: Optional[int] = None) -> List[dict]:
         """Retrieve conversation history for this session.
-        
-        Converts Firestore messages to the format expected by the Agents SDK.
+
+        Converts stored messages to the format expected by the Agents SDK.
+        With compaction enabled, the stored summary replaces the messages it covers.
+        When limit is given only the latest limit items are returned.
         """
-        query = self._messages_collection.order_by("createdAt")
-        if limit:
-            query = query.limit(limit)
-        docs = list(query.stream())
+        summary = self._load_summary() if self.compaction else None
+
+        with span('history_load') as span_attributes:
+            messages = self._load_messages(summary, limit)
+            span_attributes['messages'] = len(messages)
+            span_attributes['layout'] = self.storage_layout
+
         items: List[dict] = []
-        for doc in docs:
-            data = doc.to_dict() or {}
-            message_role = data.get("role")
-            message_content = data.get("message", "")
-            
-            # Convert to Agents SDK format
-            if message_role == "user":
-                items.append({"role": "user", "content": message_content})
-            elif message_role == "assistant":
-                items.append({"role": "assistant", "content": message_content})
-        
+        for message in messages:
+            item = _to_agent_item(message)
+            if item:
+                items.append(item)
+
+        self._history_tokens = estimate_tokens(items)
+
+        if summary:
+            items.insert(0, {
+                "role": "system",
+                "content": f"Summary of the earlier conversation:\n{summary['summary']}"
+            })
+
         return items
 
     async def add_items(self, items: List[dict]) -> None:
         """Store new items for this session.
-        
-        Converts Agents SDK format to Firestore messages and stores them.
-        Ensures proper timestamp ordering by using microsecond-precision timestamps.
-        """
-        batch = self.client.batch()
 
-        base_datetime = datetime.now()
-        
-        for i, item in enumerate(items):
+        Converts Agents SDK format to stored messages. In the messages layout
+        ordering relies on millisecond offsets of createdAt; in the segments layout
+        each message gets the next sequence number of the session.
+        """
+        messages = []
+        for item in items:
             role = item.get("role")
-            content = item.get("content", "")
-            
             # Skip items that don't match expected roles
             if role not in ["user", "assistant"]:
                 continue
-            
-            # Create datetime with milliecond precision to ensure ordering
-            message_datetime = base_datetime + timedelta(milliseconds=i*2)
-            
-            doc_ref = self._messages_collection.document()
-            batch.set(
-                doc_ref,
-                {
-                    "id": doc_ref.id,
-                    "sessionId": self.session_id,
-                    "userId": self.user_id,
-                    "role": role,
-                    "message": content,
-                    "createdAt": message_datetime
-                },
-            )
-        batch.commit()
+            messages.append(item)
+
+        if self.storage_layout == LAYOUT_SEGMENTS:
+            self._append_segments(messages)
+        else:
+            self._append_messages(messages)
+
+        # Summarize older turns once the history grows past the threshold
+        if self.compaction and self._history_tokens is not None:
+            self._history_tokens += estimate_tokens(items)
+            if self._history_tokens > COMPACTION_TOKEN_THRESHOLD:
+                self.request_compaction()
 
     async def pop_item(self) -> Optional[dict]:
         """Remove and return the most recent item from this session."""
+        if self.storage_layout == LAYOUT_SEGMENTS:
+            return self._pop_segment_message()
+
         docs = list(
             self._messages_collection.order_by("createdAt", direction=admin_firestore.Query.DESCENDING)
             .limit(1)
             .stream()
         )
+        count_firestore(reads=1)
         if not docs:
             return None
-        
+
         doc = docs[0]
-        data = doc.to_dict() or {}
-        message_role = data.get("role")
-        message_content = data.get("message", "")
-        
-        # Convert to Agents SDK format
-        if message_role == "user":
-            item = {"role": "user", "content": message_content}
-        elif message_role == "assistant":
-            item = {"role": "assistant", "content": message_content}
-        else:
+        item = _to_agent_item(doc.to_dict() or {})
+        if item is None:
             return None
-        
+
         # Delete the document
         doc.reference.delete()
+        count_firestore(deletes=1)
         return item
 
     async def clear_session(self) -> None:
         """Clear all items for this session."""
-        docs = list(self._messages_collection.stream())
+        with span('history_clear', messages=0) as span_attributes:
+            collection = (
+                self._transcript_collection if self.storage_layout == LAYOUT_SEGMENTS
+                else self._messages_collection
+            )
+            docs = list(collection.stream())
+            batch = self.client.batch()
+            for doc in docs:
+                batch.delete(doc.reference)
+            batch.delete(self._summary_ref)
+            if self.storage_layout == LAYOUT_SEGMENTS:
+                batch.set(self._session_ref, {
+                    'messageCount': 0,
+                    'lastSegment': 0,
+                    'lastSegmentMessages': 0,
+                    'lastSegmentBytes': 0,
+                }, merge=True)
+            batch.commit()
+            span_attributes['messages'] = len(docs)
+            count_firestore(reads=max(1, len(docs)), deletes=len(docs) + 1)
+
+    def _load_messages(self, summary: Optional[dict], limit: Optional[int] = None) -> List[dict]:
+        """Read the stored messages not covered by a summary, in conversation order."""
+        if self.storage_layout == LAYOUT_SEGMENTS:
+            covered_seq = summary.get("coveredSeq") if summary else None
+            query = self._transcript_collection
+            if covered_seq is not None:
+                query = query.where("endSeq", ">", covered_seq)
+            docs = list(query.order_by("endSeq").stream())
+            count_firestore(reads=max(1, len(docs)))
+
+            messages = [
+                message
+                for doc in docs
+                for message in (doc.to_dict() or {}).get("messages", [])
+                if covered_seq is None or message.get("seq", 0) > covered_seq
+            ]
+            messages.sort(key=lambda message: message.get("seq", 0))
+            return messages[-limit:] if limit else messages
+
+        query = self._messages_collection
+        if summary and summary.get("coveredUntil"):
+            query = query.where("createdAt", ">", summary["coveredUntil"])
+        if limit:
+            query = query.order_by("createdAt", direction=admin_firestore.Query.DESCENDING).limit(limit)
+        else:
+            query = query.order_by("createdAt")
+        docs = list(query.stream())
+        count_firestore(reads=max(1, len(docs)))
+
+        messages = [doc.to_dict() or {} for doc in docs]
+        return list(reversed(messages)) if limit else messages
+
+    def _append_messages(self, items: List[dict]) -> None:
+        """Write one document per message (messages layout)."""
         batch = self.client.batch()
-        for doc in docs:
+        write_count = 0
+
+        base_datetime = datetime.now()
+
+        for i, item in enumerate(items):
+            # Create datetime with milliecond precision to ensure ordering
+            message_datetime = base_datetime + timedelta(milliseconds=i*2)
+
+            doc_ref = self._messages_collection.document()
+            message_data = {
+                "id": doc_ref.id,
+                "sessionId": self.session_id,
+                "userId": self.user_id,
+                "role": item.get("role"),
+                "message": item.get("content", ""),
+                "createdAt": message_datetime
+            }
+            # Tag the user turn with the client id so retries can be traced back to it
+            if item.get("role") == "user" and self.client_message_id:
+                message_data["clientMessageId"] = self.client_message_id
+            batch.set(doc_ref, message_data)
+            write_count += 1
+
+        with span('history_save', messages=write_count):
+            batch.commit()
+            count_firestore(writes=write_count)
+
+    def _append_segments(self, items: List[dict]) -> None:
+        """Append messages to the last transcript segment (segments layout).
+
+        The sequence counter and the fill level of the last segment live on the
+        session document, so appending costs one read and no segment read: new
+        messages are appended with ArrayUnion, and a new segment is started when
+        the last one is full.
+        """
+        if not items:
+            return
+
+        created_at = datetime.now(timezone.utc)
+
+        @admin_firestore.transactional
+        def append(transaction) -> int:
+            session_snapshot = self._session_ref.get(transaction=transaction)
+            session_data = session_snapshot.to_dict() if session_snapshot.exists else {}
+
+            next_seq = session_data.get("messageCount", 0)
+            segment_index = session_data.get("lastSegment", 0)
+            segment_messages = session_data.get("lastSegmentMessages", 0)
+            segment_bytes = session_data.get("lastSegmentBytes", 0)
+            pending: List[dict] = []
+            writes = 0
+
+            def flush() -> None:
+                # Append the pending messages to the current segment
+                nonlocal writes
+                if not pending:
+                    return
+                segment_data = {
+                    "sessionId": self.session_id,
+                    "userId": self.user_id,
+                    "segment": segment_index,
+                    "endSeq": pending[-1]["seq"],
+                    "messages": admin_firestore.ArrayUnion(list(pending)),
+                    "updatedAt": created_at,
+                }
+                if segment_messages == len(pending):
+                    segment_data["startSeq"] = pending[0]["seq"]
+                transaction.set(self._segment_ref(segment_index), segment_data, merge=True)
+                pending.clear()
+                writes += 1
+
+            for item in items:
+                message = {
+                    "id": f"{self.session_id}-{next_seq}",
+                    "seq": next_seq,
+                    "role": item.get("role"),
+                    "message": item.get("content", ""),
+                    "createdAt": created_at,
+                }
+                # Tag the user turn with the client id so retries can be traced back to it
+                if item.get("role") == "user" and self.client_message_id:
+                    message["clientMessageId"] = self.client_message_id
+                message_bytes = len(json.dumps(message, default=str))
+
+                if segment_messages and (
+                    segment_messages >= SEGMENT_MAX_MESSAGES
+                    or segment_bytes + message_bytes > SEGMENT_MAX_BYTES
+                ):
+                    flush()
+                    segment_index += 1
+                    segment_messages = 0
+                    segment_bytes = 0
+
+                pending.append(message)
+                segment_messages += 1
+                segment_bytes += message_bytes
+                next_seq += 1
+
+            flush()
+            transaction.set(self._session_ref, {
+                "storageLayout": LAYOUT_SEGMENTS,
+                "messageCount": next_seq,
+                "lastSegment": segment_index,
+                "lastSegmentMessages": segment_messages,
+                "lastSegmentBytes": segment_bytes,
+            }, merge=True)
+            return writes + 1
+
+        with span('history_save', messages=len(items)):
+            write_count = append(self.client.transaction())
+            count_firestore(reads=1, writes=write_count)
+
+    def _pop_segment_message(self) -> Optional[dict]:
+        """Remove the most recent message of the last transcript segment."""
+
+        @admin_firestore.transactional
+        def pop(transaction) -> Optional[dict]:
+            session_snapshot = self._session_ref.get(transaction=transaction)
+            session_data = session_snapshot.to_dict() if session_snapshot.exists else {}
+            if not session_data.get("messageCount"):
+                return None
+
+            segment_index = session_data.get("lastSegment", 0)
+            segment_ref = self._segment_ref(segment_index)
+            segment_snapshot = segment_ref.get(transaction=transaction)
+            segment = segment_snapshot.to_dict() if segment_snapshot.exists else {}
+            messages = sorted(segment.get("messages", []), key=lambda message: message.get("seq", 0))
+            if not messages:
+                return None
+
+            last_message = messages.pop()
+            if messages:
+                transaction.update(segment_ref, {
+                    "messages": messages,
+                    "endSeq": messages[-1]["seq"],
+                })
+            else:
+                transaction.delete(segment_ref)
+                segment_index = max(0, segment_index - 1)
+            remaining_bytes = sum(len(json.dumps(message, default=str)) for message in messages)
+            transaction.update(self._session_ref, {
+                "messageCount": last_message["seq"],
+                "lastSegment": segment_index,
+                "lastSegmentMessages": len(messages) if messages else SEGMENT_MAX_MESSAGES,
+                "lastSegmentBytes": remaining_bytes if messages else SEGMENT_MAX_BYTES,
+            })
+            return last_message
+
+        message = pop(self.client.transaction())
+        count_firestore(reads=2, writes=2)
+        return _to_agent_item(message) if message else None
+
+    def _segment_ref(self, segment_index: int):
+        """Reference of a transcript segment, zero padded so IDs sort like indexes."""
+        return self._transcript_collection.document(f"{segment_index:06d}")
+
+    def _load_summary(self) -> Optional[dict]:
+        """Read the stored summary, if any."""
+        with span('summary_load'):
+            summary_doc = self._summary_ref.get()
+            count_firestore(reads=1)
+        if not summary_doc.exists:
+            return None
+        summary = summary_doc.to_dict() or {}
+        if not summary.get("summary"):
+            return None
+        if summary.get("coveredUntil") is None and summary.get("coveredSeq") is None:
+            return None
+        return summary
+
+    def request_compaction(self) -> bool:
+        """Ask the compact_session trigger to summarize the older turns of the session.
+
+        A request that is still pending is not written again, unless it is older
+        than COMPACTION_REQUEST_TIMEOUT_SECONDS.
+
+        Returns:
+            bool: True if a new request was written
+        """
+        now = datetime.now(timezone.utc)
+
+        @admin_firestore.transactional
+        def request(transaction) -> bool:
+            snapshot = self._compaction_ref.get(transaction=transaction)
+            data = (snapshot.to_dict() or {}) if snapshot.exists else {}
+            requested_at = data.get("requestedAt")
+            if requested_at is not None and requested_at.tzinfo is None:
+                requested_at = requested_at.replace(tzinfo=timezone.utc)
+            if (data.get("status") == "pending" and requested_at is not None
+                    and now - requested_at < timedelta(seconds=COMPACTION_REQUEST_TIMEOUT_SECONDS)):
+                return False
+            transaction.set(self._compaction_ref, {"status": "pending", "requestedAt": now})
+            return True
+
+        try:
+            with span('compaction_request'):
+                requested = request(self.client.transaction())
+                count_firestore(reads=1, writes=1 if requested else 0)
+            return requested
+        except Exception as e:
+            print(f"Error requesting compaction of session {self.session_id}: {str(e)}")
+            return False
+
+    def compact(self) -> bool:
+        """Summarize the turns older than COMPACTION_KEEP_RECENT_MESSAGES into the summary document.
+
+        The new summary extends the previous one and covers at most
+        COMPACTION_MAX_MESSAGES messages. It is only written if no other
+        compaction moved the summary forward in the meantime.
+
+        Returns:
+            bool: True if a new summary was written
+        """
+        try:
+            summary = self._load_summary() or {}
+            covered_position = (summary.get("coveredUntil"), summary.get("coveredSeq"))
+
+            messages = self._load_messages(summary or None)
+            if len(messages) <= COMPACTION_KEEP_RECENT_MESSAGES:
+                return False
+
+            to_summarize = messages[:-COMPACTION_KEEP_RECENT_MESSAGES][:COMPACTION_MAX_MESSAGES]
+            transcript = "\n".join(
+                f"{message.get('role')}: {message_text(message.get('message'))}"
+                for message in to_summarize
+            )
+            new_summary = summarize_conversation(summary.get("summary"), transcript)
+            covered_count = summary.get("coveredMessageCount", 0) + len(to_summarize)
+
+            @admin_firestore.transactional
+            def store_summary(transaction) -> bool:
+                current = self._summary_ref.get(transaction=transaction)
+                current_data = (current.to_dict() or {}) if current.exists else {}
+                if (current_data.get("coveredUntil"), current_data.get("coveredSeq")) != covered_position:
+                    return False
+                transaction.set(self._summary_ref, {
+                    "summary": new_summary,
+                    "coveredUntil": to_summarize[-1].get("createdAt"),
+                    "coveredSeq": to_summarize[-1].get("seq"),
+                    "coveredMessageCount": covered_count,
+                    "model": COMPACTION_MODEL,
+                    "updatedAt": datetime.now(timezone.utc),
+                })
+                return True
+
+            stored = store_summary(self.client.transaction())
+            print(f"Compacted {len(to_summarize)} messages of session {self.session_id}: stored={stored}")
+            return stored
+
+        except Exception as e:
+            print(f"Error compacting session {self.session_id}: {str(e)}")
+            return False
+
+
+def run_compaction(session_id: str) -> str:
+    """Run the compaction requested by a chat turn (compact_session trigger of main.py).
+
+    The request document is deleted once the compaction is done, so the next turn
+    past the threshold can request another one.
+
+    Args:
+        session_id: ID of the chat session
+
+    Returns:
+        str: Message describing the outcome
+    """
+    db = admin_firestore.client()
+    session_ref = db.collection("sessions").document(session_id)
+    try:
+        session_snapshot = session_ref.get()
+        if not session_snapshot.exists:
+            return f"Session {session_id} no longer exists, skipping compaction"
+        session_data = session_snapshot.to_dict() or {}
+
+        with start_trace('compact_session', session_id=session_id) as trace:
+            session = FirestoreSession(
+                session_data.get("userId"), session_id, compaction=True,
+                storage_layout=session_data.get("storageLayout") or LAYOUT_MESSAGES
+            )
+            stored = session.compact()
+            trace.set_attribute('stored', stored)
+        return f"Compaction of session {session_id}: stored={stored}"
+    finally:
+        session_ref.collection("memory").document("compaction").delete()
+
+
+def migrate_session_to_segments(session_id: str) -> int:
+    """Move a session from the messages layout to transcript segments.
+
+    Segments, the session counters and the compaction position are written in
+    one transaction, which only commits if updatedAt of the session did not
+    change since the legacy messages were read, so a turn that starts in the
+    meantime leaves the session in the messages layout. The legacy message
+    documents are deleted afterwards. Re-running the migration after an
+    interruption only finishes deleting the legacy documents. Run it through
+    migrate_idle_sessions(), which only picks sessions no turn can still be
+    writing to.
+
+    Args:
+        session_id: ID of the session to migrate
+
+    Returns:
+        int: Number of messages moved to segments, 0 if the session was busy,
+            already migrated or too long for a single transaction
+    """
+    client = admin_firestore.client()
+    session_ref = client.collection("sessions").document(session_id)
+    messages_collection = session_ref.collection("messages")
+    summary_ref = session_ref.collection("memory").document("summary")
+
+    session_snapshot = session_ref.get()
+    session_data = session_snapshot.to_dict() if session_snapshot.exists else {}
+    legacy_docs = list(messages_collection.order_by("createdAt").stream())
+    count_firestore(reads=1 + max(1, len(legacy_docs)))
+
+    migrated = 0
+    if session_data.get("storageLayout") != LAYOUT_SEGMENTS and legacy_docs:
+        segments: List[dict] = []
+        segment_bytes = 0
+        for seq, doc in enumerate(legacy_docs):
+            data = doc.to_dict() or {}
+            message = {
+                "id": data.get("id") or doc.id,
+                "seq": seq,
+                "role": data.get("role"),
+                "message": data.get("message", ""),
+                "createdAt": data.get("createdAt"),
+            }
+            if data.get("clientMessageId"):
+                message["clientMessageId"] = data["clientMessageId"]
+            message_bytes = len(json.dumps(message, default=str))
+
+            if not segments or len(segments[-1]["messages"]) >= SEGMENT_MAX_MESSAGES \
+                    or segment_bytes + message_bytes > SEGMENT_MAX_BYTES:
+                segments.append({
+                    "sessionId": session_id,
+                    "userId": data.get("userId") or session_data.get("userId"),
+                    "segment": len(segments),
+                    "startSeq": seq,
+                    "messages": [],
+                })
+                segment_bytes = 0
+            segments[-1]["messages"].append(message)
+            segments[-1]["endSeq"] = seq
+            segment_bytes += message_bytes
+
+        if len(segments) + 2 > MAX_BATCH_WRITES:
+            # The session keeps working in the messages layout
+            error_message = f"Session is too long to migrate in a single transaction ({len(segments)} segments)"
+            session_ref.set({"migrationRequested": False, "migrationError": error_message}, merge=True)
+            count_firestore(writes=1)
+            log_event('session_migration_refused', severity='WARNING', session_id=session_id,
+                      messages=len(legacy_docs), segments=len(segments))
+            return 0
+
+        @admin_firestore.transactional
+        def switch_layout(transaction) -> str:
+            current = session_ref.get(transaction=transaction)
+            current_data = (current.to_dict() or {}) if current.exists else {}
+            if current_data.get("storageLayout") == LAYOUT_SEGMENTS:
+                return "migrated"
+            if not current.exists or current_data.get("updatedAt") != session_data.get("updatedAt"):
+                return "busy"
+            summary_snapshot = summary_ref.get(transaction=transaction)
+
+            now = datetime.now(timezone.utc)
+            for segment in segments:
+                segment["updatedAt"] = now
+                transaction.set(session_ref.collection("transcript").document(f"{segment['segment']:06d}"), segment)
+            transaction.set(session_ref, {
+                "storageLayout": LAYOUT_SEGMENTS,
+                "messageCount": len(legacy_docs),
+                "lastSegment": len(segments) - 1,
+                "lastSegmentMessages": len(segments[-1]["messages"]),
+                "lastSegmentBytes": segment_bytes,
+                "migratedMessages": len(legacy_docs),
+                "migrationRequested": False,
+            }, merge=True)
+
+            # Translate the compaction position to a sequence number
+            covered_until = (summary_snapshot.to_dict() or {}).get("coveredUntil") if summary_snapshot.exists else None
+            if covered_until is not None:
+                covered_seq = max(
+                    (message["seq"] for segment in segments for message in segment["messages"]
+                     if message["createdAt"] is not None and message["createdAt"] <= covered_until),
+                    default=None,
+                )
+                transaction.update(summary_ref, {"coveredSeq": covered_seq})
+            return "switched"
+
+        outcome = switch_layout(client.transaction())
+        count_firestore(reads=2, writes=len(segments) + 2 if outcome == "switched" else 0)
+        if outcome == "busy":
+            print(f"Session {session_id} changed while it was migrated, leaving it for the next run")
+            return 0
+        if outcome == "switched":
+            migrated = len(legacy_docs)
+
+    # Delete the legacy message documents
+    for start in range(0, len(legacy_docs), MAX_BATCH_WRITES):
+        batch = client.batch()
+        chunk = legacy_docs[start:start + MAX_BATCH_WRITES]
+        for doc in chunk:
             batch.delete(doc.reference)
         batch.commit()
+        count_firestore(deletes=len(chunk))
+
+    print(f"Migrated {migrated} messages of session {session_id} to transcript segments")
+    return migrated
+
+
+def migrate_idle_sessions(limit: int = MIGRATION_BATCH_LIMIT) -> dict:
+    """Migrate the sessions flagged by chat once no turn touched them for MIGRATION_IDLE_MINUTES.
+
+    A chat turn of a legacy session only sets migrationRequested, so a turn never
+    waits for, or fails because of, a migration. Runs from the migrate_sessions
+    schedule of main.py.
+
+    Args:
+        limit: Maximum number of sessions migrated
+
+    Returns:
+        dict: Number of sessions migrated, left busy and failed, and messages moved
+    """
+    client = admin_firestore.client()
+    idle_before = datetime.now(timezone.utc) - timedelta(minutes=MIGRATION_IDLE_MINUTES)
+    snapshots = list(
+        client.collection("sessions")
+        .where("migrationRequested", "==", True)
+        .where("updatedAt", "<", idle_before)
+        .order_by("updatedAt")
+        .limit(limit)
+        .stream()
+    )
+    count_firestore(reads=max(1, len(snapshots)))
+
+    result = {'sessions': 0, 'busy': 0, 'failed': 0, 'messages': 0}
+    for snapshot in snapshots:
+        try:
+            migrated = migrate_session_to_segments(snapshot.id)
+        except Exception as e:
+            result['failed'] += 1
+            log_event('session_migration_failed', severity='ERROR', session_id=snapshot.id, error=str(e))
+            continue
+        if migrated:
+            result['sessions'] += 1
+            result['messages'] += migrated
+        else:
+            result['busy'] += 1
+    log_event('migrate_sessions', **result)
+    return result
+
+
+def message_text(content) -> str:
+    """Flatten stored message content (plain text or Agents SDK content parts) to text."""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(
+            part.get("text", "") for part in content if isinstance(part, dict)
+        )
+    return str(content or "")
+
+
+def estimate_tokens(items: List[dict]) -> int:
+    """Rough token count of Agents SDK items."""
+    return sum(len(message_text(item.get("content"))) for item in items) // CHARS_PER_TOKEN
+
+
+def summarize_conversation(previous_summary: Optional[str], transcript: str) -> str:
+    """Summarize conversation turns, extending a previous summary.
+
+    Args:
+        previous_summary: Summary of the turns before the transcript, if any
+        transcript: Turns to summarize, one "role: text" line per message
+
+    Returns:
+        str: Summary covering the previous summary and the transcript
+    """
+    # Lazy import to avoid deployment timeout
+    from agents import Agent, Runner, ModelSettings
+
+    agent = Agent(
+        name="Conversation Summarizer",
+        instructions=(
+            "You maintain the running summary of a conversation between a user and an assistant "
+            "about the user's documents. Merge the previous summary with the new turns into a single "
+            "concise summary. Keep facts, figures, document names, sources, decisions and open "
+            "questions. Return only the summary."
+        ),
+        model=COMPACTION_MODEL,
+        model_settings=ModelSettings(temperature=0.1),
+    )
+    prompt = (
+        f"Previous summary:\n{previous_summary or '(none)'}\n\n"
+        f"New turns:\n{transcript}"
+    )
+    result = asyncio.run(call_openai_async('agent_run', Runner.run, agent, prompt, policy='background'))
+    return (result.final_output or "").strip()
 
 
+def _to_agent_item(data: dict) -> Optional[dict]:
+    """Convert a stored message to the Agents SDK format."""
+    message_role = data.get("role")
+    message_content = data.get("message", "")
+    if message_role == "user":
+        return {"role": "user", "content": message_content}
+    if message_role == "assistant":
+        return {"role": "assistant", "content": message_content}
+    return None
@@ -1,82 +1,249 @@
-import os
-import tempfile
-from google.cloud import storage
-import openai
+"""
+Image description pipeline used to index images into the user's vector store.
 
+Images are decoded in memory, downscaled and re-encoded as JPEG before being
+sent to the vision model, which bounds the vision token cost of large photos.
+Descriptions are cached in Firestore by the SHA-256 of the original image bytes
+so that re-uploads of the same image never pay for a second vision call.
+"""
+import base64
+import contextvars
+import hashlib
+import io
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import List, Optional, Tuple
+from openai import OpenAI
+from openai_calls import call_openai
 
-def image_to_description(bucket_name: str, file_path: str, user_id: str) -> str:
+
+VISION_MODEL = "gpt-4.1"
+MAX_IMAGE_DIMENSION = 1536  # Longest side in pixels sent to the vision model
+JPEG_QUALITY = 85
+MAX_DESCRIPTION_TOKENS = 1000
+MAX_CONCURRENT_DESCRIPTIONS = 4  # Vision calls running at the same time
+
+DESCRIPTION_PROMPT = """Please analyze this image and provide a comprehensive description in markdown format. Include:
+1. A detailed description of what you see in the image
+2. Any text content visible in the image (OCR)
+3. Any charts, graphs, or data visualizations
+4. The overall context and purpose of the image
+
+Format your response in clean markdown with appropriate headings and structure."""
+
+
+def get_image_hash(image_bytes: bytes) -> str:
+    """
+    Compute the cache key of an image.
+
+    Args:
+        image_bytes: Original image content
+
+    Returns:
+        str: Hex SHA-256 digest of the image content
     """
-    Extract text and generate description from image using OpenAI GPT-4 Vision.
-    
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def prepare_image_for_vision(image_bytes: bytes) -> Tuple[bytes, str]:
+    """
+    Downscale and re-encode an image in memory before sending it to the vision model.
+
+    The image is rotated according to its EXIF orientation, flattened to RGB and
+    resized so that its longest side is at most MAX_IMAGE_DIMENSION pixels.
+
     Args:
-        bucket_name: Name of the Firebase Storage bucket
-        file_path: Path to the image file in storage
-        user_id: User ID for logging purposes
-        
+        image_bytes: Original image content
+
+    Returns:
+        Tuple[bytes, str]: Re-encoded image content and its MIME type
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        # Animated images (e.g. GIF) are described from their first frame
+        image.seek(0)
+        image = ImageOps.exif_transpose(image)
+
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        image.thumbnail((MAX_IMAGE_DIMENSION, MAX_IMAGE_DIMENSION))
+
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=JPEG_QUALITY, optimize=True)
+        return output.getvalue(), 'image/jpeg'
+
+
+def image_to_description(
+    openai_client: OpenAI,
+    image_bytes: bytes,
+    db_client=None
+) -> str:
+    """
+    Extract text and generate a markdown description of an image.
+
+    Args:
+        openai_client: OpenAI client instance
+        image_bytes: Original image content
+        db_client: Firestore client instance used for the description cache (optional)
+
     Returns:
         str: Image description and extracted text in markdown format
     """
-    print(f"Starting image text extraction for user {user_id}")
-    
+    image_hash = get_image_hash(image_bytes)
+
+    cached_description = get_cached_description(db_client, image_hash)
+    if cached_description is not None:
+        print(f"Using cached description for image {image_hash}")
+        return cached_description
+
+    prepared_bytes, mime_type = prepare_image_for_vision(image_bytes)
+    print(f"Image {image_hash} re-encoded from {len(image_bytes)} to {len(prepared_bytes)} bytes")
+
+    encoded_image = base64.b64encode(prepared_bytes).decode('ascii')
+    response = call_openai(
+        'chat.completions.create',
+        openai_client.chat.completions.create,
+        model=VISION_MODEL,
+        messages=[
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": DESCRIPTION_PROMPT},
+                    {
+                        "type": "image_url",
+                        "image_url": {"url": f"data:{mime_type};base64,{encoded_image}"}
+                    }
+                ]
+            }
+        ],
+        max_tokens=MAX_DESCRIPTION_TOKENS
+    )
+
+    markdown_content = response.choices[0].message.content or ""
+    print(f"Image description completed. Content length: {len(markdown_content)} characters")
+
+    store_cached_description(db_client, image_hash, markdown_content)
+    return markdown_content
+
+
+def describe_images(
+    openai_client: OpenAI,
+    images: List[bytes],
+    db_client=None
+) -> List[str]:
+    """
+    Describe several images concurrently.
+
+    Identical images are described once. At most MAX_CONCURRENT_DESCRIPTIONS
+    vision calls run at the same time.
+
+    Args:
+        openai_client: OpenAI client instance
+        images: Original content of each image
+        db_client: Firestore client instance used for the description cache (optional)
+
+    Returns:
+        List[str]: Markdown description of each image, in the same order as images
+
+    Raises:
+        Exception: The error of a failed description, once every description
+            has finished; the successful ones are cached
+    """
+    unique_images = {get_image_hash(image_bytes): image_bytes for image_bytes in images}
+
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_DESCRIPTIONS) as executor:
+        # Each description runs in a copy of the context, so its spans land in the request trace
+        futures = {
+            image_hash: executor.submit(
+                contextvars.copy_context().run, image_to_description, openai_client, image_bytes, db_client)
+            for image_hash, image_bytes in unique_images.items()
+        }
+        descriptions = {image_hash: future.result() for image_hash, future in futures.items()}
+
+    return [descriptions[get_image_hash(image_bytes)] for image_bytes in images]
+
+
+def image_to_markdown_file(
+    openai_client: OpenAI,
+    image_bytes: bytes,
+    file_name: str,
+    db_client=None
+) -> 'io.BytesIO':
+    """
+    Build the markdown document that is indexed in place of an image.
+
+    Args:
+        openai_client: OpenAI client instance
+        image_bytes: Original image content
+        file_name: Name of the image file, used as the document title
+        db_client: Firestore client instance used for the description cache (optional)
+
+    Returns:
+        io.BytesIO: In-memory markdown document
+    """
+    description = image_to_description(openai_client, image_bytes, db_client)
+    return io.BytesIO(build_image_markdown(file_name, description))
+
+
+def build_image_markdown(file_name: str, description: str) -> bytes:
+    """
+    Render the markdown document of an image description.
+
+    Args:
+        file_name: Name of the image file, used as the document title
+        description: Markdown description of the image
+
+    Returns:
+        bytes: UTF-8 encoded markdown document
+    """
+    return f"# {file_name}\n\n{description}\n".encode('utf-8')
+
+
+def get_cached_description(db_client, image_hash: str) -> Optional[str]:
+    """
+    Read a cached image description.
+
+    Args:
+        db_client: Firestore client instance, or None to skip the cache
+        image_hash: SHA-256 of the image content
+
+    Returns:
+        Optional[str]: The cached description, or None if not cached
+    """
+    if db_client is None:
+        return None
     try:
-        # Initialize OpenAI client
-        # You'll need to set OPENAI_API_KEY environment variable
-        openai.api_key = os.getenv("OPENAI_API_KEY")
-        if not openai.api_key:
-            raise ValueError("OPENAI_API_KEY environment variable not set")
-        
-        # Download the image from Firebase Storage
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(file_path)
-        
-        # Download to temporary file
-        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_file:
-            blob.download_to_filename(temp_file.name)
-            temp_file_path = temp_file.name
-        
-        # Read the file into memory
-        with open(temp_file_path, "rb") as file:
-            image_content = file.read()
-        
-        # Clean up temporary file
-        os.unlink(temp_file_path)
-        
-        # Prepare the OpenAI API request
-        response = openai.ChatCompletion.create(
-            model="gpt-4-vision-preview",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": """Please analyze this image and provide a comprehensive description in markdown format. Include:
-1. A detailed description of what you see in the image
-2. Any text content visible in the image (OCR)
-3. Any charts, graphs, or data visualizations
-4. The overall context and purpose of the image
+        cache_doc = db_client.collection('image_descriptions').document(image_hash).get()
+        if cache_doc.exists:
+            return cache_doc.to_dict().get('description')
+    except Exception as e:
+        print(f"Error reading image description cache: {str(e)}")
+    return None
 
-Format your response in clean markdown with appropriate headings and structure."""
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_content.hex()}"
-                            }
-                        }
-                    ]
-                }
-            ],
-            max_tokens=1000
-        )
-        
-        # Extract the response content
-        markdown_content = response.choices[0].message.content
-        
-        print(f"Image extraction completed. Content length: {len(markdown_content)} characters")
-        return markdown_content
-        
+
+def store_cached_description(db_client, image_hash: str, description: str) -> None:
+    """
+    Store an image description in the cache.
+
+    Args:
+        db_client: Firestore client instance, or None to skip the cache
+        image_hash: SHA-256 of the image content
+        description: Markdown description of the image
+    """
+    if db_client is None or not description:
+        return
+    try:
+        db_client.collection('image_descriptions').document(image_hash).set({
+            'description': description,
+            'model': VISION_MODEL,
+            'created_at': datetime.now()
+        })
     except Exception as e:
-        print(f"Error extracting text from image: {str(e)}")
-        raise e
+        print(f"Error writing image description cache: {str(e)}")
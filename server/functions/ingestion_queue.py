@@ -0,0 +1,478 @@
+"""
+Prioritized ingestion queue between the storage trigger and the vectorization pipeline.
+
+With INGESTION_MODE=queue the storage trigger only records a job, and workers
+run the pipeline with bounded concurrency. In the default direct mode the
+trigger runs the pipeline itself and only records a job for archives, whose
+extraction can outlast one invocation and is retried from its checkpoint,
+and for the uploads that admission control rejects. Jobs are served in priority order:
+
+1. files of interactive users (users with a chat session active in the last
+   INTERACTIVE_WINDOW_MINUTES) before files of everyone else
+2. within each group, smaller files first, so a large PDF does not hold back
+   the small files uploaded after it
+3. older jobs first among equal priorities
+
+Two implementations share the same interface:
+
+- FirestoreIngestionQueue: jobs in the ingestion_jobs collection, claimed in
+  transactions so several workers never run the same job
+- LocalIngestionQueue: an in-process heap, used by the offline benchmarks
+
+Every enqueue and claim logs the queue depth, and every claim logs the time the
+job waited, as structured 'ingestion_queue' log entries.
+
+Layout:
+  ingestion_jobs/{sha256 of path and generation}
+    - job_id: str
+    - user_id: str
+    - file_path: str
+    - bucket_name: str
+    - generation: str
+    - size_bytes: int
+    - content_type: str (from the storage event, checked against the file before download)
+    - interactive: bool
+    - priority: float (lower runs first)
+    - status: "queued" | "running" | "completed" | "failed"
+    - attempts: int
+    - worker: str
+    - error_message: str
+    - enqueued_at, started_at, finished_at: datetime
+"""
+import hashlib
+import heapq
+import itertools
+import math
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from tracing import count_firestore, log_event
+
+
+INTERACTIVE_WINDOW_MINUTES = 10  # Users with a session updated this recently are interactive
+INTERACTIVE_PRIORITY_BONUS = 100  # Priority offset that puts interactive users first
+MAX_WORKER_CONCURRENCY = 4  # Pipelines running at the same time in a worker
+STALE_JOB_SECONDS = 600  # Running jobs older than this are considered abandoned
+MAX_ATTEMPTS = 3  # Runs of a job before it is marked failed
+CLAIM_CANDIDATES = 10  # Queued jobs read per claim attempt
+
+
+@dataclass
+class IngestionJob:
+    """One file waiting for, or going through, the vectorization pipeline."""
+
+    job_id: str
+    user_id: str
+    file_path: str
+    bucket_name: str
+    generation: Optional[str]
+    size_bytes: int
+    interactive: bool
+    priority: float
+    content_type: Optional[str] = None
+    status: str = 'queued'
+    attempts: int = 0
+    worker: Optional[str] = None
+    error_message: Optional[str] = None
+    enqueued_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    def to_dict(self) -> dict:
+        """Job as stored in Firestore."""
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'IngestionJob':
+        """Job from its stored fields."""
+        return cls(**{key: data.get(key) for key in cls.__dataclass_fields__ if key in data})
+
+
+def compute_priority(size_bytes: int, interactive: bool) -> float:
+    """
+    Priority of a job, lower runs first.
+
+    Args:
+        size_bytes: Size of the uploaded file
+        interactive: Whether the user is chatting right now
+
+    Returns:
+        float: log2 of the size in KiB, offset by INTERACTIVE_PRIORITY_BONUS for background users
+    """
+    size_rank = math.log2(max(size_bytes, 0) / 1024 + 1)
+    return round(size_rank + (0 if interactive else INTERACTIVE_PRIORITY_BONUS), 3)
+
+
+def job_id_for(file_path: str, generation: Optional[str]) -> str:
+    """Stable job ID, so duplicate events of one object generation enqueue a single job."""
+    return hashlib.sha256(f"{file_path}#{generation}".encode('utf-8')).hexdigest()
+
+
+def new_job(
+    user_id: str,
+    file_path: str,
+    bucket_name: str,
+    generation: Optional[str],
+    size_bytes: int,
+    interactive: bool,
+    content_type: Optional[str] = None
+) -> IngestionJob:
+    """Build a queued job for an uploaded file."""
+    return IngestionJob(
+        job_id=job_id_for(file_path, generation),
+        user_id=user_id,
+        file_path=file_path,
+        bucket_name=bucket_name,
+        generation=generation,
+        size_bytes=size_bytes or 0,
+        interactive=interactive,
+        priority=compute_priority(size_bytes or 0, interactive),
+        content_type=content_type,
+    )
+
+
+def is_interactive_user(db_client, user_id: str) -> bool:
+    """
+    Whether a user updated a chat session in the last INTERACTIVE_WINDOW_MINUTES.
+
+    Args:
+        db_client: Firestore client instance
+        user_id: ID of the user
+
+    Returns:
+        bool: True if the user is chatting right now
+    """
+    from firebase_admin import firestore
+
+    cutoff = datetime.now(timezone.utc) - timedelta(minutes=INTERACTIVE_WINDOW_MINUTES)
+    sessions = list(
+        db_client.collection('sessions')
+        .where('userId', '==', user_id)
+        .order_by('updatedAt', direction=firestore.Query.DESCENDING)
+        .limit(1)
+        .stream()
+    )
+    count_firestore(reads=1)
+    if not sessions:
+        return False
+    updated_at = (sessions[0].to_dict() or {}).get('updatedAt')
+    if updated_at is None:
+        return False
+    if updated_at.tzinfo is None:
+        updated_at = updated_at.replace(tzinfo=timezone.utc)
+    return updated_at >= cutoff
+
+
+class LocalIngestionQueue:
+    """In-process priority queue with the FirestoreIngestionQueue interface."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._heap: List[tuple] = []
+        self._jobs: Dict[str, IngestionJob] = {}
+        self._sequence = itertools.count()
+
+    def enqueue(self, job: IngestionJob) -> bool:
+        """
+        Add a job unless a job with the same ID exists.
+
+        Returns:
+            bool: True if the job was added
+        """
+        with self._lock:
+            if job.job_id in self._jobs:
+                return False
+            self._jobs[job.job_id] = job
+            heapq.heappush(self._heap, (job.priority, job.enqueued_at, next(self._sequence), job.job_id))
+        log_event('ingestion_queue', event='enqueued', job_id=job.job_id, priority=job.priority, depth=self.depth())
+        return True
+
+    def claim(self, worker: str) -> Optional[IngestionJob]:
+        """Take the queued job with the lowest priority value, or None if the queue is empty."""
+        with self._lock:
+            while self._heap:
+                _, _, _, job_id = heapq.heappop(self._heap)
+                job = self._jobs[job_id]
+                if job.status != 'queued':
+                    continue
+                job.status = 'running'
+                job.worker = worker
+                job.attempts += 1
+                job.started_at = datetime.now(timezone.utc)
+                break
+            else:
+                return None
+        _log_claim(job, self.depth())
+        return job
+
+    def complete(self, job: IngestionJob, succeeded: bool, error_message: Optional[str] = None) -> None:
+        """Record the outcome of a claimed job, re-queueing failures that have attempts left."""
+        with self._lock:
+            job.finished_at = datetime.now(timezone.utc)
+            job.error_message = error_message
+            if succeeded:
+                job.status = 'completed'
+            elif job.attempts < MAX_ATTEMPTS:
+                job.status = 'queued'
+                heapq.heappush(self._heap, (job.priority, job.enqueued_at, next(self._sequence), job.job_id))
+            else:
+                job.status = 'failed'
+
+    def depth(self) -> int:
+        """Number of queued jobs."""
+        return sum(1 for job in self._jobs.values() if job.status == 'queued')
+
+
+class FirestoreIngestionQueue:
+    """Priority queue of jobs in the ingestion_jobs collection."""
+
+    def __init__(self, db_client=None):
+        from firebase_admin import firestore
+
+        self.db_client = db_client or firestore.client()
+        self.collection = self.db_client.collection('ingestion_jobs')
+
+    def enqueue(self, job: IngestionJob) -> bool:
+        """
+        Add a job unless a job with the same ID exists.
+
+        Returns:
+            bool: True if the job was added
+        """
+        from google.api_core.exceptions import AlreadyExists
+
+        try:
+            self.collection.document(job.job_id).create(job.to_dict())
+            count_firestore(writes=1)
+        except AlreadyExists:
+            print(f"Ingestion job {job.job_id} already exists for {job.file_path}")
+            return False
+        log_event('ingestion_queue', event='enqueued', job_id=job.job_id, priority=job.priority, depth=self.depth())
+        return True
+
+    def claim(self, worker: str) -> Optional[IngestionJob]:
+        """
+        Take the queued job with the lowest priority value.
+
+        Candidates are read outside of a transaction; each is then claimed in a
+        transaction that checks it is still queued, so concurrent workers skip jobs
+        claimed by someone else.
+
+        Returns:
+            Optional[IngestionJob]: The claimed job, or None if no job is queued
+        """
+        from firebase_admin import firestore
+
+        candidates = list(
+            self.collection.where('status', '==', 'queued')
+            .order_by('priority')
+            .order_by('enqueued_at')
+            .limit(CLAIM_CANDIDATES)
+            .stream()
+        )
+        count_firestore(reads=max(1, len(candidates)))
+
+        for candidate in candidates:
+            @firestore.transactional
+            def take(transaction) -> Optional[dict]:
+                snapshot = candidate.reference.get(transaction=transaction)
+                data = snapshot.to_dict() if snapshot.exists else None
+                if not data or data.get('status') != 'queued':
+                    return None
+                data.update(
+                    status='running',
+                    worker=worker,
+                    attempts=(data.get('attempts') or 0) + 1,
+                    started_at=datetime.now(timezone.utc),
+                )
+                transaction.update(candidate.reference, {
+                    'status': data['status'],
+                    'worker': worker,
+                    'attempts': data['attempts'],
+                    'started_at': data['started_at'],
+                })
+                return data
+
+            data = take(self.db_client.transaction())
+            count_firestore(reads=1, writes=1 if data else 0)
+            if data:
+                job = IngestionJob.from_dict(data)
+                _log_claim(job, self.depth())
+                return job
+        return None
+
+    def depth(self) -> int:
+        """Number of queued jobs (count aggregation, one read per 1000 jobs)."""
+        result = self.collection.where('status', '==', 'queued').count().get()
+        depth = int(result[0][0].value)
+        count_firestore(reads=max(1, (depth + 999) // 1000))
+        return depth
+
+    def complete(self, job: IngestionJob, succeeded: bool, error_message: Optional[str] = None) -> None:
+        """Record the outcome of a claimed job, re-queueing failures that have attempts left."""
+        if succeeded:
+            status = 'completed'
+        else:
+            status = 'queued' if job.attempts < MAX_ATTEMPTS else 'failed'
+        update = {'status': status, 'finished_at': datetime.now(timezone.utc)}
+        if error_message:
+            update['error_message'] = error_message
+        self.collection.document(job.job_id).update(update)
+        count_firestore(writes=1)
+
+    def requeue_stale(self, max_age_seconds: float = STALE_JOB_SECONDS) -> int:
+        """
+        Put back running jobs whose worker stopped before finishing them.
+
+        Returns:
+            int: Number of jobs re-queued
+        """
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=max_age_seconds)
+        stale = list(
+            self.collection.where('status', '==', 'running').where('started_at', '<', cutoff).stream()
+        )
+        count_firestore(reads=max(1, len(stale)))
+        for snapshot in stale:
+            self.collection.document(snapshot.id).update({'status': 'queued', 'worker': None})
+            count_firestore(writes=1)
+        if stale:
+            print(f"Re-queued {len(stale)} stale ingestion jobs")
+        return len(stale)
+
+
+def get_ingestion_queue():
+    """The queue selected with INGESTION_QUEUE_BACKEND ('firestore' by default, or 'local')."""
+    global _local_queue
+    if os.getenv('INGESTION_QUEUE_BACKEND', 'firestore') == 'local':
+        with _local_queue_lock:
+            if _local_queue is None:
+                _local_queue = LocalIngestionQueue()
+            return _local_queue
+    return FirestoreIngestionQueue()
+
+
+_local_queue: Optional[LocalIngestionQueue] = None
+_local_queue_lock = threading.Lock()
+
+
+def enqueue_upload(
+    file_path: str,
+    bucket_name: str,
+    generation: Optional[str],
+    size_bytes: Optional[int],
+    content_type: Optional[str] = None,
+    queue=None
+) -> str:
+    """
+    Record an uploaded file as a queued ingestion job (storage trigger side).
+
+    Args:
+        file_path: Path to the file in storage (e.g., 'user-documents/user123/document.pdf')
+        bucket_name: Name of the Firebase Storage bucket
+        generation: Storage generation of the object
+        size_bytes: Size of the object from the storage event
+        content_type: Content type of the object from the storage event, if known
+        queue: Queue to use, get_ingestion_queue() by default
+
+    Returns:
+        str: Message describing the outcome
+    """
+    from firebase_admin import firestore
+    from path_handling import get_user_id, get_file_name
+    from vectorize_file import update_processing_status
+
+    db_client = firestore.client()
+    user_id = get_user_id(file_path)
+    file_name = get_file_name(file_path)
+    job = new_job(
+        user_id, file_path, bucket_name, generation, int(size_bytes or 0),
+        interactive=is_interactive_user(db_client, user_id), content_type=content_type,
+    )
+
+    if not (queue or get_ingestion_queue()).enqueue(job):
+        return f"{file_name} - Already queued"
+    update_processing_status(
+        db_client, user_id, file_name, 'queued', progress_percentage=0,
+        metadata={'size': job.size_bytes, 'uploaded_at': datetime.now(timezone.utc)})
+    return f"{file_name} - Queued for vectorization with priority {job.priority}"
+
+
+def process_job(job: IngestionJob) -> bool:
+    """
+    Run the vectorization pipeline of a claimed job.
+
+    Returns:
+        bool: False if the pipeline failed and the job should be retried
+    """
+    from vectorize_file import vectorize_file_with_outcome
+
+    # Jobs of events without a size store 0, the pipeline then reads the size from storage
+    message, succeeded = vectorize_file_with_outcome(
+        job.file_path, job.bucket_name, job.generation, job.size_bytes or None, job.content_type)
+    print(message)
+    return succeeded
+
+
+def run_ingestion_worker(
+    queue,
+    process: Callable[[IngestionJob], bool],
+    concurrency: int = MAX_WORKER_CONCURRENCY,
+    max_seconds: Optional[float] = None
+) -> int:
+    """
+    Drain a queue with bounded concurrency.
+
+    Args:
+        queue: LocalIngestionQueue or FirestoreIngestionQueue
+        process: Runs the pipeline of a job and returns True on success
+        concurrency: Jobs running at the same time
+        max_seconds: Stop claiming new jobs after this long (e.g., the function timeout minus a margin)
+
+    Returns:
+        int: Number of jobs processed
+    """
+    worker = uuid.uuid4().hex[:12]
+    deadline = None if max_seconds is None else datetime.now(timezone.utc) + timedelta(seconds=max_seconds)
+    processed = itertools.count()
+
+    def work() -> None:
+        while deadline is None or datetime.now(timezone.utc) < deadline:
+            job = queue.claim(worker)
+            if job is None:
+                return
+            try:
+                succeeded = process(job)
+                queue.complete(job, succeeded)
+            except Exception as e:
+                print(f"Error processing ingestion job {job.job_id}: {str(e)}")
+                queue.complete(job, False, str(e))
+            next(processed)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(work)
+    return next(processed)
+
+
+def _log_claim(job: IngestionJob, depth: int) -> None:
+    """Log the wait time of a claimed job and the remaining depth."""
+    enqueued_at = job.enqueued_at
+    if enqueued_at is not None and enqueued_at.tzinfo is None:
+        enqueued_at = enqueued_at.replace(tzinfo=timezone.utc)
+    wait_ms = (job.started_at - enqueued_at).total_seconds() * 1000 if enqueued_at else None
+    log_event(
+        'ingestion_queue',
+        event='claimed',
+        job_id=job.job_id,
+        priority=job.priority,
+        interactive=job.interactive,
+        size_bytes=job.size_bytes,
+        attempts=job.attempts,
+        wait_ms=round(wait_ms, 1) if wait_ms is not None else None,
+        depth=depth,
+    )
@@ -0,0 +1,230 @@
+"""
+Firestore leases that give a unit of work a single owner at a time.
+
+Storage events are delivered at least once, so the same object generation can
+start two vectorization pipelines at the same moment. A lease is acquired in a
+transaction before the work starts and carries an expiry. A heartbeat thread
+renews it while the work runs, and it is released when the work ends:
+
+- while a live lease is held by another owner, acquire_lease() returns None
+  and the duplicate invocation exits immediately;
+- a lease released as completed keeps later duplicates out for good, and
+  stores the outcome of the work so that they can report it;
+- a lease released as failed, or whose owner died and stopped renewing it,
+  can be taken over by the next attempt once it is released or expired.
+
+Layout:
+  processing_leases/{sha256 of the key}
+    - key: str
+    - owner: str
+    - state: "held" | "completed" | "failed"
+    - expires_at: datetime
+    - acquired_at: datetime
+    - updated_at: datetime
+    - outcome: str (message of the work, set on release)
+
+A renewal that finds the lease taken over sets Lease.lost; the work then
+calls check_lease() between its stages, which raises LeaseLost so that it
+stops before writing anything the new owner also writes.
+"""
+import hashlib
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from tracing import count_firestore
+
+
+LEASE_SECONDS = 120  # Lifetime of a lease without renewal
+RENEW_INTERVAL_SECONDS = 30  # Heartbeat period, well below LEASE_SECONDS
+
+
+class LeaseLost(Exception):
+    """Raised by check_lease() when the lease of the running work was taken over."""
+
+
+class Lease:
+    """A lease held by this invocation, renewed in the background until released."""
+
+    def __init__(self, db_client, key: str, owner: str, lease_seconds: float):
+        self.db_client = db_client
+        self.key = key
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.lost = False  # Set when a renewal finds the lease taken over
+        self._reference = lease_reference(db_client, key)
+        self._stop = threading.Event()
+        self._heartbeat: Optional[threading.Thread] = None
+
+    def start_heartbeat(self, interval_seconds: Optional[float] = None) -> None:
+        """Renew the lease every interval_seconds (RENEW_INTERVAL_SECONDS by default) until it is released."""
+        self._heartbeat = threading.Thread(
+            target=self._renew_periodically,
+            args=(interval_seconds or RENEW_INTERVAL_SECONDS,),
+            name=f"lease-{self.owner[:8]}",
+            daemon=True,
+        )
+        self._heartbeat.start()
+
+    def renew(self) -> bool:
+        """
+        Push the expiry of the lease forward.
+
+        Returns:
+            bool: False if the lease is no longer held by this owner
+        """
+        from firebase_admin import firestore
+
+        @firestore.transactional
+        def extend(transaction) -> bool:
+            data = _read(self._reference, transaction)
+            if data.get('owner') != self.owner or data.get('state') != 'held':
+                return False
+            now = datetime.now(timezone.utc)
+            transaction.update(self._reference, {
+                'expires_at': now + timedelta(seconds=self.lease_seconds),
+                'updated_at': now,
+            })
+            return True
+
+        renewed = extend(self.db_client.transaction())
+        count_firestore(reads=1, writes=1 if renewed else 0)
+        if not renewed:
+            self.lost = True
+            print(f"Lease {self.key} was taken over, owner {self.owner} lost it")
+        return renewed
+
+    def release(self, completed: bool, outcome: Optional[str] = None) -> None:
+        """
+        Stop the heartbeat and release the lease.
+
+        Args:
+            completed: True keeps duplicates of the work out for good, False lets a retry take over
+            outcome: Message of the work, reported to the duplicates kept out by the lease
+        """
+        from firebase_admin import firestore
+
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join(timeout=5)
+
+        @firestore.transactional
+        def finish(transaction) -> None:
+            data = _read(self._reference, transaction)
+            if data.get('owner') != self.owner:
+                return
+            now = datetime.now(timezone.utc)
+            fields = {
+                'state': 'completed' if completed else 'failed',
+                'expires_at': now,
+                'updated_at': now,
+            }
+            if outcome is not None:
+                fields['outcome'] = outcome
+            transaction.update(self._reference, fields)
+
+        try:
+            finish(self.db_client.transaction())
+            count_firestore(reads=1, writes=1)
+        except Exception as e:
+            # An unreleased lease simply expires after lease_seconds
+            print(f"Error releasing lease {self.key}: {str(e)}")
+
+    def _renew_periodically(self, interval_seconds: float) -> None:
+        """Heartbeat loop of the lease."""
+        while not self._stop.wait(interval_seconds):
+            try:
+                if not self.renew():
+                    return
+            except Exception as e:
+                print(f"Error renewing lease {self.key}: {str(e)}")
+
+
+def check_lease(lease: Optional[Lease]) -> None:
+    """
+    Stop the work if its lease was taken over.
+
+    Args:
+        lease: Lease of the running work, None if the work runs without one
+
+    Raises:
+        LeaseLost: If a renewal found the lease held by another owner
+    """
+    if lease is not None and lease.lost:
+        raise LeaseLost(f"Lease {lease.key} was taken over by another owner")
+
+
+def lease_outcome(db_client, key: str) -> Optional[str]:
+    """
+    Outcome stored by the owner that completed a unit of work.
+
+    Args:
+        db_client: Firestore client instance
+        key: Identifier of the work
+
+    Returns:
+        Optional[str]: Message stored on release, None if the work is not completed or stored none
+    """
+    snapshot = lease_reference(db_client, key).get()
+    count_firestore(reads=1)
+    data = (snapshot.to_dict() or {}) if snapshot.exists else {}
+    return data.get('outcome') if data.get('state') == 'completed' else None
+
+
+def lease_reference(db_client, key: str):
+    """Firestore reference of the lease of a key (keys may contain '/', so they are hashed)."""
+    document_id = hashlib.sha256(key.encode('utf-8')).hexdigest()
+    return db_client.collection('processing_leases').document(document_id)
+
+
+def acquire_lease(db_client, key: str, lease_seconds: float = LEASE_SECONDS) -> Optional[Lease]:
+    """
+    Try to become the single owner of a unit of work.
+
+    Args:
+        db_client: Firestore client instance
+        key: Identifier of the work (e.g., object path and generation)
+        lease_seconds: Lifetime of the lease without renewal
+
+    Returns:
+        Optional[Lease]: The lease, or None if the work is completed or held by another live owner
+    """
+    from firebase_admin import firestore
+
+    owner = uuid.uuid4().hex
+    reference = lease_reference(db_client, key)
+
+    @firestore.transactional
+    def acquire(transaction) -> Optional[str]:
+        data = _read(reference, transaction)
+        now = datetime.now(timezone.utc)
+        if data.get('state') == 'completed':
+            return 'completed'
+        expires_at = data.get('expires_at')
+        if expires_at is not None and expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        if data.get('state') == 'held' and expires_at is not None and expires_at > now:
+            return 'held'
+        transaction.set(reference, {
+            'key': key,
+            'owner': owner,
+            'state': 'held',
+            'expires_at': now + timedelta(seconds=lease_seconds),
+            'acquired_at': now,
+            'updated_at': now,
+        })
+        return None
+
+    conflict = acquire(db_client.transaction())
+    count_firestore(reads=1, writes=0 if conflict else 1)
+    if conflict:
+        print(f"Lease {key} not acquired: {conflict}")
+        return None
+    return Lease(db_client, key, owner, lease_seconds)
+
+
+def _read(reference, transaction) -> dict:
+    """Data of a lease document read inside a transaction."""
+    snapshot = reference.get(transaction=transaction)
+    return (snapshot.to_dict() or {}) if snapshot.exists else {}
@@ -1,14 +1,18 @@
-from firebase_functions import https_fn, storage_fn
-from firebase_functions.options import set_global_options
+import os
+
+from firebase_functions import https_fn, storage_fn, firestore_fn, scheduler_fn
+from firebase_functions.options import MemoryOption, set_global_options
 from firebase_admin import initialize_app
-from firebase_admin import firestore
-from datetime import datetime
 
+from file_handling import get_archive_format
 from path_handling import get_user_id, get_file_name
-from chat import run_chat
-from vectorize_file import run_vectorize_file
-from session_management import create_user_session, list_user_sessions, delete_user_session
-from delete_file import delete_file_from_openai, delete_vector_store_from_openai
+from admission_control import admit, AdmissionRejected, overloaded_response
+from prewarm import prewarm_in_background
+from traffic_capture import capture_request
+
+# Pipeline modules (chat, vectorize_file, session_management, delete_file) are
+# imported inside each function, so a container only loads what its function
+# needs. Run server/benchmarks/import_profiler.py to see the cost of each import.
 
 
 # Maximum number of containers that can be running at the same time.
@@ -16,6 +20,18 @@ set_global_options(max_instances=2)
 
 app = initialize_app()
 
+# Bucket of the uploaded user documents
+DOCUMENTS_BUCKET = "chat-with-it-e09f2.firebasestorage.app"
+
+# Modules imported in the background once per container: by vectorize_file
+# after its first request, for the paths it may not have taken (e.g. images),
+# and by chat at the start of its first turn, for the Responses API resource
+# that the OpenAI client only imports on the first agent run
+PREWARM_MODULES = {
+    'vectorize_file': ['PIL.Image', 'PIL.ImageOps'],
+    'chat': ['openai.resources.responses'],
+}
+
 
 # Session Management Functions
 @https_fn.on_call()
@@ -25,7 +41,10 @@ def create_session(req: https_fn.CallableRequest) -> dict:
     if not req.auth:
         return {'success': False, 'message': 'Unauthorized', 'data': None}
     
+    from session_management import create_user_session
+
     uid = req.auth.uid
+    capture_request('create_session', uid)
     return create_user_session(uid)
 
 @https_fn.on_call()
@@ -35,7 +54,10 @@ def list_sessions(req: https_fn.CallableRequest) -> dict:
     if not req.auth:
         return {'success': False, 'message': 'Unauthorized', 'data': None}
     
+    from session_management import list_user_sessions
+
     uid = req.auth.uid
+    capture_request('list_sessions', uid)
     return list_user_sessions(uid)
 
 @https_fn.on_call()
@@ -51,10 +73,14 @@ def delete_session(req: https_fn.CallableRequest) -> dict:
     if not session_id:
         return {'success': False, 'message': 'Session ID is required', 'data': None}
     
+    from session_management import delete_user_session
+
+    capture_request('delete_session', uid, session_id=session_id)
     return delete_user_session(uid, session_id)
 
 
-@https_fn.on_call()
+# Deleting an archive deletes each of its up to 1000 members
+@https_fn.on_call(timeout_sec=300)
 def delete_document(req: https_fn.CallableRequest) -> dict:
     """Cloud function to delete a document from OpenAI storage and vector stores."""
     # Verify authentication
@@ -67,9 +93,48 @@ def delete_document(req: https_fn.CallableRequest) -> dict:
     if not file_name:
         return {'success': False, 'message': 'File name is required', 'data': None}
     
+    from delete_file import delete_file_from_openai
+
+    capture_request('delete_document', uid, file_name=file_name)
     return delete_file_from_openai(uid, file_name)
 
 
+@https_fn.on_call()
+def list_documents(req: https_fn.CallableRequest) -> dict:
+    """Cloud function to list a page of the documents of the calling user from their catalog."""
+    # Verify authentication
+    if not req.auth:
+        return {'success': False, 'message': 'Unauthorized', 'data': None}
+
+    page_size = req.data.get('pageSize')
+    page_token = req.data.get('pageToken')
+
+    if page_size is not None and (not isinstance(page_size, int) or page_size < 1):
+        return {'success': False, 'message': 'pageSize must be a positive integer', 'data': None}
+    if page_token is not None and not isinstance(page_token, str):
+        return {'success': False, 'message': 'pageToken must be a string', 'data': None}
+
+    from document_catalog import list_documents as list_catalog_documents
+
+    capture_request('list_documents', req.auth.uid, page_size=page_size, paged=page_token is not None)
+    return list_catalog_documents(req.auth.uid, DOCUMENTS_BUCKET, page_size, page_token)
+
+
+@https_fn.on_call(timeout_sec=540)
+def purge_user(req: https_fn.CallableRequest) -> dict:
+    """Cloud function to delete all data of the calling user, or continue an interrupted purge."""
+    # Verify authentication
+    if not req.auth:
+        return {'success': False, 'message': 'Unauthorized', 'data': None}
+    
+    if req.data.get('confirm') is not True:
+        return {'success': False, 'message': 'confirm must be true to delete all account data', 'data': None}
+    
+    from purge_user import purge_user_data
+
+    return purge_user_data(req.auth.uid, DOCUMENTS_BUCKET)
+
+
 @https_fn.on_call()
 def chat(req: https_fn.CallableRequest) -> any:
     """Process user prompt using OpenAI Agents SDK and return response"""
@@ -86,17 +151,111 @@ def chat(req: https_fn.CallableRequest) -> any:
     prompt = req.data.get('prompt')
     session_id = req.data.get('sessionId') or 'default'
     client_message_id = req.data.get('clientMessageId')  # optional for dedupe
+    include_timings = bool(req.data.get('includeTimings'))  # optional timing breakdown in meta
+    documents = req.data.get('documents')  # optional file names that scope retrieval
+    max_num_results = req.data.get('maxNumResults')  # optional number of chunks retrieved
     if prompt is None:
         return {
             'success': False,
             'message': 'No text prompt provided',
             'data': None
         }
+    if documents is not None and (
+        not isinstance(documents, list) or not all(isinstance(name, str) for name in documents)
+    ):
+        return {
+            'success': False,
+            'message': 'documents must be a list of file names',
+            'data': None
+        }
+    if max_num_results is not None and (isinstance(max_num_results, bool) or not isinstance(max_num_results, int)):
+        return {
+            'success': False,
+            'message': 'maxNumResults must be an integer',
+            'data': None
+        }
+
+    from chat import run_chat
 
-    return run_chat(uid, prompt, session_id, client_message_id)
+    # The import overlaps the Firestore reads that come before the agent run
+    prewarm_in_background(PREWARM_MODULES['chat'])
+
+    capture_request(
+        'chat', uid, session_id=session_id, prompt_chars=len(str(prompt)), documents=len(documents or [])
+    )
+
+    # Per-user rate limit and fair queuing across users
+    try:
+        with admit(uid, 'chat'):
+            return run_chat(
+                uid, prompt, session_id, client_message_id, include_timings, documents, max_num_results
+            )
+    except AdmissionRejected as e:
+        return overloaded_response(e)
+
+
+@https_fn.on_call(timeout_sec=300)
+def batch_chat(req: https_fn.CallableRequest) -> dict:
+    """Answer a list of prompts about the documents of the user, running the agents concurrently"""
+
+    # Require authenticated user
+    if not req.auth or not req.auth.uid:
+        return {
+            'success': False,
+            'message': 'Unauthenticated request',
+            'data': None
+        }
 
+    from batch_chat import run_batch_chat, MAX_BATCH_PROMPTS
 
-@storage_fn.on_object_finalized(bucket="chat-with-it-e09f2.firebasestorage.app")
+    uid = req.auth.uid
+    prompts = req.data.get('prompts')
+    session_id = req.data.get('sessionId')  # optional, no transcript is written without it
+    include_timings = bool(req.data.get('includeTimings'))
+    documents = req.data.get('documents')
+    max_num_results = req.data.get('maxNumResults')
+    if not isinstance(prompts, list) or not prompts or not all(isinstance(prompt, str) and prompt for prompt in prompts):
+        return {
+            'success': False,
+            'message': 'prompts must be a non-empty list of text prompts',
+            'data': None
+        }
+    if len(prompts) > MAX_BATCH_PROMPTS:
+        return {
+            'success': False,
+            'message': f'At most {MAX_BATCH_PROMPTS} prompts can be sent in a batch',
+            'data': None
+        }
+    if documents is not None and (
+        not isinstance(documents, list) or not all(isinstance(name, str) for name in documents)
+    ):
+        return {
+            'success': False,
+            'message': 'documents must be a list of file names',
+            'data': None
+        }
+    if max_num_results is not None and (isinstance(max_num_results, bool) or not isinstance(max_num_results, int)):
+        return {
+            'success': False,
+            'message': 'maxNumResults must be an integer',
+            'data': None
+        }
+
+    capture_request(
+        'batch_chat', uid, session_id=session_id, prompts=len(prompts),
+        prompt_chars=sum(len(prompt) for prompt in prompts), documents=len(documents or [])
+    )
+
+    try:
+        with admit(uid, 'batch_chat'):
+            return run_batch_chat(uid, prompts, session_id, documents, max_num_results, include_timings)
+    except AdmissionRejected as e:
+        return overloaded_response(e)
+
+
+# The pipeline holds the downloaded document in memory, up to file_handling.MAX_SPLIT_DOCUMENT_BYTES
+# for documents it splits, so an instance runs one pipeline at a time
+@storage_fn.on_object_finalized(bucket=DOCUMENTS_BUCKET, memory=MemoryOption.GB_4, timeout_sec=540, concurrency=1)
 def vectorize_file(event: storage_fn.CloudEvent[storage_fn.StorageObjectData]) -> str:
     """
     Cloud function triggered by file upload to /user-documents folder.
@@ -110,6 +269,101 @@ def vectorize_file(event: storage_fn.CloudEvent[storage_fn.StorageObjectData]) -
     # Extract file information from the event
     file_path = event.data.name
     bucket_name = event.data.bucket
-        
-    # Run the vectorization pipeline
-    return run_vectorize_file(file_path, bucket_name)
+    generation = str(event.data.generation) if event.data.generation is not None else None
+    capture_request(
+        'vectorize_file', get_user_id(file_path), file_name=get_file_name(file_path), size_bytes=event.data.size
+    )
+
+    # In queue mode the trigger only records the job, the ingestion workers run it. Archives
+    # always go to the workers, whose timeout covers the extraction and the wait for the
+    # file batches, and which retry an interrupted archive from its checkpoint
+    if os.getenv('INGESTION_MODE', 'direct') == 'queue' or get_archive_format(file_path):
+        from ingestion_queue import enqueue_upload
+
+        return enqueue_upload(file_path, bucket_name, generation, event.data.size, event.data.content_type)
+
+    from vectorize_file import run_vectorize_file
+
+    # Run the vectorization pipeline behind per-user rate limit and fair queuing
+    user_id = get_user_id(file_path)
+    try:
+        with admit(user_id, 'vectorize'):
+            return run_vectorize_file(
+                file_path, bucket_name, generation, event.data.size, event.data.content_type
+            )
+    except AdmissionRejected as e:
+        # Uploads beyond the burst are deferred to the ingestion workers, never failed
+        from ingestion_queue import enqueue_upload
+
+        print(f"Deferring {file_path} to the ingestion queue, admission retry after {e.retry_after_seconds}s")
+        return enqueue_upload(file_path, bucket_name, generation, event.data.size, event.data.content_type)
+    finally:
+        prewarm_in_background(PREWARM_MODULES['vectorize_file'])
+
+
+# Ingestion workers (INGESTION_MODE=queue, and archives and uploads deferred by
+# admission control in direct mode). A single instance that handles one event at a time
+# bounds the number of pipelines running at the same time to the worker
+# concurrency, which leaves the other instance to chat. The memory holds the
+# documents of the pipelines running at the same time.
+@firestore_fn.on_document_created(
+    document="ingestion_jobs/{jobId}", max_instances=1, concurrency=1, timeout_sec=540, memory=MemoryOption.GB_8
+)
+def process_ingestion_jobs(event: firestore_fn.Event[firestore_fn.DocumentSnapshot]) -> None:
+    """Drain the ingestion queue when a job is enqueued."""
+    from ingestion_queue import get_ingestion_queue, process_job, run_ingestion_worker
+
+    processed = run_ingestion_worker(get_ingestion_queue(), process_job, max_seconds=480)
+    print(f"Ingestion worker processed {processed} jobs")
+
+
+@scheduler_fn.on_schedule(schedule="every 5 minutes", max_instances=1, timeout_sec=540, memory=MemoryOption.GB_8)
+def sweep_ingestion_queue(event: scheduler_fn.ScheduledEvent) -> None:
+    """Re-queue abandoned jobs and drain what is left in the ingestion queue."""
+    from ingestion_queue import FirestoreIngestionQueue, process_job, run_ingestion_worker
+
+    queue = FirestoreIngestionQueue()
+    queue.requeue_stale()
+    processed = run_ingestion_worker(queue, process_job, max_seconds=480)
+    print(f"Ingestion sweep processed {processed} jobs")
+
+
+@firestore_fn.on_document_written(document="document_summaries/{summaryId}", timeout_sec=540)
+def summarize_document(event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot]]) -> None:
+    """Generate the summary and outline of an indexed document once it is marked pending."""
+    after = event.data.after
+    if after is None or not after.exists or (after.to_dict() or {}).get('status') != 'pending':
+        return
+
+    from document_summaries import generate_document_summary
+
+    print(generate_document_summary(event.params['summaryId']))
+
+
+@firestore_fn.on_document_written(document="sessions/{sessionId}/memory/compaction", timeout_sec=120)
+def compact_session(event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot]]) -> None:
+    """Summarize the older turns of a chat session once a turn requests a compaction."""
+    after = event.data.after
+    if after is None or not after.exists or (after.to_dict() or {}).get('status') != 'pending':
+        return
+
+    from firestore_session import run_compaction
+
+    print(run_compaction(event.params['sessionId']))
+
+
+@scheduler_fn.on_schedule(schedule="every 15 minutes", max_instances=1, timeout_sec=300)
+def migrate_sessions(event: scheduler_fn.ScheduledEvent) -> None:
+    """Move idle legacy chat sessions flagged by chat to transcript segments."""
+    from firestore_session import migrate_idle_sessions
+
+    migrate_idle_sessions()
+
+
+@scheduler_fn.on_schedule(schedule="every 15 minutes", max_instances=1, timeout_sec=300)
+def reconcile_orphans(event: scheduler_fn.ScheduledEvent) -> None:
+    """Clean up a bounded slice of orphaned OpenAI files, vector store files and statuses."""
+    from reconcile_orphans import run_orphan_reconciler
+
+    result = run_orphan_reconciler(DOCUMENTS_BUCKET)
+    print(result['message'])
@@ -0,0 +1,359 @@
+"""
+Retries, circuit breaking and hedging around calls to the OpenAI API.
+
+A single 429 or transient 5xx used to fail a whole document or chat turn. Every
+OpenAI call of the functions goes through call_openai (or call_openai_async for
+coroutines): ingestion, deletion, the account purge, the orphan reconciler,
+the chat agent and its router, session names, compaction and document
+summaries. Each call applies:
+
+1. A retry policy per kind of caller (RETRY_POLICIES). Retryable errors are
+   connection errors, timeouts and the statuses of RETRY_STATUS_CODES. The
+   delay before the next attempt is the Retry-After of the response when there
+   is one, otherwise a full-jitter exponential backoff, and attempts stop at
+   the deadline of the policy.
+2. A circuit breaker per endpoint (e.g. 'files.create'). After
+   CIRCUIT_FAILURE_THRESHOLD consecutive outage errors (connection errors and
+   5xx) calls fail fast with CircuitOpen for CIRCUIT_RESET_SECONDS, then one
+   trial call decides whether the circuit closes again. Rate limits do not
+   open the circuit, they are handled by the backoff.
+3. Optional hedging of idempotent reads (hedge=True, e.g. vector store file
+   polls). When OPENAI_HEDGE_AFTER_MS is set, a read still running after that
+   delay is sent a second time and the first answer wins.
+
+Background policies also wait for the shared rate limit budget to leave the
+share reserved for chat (see openai_quota.py). Clients whose calls go through
+this module are created by openai_quota.create_openai_client, with
+max_retries=0 so the SDK does not retry underneath the policies. Agent runs
+('agent_run') use the client of the Agents SDK and are retried as a whole.
+"""
+import asyncio
+import contextvars
+import math
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from openai import APIConnectionError
+from openai_quota import get_budget_tracker
+from tracing import current_trace
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """Retries applied to one kind of caller."""
+
+    max_attempts: int  # Attempts including the first one
+    base_delay_seconds: float  # Backoff before the second attempt, doubled after each attempt
+    max_delay_seconds: float  # Longest backoff between two attempts
+    deadline_seconds: float  # No attempt starts after this time since the first one
+    waits_for_budget: bool = False  # Whether attempts wait while the rate limit budget is in the chat reserve
+
+
+RETRY_POLICIES: Dict[str, RetryPolicy] = {
+    # A user is waiting for the answer
+    'interactive': RetryPolicy(max_attempts=3, base_delay_seconds=0.25, max_delay_seconds=2, deadline_seconds=8),
+    # Ingestion and deletion run in the background and can wait for the API to recover
+    'background': RetryPolicy(
+        max_attempts=6, base_delay_seconds=1, max_delay_seconds=20, deadline_seconds=90, waits_for_budget=True),
+}
+
+RETRY_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+CIRCUIT_FAILURE_THRESHOLD = 5  # Consecutive outage errors that open the circuit of an endpoint
+CIRCUIT_RESET_SECONDS = 30  # Time an open circuit fails fast before a trial call
+HEDGE_WORKERS = 16  # Threads running hedged reads
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling an endpoint whose circuit is open."""
+
+    def __init__(self, endpoint: str, retry_after_seconds: float):
+        super().__init__(f"OpenAI {endpoint} is unavailable, retry in {math.ceil(retry_after_seconds)} seconds")
+        self.endpoint = endpoint
+        self.retry_after_seconds = retry_after_seconds
+
+
+class CircuitBreaker:
+    """Consecutive failure counter of one endpoint, shared by the threads of the container."""
+
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_seconds: float = CIRCUIT_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """'closed', 'open', or 'half_open' when the next call is a trial."""
+        with self.lock:
+            if self.opened_at is None:
+                return 'closed'
+            if time.monotonic() - self.opened_at < self.reset_seconds:
+                return 'open'
+            return 'half_open'
+
+    def before_call(self, endpoint: str) -> None:
+        """
+        Let a call through, or fail fast while the circuit is open.
+
+        Raises:
+            CircuitOpen: If the circuit is open, or half open with a trial call already running
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return
+            remaining = self.reset_seconds - (time.monotonic() - self.opened_at)
+            if remaining > 0 or self.trial_running:
+                raise CircuitOpen(endpoint, max(remaining, 1))
+            self.trial_running = True
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self, endpoint: str) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self.trial_running:
+                    print(f"Circuit of OpenAI {endpoint} opened after {self.failures} consecutive failures")
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+    def record_other(self) -> None:
+        """A call ended with an error that says nothing about an outage."""
+        with self.lock:
+            self.trial_running = False
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+_hedge_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_circuit_breaker(endpoint: str) -> CircuitBreaker:
+    """Circuit breaker of an endpoint, created on first use."""
+    with _breakers_lock:
+        if endpoint not in _breakers:
+            _breakers[endpoint] = CircuitBreaker()
+        return _breakers[endpoint]
+
+
+def circuit_states() -> Dict[str, str]:
+    """State of the circuit of every endpoint called by this container."""
+    with _breakers_lock:
+        breakers = dict(_breakers)
+    return {endpoint: breaker.state for endpoint, breaker in breakers.items()}
+
+
+def status_code_of(error: Exception) -> Optional[int]:
+    """HTTP status of an OpenAI API error, None for errors without a response."""
+    status_code = getattr(error, 'status_code', None)
+    return status_code if isinstance(status_code, int) else None
+
+
+def is_retryable(error: Exception) -> bool:
+    """Whether an error is transient: connection errors, timeouts, rate limits and 5xx."""
+    return isinstance(error, APIConnectionError) or status_code_of(error) in RETRY_STATUS_CODES
+
+
+def is_outage(error: Exception) -> bool:
+    """Whether an error counts towards opening the circuit of the endpoint."""
+    status_code = status_code_of(error)
+    return isinstance(error, APIConnectionError) or (status_code is not None and status_code >= 500)
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """
+    Delay requested by the API in the Retry-After headers of an error response.
+
+    Args:
+        error: Error raised by the OpenAI client
+
+    Returns:
+        Optional[float]: Seconds to wait, None when the response has no usable header
+    """
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        if headers.get('retry-after-ms') is not None:
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after') is not None:
+            return float(headers['retry-after'])
+    except (TypeError, ValueError):
+        pass  # HTTP dates and malformed values fall back to the backoff
+    return None
+
+
+def backoff_seconds(policy: RetryPolicy, attempt: int, error: Exception) -> float:
+    """
+    Delay before the next attempt.
+
+    Args:
+        policy: Retry policy of the call
+        attempt: Number of attempts made so far (1 after the first failure)
+        error: Error of the last attempt
+
+    Returns:
+        float: Retry-After of the error when present, otherwise a random delay up
+            to the exponential backoff of the attempt (full jitter)
+    """
+    requested = retry_after_seconds(error)
+    if requested is not None:
+        return requested
+    return random.uniform(0, min(policy.max_delay_seconds, policy.base_delay_seconds * 2 ** (attempt - 1)))
+
+
+def call_openai(
+    endpoint: str,
+    function: Callable[..., Any],
+    *args: Any,
+    policy: str = 'background',
+    hedge: bool = False,
+    **kwargs: Any
+) -> Any:
+    """
+    Call the OpenAI API with the retry policy, the circuit breaker of the endpoint and optional hedging.
+
+    Args:
+        endpoint: Name of the endpoint (e.g., 'files.create'), which keys the circuit breaker
+        function: Client method (or closure) making the call; it is called again for each attempt
+        *args: Positional arguments of the call
+        policy: Key of RETRY_POLICIES
+        hedge: Whether the call is an idempotent read that can be sent twice
+        **kwargs: Keyword arguments of the call
+
+    Returns:
+        Any: Result of the call
+
+    Raises:
+        CircuitOpen: If the circuit of the endpoint is open
+        Exception: The error of the last attempt once retries are exhausted, or
+            any non-retryable error right away
+    """
+    retry_policy = RETRY_POLICIES[policy]
+    breaker = get_circuit_breaker(endpoint)
+    hedge_after_ms = float(os.getenv('OPENAI_HEDGE_AFTER_MS', '0')) if hedge else 0
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        breaker.before_call(endpoint)
+        if retry_policy.waits_for_budget:
+            get_budget_tracker().wait_for_budget()
+        attempt += 1
+        try:
+            if hedge_after_ms > 0:
+                result = _hedged_call(function, args, kwargs, hedge_after_ms / 1000)
+            else:
+                result = function(*args, **kwargs)
+        except Exception as e:
+            delay = _after_failure(endpoint, breaker, retry_policy, attempt, started, e)
+            time.sleep(delay)
+            continue
+        breaker.record_success()
+        return result
+
+
+async def call_openai_async(
+    endpoint: str,
+    function: Callable[..., Awaitable[Any]],
+    *args: Any,
+    policy: str = 'interactive',
+    **kwargs: Any
+) -> Any:
+    """
+    Await a coroutine function calling OpenAI (e.g., Runner.run) with the retry policy and circuit breaker.
+
+    Args:
+        endpoint: Name of the endpoint (e.g., 'agent_run'), which keys the circuit breaker
+        function: Coroutine function making the call; it is called again for each attempt
+        *args: Positional arguments of the call
+        policy: Key of RETRY_POLICIES
+        **kwargs: Keyword arguments of the call
+
+    Returns:
+        Any: Result of the call
+
+    Raises:
+        CircuitOpen: If the circuit of the endpoint is open
+        Exception: The error of the last attempt once retries are exhausted, or
+            any non-retryable error right away
+    """
+    retry_policy = RETRY_POLICIES[policy]
+    breaker = get_circuit_breaker(endpoint)
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        breaker.before_call(endpoint)
+        attempt += 1
+        try:
+            result = await function(*args, **kwargs)
+        except Exception as e:
+            delay = _after_failure(endpoint, breaker, retry_policy, attempt, started, e)
+            await asyncio.sleep(delay)
+            continue
+        breaker.record_success()
+        return result
+
+
+def _after_failure(
+    endpoint: str,
+    breaker: CircuitBreaker,
+    policy: RetryPolicy,
+    attempt: int,
+    started: float,
+    error: Exception
+) -> float:
+    """Record a failed attempt and return the delay before the next one, or raise the error."""
+    if is_outage(error):
+        breaker.record_failure(endpoint)
+    else:
+        breaker.record_other()
+    if not is_retryable(error) or attempt >= policy.max_attempts:
+        raise error
+    delay = backoff_seconds(policy, attempt, error)
+    if time.monotonic() - started + delay > policy.deadline_seconds:
+        raise error
+    print(f"OpenAI {endpoint} attempt {attempt} failed ({str(error)}), retrying in {delay:.2f}s")
+    current_trace().add('openai_retries')
+    return delay
+
+
+def _hedged_call(function: Callable[..., Any], args: tuple, kwargs: dict, hedge_after_seconds: float) -> Any:
+    """
+    Send a read, and send it again if it has not answered after hedge_after_seconds.
+
+    Returns:
+        Any: The first successful result
+
+    Raises:
+        Exception: The error of the last request when both fail
+    """
+    global _hedge_executor
+    with _breakers_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix='openai-hedge')
+    executor = _hedge_executor
+
+    # Each request runs in a copy of the context, so its spans land in the request trace
+    pending = {executor.submit(contextvars.copy_context().run, function, *args, **kwargs)}
+    done, _ = wait(pending, timeout=hedge_after_seconds)
+    if not done:
+        current_trace().add('openai_hedges')
+        pending.add(executor.submit(contextvars.copy_context().run, function, *args, **kwargs))
+
+    error: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+    raise error
@@ -0,0 +1,254 @@
+"""
+Shared OpenAI rate limit budget, with a share reserved for interactive chat.
+
+Chat and ingestion use the same API key, so a bulk upload can use up the rate
+limit and make chat turns fail or wait. Every response of the OpenAI clients
+created by create_openai_client carries the remaining budget of the key in its
+x-ratelimit-* headers:
+
+    x-ratelimit-limit-requests: 5000        x-ratelimit-limit-tokens: 2000000
+    x-ratelimit-remaining-requests: 4870    x-ratelimit-remaining-tokens: 1950000
+    x-ratelimit-reset-requests: 1.56s       x-ratelimit-reset-tokens: 1.5s
+
+The budget tracker keeps the latest of these values (per container). Before a
+'background' call (ingestion, deletion) call_openai waits while the remaining
+requests or tokens are within the reserve, OPENAI_CHAT_RESERVED_SHARE of the
+limits (default 0.2), until the budget resets or QUOTA_MAX_WAIT_SECONDS pass.
+Background calls let through are counted against the remaining budget until
+the next response updates it, so concurrent uploads do not all pass at once.
+'interactive' calls never wait and use the reserve.
+
+The chat agents run on the Agents SDK client, whose responses are not
+observed; their usage shows in the headers of the next observed response,
+the limits being those of the key. get_budget_state returns the budget for
+monitoring, and every change between ample and tight budget is logged as an
+'openai budget' event.
+"""
+import math
+import os
+import re
+import threading
+import time
+from typing import Dict, Optional
+
+from tracing import current_trace, log_event
+
+
+QUOTA_MAX_WAIT_SECONDS = 60  # Longest wait of a background call for the budget to reset
+QUOTA_MIN_WAIT_SECONDS = 0.25  # Wait when the reset time of a tight budget is unknown
+DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+DURATION_SECONDS = {'h': 3600, 'm': 60, 's': 1, 'ms': 0.001}
+
+
+def chat_reserved_share() -> float:
+    """Fraction of the rate limits that background calls leave to chat."""
+    return float(os.getenv('OPENAI_CHAT_RESERVED_SHARE', '0.2'))
+
+
+def parse_reset_duration(value: Optional[str]) -> Optional[float]:
+    """
+    Parse the reset time of a rate limit header.
+
+    Args:
+        value: Duration as sent by OpenAI (e.g., '20ms', '1.5s', '6m0s', '1h2m3s')
+
+    Returns:
+        Optional[float]: Seconds, None when the value is missing or malformed
+    """
+    if not value:
+        return None
+    parts = DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * DURATION_SECONDS[unit] for amount, unit in parts)
+
+
+class _Limit:
+    """Budget of one rate limit (requests or tokens)."""
+
+    def __init__(self):
+        self.limit: Optional[float] = None
+        self.remaining: Optional[float] = None
+        self.reset_at: Optional[float] = None
+
+    def observe(self, limit: Optional[str], remaining: Optional[str], reset: Optional[str]) -> None:
+        try:
+            if limit is not None:
+                self.limit = float(limit)
+            if remaining is not None:
+                self.remaining = float(remaining)
+        except ValueError:
+            return
+        reset_seconds = parse_reset_duration(reset)
+        if reset_seconds is not None:
+            self.reset_at = time.monotonic() + reset_seconds
+
+    def reserved(self, share: float) -> float:
+        return math.ceil(self.limit * share) if self.limit else 0
+
+    def wait_seconds(self, share: float) -> float:
+        """Time until the budget is above the reserve, 0 when it already is or is unknown."""
+        if self.remaining is None or self.limit is None:
+            return 0
+        now = time.monotonic()
+        if self.reset_at is not None and now >= self.reset_at:
+            # The window reset since the last response, the budget is back
+            return 0
+        if self.remaining > self.reserved(share):
+            return 0
+        return self.reset_at - now if self.reset_at is not None else QUOTA_MIN_WAIT_SECONDS
+
+    def state(self, share: float) -> dict:
+        reset_in = None
+        if self.reset_at is not None:
+            reset_in = round(max(self.reset_at - time.monotonic(), 0), 3)
+        return {
+            'limit': self.limit,
+            'remaining': self.remaining,
+            'reserved_for_chat': self.reserved(share),
+            'reset_in_seconds': reset_in,
+        }
+
+
+class BudgetTracker:
+    """Latest rate limit budget of the API key, seen by this container."""
+
+    def __init__(self):
+        self.requests = _Limit()
+        self.tokens = _Limit()
+        self.observed_at: Optional[float] = None
+        self.background_waits = 0
+        self.background_wait_seconds = 0.0
+        self.tight = False
+        self.lock = threading.Lock()
+
+    def observe(self, headers) -> None:
+        """
+        Update the budget from the headers of an OpenAI response.
+
+        Args:
+            headers: Response headers (any mapping with a get method)
+        """
+        if headers.get('x-ratelimit-remaining-requests') is None and headers.get('x-ratelimit-remaining-tokens') is None:
+            return
+        with self.lock:
+            self.requests.observe(
+                headers.get('x-ratelimit-limit-requests'),
+                headers.get('x-ratelimit-remaining-requests'),
+                headers.get('x-ratelimit-reset-requests'),
+            )
+            self.tokens.observe(
+                headers.get('x-ratelimit-limit-tokens'),
+                headers.get('x-ratelimit-remaining-tokens'),
+                headers.get('x-ratelimit-reset-tokens'),
+            )
+            self.observed_at = time.monotonic()
+        self._log_transition()
+
+    def background_wait_seconds_now(self) -> float:
+        """Time a background call should wait before the next look at the budget, 0 to go."""
+        share = chat_reserved_share()
+        if share <= 0:
+            return 0
+        with self.lock:
+            wait = max(self.requests.wait_seconds(share), self.tokens.wait_seconds(share))
+            if wait <= 0 and self.requests.remaining is not None:
+                # Count the call until the next response reports the real budget
+                self.requests.remaining -= 1
+            return wait
+
+    def wait_for_budget(self, max_wait_seconds: float = QUOTA_MAX_WAIT_SECONDS) -> float:
+        """
+        Block a background call while the budget is within the chat reserve.
+
+        Args:
+            max_wait_seconds: Longest wait, after which the call goes ahead anyway
+
+        Returns:
+            float: Seconds waited
+        """
+        started = time.monotonic()
+        waited = 0.0
+        while waited < max_wait_seconds:
+            wait = self.background_wait_seconds_now()
+            if wait <= 0:
+                break
+            self._log_transition()
+            time.sleep(min(wait, max_wait_seconds - waited))
+            waited = time.monotonic() - started
+        if waited:
+            with self.lock:
+                self.background_waits += 1
+                self.background_wait_seconds += waited
+            current_trace().add('openai_budget_waits')
+            current_trace().add('openai_budget_wait_ms', round(waited * 1000))
+        return waited
+
+    def state(self) -> dict:
+        share = chat_reserved_share()
+        with self.lock:
+            return {
+                'chat_reserved_share': share,
+                'requests': self.requests.state(share),
+                'tokens': self.tokens.state(share),
+                'tight': self.requests.wait_seconds(share) > 0 or self.tokens.wait_seconds(share) > 0,
+                'observed_seconds_ago': (
+                    round(time.monotonic() - self.observed_at, 3) if self.observed_at is not None else None
+                ),
+                'background_waits': self.background_waits,
+                'background_wait_seconds': round(self.background_wait_seconds, 3),
+            }
+
+    def _log_transition(self) -> None:
+        """Log the budget when it turns tight or ample."""
+        state = self.state()
+        with self.lock:
+            if state['tight'] == self.tight:
+                return
+            self.tight = state['tight']
+        log_event('openai budget', severity='WARNING' if state['tight'] else 'INFO', budget=state)
+
+
+_tracker = BudgetTracker()
+
+
+def get_budget_tracker() -> BudgetTracker:
+    """Budget tracker shared by the OpenAI clients of this container."""
+    return _tracker
+
+
+def get_budget_state() -> Dict:
+    """
+    Current rate limit budget, for monitoring.
+
+    Returns:
+        Dict: chat_reserved_share; limit, remaining, reserved_for_chat and
+            reset_in_seconds of 'requests' and 'tokens'; whether the budget is
+            'tight' (background calls wait); observed_seconds_ago; and the
+            number and total duration of background waits
+    """
+    return _tracker.state()
+
+
+def observe_response(response) -> None:
+    """httpx response hook feeding the budget tracker."""
+    _tracker.observe(response.headers)
+
+
+def create_openai_client():
+    """
+    OpenAI client whose responses update the shared budget.
+
+    Retries are left to openai_calls, so the SDK does not retry underneath its policies.
+
+    Returns:
+        OpenAI: Client for the key in OPENAI_API_KEY
+    """
+    from openai import OpenAI, DefaultHttpxClient
+
+    return OpenAI(
+        api_key=os.getenv('OPENAI_API_KEY'),
+        max_retries=0,
+        # Keeps the timeouts and connection limits of the SDK
+        http_client=DefaultHttpxClient(event_hooks={'response': [observe_response]}),
+    )
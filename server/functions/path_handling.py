@@ -38,3 +38,18 @@ def get_file_name(file_path: str) -> str:
     else:
         # Fallback if path structure is different
         return path_parts[-1] if path_parts else "unknown"
+
+
+def get_status_document_id(user_id: str, file_name: str) -> str:
+    """
+    Build the ID of the processing status document of a file.
+    
+    Args:
+        user_id: ID of the user
+        file_name: Name of the file, may contain '/' for archive members (e.g., 'docs.zip/a/b.pdf')
+        
+    Returns:
+        str: Document ID '{user_id}_{file_name}', with '/' encoded as '%2F' since
+            Firestore document IDs cannot contain it
+    """
+    return f"{user_id}_{file_name}".replace('/', '%2F')
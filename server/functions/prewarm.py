@@ -0,0 +1,56 @@
+"""
+Background import of heavy modules after the first request of a container.
+
+The entry point only imports what each function needs to serve its own
+request, which keeps cold starts short. Modules that are imported late are
+loaded in a daemon thread instead, so that requests find them already loaded
+rather than paying the import themselves: vectorize_file imports image
+processing (Pillow) once its first request has been served, and chat starts
+importing the OpenAI Responses API resource, which the client only loads on
+the first agent run, at the beginning of its first turn, while the turn reads
+its session from Firestore.
+"""
+import importlib
+import threading
+import time
+from typing import Iterable
+
+from tracing import log_event
+
+
+_lock = threading.Lock()
+_started = False
+
+
+def prewarm_in_background(modules: Iterable[str]) -> bool:
+    """
+    Import modules in a background thread, once per container.
+
+    Args:
+        modules: Names of the modules to import, in order
+
+    Returns:
+        bool: True if this call started the pre-warm thread
+    """
+    global _started
+    with _lock:
+        if _started:
+            return False
+        _started = True
+
+    thread = threading.Thread(target=_import_modules, args=(list(modules),), name='prewarm', daemon=True)
+    thread.start()
+    return True
+
+
+def _import_modules(modules: list) -> None:
+    """Import each module and log how long it took."""
+    durations = {}
+    for module in modules:
+        started = time.perf_counter()
+        try:
+            importlib.import_module(module)
+            durations[module] = round((time.perf_counter() - started) * 1000, 1)
+        except Exception as e:
+            durations[module] = f"failed: {type(e).__name__}"
+    log_event('prewarm', modules=durations)
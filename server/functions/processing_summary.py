@@ -0,0 +1,157 @@
+"""
+Per-user summary of document processing, for realtime clients.
+
+Every status change of a document is written to its own
+document_processing_status row, so a client listening to all rows of a user
+receives one snapshot event per file and per progress step during a bulk
+upload. The summary keeps what the documents page shows in a single document
+per user: the files in flight with their progress, the recently finished ones
+and the failed ones, and the number of files in each state. Clients subscribe
+to that one document instead of querying the collection.
+
+The summary is updated in a transaction by update_processing_status and by the
+deletion. Progress updates of a file that keeps its status are written at most
+every SUMMARY_MIN_INTERVAL_SECONDS, status changes always are. A container
+remembers the last status it wrote for each file, so those progress updates
+are dropped before the transaction instead of contending on the summary of a
+user whose files are uploaded in bulk. Failed updates are logged as warnings
+with the file and the status; the next status change of the file repairs them. Completed files
+are dropped after RECENT_SECONDS, failed ones when the file is uploaded again or
+deleted (keeping the MAX_FAILED_FILES most recent), and files in flight that have
+not been updated for STALE_SECONDS, since their pipeline was interrupted.
+
+Layout:
+  user_processing_status/{uid}
+    - files: {file name: {status, progress_percentage, error_message, updated_at}}
+    - counts: {status: number of files in files with that status}
+    - updated_at: datetime
+"""
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+from firebase_admin import firestore
+
+from tracing import count_firestore, log_event
+
+
+SUMMARY_MIN_INTERVAL_SECONDS = 2  # Between two progress updates of a file with the same status
+RECENT_SECONDS = 600  # Completed files are kept this long
+STALE_SECONDS = 6 * 60 * 60  # Files in flight without update this long are dropped
+MAX_FAILED_FILES = 100
+TERMINAL_STATUSES = {'completed', 'failed'}
+MAX_REMEMBERED_FILES = 1000  # Files whose last written status a container remembers
+
+# Last status written to the summary by this container, by user and file name
+_last_written: Dict[Tuple[str, str], Tuple[str, float]] = {}
+_last_written_lock = threading.Lock()
+
+
+def update_processing_summary(
+    db_client,
+    user_id: str,
+    file_name: str,
+    status: Optional[str],
+    progress_percentage: Optional[int] = None,
+    error_message: Optional[str] = None
+) -> None:
+    """
+    Record the status of a file in the processing summary of its user.
+
+    Archive members ('{archive}/{path}') are left out, the archive reports their progress.
+
+    Args:
+        db_client: Firestore client instance
+        user_id: ID of the user
+        file_name: Name of the file
+        status: Current processing status, None to remove the file from the summary
+        progress_percentage: Progress percentage (0-100)
+        error_message: Error message if status is 'failed'
+    """
+    if '/' in file_name:
+        return
+    key = (user_id, file_name)
+    if status is not None and status not in TERMINAL_STATUSES:
+        with _last_written_lock:
+            last_status, written_at = _last_written.get(key, (None, 0.0))
+        if last_status == status and time.monotonic() - written_at < SUMMARY_MIN_INTERVAL_SECONDS:
+            return
+    summary_ref = db_client.collection('user_processing_status').document(user_id)
+
+    @firestore.transactional
+    def write(transaction) -> bool:
+        snapshot = summary_ref.get(transaction=transaction)
+        files: Dict[str, dict] = dict(((snapshot.to_dict() or {}) if snapshot.exists else {}).get('files', {}))
+        now = datetime.now(timezone.utc)
+
+        previous = files.get(file_name)
+        if status is None:
+            if previous is None:
+                return False
+            files.pop(file_name)
+        else:
+            if (previous and previous.get('status') == status and status not in TERMINAL_STATUSES
+                    and _age_seconds(previous.get('updated_at'), now) < SUMMARY_MIN_INTERVAL_SECONDS):
+                return False
+            entry = {'status': status, 'updated_at': now}
+            if progress_percentage is not None:
+                entry['progress_percentage'] = progress_percentage
+            elif previous and previous.get('status') == status and 'progress_percentage' in previous:
+                entry['progress_percentage'] = previous['progress_percentage']
+            if error_message:
+                entry['error_message'] = error_message
+            files[file_name] = entry
+
+        files = _prune(files, now)
+        counts: Dict[str, int] = {}
+        for entry in files.values():
+            counts[entry['status']] = counts.get(entry['status'], 0) + 1
+        transaction.set(summary_ref, {'files': files, 'counts': counts, 'updated_at': now})
+        return True
+
+    try:
+        written = write(db_client.transaction())
+        count_firestore(reads=1, writes=1 if written else 0)
+    except Exception as e:
+        log_event('processing_summary_update_failed', severity='WARNING',
+                  user_id=user_id, file_name=file_name, status=status, error=str(e))
+        return
+
+    with _last_written_lock:
+        if status is None:
+            _last_written.pop(key, None)
+            return
+        if len(_last_written) >= MAX_REMEMBERED_FILES:
+            _last_written.clear()
+        if written:
+            _last_written[key] = (status, time.monotonic())
+
+
+def _prune(files: Dict[str, dict], now: datetime) -> Dict[str, dict]:
+    """Drop completed files after RECENT_SECONDS, stale files in flight and the oldest failures."""
+    kept = {}
+    for name, entry in files.items():
+        age = _age_seconds(entry.get('updated_at'), now)
+        if entry.get('status') == 'completed' and age > RECENT_SECONDS:
+            continue
+        if entry.get('status') not in TERMINAL_STATUSES and age > STALE_SECONDS:
+            continue
+        kept[name] = entry
+
+    failed = sorted(
+        (name for name, entry in kept.items() if entry.get('status') == 'failed'),
+        key=lambda name: _age_seconds(kept[name].get('updated_at'), now)
+    )
+    for name in failed[MAX_FAILED_FILES:]:
+        kept.pop(name)
+    return kept
+
+
+def _age_seconds(timestamp, now: datetime) -> float:
+    """Seconds since a stored datetime, infinite when missing."""
+    if not isinstance(timestamp, datetime):
+        return float('inf')
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return (now - timestamp).total_seconds()
@@ -0,0 +1,332 @@
+"""
+Account-wide purge of the data of a user.
+
+Deletes, in this order, everything the backend stores for a user:
+
+1. vector_stores: the OpenAI vector stores of the user (which detaches all
+   their files at once) and the user_vector_stores row;
+2. documents: the OpenAI file of each processing status row, then the rows;
+3. sessions: every session with its messages, transcript segments, chat
+   execution records, memory and items;
+4. storage_objects: the uploaded documents in user-documents/{uid}/;
+5. records: ingestion jobs, document summaries, admission control buckets,
+   the document catalog and the processing summary of the user.
+
+Every stage works page by page and deletes what it has handled before reading
+the next page, so a purge interrupted at any point resumes by simply running
+again: the next page is always what is left. Within a page, OpenAI files and
+storage objects are deleted by a bounded thread pool, and Firestore documents
+in batches of up to 500, several sessions at the same time.
+
+Progress is persisted after every page in user_purges/{uid}, which the user
+can read, and returned by each call. A call that runs out of its time budget
+returns with status 'running'; calling again continues the purge.
+
+Layout:
+  user_purges/{uid}
+    - status: "running" | "completed" | "failed"
+    - stage: str, current stage
+    - deleted: dict, number of items deleted per stage
+    - error_message: str
+    - started_at, updated_at, completed_at: datetime
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List
+
+from firebase_admin import firestore, storage
+from google.api_core.exceptions import NotFound
+from openai import OpenAI, NotFoundError
+
+from leases import acquire_lease
+from openai_calls import call_openai
+from openai_quota import create_openai_client
+from tracing import start_trace, span, count_firestore, log_event
+
+
+PURGE_STAGES = ['vector_stores', 'documents', 'sessions', 'storage_objects', 'records']
+SESSION_SUBCOLLECTIONS = ['messages', 'transcript', 'chat_executions', 'memory', 'items']
+DELETE_CONCURRENCY = 8  # OpenAI and storage deletions running at the same time
+SESSION_CONCURRENCY = 4  # Sessions deleted at the same time
+DOCUMENT_PAGE_SIZE = 100  # Status rows and storage objects handled per page
+SESSION_PAGE_SIZE = 20  # Sessions handled per page
+BATCH_LIMIT = 500  # Firestore batch limit
+PURGE_MAX_SECONDS = 480  # Time budget of one call, below the function timeout
+
+
+class UserPurge:
+    """Purge of one user, resumable from the progress stored in user_purges/{uid}."""
+
+    def __init__(self, db_client, openai_client: OpenAI, uid: str, bucket_name: str):
+        self.db_client = db_client
+        self.openai_client = openai_client
+        self.uid = uid
+        self.bucket_name = bucket_name
+        self.progress_ref = db_client.collection('user_purges').document(uid)
+
+    def run(self, max_seconds: float = PURGE_MAX_SECONDS) -> dict:
+        """
+        Run stages from the stored progress until the purge completes or the budget is spent.
+
+        Args:
+            max_seconds: Time budget of this call
+
+        Returns:
+            dict: Progress of the purge (status, stage, deleted counts per stage)
+        """
+        progress = self.load_progress()
+        steps: Dict[str, Callable[[], int]] = {
+            'vector_stores': self.purge_vector_stores,
+            'documents': self.purge_documents,
+            'sessions': self.purge_sessions,
+            'storage_objects': self.purge_storage_objects,
+            'records': self.purge_records,
+        }
+        deadline = time.monotonic() + max_seconds
+
+        while progress['status'] == 'running' and time.monotonic() < deadline:
+            stage = progress['stage']
+            with span(f'purge_{stage}') as span_attributes:
+                deleted = steps[stage]()
+                span_attributes['deleted'] = deleted
+            progress['deleted'][stage] = progress['deleted'].get(stage, 0) + deleted
+
+            # A step that found nothing left to delete ends its stage
+            if not deleted:
+                next_index = PURGE_STAGES.index(stage) + 1
+                if next_index == len(PURGE_STAGES):
+                    progress['status'] = 'completed'
+                    progress['completed_at'] = datetime.now()
+                else:
+                    progress['stage'] = PURGE_STAGES[next_index]
+            self.save_progress(progress)
+
+        return progress
+
+    def load_progress(self) -> dict:
+        """Stored progress of the purge, restarted if a previous purge completed."""
+        snapshot = self.progress_ref.get()
+        count_firestore(reads=1)
+        progress = (snapshot.to_dict() or {}) if snapshot.exists else {}
+        if progress.get('status') == 'completed' or progress.get('stage') not in PURGE_STAGES:
+            # A completed purge starts over, data may have been created since
+            return {
+                'status': 'running',
+                'stage': PURGE_STAGES[0],
+                'deleted': {},
+                'started_at': datetime.now(),
+            }
+        # A running or failed purge continues from its stage
+        progress['status'] = 'running'
+        progress.pop('error_message', None)
+        progress.setdefault('deleted', {})
+        return progress
+
+    def save_progress(self, progress: dict) -> None:
+        """Persist the progress after each page."""
+        self.progress_ref.set({**progress, 'user_id': self.uid, 'updated_at': datetime.now()})
+        count_firestore(writes=1)
+
+    # Stages: each step deletes one page and returns the number of deleted items, 0 when done
+
+    def purge_vector_stores(self) -> int:
+        """Delete the vector stores of the user and the user_vector_stores row."""
+        from delete_file import delete_vector_store_from_openai
+
+        user_vector_stores_ref = self.db_client.collection('user_vector_stores').document(self.uid)
+        snapshot = user_vector_stores_ref.get()
+        count_firestore(reads=1)
+        if not snapshot.exists:
+            return 0
+
+        vector_store_ids = (snapshot.to_dict() or {}).get('vector_store_ids', [])
+        for vector_store_id in vector_store_ids:
+            response = delete_vector_store_from_openai(self.uid, vector_store_id)
+            if not response.get('success'):
+                raise Exception(response.get('message'))
+        user_vector_stores_ref.delete()
+        count_firestore(deletes=1)
+        return len(vector_store_ids) + 1
+
+    def purge_documents(self) -> int:
+        """Delete the OpenAI files of a page of status rows, then the rows."""
+        snapshots = list(
+            self.db_client.collection('document_processing_status')
+            .where('user_id', '==', self.uid)
+            .limit(DOCUMENT_PAGE_SIZE)
+            .stream()
+        )
+        count_firestore(reads=max(1, len(snapshots)))
+        if not snapshots:
+            return 0
+
+        file_ids = {
+            (snapshot.to_dict() or {}).get('file_id') for snapshot in snapshots
+        } - {None}
+
+        def delete_file(file_id: str) -> None:
+            try:
+                call_openai('files.delete', self.openai_client.files.delete, file_id=file_id)
+            except NotFoundError:
+                pass
+
+        self._run_concurrently(delete_file, file_ids)
+        self._delete_in_batches([snapshot.reference for snapshot in snapshots])
+        return len(snapshots)
+
+    def purge_sessions(self) -> int:
+        """Delete a page of sessions with all their subcollections, several sessions at a time."""
+        snapshots = list(
+            self.db_client.collection('sessions')
+            .where('userId', '==', self.uid)
+            .limit(SESSION_PAGE_SIZE)
+            .stream()
+        )
+        count_firestore(reads=max(1, len(snapshots)))
+        if not snapshots:
+            return 0
+
+        def delete_session(session_ref) -> int:
+            deleted = 0
+            for name in SESSION_SUBCOLLECTIONS:
+                subcollection = session_ref.collection(name)
+                while True:
+                    page = list(subcollection.limit(BATCH_LIMIT).stream())
+                    count_firestore(reads=max(1, len(page)))
+                    if not page:
+                        break
+                    self._delete_in_batches([snapshot.reference for snapshot in page])
+                    deleted += len(page)
+            # The session itself goes last, so an interrupted purge finds it again
+            session_ref.delete()
+            count_firestore(deletes=1)
+            return deleted + 1
+
+        with ThreadPoolExecutor(max_workers=SESSION_CONCURRENCY) as executor:
+            return sum(executor.map(delete_session, [snapshot.reference for snapshot in snapshots]))
+
+    def purge_storage_objects(self) -> int:
+        """Delete a page of the uploaded documents of the user."""
+        bucket = storage.bucket(self.bucket_name)
+        blobs = list(bucket.list_blobs(prefix=f"user-documents/{self.uid}/", max_results=DOCUMENT_PAGE_SIZE))
+        if not blobs:
+            return 0
+
+        def delete_blob(blob) -> None:
+            try:
+                blob.delete()
+            except NotFound:
+                pass
+
+        self._run_concurrently(delete_blob, blobs)
+        return len(blobs)
+
+    def purge_records(self) -> int:
+        """Delete the ingestion jobs, document summaries, admission buckets, document catalog and processing summary of the user."""
+        from admission_control import ADMISSION_POLICIES
+        from document_catalog import catalog_reference
+        from document_summaries import SUMMARIES_COLLECTION
+
+        jobs = list(
+            self.db_client.collection('ingestion_jobs')
+            .where('user_id', '==', self.uid)
+            .limit(BATCH_LIMIT)
+            .stream()
+        )
+        summaries = list(
+            self.db_client.collection(SUMMARIES_COLLECTION)
+            .where('user_id', '==', self.uid)
+            .limit(BATCH_LIMIT)
+            .stream()
+        )
+        count_firestore(reads=max(1, len(jobs)) + max(1, len(summaries)))
+        references = [snapshot.reference for snapshot in jobs + summaries]
+        if len(jobs) < BATCH_LIMIT and len(summaries) < BATCH_LIMIT:
+            user_records = [
+                self.db_client.collection('admission_buckets').document(f"{kind}_{self.uid}")
+                for kind in ADMISSION_POLICIES
+            ] + [self.db_client.collection('user_processing_status').document(self.uid)]
+            existing = [snapshot.reference for snapshot in self.db_client.get_all(user_records) if snapshot.exists]
+            count_firestore(reads=len(user_records))
+            references += existing
+
+            # Catalog shards first, the root goes last so an interrupted purge finds it again
+            catalog_ref = catalog_reference(self.db_client, self.uid)
+            shards = list(catalog_ref.collection('shards').stream())
+            catalog = catalog_ref.get()
+            count_firestore(reads=len(shards) + 1)
+            references += [snapshot.reference for snapshot in shards]
+            if catalog.exists:
+                references.append(catalog_ref)
+        self._delete_in_batches(references)
+        return len(references)
+
+    # Helpers
+
+    def _run_concurrently(self, delete: Callable, items) -> None:
+        """Run a deletion for each item on a bounded pool, raising the first error."""
+        with ThreadPoolExecutor(max_workers=DELETE_CONCURRENCY) as executor:
+            for future in [executor.submit(delete, item) for item in items]:
+                future.result()
+
+    def _delete_in_batches(self, references: List) -> None:
+        """Delete Firestore documents in batches of up to BATCH_LIMIT."""
+        for start in range(0, len(references), BATCH_LIMIT):
+            batch = self.db_client.batch()
+            chunk = references[start:start + BATCH_LIMIT]
+            for reference in chunk:
+                batch.delete(reference)
+            batch.commit()
+            count_firestore(deletes=len(chunk))
+
+
+def purge_user_data(uid: str, bucket_name: str, max_seconds: float = PURGE_MAX_SECONDS) -> dict:
+    """
+    Delete all data of a user, or continue a purge that was interrupted.
+
+    Args:
+        uid: ID of the user
+        bucket_name: Name of the Firebase Storage bucket of the user documents
+        max_seconds: Time budget of this call
+
+    Returns:
+        dict: Success/failure message, with the progress of the purge in data
+    """
+    db_client = firestore.client()
+    lease = acquire_lease(db_client, f"purge:{uid}", lease_seconds=max_seconds + 60)
+    if lease is None:
+        return {'success': False, 'message': 'A purge of this account is already in progress', 'data': None}
+
+    with start_trace('purge_user', uid=uid) as trace:
+        purge = UserPurge(db_client, create_openai_client(), uid, bucket_name)
+        try:
+            progress = purge.run(max_seconds=max_seconds)
+        except Exception as e:
+            trace.status = 'failed'
+            error_msg = f"Error purging user data: {str(e)}"
+            print(error_msg)
+            purge.progress_ref.set({
+                'status': 'failed', 'error_message': error_msg, 'updated_at': datetime.now()
+            }, merge=True)
+            count_firestore(writes=1)
+            return {'success': False, 'message': error_msg, 'data': None}
+        finally:
+            # Not completed: a later call can always take the lease and purge again
+            lease.release(completed=False)
+
+        summary = {
+            'status': progress['status'],
+            'stage': progress['stage'],
+            'deleted': progress['deleted'],
+        }
+        trace.set_attribute('purge', summary)
+        log_event('purge_user', uid=uid, **summary)
+
+    if progress['status'] == 'completed':
+        return {'success': True, 'message': 'All account data deleted', 'data': summary}
+    return {
+        'success': True,
+        'message': f"Purge in progress at stage {progress['stage']}, call again to continue",
+        'data': summary,
+    }
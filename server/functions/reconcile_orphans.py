@@ -0,0 +1,443 @@
+"""
+Scheduled reconciliation of OpenAI files, vector store files and processing statuses.
+
+A pipeline or a deletion that fails partway leaves state behind: OpenAI files
+that no status references, vector store files of deleted documents, vector
+store IDs of expired stores, and status rows stuck in progress or pointing at
+a storage object that no longer exists. The reconciler walks every source page
+by page and cleans up what no longer matches.
+
+Each run handles a bounded slice of the work (MAX_PAGES_PER_RUN pages or
+MAX_RUN_SECONDS, whichever comes first) and persists its position, so a run
+never times out and the next run continues where the previous one stopped.
+The phases run in a cycle:
+
+1. openai_files: files with purpose 'assistants' that no status row references
+   are deleted;
+2. vector_store_files: for each vector store of each user, vector store files
+   that no status row of that store references are detached, and vector store
+   IDs that OpenAI no longer knows are removed from user_vector_stores;
+3. status_docs: rows whose storage object was deleted are deleted with their
+   OpenAI file, rows stuck in progress are marked failed.
+
+Each page is compared with its references using set operations in memory.
+Objects younger than ORPHAN_GRACE_SECONDS are never touched, since a running
+pipeline may not have recorded them yet. Deletions run concurrently within
+DELETES_PER_SECOND. Setting ORPHAN_RECONCILER_DRY_RUN=1 logs the orphans
+without deleting anything.
+
+Layout:
+  maintenance/orphan_reconciler
+    - phase: "openai_files" | "vector_store_files" | "status_docs"
+    - cursors: dict, position of each phase
+    - cycles: int, number of completed cycles
+    - last_cycle_completed_at: datetime
+    - updated_at: datetime
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from firebase_admin import firestore, storage
+from openai import OpenAI, NotFoundError
+
+from admission_control import InMemoryTokenBucket
+from leases import acquire_lease
+from openai_calls import call_openai
+from openai_quota import create_openai_client
+from tracing import start_trace, span, count_firestore, log_event
+
+
+PHASES = ['openai_files', 'vector_store_files', 'status_docs']
+PAGE_SIZE = 100  # Items listed per page of every source
+MAX_PAGES_PER_RUN = 20  # Pages handled by one run
+MAX_RUN_SECONDS = 240  # Time budget of one run, well below the function timeout
+ORPHAN_GRACE_SECONDS = 3600  # Objects younger than this are never considered orphans
+STALE_STATUS_SECONDS = 6 * 3600  # In-progress rows not updated for this long are interrupted
+DELETE_CONCURRENCY = 4  # Deletions running at the same time
+DELETES_PER_SECOND = 5  # Rate budget of the deletions
+IN_QUERY_LIMIT = 30  # Values allowed in a Firestore 'in' filter
+IN_PROGRESS_STATUSES = {'queued', 'uploading', 'processing', 'vectorizing', 'deleting'}
+
+
+class DeleteBudget:
+    """Runs deletions concurrently while keeping them within a rate budget."""
+
+    def __init__(self, dry_run: bool):
+        self.dry_run = dry_run
+        self.deleted = 0
+        self.errors = 0
+        self._bucket = InMemoryTokenBucket(capacity=DELETES_PER_SECOND, refill_per_second=DELETES_PER_SECOND)
+
+    def run(self, deletions: Dict[str, Callable[[], None]]) -> None:
+        """
+        Run deletions and wait for all of them.
+
+        Args:
+            deletions: Deletion callables by a description of the deleted object
+        """
+        if not deletions:
+            return
+        if self.dry_run:
+            for description in deletions:
+                print(f"[dry run] Would delete {description}")
+            return
+
+        def delete(description: str, deletion: Callable[[], None]) -> bool:
+            while True:
+                wait_seconds = self._bucket.try_acquire('deletes')
+                if not wait_seconds:
+                    break
+                time.sleep(wait_seconds)
+            try:
+                deletion()
+                print(f"Deleted orphan {description}")
+                return True
+            except Exception as e:
+                print(f"Error deleting orphan {description}: {str(e)}")
+                return False
+
+        with ThreadPoolExecutor(max_workers=DELETE_CONCURRENCY) as executor:
+            results = list(executor.map(lambda item: delete(*item), deletions.items()))
+        self.deleted += sum(results)
+        self.errors += len(results) - sum(results)
+
+
+class OrphanReconciler:
+    """One run of the reconciler, handling pages until its budget is spent."""
+
+    def __init__(self, db_client, openai_client: OpenAI, bucket_name: str, dry_run: bool = False):
+        self.db_client = db_client
+        self.openai_client = openai_client
+        self.bucket_name = bucket_name
+        self.budget = DeleteBudget(dry_run)
+        self.now = datetime.now(timezone.utc)
+        self.state_ref = db_client.collection('maintenance').document('orphan_reconciler')
+        self.stats = {phase: {'pages': 0, 'scanned': 0, 'orphans': 0} for phase in PHASES}
+        self._storage_names: Dict[str, Set[str]] = {}
+
+    def run(self, max_pages: int = MAX_PAGES_PER_RUN, max_seconds: float = MAX_RUN_SECONDS) -> dict:
+        """
+        Handle pages of the current phase, and of the next ones, until the budget is spent.
+
+        Args:
+            max_pages: Pages handled by this run
+            max_seconds: Time budget of this run
+
+        Returns:
+            dict: Phase and cycle reached, and per-phase page, item and orphan counts
+        """
+        state = self.load_state()
+        deadline = time.monotonic() + max_seconds
+        handlers = {
+            'openai_files': self.reconcile_openai_files,
+            'vector_store_files': self.reconcile_vector_store_files,
+            'status_docs': self.reconcile_status_docs,
+        }
+
+        pages = 0
+        while pages < max_pages and time.monotonic() < deadline:
+            phase = state['phase']
+            cursor = state['cursors'].setdefault(phase, {})
+            with span(f'reconcile_{phase}'):
+                phase_done = handlers[phase](cursor)
+            self.stats[phase]['pages'] += 1
+            pages += 1
+
+            if phase_done:
+                state['cursors'][phase] = {}
+                next_index = (PHASES.index(phase) + 1) % len(PHASES)
+                state['phase'] = PHASES[next_index]
+                if next_index == 0:
+                    state['cycles'] = state.get('cycles', 0) + 1
+                    state['last_cycle_completed_at'] = datetime.now(timezone.utc)
+            self.save_state(state)
+
+        return {
+            'phase': state['phase'],
+            'cycles': state.get('cycles', 0),
+            'pages': pages,
+            'deleted': self.budget.deleted,
+            'errors': self.budget.errors,
+            'phases': self.stats,
+        }
+
+    def load_state(self) -> dict:
+        """Position of the reconciler saved by the previous run."""
+        snapshot = self.state_ref.get()
+        count_firestore(reads=1)
+        state = (snapshot.to_dict() or {}) if snapshot.exists else {}
+        if state.get('phase') not in PHASES:
+            state['phase'] = PHASES[0]
+        state.setdefault('cursors', {})
+        return state
+
+    def save_state(self, state: dict) -> None:
+        """Persist the position of the reconciler after each page."""
+        self.state_ref.set({**state, 'updated_at': datetime.now(timezone.utc)})
+        count_firestore(writes=1)
+
+    # Phases: each handles one page, moves its cursor and returns True when the phase is done
+
+    def reconcile_openai_files(self, cursor: dict) -> bool:
+        """Delete OpenAI files that no processing status references."""
+        page = call_openai(
+            'files.list', self.openai_client.files.list,
+            purpose='assistants', after=cursor.get('after'), limit=PAGE_SIZE, order='asc')
+        files = list(page.data)
+        candidates = {file.id for file in files if self.is_past_grace(file.created_at)}
+        orphans = candidates - set(self.find_status_references(candidates))
+        self.record('openai_files', len(files), orphans)
+
+        self.budget.run({
+            f"OpenAI file {file_id}": (lambda file_id=file_id: call_openai(
+                'files.delete', self.openai_client.files.delete, file_id=file_id))
+            for file_id in orphans
+        })
+        self.advance(cursor, 'after', [file.id for file in files], orphans)
+        return not page.has_more
+
+    def reconcile_vector_store_files(self, cursor: dict) -> bool:
+        """Detach vector store files that no processing status of the store references."""
+        if not cursor.get('vector_store_ids'):
+            user_id, vector_store_ids = self.next_user_vector_stores(cursor.get('user_after'))
+            if user_id is None:
+                return True
+            cursor.update({'user_id': user_id, 'user_after': user_id, 'vector_store_ids': vector_store_ids, 'after': None})
+            if not vector_store_ids:
+                return False
+
+        user_id = cursor['user_id']
+        vector_store_id = cursor['vector_store_ids'][0]
+        try:
+            page = call_openai(
+                'vector_stores.files.list', self.openai_client.vector_stores.files.list,
+                vector_store_id=vector_store_id, after=cursor.get('after'), limit=PAGE_SIZE, order='asc')
+        except NotFoundError:
+            # The store expired or was deleted: drop its ID from the user
+            self.record('vector_store_files', 0, {vector_store_id})
+            self.budget.run({
+                f"vector store ID {vector_store_id} of {user_id}": lambda: self.remove_vector_store_id(user_id, vector_store_id)
+            })
+            cursor['vector_store_ids'] = cursor['vector_store_ids'][1:]
+            cursor['after'] = None
+            return False
+
+        vector_store_files = list(page.data)
+        candidates = {item.id for item in vector_store_files if self.is_past_grace(item.created_at)}
+        references = self.find_status_references(candidates)
+        orphans = {
+            file_id for file_id in candidates
+            if vector_store_id not in references.get(file_id, set())
+        }
+        self.record('vector_store_files', len(vector_store_files), orphans)
+
+        self.budget.run({
+            f"vector store file {file_id} of {vector_store_id}": (
+                lambda file_id=file_id: call_openai(
+                    'vector_stores.files.delete', self.openai_client.vector_stores.files.delete,
+                    vector_store_id=vector_store_id, file_id=file_id)
+            )
+            for file_id in orphans
+        })
+        if page.has_more:
+            self.advance(cursor, 'after', [item.id for item in vector_store_files], orphans)
+        else:
+            cursor['vector_store_ids'] = cursor['vector_store_ids'][1:]
+            cursor['after'] = None
+        return False
+
+    def reconcile_status_docs(self, cursor: dict) -> bool:
+        """Clean up status rows of deleted storage objects and rows stuck in progress."""
+        from delete_file import delete_file_from_openai
+
+        collection = self.db_client.collection('document_processing_status')
+        query = collection.order_by('__name__').limit(PAGE_SIZE)
+        if cursor.get('after'):
+            query = query.start_after({'__name__': collection.document(cursor['after'])})
+        snapshots = list(query.stream())
+        count_firestore(reads=max(1, len(snapshots)))
+
+        deletions: Dict[str, Callable[[], None]] = {}
+        interrupted: List[str] = []
+        for snapshot in snapshots:
+            data = snapshot.to_dict() or {}
+            user_id, file_name = data.get('user_id'), data.get('file_name')
+            if not user_id or not file_name or not self.is_past_grace(data.get('updated_at')):
+                continue
+
+            # Archive members live as long as their archive does
+            object_name = data.get('archive') or file_name
+            if object_name not in self.storage_names(user_id):
+                if data.get('file_id') or data.get('archive_members'):
+                    deletions[f"document {user_id}/{file_name}"] = (
+                        lambda user_id=user_id, file_name=file_name: _raise_on_failure(
+                            delete_file_from_openai(user_id, file_name))
+                    )
+                else:
+                    deletions[f"status {snapshot.id}"] = (
+                        lambda reference=snapshot.reference: _delete_status(reference)
+                    )
+            elif data.get('status') in IN_PROGRESS_STATUSES and self.is_stale(data.get('updated_at')):
+                interrupted.append(snapshot.id)
+
+        self.record('status_docs', len(snapshots), set(deletions) | set(interrupted))
+        self.budget.run(deletions)
+        if interrupted and not self.budget.dry_run:
+            self.mark_interrupted(collection, interrupted)
+
+        if snapshots:
+            cursor['after'] = snapshots[-1].id
+        return len(snapshots) < PAGE_SIZE
+
+    # Helpers
+
+    def find_status_references(self, file_ids: Iterable[str]) -> Dict[str, Set[str]]:
+        """
+        Look up the processing statuses that reference OpenAI files.
+
+        Args:
+            file_ids: OpenAI file IDs
+
+        Returns:
+            Dict[str, Set[str]]: Vector store IDs recorded with each referenced file ID
+        """
+        file_ids = list(file_ids)
+        references: Dict[str, Set[str]] = {}
+        collection = self.db_client.collection('document_processing_status')
+        for start in range(0, len(file_ids), IN_QUERY_LIMIT):
+            chunk = file_ids[start:start + IN_QUERY_LIMIT]
+            snapshots = list(collection.where('file_id', 'in', chunk).stream())
+            count_firestore(reads=max(1, len(snapshots)))
+            for snapshot in snapshots:
+                data = snapshot.to_dict() or {}
+                vector_store_ids = references.setdefault(data['file_id'], set())
+                if data.get('vector_store_id'):
+                    vector_store_ids.add(data['vector_store_id'])
+        return references
+
+    def next_user_vector_stores(self, user_after: Optional[str]):
+        """User after user_after in user_vector_stores, with their vector store IDs."""
+        collection = self.db_client.collection('user_vector_stores')
+        query = collection.order_by('__name__').limit(1)
+        if user_after:
+            query = query.start_after({'__name__': collection.document(user_after)})
+        snapshots = list(query.stream())
+        count_firestore(reads=1)
+        if not snapshots:
+            return None, []
+        return snapshots[0].id, list((snapshots[0].to_dict() or {}).get('vector_store_ids', []))
+
+    def remove_vector_store_id(self, user_id: str, vector_store_id: str) -> None:
+        """Remove a vector store ID that OpenAI no longer knows from a user."""
+        self.db_client.collection('user_vector_stores').document(user_id).update({
+            'vector_store_ids': firestore.ArrayRemove([vector_store_id])
+        })
+        count_firestore(writes=1)
+
+    def storage_names(self, user_id: str) -> Set[str]:
+        """Names of the storage objects of a user, listed once per run."""
+        if user_id not in self._storage_names:
+            prefix = f"user-documents/{user_id}/"
+            blobs = storage.bucket(self.bucket_name).list_blobs(prefix=prefix)
+            self._storage_names[user_id] = {blob.name[len(prefix):] for blob in blobs}
+        return self._storage_names[user_id]
+
+    def mark_interrupted(self, collection, document_ids: List[str]) -> None:
+        """Mark rows stuck in progress as failed so the user can upload or delete again."""
+        batch = self.db_client.batch()
+        for document_id in document_ids:
+            batch.set(collection.document(document_id), {
+                'status': 'failed',
+                'error_message': 'Processing was interrupted, please upload the file again',
+                'updated_at': datetime.now(),
+                'completed_at': datetime.now(),
+            }, merge=True)
+        batch.commit()
+        count_firestore(writes=len(document_ids))
+
+    def is_past_grace(self, timestamp) -> bool:
+        """Whether an object created or updated at timestamp is older than the grace period."""
+        return self._age_seconds(timestamp) > ORPHAN_GRACE_SECONDS
+
+    def is_stale(self, timestamp) -> bool:
+        """Whether an in-progress row updated at timestamp was abandoned."""
+        return self._age_seconds(timestamp) > STALE_STATUS_SECONDS
+
+    def _age_seconds(self, timestamp) -> float:
+        if timestamp is None:
+            return float('inf')
+        if isinstance(timestamp, (int, float)):
+            timestamp = datetime.fromtimestamp(timestamp, timezone.utc)
+        elif timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        return (self.now - timestamp).total_seconds()
+
+    def record(self, phase: str, scanned: int, orphans: Set[str]) -> None:
+        self.stats[phase]['scanned'] += scanned
+        self.stats[phase]['orphans'] += len(orphans)
+
+    def advance(self, cursor: dict, key: str, page_ids: List[str], deleted: Set[str]) -> None:
+        """Move a list cursor to the last item of the page that still exists."""
+        kept = [item_id for item_id in page_ids if item_id not in deleted or self.budget.dry_run]
+        if kept:
+            cursor[key] = kept[-1]
+
+
+def _delete_status(reference) -> None:
+    """Delete a status row that has nothing to clean up in OpenAI."""
+    reference.delete()
+    count_firestore(deletes=1)
+
+
+def _raise_on_failure(response: dict) -> None:
+    """Turn a failed delete_file_from_openai response into an error of the deletion."""
+    from delete_file import is_nothing_to_delete
+
+    # A row without an OpenAI file is deleted as a plain status row by the next pass
+    if not response.get('success') and not is_nothing_to_delete(response):
+        raise Exception(response.get('message'))
+
+
+def run_orphan_reconciler(
+    bucket_name: str,
+    max_pages: int = MAX_PAGES_PER_RUN,
+    max_seconds: float = MAX_RUN_SECONDS
+) -> dict:
+    """
+    Run one bounded slice of the orphan reconciliation.
+
+    Args:
+        bucket_name: Name of the Firebase Storage bucket of the user documents
+        max_pages: Pages handled by this run
+        max_seconds: Time budget of this run
+
+    Returns:
+        dict: Success/failure message, with the progress of the run in data
+    """
+    db_client = firestore.client()
+    lease = acquire_lease(db_client, 'orphan_reconciler', lease_seconds=max_seconds + 60)
+    if lease is None:
+        return {'success': False, 'message': 'Another reconciler run is in progress', 'data': None}
+
+    with start_trace('orphan_reconciler', bucket=bucket_name) as trace:
+        try:
+            reconciler = OrphanReconciler(
+                db_client,
+                create_openai_client(),
+                bucket_name,
+                dry_run=os.getenv('ORPHAN_RECONCILER_DRY_RUN') == '1',
+            )
+            summary = reconciler.run(max_pages=max_pages, max_seconds=max_seconds)
+            trace.set_attribute('summary', summary)
+            log_event('orphan_reconciler', **summary)
+            return {'success': True, 'message': f"Reconciled {summary['pages']} pages", 'data': summary}
+        except Exception as e:
+            trace.status = 'failed'
+            print(f"Error running orphan reconciler: {str(e)}")
+            return {'success': False, 'message': f"Error running orphan reconciler: {str(e)}", 'data': None}
+        finally:
+            # Not completed: the next scheduled run takes the lease again
+            lease.release(completed=False)
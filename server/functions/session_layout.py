@@ -0,0 +1,20 @@
+"""
+Storage layouts of chat sessions.
+
+Kept free of heavy imports so that session management functions can pick the
+layout of new sessions without loading the Agents SDK (see firestore_session.py
+for the layouts themselves).
+"""
+import os
+
+
+LAYOUT_MESSAGES = "messages"  # One document per message (legacy)
+LAYOUT_SEGMENTS = "segments"  # Append-only transcript segments of up to SEGMENT_MAX_MESSAGES
+SEGMENT_MAX_MESSAGES = 50  # Messages stored in one transcript segment
+SEGMENT_MAX_BYTES = 600_000  # Keeps segments well below the 1 MiB document limit
+
+
+def default_storage_layout() -> str:
+    """Storage layout of new sessions, selected with SESSION_STORAGE_LAYOUT."""
+    layout = os.getenv('SESSION_STORAGE_LAYOUT', LAYOUT_MESSAGES)
+    return layout if layout in (LAYOUT_MESSAGES, LAYOUT_SEGMENTS) else LAYOUT_MESSAGES
@@ -4,6 +4,7 @@ from firebase_admin import firestore as admin_firestore
 from firebase_functions import https_fn
 from firebase_admin import auth
 import asyncio
+from session_layout import default_storage_layout
 
 
 def create_user_session(uid: str) -> dict:
@@ -22,6 +23,7 @@ def create_user_session(uid: str) -> dict:
             'name': None,  # Will be set when first message is sent
             'createdAt': admin_firestore.SERVER_TIMESTAMP,
             'updatedAt': admin_firestore.SERVER_TIMESTAMP,
+            'storageLayout': default_storage_layout(),
         })
         
         return {
@@ -102,12 +104,15 @@ def delete_user_session(uid: str, session_id: str) -> dict:
                 'data': None
             }
         
-        # Delete all messages in the session
+        # Delete all messages, transcript segments, chat execution records and memory in the session
         messages_ref = session_ref.collection('messages')
         messages = list(messages_ref.stream())
+        transcript = list(session_ref.collection('transcript').stream())
+        executions = list(session_ref.collection('chat_executions').stream())
+        memory = list(session_ref.collection('memory').stream())
         
         batch = db.batch()
-        for message in messages:
+        for message in messages + transcript + executions + memory:
             batch.delete(message.reference)
         
         # Delete the session document
@@ -136,6 +141,7 @@ def generate_session_name(prompt: str) -> str:
     try:
         # Lazy import to avoid deployment timeout
         from agents import Agent, Runner, ModelSettings
+        from openai_calls import call_openai_async
         
         # Create a simple agent to generate session names
         agent = Agent(
@@ -150,8 +156,8 @@ def generate_session_name(prompt: str) -> str:
             model_settings=ModelSettings(temperature=0.3),
         )
         
-        # Run the agent to generate the session name
-        result = asyncio.run(Runner.run(agent, prompt))
+        # Run the agent to generate the session name, the user is waiting for the first answer
+        result = asyncio.run(call_openai_async('agent_run', Runner.run, agent, prompt, policy='interactive'))
         session_name = result.final_output or "New Chat"
         
         # Ensure the name is not too long
@@ -0,0 +1,211 @@
+"""
+Lightweight stage-level tracing for the request hot paths.
+
+A trace is started once per request with start_trace(). While it is active,
+instrumented code records stages with span() and counts bytes and Firestore
+operations with add_bytes() and count_firestore(). When the request finishes a
+single structured JSON log line is written to stdout, which Cloud Logging
+ingests as a structured entry:
+
+    {"severity": "INFO", "message": "trace chat", "trace": {
+        "name": "chat", "duration_ms": 812.4, "status": "ok",
+        "attributes": {...}, "counters": {"firestore_reads": 5, ...},
+        "spans": [{"name": "agent_run", "start_ms": 40.1, "duration_ms": 702.3}, ...]}}
+
+Code that runs outside of a trace records into a no-op trace, so call sites
+never need to check whether tracing is active.
+"""
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+
+class RequestTrace:
+    """Spans and counters recorded for a single request."""
+
+    def __init__(self, name: str, **attributes: Any):
+        self.name = name
+        self.attributes: Dict[str, Any] = dict(attributes)
+        self.counters: Dict[str, float] = {}
+        self.spans: List[dict] = []
+        self.status = 'ok'
+        self._started = time.perf_counter()
+        self._finished: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[dict]:
+        """
+        Time a stage of the request.
+
+        Args:
+            name: Name of the stage (e.g., 'agent_run')
+            **attributes: Extra attributes recorded with the span
+
+        Yields:
+            dict: The span attributes, which the stage can extend while it runs
+        """
+        span_attributes = dict(attributes)
+        started = time.perf_counter()
+        error = None
+        try:
+            yield span_attributes
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            span = {
+                'name': name,
+                'start_ms': round((started - self._started) * 1000, 1),
+                'duration_ms': round((time.perf_counter() - started) * 1000, 1),
+            }
+            if span_attributes:
+                span['attributes'] = span_attributes
+            if error:
+                span['error'] = error
+            with self._lock:
+                self.spans.append(span)
+
+    def add(self, counter: str, value: float = 1) -> None:
+        """Increase a counter of the request."""
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        """Record an attribute of the request."""
+        with self._lock:
+            self.attributes[key] = value
+
+    def duration_ms(self) -> float:
+        """Elapsed time of the request in milliseconds."""
+        end = self._finished if self._finished is not None else time.perf_counter()
+        return round((end - self._started) * 1000, 1)
+
+    def timings(self) -> dict:
+        """
+        Timing breakdown suitable for a response meta.
+
+        Returns:
+            dict: Total duration, duration per stage and counters
+        """
+        with self._lock:
+            stages: Dict[str, float] = {}
+            for span in self.spans:
+                stages[span['name']] = round(stages.get(span['name'], 0) + span['duration_ms'], 1)
+            return {
+                'totalMs': self.duration_ms(),
+                'stages': stages,
+                'counters': dict(self.counters),
+            }
+
+    def to_dict(self) -> dict:
+        """Full trace as a JSON serializable dict."""
+        with self._lock:
+            return {
+                'name': self.name,
+                'status': self.status,
+                'duration_ms': self.duration_ms(),
+                'attributes': dict(self.attributes),
+                'counters': dict(self.counters),
+                'spans': list(self.spans),
+            }
+
+    def finish(self) -> None:
+        """Stop the clock and emit the trace as a structured log line."""
+        self._finished = time.perf_counter()
+        log_event(f"trace {self.name}", trace=self.to_dict())
+
+
+class _NullTrace(RequestTrace):
+    """Trace used outside of start_trace(), records nothing."""
+
+    def __init__(self):
+        super().__init__('null')
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[dict]:
+        yield {}
+
+    def add(self, counter: str, value: float = 1) -> None:
+        pass
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def finish(self) -> None:
+        pass
+
+
+_NULL_TRACE = _NullTrace()
+_current_trace: contextvars.ContextVar = contextvars.ContextVar('current_trace', default=_NULL_TRACE)
+
+
+@contextmanager
+def start_trace(name: str, **attributes: Any) -> Iterator[RequestTrace]:
+    """
+    Trace a request and emit its structured log when it finishes.
+
+    Args:
+        name: Name of the request (e.g., 'chat', 'vectorize_file')
+        **attributes: Attributes identifying the request (user, session, file...)
+
+    Yields:
+        RequestTrace: The active trace
+    """
+    trace = RequestTrace(name, **attributes)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    except Exception:
+        trace.status = 'error'
+        raise
+    finally:
+        _current_trace.reset(token)
+        trace.finish()
+
+
+def current_trace() -> RequestTrace:
+    """The trace of the current request, or a no-op trace."""
+    return _current_trace.get()
+
+
+def span(name: str, **attributes: Any):
+    """Time a stage of the current request (see RequestTrace.span)."""
+    return current_trace().span(name, **attributes)
+
+
+def add_bytes(direction: str, count: int) -> None:
+    """
+    Count bytes transferred by the current request.
+
+    Args:
+        direction: 'in' for downloads, 'out' for uploads
+        count: Number of bytes
+    """
+    current_trace().add(f"bytes_{direction}", count)
+
+
+def count_firestore(reads: int = 0, writes: int = 0, deletes: int = 0) -> None:
+    """Count Firestore document operations made by the current request."""
+    trace = current_trace()
+    if reads:
+        trace.add('firestore_reads', reads)
+    if writes:
+        trace.add('firestore_writes', writes)
+    if deletes:
+        trace.add('firestore_deletes', deletes)
+
+
+def log_event(message: str, severity: str = 'INFO', **fields: Any) -> None:
+    """
+    Write a structured JSON log line.
+
+    Args:
+        message: Human readable message of the entry
+        severity: Cloud Logging severity
+        **fields: Extra JSON serializable fields of the entry
+    """
+    print(json.dumps({'severity': severity, 'message': message, **fields}, default=str))
@@ -0,0 +1,85 @@
+"""
+Anonymized capture of the request mix, for offline replay.
+
+When TRAFFIC_CAPTURE is set to 1, every handled request writes one structured
+log line with the shape of the request and nothing of its content:
+
+    {"severity": "INFO", "message": "traffic capture", "capture": {
+        "function": "chat", "ts": 1760000000.123, "user": "3f9a1c0be2d4",
+        "session": "a81c44e09b7f", "prompt_chars": 182, "documents": 0}}
+
+User, session and file identifiers are replaced by keyed hashes (salted with
+TRAFFIC_CAPTURE_SALT), so the sequence of requests of a user, the length of a
+session, and the deletion of an uploaded file can be rebuilt without knowing
+who or what they were. File names are reduced to their extension, prompts to
+their length.
+
+TRAFFIC_CAPTURE_SAMPLE (0 to 1, default 1) keeps a fraction of the users, all
+requests of a kept user being captured. The lines are exported from Cloud
+Logging and replayed by server/benchmarks/replay.py:
+
+    gcloud logging read 'jsonPayload.message="traffic capture"' --format=json > capture.json
+"""
+import hashlib
+import hmac
+import os
+import time
+from typing import Any, Optional
+
+from tracing import log_event
+
+
+def capture_enabled() -> bool:
+    """Whether request capture is turned on."""
+    return os.getenv('TRAFFIC_CAPTURE', '0') == '1'
+
+
+def anonymize(value: Optional[str]) -> Optional[str]:
+    """
+    Keyed hash of an identifier, stable for a given TRAFFIC_CAPTURE_SALT.
+
+    Args:
+        value: User ID, session ID or file name
+
+    Returns:
+        Optional[str]: 12 hexadecimal characters, None when value is None
+    """
+    if value is None:
+        return None
+    salt = os.getenv('TRAFFIC_CAPTURE_SALT', '').encode('utf-8')
+    return hmac.new(salt, str(value).encode('utf-8'), hashlib.sha256).hexdigest()[:12]
+
+
+def is_sampled(user_hash: str) -> bool:
+    """Whether the requests of a user are captured, decided once per user."""
+    sample = float(os.getenv('TRAFFIC_CAPTURE_SAMPLE', '1'))
+    return int(user_hash[:8], 16) / 0xFFFFFFFF < sample
+
+
+def capture_request(function: str, uid: Optional[str], **shape: Any) -> None:
+    """
+    Log the shape of a request when capture is turned on.
+
+    Args:
+        function: Name of the handler (e.g., 'chat', 'vectorize_file')
+        uid: ID of the user, anonymized before logging
+        **shape: Sizes and counts of the request; session_id and file_name
+            are anonymized, file_name also gives the extension
+    """
+    if not capture_enabled():
+        return
+    try:
+        user = anonymize(uid or '')
+        if not is_sampled(user):
+            return
+        capture = {'function': function, 'ts': round(time.time(), 3), 'user': user}
+        if 'session_id' in shape:
+            capture['session'] = anonymize(shape.pop('session_id'))
+        if 'file_name' in shape:
+            file_name = shape.pop('file_name') or ''
+            capture['file'] = anonymize(file_name)
+            capture['extension'] = os.path.splitext(file_name)[1].lower()
+        capture.update(shape)
+        log_event('traffic capture', capture=capture)
+    except Exception as e:
+        print(f"Error capturing request: {str(e)}")
@@ -4,32 +4,126 @@ Vectorize file pipeline logic for local testing.
 This module contains the core vectorization pipeline extracted from main.py.
 """
 from google.cloud.firestore import DocumentReference, DocumentSnapshot
+from google.api_core.exceptions import NotFound
 from firebase_admin import storage
 from firebase_admin import firestore
 from openai import OpenAI
 import io
 from datetime import datetime
+from typing import Optional, Tuple
 
-from path_handling import get_user_id, get_file_name
-from file_handling import get_file_extension, detect_file_type
+from path_handling import get_user_id, get_file_name, get_status_document_id
+from file_handling import (
+    get_file_extension, detect_file_type, get_archive_format, check_upload_metadata, check_upload_content, SNIFF_BYTES
+)
+from image_to_description import image_to_markdown_file
+from document_catalog import CATALOG_STATUSES, document_metadata, upsert_catalog_entry
+from document_summaries import request_document_summary
+from processing_summary import update_processing_summary
+from leases import Lease, LeaseLost, acquire_lease, check_lease, lease_outcome
+from openai_calls import call_openai
+from openai_quota import create_openai_client
+from tracing import start_trace, span, add_bytes, count_firestore, current_trace, log_event
 
 
 AWAIT_MAX_SECONDS = 30  # Maximum wait time in seconds
 
 
-def run_vectorize_file(file_path: str, bucket_name: str) -> str:
+def run_vectorize_file(
+    file_path: str,
+    bucket_name: str,
+    generation: Optional[str] = None,
+    size_bytes: Optional[int] = None,
+    content_type: Optional[str] = None
+) -> str:
     """
     Run the complete vectorization pipeline for a file.
     
+    Each run emits a structured trace log with the duration of each stage
+    (download, upload, vector store attach, polling) and the bytes moved.
+    
+    Before any download, status write or OpenAI call, the upload is validated
+    from its name, size and content type, then from its first bytes: a file of
+    an unsupported type, too large, or whose content does not match its
+    extension (e.g., a renamed binary) is marked failed and not processed.
+    
+    Completed stages are checkpointed in the processing status document under the
+    storage generation of the object. A retry of the same generation resumes after
+    the last completed stage, so the file is never uploaded to OpenAI twice.
+    A lease on the object generation makes duplicate deliveries that arrive while
+    the pipeline runs, or after it completed, exit immediately; the latter report
+    the outcome of the completed run. A run whose lease was taken over stops at
+    the next stage, before writing any checkpoint or status.
+
     Args:
         file_path: Path to the file in storage (e.g., '/user-documents/user123/document.pdf')
         bucket_name: Name of the Firebase Storage bucket
+        generation: Storage generation of the object; without it every run starts from scratch
+        size_bytes: Size of the object from the storage event; read from storage when None
+        content_type: Content type of the object from the storage event, if known
         
     Returns:
         str: Success/failure message
     """
-    import os
+    return vectorize_file_with_outcome(file_path, bucket_name, generation, size_bytes, content_type)[0]
+
+
+def vectorize_file_with_outcome(
+    file_path: str, 
+    bucket_name: str, 
+    generation: Optional[str] = None,
+    size_bytes: Optional[int] = None,
+    content_type: Optional[str] = None
+) -> Tuple[str, bool]:
+    """
+    Run the vectorization pipeline and report whether it succeeded (see run_vectorize_file).
     
+    Returns:
+        Tuple[str, bool]: Success/failure message, and False if the run failed and can be retried
+    """
+    with start_trace('vectorize_file', file_path=file_path, bucket=bucket_name, generation=generation) as trace:
+        if generation is None:
+            return _run_vectorize_file(file_path, bucket_name, generation, size_bytes, content_type), trace.status == 'ok'
+        
+        # Only one invocation processes a given object generation
+        lease_key = f"{file_path}#{generation}"
+        with span('lease_acquire'):
+            lease = acquire_lease(firestore.client(), lease_key)
+        if lease is None:
+            trace.set_attribute('duplicate', True)
+            outcome = lease_outcome(firestore.client(), lease_key)
+            if outcome:
+                return f"{outcome} (generation {generation} already processed, skipping)", True
+            return f"{get_file_name(file_path)} - Generation {generation} is already being processed, skipping", True
+        
+        lease.start_heartbeat()
+        message = None
+        try:
+            message = _run_vectorize_file(file_path, bucket_name, generation, size_bytes, content_type, lease)
+        except LeaseLost as e:
+            # The new owner runs the pipeline, a retry of this invocation has nothing to do
+            print(f"Stopping {file_path}: {str(e)}")
+            trace.status = 'failed'
+            trace.set_attribute('lease_lost', True)
+            lease.release(completed=False)
+            return f"{get_file_name(file_path)} - {str(e)}, stopped", True
+        except Exception:
+            # The trace only records the error on exit, leave the generation to a retry
+            lease.release(completed=False)
+            raise
+        lease.release(completed=trace.status == 'ok', outcome=message)
+        return message, trace.status == 'ok'
+
+
+def _run_vectorize_file(
+    file_path: str,
+    bucket_name: str,
+    generation: Optional[str],
+    size_bytes: Optional[int] = None,
+    content_type: Optional[str] = None,
+    lease: Optional[Lease] = None
+) -> str:
+    """Run the vectorization stages inside the request trace, checking the lease between stages."""
     # Extract user ID and file name from the path
     user_id = get_user_id(file_path)
     file_name = get_file_name(file_path)
@@ -40,6 +134,21 @@ def run_vectorize_file(file_path: str, bucket_name: str) -> str:
     print(f"Full path: {file_path}")
     print(f"Bucket: {bucket_name}")
     
+    # Reject unsupported, oversized or mislabeled objects before any download or OpenAI call
+    rejection = validate_upload(file_path, bucket_name, size_bytes, content_type)
+    if rejection:
+        print(f"Rejected {file_name}: {rejection}")
+        current_trace().set_attribute('rejected', rejection)
+        update_processing_status(firestore.client(), user_id, file_name, 'failed', rejection)
+        return f"{file_name} - {rejection}"
+    
+    # Archives are extracted and their members ingested in a single job
+    archive_format = get_archive_format(file_name)
+    if archive_format:
+        from archive_ingestion import ingest_archive
+        
+        return ingest_archive(file_path, bucket_name, archive_format, generation, size_bytes, content_type)
+    
     # File type detection
     file_extension = get_file_extension(file_name)
     file_type = detect_file_type(file_extension)
@@ -47,68 +156,141 @@ def run_vectorize_file(file_path: str, bucket_name: str) -> str:
     print(f"File extension: {file_extension}")
     print(f"Detected file type: {file_type}")
     
-    # Initialize Firestore client and create initial uploading status
+    # Initialize Firestore client and resume from the checkpoint of a previous attempt
     db_client = firestore.client()
-    update_processing_status(db_client, user_id, file_name, 'uploading', progress_percentage=0)
+    checkpoint = load_checkpoint(db_client, user_id, file_name, generation)
+    check_lease(lease)
+    if checkpoint.get('indexed'):
+        print(f"{file_name} generation {generation} is already indexed, skipping")
+        current_trace().set_attribute('resumed_from', 'indexed')
+        return f"{file_name} ({file_type}) - Already vectorized and stored in OpenAI Vector Store."
+    
+    # Parts of a split document were uploaded by a previous attempt
+    if checkpoint.get('member_file_ids'):
+        from document_splitter import ingest_split_document
+
+        return ingest_split_document(db_client, file_path, bucket_name, generation, checkpoint, lease=lease)
+
+    if checkpoint.get('file_id'):
+        print(f"Resuming {file_name} from checkpoint: {checkpoint}")
+        current_trace().set_attribute('resumed_from', 'attached' if checkpoint.get('attached') else 'uploaded')
+        update_processing_status(db_client, user_id, file_name, 'vectorizing', progress_percentage=60)
+    else:
+        update_processing_status(
+            db_client, user_id, file_name, 'uploading', progress_percentage=0, checkpoint=checkpoint,
+            metadata=document_metadata(file_path, size_bytes, content_type))
     
     try:
-        # Check if file type is supported by OpenAI FileSearch
-        supported_extensions = {
-            '.pdf', '.docx', '.doc', '.pptx', '.ppt', '.xlsx', '.xls', '.txt', '.rtf', 
-            '.odt', '.ods', '.odp', '.csv', '.tsv', '.json', '.xml', '.html', '.htm',
-            '.md', '.markdown', '.tex', '.latex', '.epub', '.mobi', '.azw3'
-        }
-        
-        if file_extension.lower() not in supported_extensions:
-            error_msg = f"File type not supported by OpenAI FileSearch. Supported types: {', '.join(supported_extensions)}"
-            update_processing_status(db_client, user_id, file_name, 'failed', error_msg)
-            return f"{file_name} ({file_type}) - {error_msg}"
-        
-        openai_client = OpenAI(api_key= os.getenv('OPENAI_API_KEY'))
+        # Images are not indexed by FileSearch directly, their description is indexed instead
+        is_image = file_type == 'IMAGE'
 
-        user_vector_stores_ref = db_client.collection('user_vector_stores').document(user_id)
-        user_vector_stores_doc = user_vector_stores_ref.get()
-        
-        # Download file to memory
-        update_processing_status(db_client, user_id, file_name, 'processing', progress_percentage=20)
-        in_memory_file = download_file_to_memory(file_path, bucket_name, file_extension)
+        openai_client = create_openai_client()
+
+        with span('vector_stores_load'):
+            user_vector_stores_ref = db_client.collection('user_vector_stores').document(user_id)
+            user_vector_stores_doc = user_vector_stores_ref.get()
+            count_firestore(reads=1)
         
-        # Upload to OpenAI
-        update_processing_status(db_client, user_id, file_name, 'processing', progress_percentage=40)
-        file_id = upload_file_to_openai(in_memory_file, openai_client, file_name)
+        file_id = checkpoint.get('file_id')
+        if not file_id:
+            # Download file to memory
+            update_processing_status(db_client, user_id, file_name, 'processing', progress_percentage=20)
+            in_memory_file = download_file_to_memory(file_path, bucket_name, file_extension)
+            upload_file_name = file_name
+            checkpoint['downloaded'] = True
+            check_lease(lease)
+
+            # Oversized documents are cut into parts that are ingested in parallel
+            from document_splitter import needs_split
+
+            if needs_split(file_name, in_memory_file.getbuffer().nbytes):
+                from document_splitter import ingest_split_document
+
+                return ingest_split_document(
+                    db_client, file_path, bucket_name, generation, checkpoint, in_memory_file, lease)
+
+            # Replace images by their markdown description
+            if is_image:
+                update_processing_status(db_client, user_id, file_name, 'processing', progress_percentage=30)
+                image_bytes = in_memory_file.getvalue()
+                in_memory_file.close()
+                with span('image_description'):
+                    in_memory_file = image_to_markdown_file(openai_client, image_bytes, file_name, db_client)
+                upload_file_name = f"{file_name}.md"
+            
+            # Upload to OpenAI and checkpoint the file ID right away
+            check_lease(lease)
+            update_processing_status(
+                db_client, user_id, file_name, 'processing', progress_percentage=40, checkpoint=checkpoint)
+            file_id = upload_file_to_openai(in_memory_file, openai_client, upload_file_name)
+            checkpoint['file_id'] = file_id
+            check_lease(lease)
+            update_processing_status(
+                db_client, user_id, file_name, 'processing', progress_percentage=50,
+                file_id=file_id, checkpoint=checkpoint)
         
         # Get or create vector store
+        check_lease(lease)
         update_processing_status(db_client, user_id, file_name, 'vectorizing', progress_percentage=60)
-        vector_store_id = get_vector_store(user_id, user_vector_stores_doc, openai_client)
+        vector_store_id = checkpoint.get('vector_store_id')
+        if not vector_store_id:
+            with span('vector_store_lookup'):
+                vector_store_id = get_vector_store(user_id, user_vector_stores_doc, openai_client)
+            checkpoint['vector_store_id'] = vector_store_id
         
         # Add file to vector store
-        update_processing_status(
-            db_client, user_id, file_name, 'vectorizing', progress_percentage=80, file_id=file_id)
-        add_file_to_vector_store(openai_client, vector_store_id, file_id)
+        if not checkpoint.get('attached'):
+            check_lease(lease)
+            update_processing_status(
+                db_client, user_id, file_name, 'vectorizing', progress_percentage=80, file_id=file_id,
+                vector_store_id=vector_store_id, checkpoint=checkpoint)
+            with span('vector_store_attach'):
+                add_file_to_vector_store(
+                    openai_client, vector_store_id, file_id,
+                    attributes=build_file_attributes(file_name, file_type)
+                )
+            checkpoint['attached'] = True
+            check_lease(lease)
+            update_processing_status(
+                db_client, user_id, file_name, 'vectorizing', progress_percentage=85,
+                file_id=file_id, vector_store_id=vector_store_id, checkpoint=checkpoint)
         
         # Wait for processing to complete
-        await_vector_store_processing(openai_client, vector_store_id, file_id)
+        with span('vector_store_polling'):
+            await_vector_store_processing(openai_client, vector_store_id, file_id)
         
         # Update Firestore with vector store info
+        check_lease(lease)
         update_processing_status(
             db_client, user_id, file_name, 'vectorizing', 
             progress_percentage=90, file_id=file_id, vector_store_id=vector_store_id)
-        update_firestore_vector_store(
-            user_vector_stores_ref, 
-            user_vector_stores_doc, 
-            user_id, vector_store_id
-        )
+        with span('vector_stores_save'):
+            update_firestore_vector_store(
+                user_vector_stores_ref, 
+                user_vector_stores_doc, 
+                user_id, vector_store_id
+            )
         
         # Mark as completed
+        checkpoint['indexed'] = True
         update_processing_status(
             db_client, user_id, file_name, 'completed', 
-            progress_percentage=100, file_id=file_id, vector_store_id=vector_store_id)
+            progress_percentage=100, file_id=file_id, vector_store_id=vector_store_id,
+            checkpoint=checkpoint)
+
+        # Summary and outline are generated in the background by the summarize_document trigger
+        request_document_summary(db_client, user_id, file_name, generation, vector_store_id)
             
         return f"{file_name} ({file_type}) - OpenAI Vector Store pipeline successful! File vectorized and stored in OpenAI Vector Store."
             
+    except LeaseLost:
+        # The status belongs to the new owner of the lease
+        raise
+
     except Exception as e:
         error_msg = f"OpenAI Vector Store processing failed: {str(e)}"
         print(f"Error during OpenAI Vector Store processing: {str(e)}")
+        current_trace().status = 'failed'
         
         # Update status to failed if we have the db_client
         if 'db_client' in locals():
@@ -133,6 +315,54 @@ def run_vectorize_file(file_path: str, bucket_name: str) -> str:
                     time.sleep(1)  # Wait before retrying
 
 
+def validate_upload(
+    file_path: str,
+    bucket_name: str,
+    size_bytes: Optional[int],
+    content_type: Optional[str]
+) -> Optional[str]:
+    """
+    Check an upload from its metadata and first bytes, without downloading it.
+
+    The name, size and content type are checked first. The first SNIFF_BYTES
+    bytes are then read with a ranged request to check that the content matches
+    the extension. The object metadata is only read from storage when the size
+    is not known from the event.
+
+    Args:
+        file_path: Path to the file in storage (e.g., 'user-documents/user123/document.pdf')
+        bucket_name: Name of the Firebase Storage bucket
+        size_bytes: Size of the object from the storage event, None if unknown
+        content_type: Content type of the object from the storage event, None if unknown
+
+    Returns:
+        Optional[str]: Reason of the rejection, None if the upload can be processed
+    """
+    file_name = get_file_name(file_path)
+    rejection = check_upload_metadata(file_name, size_bytes, content_type)
+    if rejection:
+        return rejection
+
+    with span('upload_validation') as span_attributes:
+        blob = storage.bucket(bucket_name).blob(file_path)
+        try:
+            if size_bytes is None:
+                blob.reload()
+                rejection = check_upload_metadata(file_name, blob.size, content_type or blob.content_type)
+                if rejection:
+                    return rejection
+            header = blob.download_as_bytes(start=0, end=SNIFF_BYTES - 1)
+        except NotFound:
+            return "File no longer exists in storage"
+        except Exception as e:
+            # The download reports storage errors, validation does not block on them
+            print(f"Error reading the first bytes of {file_name}: {str(e)}")
+            return None
+        add_bytes('in', len(header))
+        span_attributes['bytes'] = len(header)
+        return check_upload_content(file_name, header)
+
+
 def download_file_to_memory(
     file_path: str, 
     bucket_name: str, 
@@ -157,7 +387,10 @@ def download_file_to_memory(
     
     print(f"Downloading file from Firebase Storage: {file_path}")
     # Download file content as bytes
-    file_bytes = blob.download_as_bytes()
+    with span('download') as span_attributes:
+        file_bytes = blob.download_as_bytes()
+        span_attributes['bytes'] = len(file_bytes)
+        add_bytes('in', len(file_bytes))
     # Create an in-memory bytes object
     in_memory_file = io.BytesIO(file_bytes)
     
@@ -181,10 +414,19 @@ def upload_file_to_openai(temp_file: 'io.BytesIO', openai_client: OpenAI, file_n
         Exception: If file upload fails
     """
     try:
-        file_upload = openai_client.files.create(
-            file=(file_name, temp_file),
-            purpose='assistants'
-        )
+        upload_size = temp_file.seek(0, io.SEEK_END)
+        temp_file.seek(0)
+        def create_file():
+            # A retried upload sends the content again from the start
+            temp_file.seek(0)
+            return openai_client.files.create(
+                file=(file_name, temp_file),
+                purpose='assistants'
+            )
+
+        with span('upload', bytes=upload_size):
+            file_upload = call_openai('files.create', create_file)
+        add_bytes('out', upload_size)
     
         print(f"File uploaded to OpenAI with ID: {file_upload.id}")
         return file_upload.id
@@ -220,7 +462,8 @@ def get_vector_store(
             print(f"Using existing vector store: {vector_store_id}")
         else:
             # Create new vector store
-            vector_store = openai_client.vector_stores.create(
+            vector_store = call_openai(
+                'vector_stores.create', openai_client.vector_stores.create,
                 name=f"Vector Store for {user_id}",
                 expires_after={"anchor": "last_active_at", "days": 30}
             )
@@ -228,7 +471,8 @@ def get_vector_store(
             print(f"Created new vector store: {vector_store_id}")
     else:
         # Create new vector store for new user
-        vector_store = openai_client.vector_stores.create(
+        vector_store = call_openai(
+            'vector_stores.create', openai_client.vector_stores.create,
             name=f"Vector Store for {user_id}",
             expires_after={"anchor": "last_active_at", "days": 30}
         )
@@ -237,10 +481,29 @@ def get_vector_store(
     
     return vector_store_id
 
+def build_file_attributes(file_name: str, file_type: str) -> dict:
+    """
+    Build the vector store file attributes used to scope chat retrieval.
+    
+    Args:
+        file_name: Name of the file as uploaded by the user (e.g., 'document.pdf')
+        file_type: Detected file type (e.g., 'PDF')
+        
+    Returns:
+        dict: Attributes with the file name, file type and upload time (Unix seconds)
+    """
+    return {
+        'file_name': file_name,
+        'file_type': file_type,
+        'uploaded_at': int(datetime.now().timestamp()),
+    }
+
+
 def add_file_to_vector_store(
     openai_client: OpenAI, 
     vector_store_id: str, 
-    file_id: str
+    file_id: str,
+    attributes: Optional[dict] = None
 ) -> str:
     """
     Add a file to a vector store.
@@ -249,13 +512,16 @@ def add_file_to_vector_store(
         openai_client: OpenAI client instance
         vector_store_id: ID of the vector store
         file_id: ID of the file to add
+        attributes: Optional file attributes that FileSearch filters can match
         
     Returns:
         str: ID of the vector store file (same as file_id for consistency)
     """
-    vector_store_file = openai_client.vector_stores.files.create(
+    vector_store_file = call_openai(
+        'vector_stores.files.create', openai_client.vector_stores.files.create,
         vector_store_id=vector_store_id,
-        file_id=file_id
+        file_id=file_id,
+        **({'attributes': attributes} if attributes else {})
     )
     
     print(f"File added to vector store with ID: {vector_store_file.id}")
@@ -282,10 +548,13 @@ def await_vector_store_processing(
     
     elapsed_seconds = 0    
     while elapsed_seconds < AWAIT_MAX_SECONDS:
-        file_status = openai_client.vector_stores.files.retrieve(
+        file_status = call_openai(
+            'vector_stores.files.retrieve', openai_client.vector_stores.files.retrieve,
             vector_store_id=vector_store_id,
-            file_id=file_id
+            file_id=file_id,
+            hedge=True
         )
+        current_trace().add('vector_store_polls')
         
         if file_status.status == 'completed':
             print("File processing completed successfully")
@@ -325,6 +594,7 @@ def update_firestore_vector_store(
             'user_id': user_id,
             'vector_store_ids': [vector_store_id]
         })
+        count_firestore(writes=1)
     else:
         # Update existing user vector stores document
         user_data = user_vector_stores_doc.to_dict()
@@ -335,9 +605,65 @@ def update_firestore_vector_store(
             user_vector_stores_ref.update({
                 'vector_store_ids': vector_store_ids
             })
+            count_firestore(writes=1)
 
     print(f"Updated Firestore with vector store ID: {vector_store_id}")
 
+def load_checkpoint(db_client, user_id: str, file_name: str, generation: Optional[str]) -> dict:
+    """
+    Read the pipeline checkpoint of a file generation from its processing status.
+    
+    Args:
+        db_client: Firestore client instance
+        user_id: ID of the user
+        file_name: Name of the file being processed
+        generation: Storage generation of the object
+        
+    Returns:
+        dict: The stored checkpoint when it belongs to the same generation, otherwise
+            a fresh checkpoint (generation, downloaded, file_id, vector_store_id,
+            attached, indexed) that replaces the stored one on the next status update
+    """
+    fresh_checkpoint = {
+        'generation': generation,
+        'downloaded': False,
+        'file_id': None,
+        'vector_store_id': None,
+        'attached': False,
+        'indexed': False,
+    }
+    if generation is None:
+        return fresh_checkpoint
+    
+    with span('checkpoint_load'):
+        status_doc = db_client.collection('document_processing_status').document(get_status_document_id(user_id, file_name)).get()
+        count_firestore(reads=1)
+    checkpoint = (status_doc.to_dict() or {}).get('checkpoint') if status_doc.exists else None
+    if not checkpoint or checkpoint.get('generation') != generation:
+        return fresh_checkpoint
+    return {**fresh_checkpoint, **checkpoint}
+
+
+def save_checkpoint(db_client, user_id: str, file_name: str, checkpoint: dict) -> None:
+    """
+    Store the pipeline checkpoint of a file without changing its status.
+    
+    Used by stages that checkpoint many times while they run (the uploads of
+    archive members and document parts), where update_processing_status would
+    also update the processing summary and the catalog of the user each time.
+    
+    Args:
+        db_client: Firestore client instance
+        user_id: ID of the user
+        file_name: Name of the file being processed
+        checkpoint: Pipeline checkpoint to store (see load_checkpoint)
+    """
+    document_id = get_status_document_id(user_id, file_name)
+    db_client.collection('document_processing_status').document(document_id).set(
+        {'checkpoint': {**checkpoint, 'updated_at': datetime.now()}}, merge=True)
+    count_firestore(writes=1)
+
+
 def update_processing_status(
     db_client, 
     user_id: str, 
@@ -346,11 +672,19 @@ def update_processing_status(
     error_message: str = None,
     progress_percentage: int = None,
     file_id: str = None,
-    vector_store_id: str = None
+    vector_store_id: str = None,
+    checkpoint: dict = None,
+    metadata: dict = None
 ) -> None:
     """
     Update the processing status of a document in Firestore for real-time notifications.
     
+    The status is also recorded in the processing summary of the user, and status
+    changes in CATALOG_STATUSES are copied to the document catalog of the user.
+    Progress updates that keep the status of the file skip the summary
+    transaction (see processing_summary), and failures of any of the three
+    writes are logged with their severity rather than failing the pipeline.
+    
     Args:
         db_client: Firestore client instance
         user_id: ID of the user
@@ -358,10 +692,12 @@ def update_processing_status(
         status: Current processing status
         error_message: Error message if status is 'failed'
         progress_percentage: Progress percentage (0-100)
+        checkpoint: Pipeline checkpoint to store (see load_checkpoint)
+        metadata: Size, content type and upload time for the catalog (see document_metadata)
     """
     try:
         # Create a unique document ID that combines user_id and file_name
-        document_id = f"{user_id}_{file_name}"
+        document_id = get_status_document_id(user_id, file_name)
         status_ref = db_client.collection('document_processing_status').document(document_id)
         
         update_data = {
@@ -383,13 +719,24 @@ def update_processing_status(
         if vector_store_id:
             update_data['vector_store_id'] = vector_store_id
             
+        if checkpoint is not None:
+            update_data['checkpoint'] = {**checkpoint, 'updated_at': datetime.now()}
+            
         if status == 'uploading':
             update_data['started_at'] = datetime.now()
         elif status in ['completed', 'failed']:
             update_data['completed_at'] = datetime.now()
             
         status_ref.set(update_data, merge=True)
+        count_firestore(writes=1)
         print(f"Updated processing status for {file_name}: {status}")
         
+        update_processing_summary(db_client, user_id, file_name, status, progress_percentage, error_message)
+        if status in CATALOG_STATUSES:
+            upsert_catalog_entry(db_client, user_id, file_name, {
+                **(metadata or {}), 'status': status, 'file_id': file_id
+            })
+        
     except Exception as e:
-        print(f"Error updating processing status: {str(e)}")
+        log_event('processing_status_update_failed', severity='ERROR',
+                  user_id=user_id, file_name=file_name, status=status, error=str(e))
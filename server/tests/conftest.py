@@ -0,0 +1,53 @@
+"""
+Shared fixtures of the tests of server/functions.
+
+The functions run unchanged against the in-memory Firestore, Cloud Storage,
+OpenAI and Agents SDK of server/benchmarks/fakes.py. The fakes are installed
+once, before any module of server/functions is imported, since those modules
+bind the fake services at import time; every test then starts from empty
+services, closed circuits, a fresh budget tracker and short retry delays.
+Run from the repository root:
+
+    python -m pytest -q server/tests
+"""
+import dataclasses
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+from fakes import FakeConfig, install_fakes  # noqa: E402
+
+FAKES = install_fakes(FakeConfig())
+
+
+@pytest.fixture(autouse=True)
+def fakes(monkeypatch):
+    """The fake services, emptied before each test."""
+    import openai_calls
+    import openai_quota
+    import processing_summary
+
+    FAKES.reset()
+    openai_calls._breakers.clear()
+    processing_summary._last_written.clear()
+    monkeypatch.setattr(openai_quota, '_tracker', openai_quota.BudgetTracker())
+    for name, policy in list(openai_calls.RETRY_POLICIES.items()):
+        monkeypatch.setitem(openai_calls.RETRY_POLICIES, name, dataclasses.replace(
+            policy, base_delay_seconds=0.001, max_delay_seconds=0.01))
+    yield FAKES
+    FAKES.reset()
+    openai_calls._breakers.clear()
+
+
+@pytest.fixture
+def config(fakes, monkeypatch):
+    """Set latencies of the fake services for one test, e.g. config(agent_latency=0.1)."""
+    def configure(**values):
+        for key, value in values.items():
+            monkeypatch.setattr(fakes.config, key, value)
+            if key == 'firestore_latency':
+                monkeypatch.setattr(fakes.db, 'latency', value)
+    return configure
@@ -0,0 +1,190 @@
+"""Tests of the ingestion of archives, member by member."""
+import io
+import zipfile
+
+BUCKET = 'archive-bucket'
+USER_ID = 'archive-user'
+ARCHIVE_PATH = f'user-documents/{USER_ID}/folder.zip'
+FILES = 10
+
+
+def document_bytes(index: int, size: int) -> bytes:
+    return b'%PDF-1.7\n' + str(index).encode() * (size // len(str(index)))
+
+
+def put_archive(fakes, sizes: dict = None) -> str:
+    """Store a .zip of FILES documents, of 256 bytes unless given in sizes, and return its path."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for index in range(FILES):
+            archive.writestr(f'folder/doc{index}.pdf', document_bytes(index, (sizes or {}).get(index, 256)))
+    fakes.storage.put(BUCKET, ARCHIVE_PATH, buffer.getvalue(), 'application/zip')
+    return ARCHIVE_PATH
+
+
+def archive_status(fakes) -> dict:
+    return fakes.db.documents.get(f'document_processing_status/{USER_ID}_folder.zip') or {}
+
+
+def test_members_indexed(fakes):
+    from vectorize_file import run_vectorize_file
+
+    message = run_vectorize_file(put_archive(fakes), BUCKET, '1')
+    members = [
+        data for path, data in fakes.db.documents.items()
+        if path.startswith(f'document_processing_status/{USER_ID}_folder.zip%2F')
+    ]
+
+    assert 'successful' in message
+    assert fakes.openai.stats.calls['files.create'] == FILES
+    assert len(members) == FILES
+    assert all(member['status'] == 'completed' for member in members)
+
+
+def test_failed_attach_resumes_without_uploads(fakes):
+    from vectorize_file import run_vectorize_file
+
+    path = put_archive(fakes)
+    failures = {'left': 1}
+
+    def fail_batch_once(endpoint: str) -> None:
+        if endpoint == 'vector_stores.file_batches.create' and failures['left']:
+            failures['left'] -= 1
+            raise RuntimeError('injected batch failure')
+
+    fakes.openai.fault_injector = fail_batch_once
+    first = run_vectorize_file(path, BUCKET, '2')
+    second = run_vectorize_file(path, BUCKET, '2')
+
+    assert 'failed' in first
+    assert 'successful' in second
+    assert fakes.openai.stats.calls['files.create'] == FILES
+
+
+def test_interrupted_extraction_resumes_from_checkpoint(fakes, monkeypatch):
+    import archive_ingestion
+    from vectorize_file import run_vectorize_file
+
+    path = put_archive(fakes)
+    iter_members = archive_ingestion.iter_archive_members
+    interrupt_after = FILES // 2
+
+    def interrupted_once(archive_file, archive_format):
+        monkeypatch.setattr(archive_ingestion, 'iter_archive_members', iter_members)
+        for index, member in enumerate(iter_members(archive_file, archive_format)):
+            if index == interrupt_after:
+                raise ConnectionError('injected stream failure')
+            yield member
+
+    monkeypatch.setattr(archive_ingestion, 'iter_archive_members', interrupted_once)
+    first = run_vectorize_file(path, BUCKET, '3')
+    checkpointed = (archive_status(fakes).get('checkpoint') or {}).get('member_file_ids') or {}
+    second = run_vectorize_file(path, BUCKET, '3')
+
+    assert 'failed' in first
+    assert len(checkpointed) == interrupt_after
+    assert 'successful' in second
+    assert fakes.openai.stats.calls['files.create'] == FILES
+
+
+def test_extracted_size_limit_before_upload(fakes, monkeypatch):
+    import archive_ingestion
+    from vectorize_file import run_vectorize_file
+
+    path = put_archive(fakes)
+    monkeypatch.setattr(archive_ingestion, 'MAX_EXTRACTED_BYTES', FILES * 256 // 2)
+
+    assert 'expands to more than' in run_vectorize_file(path, BUCKET, '4')
+    assert fakes.openai.stats.calls.get('files.create', 0) == 0
+
+
+def test_member_larger_than_listed_fails_alone(fakes, monkeypatch):
+    import archive_ingestion
+    from vectorize_file import run_vectorize_file
+
+    path = put_archive(fakes, sizes={0: 4096})
+    list_members = archive_ingestion.list_archive_members
+
+    def understated_sizes(archive_file, archive_format):
+        return [(name, 1 if name == 'folder/doc0.pdf' else size)
+                for name, size in list_members(archive_file, archive_format)]
+
+    monkeypatch.setattr(archive_ingestion, 'list_archive_members', understated_sizes)
+    monkeypatch.setattr(archive_ingestion, 'MAX_MEMBER_BYTES', 1024)
+    result = run_vectorize_file(path, BUCKET, '5')
+    member = fakes.db.documents.get(f'document_processing_status/{USER_ID}_folder.zip%2Ffolder%2Fdoc0.pdf') or {}
+
+    assert 'successful' in result
+    assert member.get('status') == 'failed'
+    assert 'larger than' in member.get('error_message', '')
+    assert fakes.openai.stats.calls['files.create'] == FILES - 1
+
+
+def test_members_uploaded_concurrently(fakes, config):
+    import archive_ingestion
+    from vectorize_file import run_vectorize_file
+
+    config(openai_latency=0.02)
+    run_vectorize_file(put_archive(fakes), BUCKET, '6')
+
+    assert fakes.openai.stats.peak_in_flight['files.create'] == min(archive_ingestion.ARCHIVE_UPLOAD_CONCURRENCY, FILES)
+
+
+def test_delete_removes_every_member(fakes):
+    from delete_file import delete_file_from_openai
+    from vectorize_file import run_vectorize_file
+
+    run_vectorize_file(put_archive(fakes), BUCKET, '1')
+    deleted = delete_file_from_openai(USER_ID, 'folder.zip')
+
+    assert deleted['success']
+    assert not fakes.openai.files
+    assert not [path for path in fakes.db.documents if path.startswith('document_processing_status/')]
+
+
+def test_chat_scoped_to_the_archive_matches_its_members(fakes):
+    from chat import build_document_filter
+    from vectorize_file import run_vectorize_file
+
+    run_vectorize_file(put_archive(fakes), BUCKET, '1')
+    attributes = [vector_store_file.attributes for vector_store_file in fakes.openai.vector_store_files.values()]
+    document_filter = build_document_filter(['folder.zip'])
+
+    assert len(attributes) == FILES
+    assert all(item['file_type'] == 'PDF' for item in attributes)
+    assert all(
+        any(item.get(condition['key']) == condition['value'] for condition in document_filter['filters'])
+        for item in attributes
+    )
+    # A member can still be scoped on its own
+    assert build_document_filter(['folder.zip/folder/doc0.pdf']) == {
+        'type': 'eq', 'key': 'file_name', 'value': 'folder.zip/folder/doc0.pdf'}
+
+
+def test_members_deleted_concurrently(fakes, config):
+    import delete_file
+    from delete_file import delete_file_from_openai
+    from vectorize_file import run_vectorize_file
+
+    run_vectorize_file(put_archive(fakes), BUCKET, '1')
+    config(openai_latency=0.02)
+    deleted = delete_file_from_openai(USER_ID, 'folder.zip')
+
+    assert deleted['success']
+    assert fakes.openai.stats.peak_in_flight['files.delete'] == min(delete_file.MEMBER_DELETE_CONCURRENCY, FILES)
+
+
+def test_trigger_hands_archives_to_the_workers(fakes):
+    import main
+    from fakes import FakeCloudEvent, FakeStorageObjectData
+
+    path = put_archive(fakes)
+    stored = fakes.storage.objects[(BUCKET, path)]
+    message = main.vectorize_file(FakeCloudEvent(FakeStorageObjectData(
+        name=path, bucket=BUCKET, size=len(stored['data']), content_type='application/zip',
+        generation=stored['generation'])))
+    jobs = [data for key, data in fakes.db.documents.items() if key.startswith('ingestion_jobs/')]
+
+    assert 'Queued' in message
+    assert [job['file_path'] for job in jobs] == [path]
+    assert fakes.openai.stats.calls.get('files.create', 0) == 0
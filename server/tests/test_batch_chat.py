@@ -0,0 +1,58 @@
+"""Tests of batch_chat, answering a list of questions in one call."""
+import pytest
+
+USER_ID = 'batch-user'
+PROMPTS = [f"What does section {index} of the contract say about termination fees?" for index in range(12)]
+
+
+@pytest.fixture(autouse=True)
+def vector_store(fakes):
+    fakes.db.documents[f'user_vector_stores/{USER_ID}'] = {'vector_store_ids': ['vs_batch']}
+
+
+def test_answers_in_prompt_order(fakes, config):
+    from batch_chat import run_batch_chat
+
+    config(agent_latency=0.05)
+    answers = run_batch_chat(USER_ID, PROMPTS)['data']['answers']
+
+    assert len(answers) == len(PROMPTS)
+    assert all(prompt[:80] in answer['answer'] for prompt, answer in zip(PROMPTS, answers))
+    assert all(answer['latency_ms'] >= 50 for answer in answers)
+
+
+def test_prompts_run_concurrently(fakes, config):
+    from batch_chat import BATCH_CHAT_CONCURRENCY, run_batch_chat
+
+    config(agent_latency=0.05)
+    run_batch_chat(USER_ID, PROMPTS)
+
+    assert fakes.runner.stats.runs == len(PROMPTS)
+    assert fakes.runner.stats.peak_in_flight == min(BATCH_CHAT_CONCURRENCY, len(PROMPTS))
+
+
+def test_no_transcript_by_default(fakes):
+    from batch_chat import run_batch_chat
+
+    run_batch_chat(USER_ID, PROMPTS)
+
+    assert not [path for path in fakes.db.documents if path.startswith('sessions/')]
+
+
+def test_transcript_with_session(fakes):
+    from batch_chat import run_batch_chat
+
+    run_batch_chat(USER_ID, PROMPTS[:5], session_id='review-session')
+    stored = sorted(
+        (data for path, data in fakes.db.documents.items() if path.startswith('sessions/review-session/messages/')),
+        key=lambda data: str(data.get('createdAt')))
+
+    assert [data['message'] for data in stored if data.get('role') == 'user'] == PROMPTS[:5]
+
+
+def test_foreign_session_refused(fakes):
+    from batch_chat import run_batch_chat
+
+    fakes.db.documents['sessions/other-session'] = {'userId': 'someone-else'}
+
+    assert not run_batch_chat(USER_ID, PROMPTS[:1], session_id='other-session')['success']
@@ -0,0 +1,105 @@
+"""Tests of the deduplication of retried chat messages by their clientMessageId."""
+import threading
+from datetime import timedelta
+
+import pytest
+
+USER_ID = 'idempotency-user'
+SESSION_ID = 'idempotency-session'
+PROMPT = 'What does the contract say about termination fees?'
+
+
+@pytest.fixture(autouse=True)
+def session(fakes):
+    """A session with a first turn, whose title agent run is out of the way."""
+    from chat import run_chat
+
+    fakes.db.documents[f'user_vector_stores/{USER_ID}'] = {'vector_store_ids': ['vs_idempotency']}
+    run_chat(USER_ID, PROMPT, SESSION_ID, client_message_id='message-1')
+
+
+def test_replay_returns_stored_answer(fakes):
+    from chat import run_chat
+
+    first = fakes.db.documents[f'sessions/{SESSION_ID}/chat_executions/message-1']['response']
+    runs = fakes.runner.stats.runs
+    before = fakes.db.stats.snapshot()
+    replay = run_chat(USER_ID, PROMPT, SESSION_ID, client_message_id='message-1', include_timings=True)
+    operations = fakes.db.stats - before
+
+    assert first['success']
+    assert replay['data'] == first['data']
+    assert replay['meta']['deduplicated'] is True
+    assert fakes.runner.stats.runs == runs
+    counters = replay['meta']['timings']['counters']
+    assert counters.get('firestore_reads', 0) == operations.reads == 1
+    assert counters.get('firestore_writes', 0) == operations.writes == 0
+
+
+def test_concurrent_retry_waits_for_running_attempt(fakes, config, monkeypatch):
+    import chat_idempotency
+    from chat import run_chat
+
+    config(agent_latency=0.3)
+    monkeypatch.setattr(chat_idempotency, 'WAIT_POLL_SECONDS', 0.02)
+    runs = fakes.runner.stats.runs
+    answers = {}
+
+    def attempt(label: str) -> None:
+        answers[label] = run_chat(USER_ID, 'And the notice period?', SESSION_ID, client_message_id='message-2')
+
+    original = threading.Thread(target=attempt, args=('original',))
+    original.start()
+    while not fakes.db.documents.get(f'sessions/{SESSION_ID}/chat_executions/message-2'):
+        original.join(0.001)
+    retry = threading.Thread(target=attempt, args=('retry',))
+    retry.start()
+    original.join()
+    retry.join()
+
+    assert fakes.runner.stats.runs - runs == 1
+    assert answers['original']['success']
+    assert answers['retry']['data'] == answers['original']['data']
+    assert answers['retry']['meta']['deduplicated'] is True
+
+
+def test_failed_attempt_is_run_again(fakes):
+    from chat import run_chat
+
+    def fail_once(endpoint: str) -> None:
+        fakes.runner.fault_injector = None
+        raise RuntimeError('model unavailable')
+
+    fakes.runner.fault_injector = fail_once
+    runs = fakes.runner.stats.runs
+    failed = run_chat(USER_ID, 'Who signed it?', SESSION_ID, client_message_id='message-3')
+    retried = run_chat(USER_ID, 'Who signed it?', SESSION_ID, client_message_id='message-3')
+
+    assert not failed['success']
+    assert retried['success']
+    assert not retried.get('meta', {}).get('deduplicated')
+    assert fakes.runner.stats.runs - runs == 2
+
+
+def test_message_id_of_another_user_rejected():
+    from chat import run_chat
+
+    foreign = run_chat('another-user', PROMPT, SESSION_ID, client_message_id='message-1')
+
+    assert not foreign['success']
+    assert foreign['data'] is None
+
+
+def test_outcome_of_taken_over_execution_not_recorded(fakes):
+    from chat_idempotency import IN_FLIGHT_TIMEOUT_SECONDS, begin_chat_execution, complete_chat_execution
+
+    path = f'sessions/{SESSION_ID}/chat_executions/message-4'
+    begin_chat_execution(fakes.db, USER_ID, SESSION_ID, 'message-4', 'stale-owner')
+    fakes.db.documents[path]['startedAt'] -= timedelta(seconds=IN_FLIGHT_TIMEOUT_SECONDS + 1)
+    assert begin_chat_execution(fakes.db, USER_ID, SESSION_ID, 'message-4', 'new-owner') is None
+
+    complete_chat_execution(fakes.db, SESSION_ID, 'message-4', 'stale-owner', {'answer': 'stale'})
+    assert fakes.db.documents[path]['status'] == 'in_flight'
+    complete_chat_execution(fakes.db, SESSION_ID, 'message-4', 'new-owner', {'answer': 'fresh'})
+    assert fakes.db.documents[path]['status'] == 'completed'
+    assert fakes.db.documents[path]['response'] == {'answer': 'fresh'}
@@ -0,0 +1,99 @@
+"""Tests of the model routing of chat turns."""
+import json
+
+import pytest
+
+import fakes as fake_services
+from fakes import APIStatusError, FakeObject
+
+# prompt, documents, expected tier, expected retrieval
+ROUTING_TABLE = [
+    ('hi', None, 'trivial', False),
+    ('Thanks a lot!', None, 'trivial', False),
+    ('good morning', None, 'trivial', False),
+    ('got it, bye', None, 'standard', True),
+    ('yes', None, 'standard', True),
+    ('Yes please', None, 'standard', True),
+    ('no', None, 'standard', True),
+    ('sure!', None, 'standard', True),
+    ('ok', None, 'standard', True),
+    ('okay', None, 'standard', True),
+    ('sounds good', None, 'standard', True),
+    ('thanks', ['contract.pdf'], 'standard', True),
+    ('What is the notice period?', None, 'standard', True),
+    ('What is the notice period? And the fees?', None, 'complex', True),
+    ('Compare the fees of both contracts', None, 'complex', True),
+    ('Summarize the lease', None, 'complex', True),
+    ('What does it say?', ['a.pdf', 'b.pdf'], 'complex', True),
+    (' '.join(['word'] * 45), None, 'complex', True),
+]
+
+
+@pytest.fixture
+def classifier(monkeypatch):
+    """Make the fake chat completions answer the classifier with the given content."""
+    def answer(content: str) -> None:
+        def create(self, model: str, messages: list, **kwargs):
+            self._backend.call('chat.completions.create')
+            return FakeObject(choices=[FakeObject(message=FakeObject(role='assistant', content=content))])
+        monkeypatch.setattr(fake_services._FakeChatCompletions, 'create', create)
+    monkeypatch.setenv('CHAT_ROUTER', 'model')
+    return answer
+
+
+@pytest.mark.parametrize('prompt, documents, tier, retrieval', ROUTING_TABLE)
+def test_heuristic_router(prompt, documents, tier, retrieval):
+    from chat_routing import route_prompt
+
+    decision = route_prompt(prompt, documents)
+
+    assert (decision.tier, decision.use_retrieval) == (tier, retrieval)
+
+
+def test_model_router(fakes, classifier):
+    from chat_routing import route_prompt
+
+    classifier(json.dumps({'tier': 'complex'}))
+    classified = route_prompt('What is the notice period?')
+    classifier(json.dumps({'tier': 'trivial'}))
+    trivial_scoped = route_prompt('thanks', ['contract.pdf'])
+
+    assert classified.tier == 'complex'
+    assert classified.router == 'model'
+    # A turn scoped to documents keeps retrieval even when classified trivial
+    assert trivial_scoped.tier == 'standard'
+    assert fakes.openai.stats.calls.get('chat.completions.create') == 2
+
+
+def test_classifier_retried(fakes, classifier):
+    from chat_routing import route_prompt
+
+    def fail_once(endpoint: str) -> None:
+        fakes.openai.fault_injector = None
+        raise APIStatusError('Service unavailable', 503)
+
+    fakes.openai.fault_injector = fail_once
+    classifier(json.dumps({'tier': 'standard'}))
+    retried = route_prompt('Compare the fees of both contracts')
+
+    assert retried.router == 'model'
+    assert retried.tier == 'standard'
+    assert fakes.openai.stats.calls.get('chat.completions.create') == 2
+
+
+def test_unparsable_classifier_falls_back_to_heuristic(classifier):
+    from chat_routing import route_prompt
+
+    classifier('not json')
+    fallback = route_prompt('Compare the fees of both contracts')
+
+    assert fallback.router == 'heuristic'
+    assert fallback.tier == 'complex'
+
+
+def test_router_off(monkeypatch):
+    from chat_routing import route_prompt
+
+    monkeypatch.setenv('CHAT_ROUTER', 'off')
+
+    assert {route_prompt(prompt, documents).tier for prompt, documents, _, _ in ROUTING_TABLE} == {'complex'}
@@ -0,0 +1,114 @@
+"""Tests of the per-user document catalog."""
+import pytest
+
+BUCKET = 'catalog-bucket'
+USER_ID = 'catalog-user'
+DOCUMENTS = 60
+PAGE_SIZE = 25
+
+
+@pytest.fixture(autouse=True)
+def small_shards(monkeypatch):
+    import document_catalog
+
+    monkeypatch.setattr(document_catalog, 'MAX_SHARD_ENTRIES', 16)
+
+
+def seed_documents(fakes, documents: int = DOCUMENTS) -> None:
+    from vectorize_file import run_vectorize_file
+
+    for index in range(documents):
+        path = f'user-documents/{USER_ID}/doc{index:04d}.pdf'
+        data = b'%PDF-1.7\n' + b'0' * (256 + index)
+        stored = fakes.storage.put(BUCKET, path, data, 'application/pdf')
+        run_vectorize_file(path, BUCKET, str(stored['generation']), len(data), 'application/pdf')
+
+
+def list_all() -> list:
+    from document_catalog import list_documents
+
+    names, page_token = [], None
+    while True:
+        response = list_documents(USER_ID, BUCKET, PAGE_SIZE, page_token)
+        assert response['success'], response['message']
+        names += [entry['name'] for entry in response['data']['documents']]
+        page_token = response['data']['nextPageToken']
+        if not page_token:
+            return names
+
+
+def catalog_of(fakes) -> dict:
+    return fakes.db.documents.get(f'document_catalogs/{USER_ID}', {})
+
+
+def test_pipeline_reads_no_object_metadata(fakes):
+    seed_documents(fakes)
+
+    # The first bytes and the download of each document
+    assert fakes.storage.calls == 2 * DOCUMENTS
+
+
+def test_pages_list_every_document_once_newest_first(fakes):
+    seed_documents(fakes)
+
+    assert catalog_of(fakes)['document_count'] == DOCUMENTS
+    assert catalog_of(fakes)['shard_count'] > 1
+    assert list_all() == [f'doc{index:04d}.pdf' for index in reversed(range(DOCUMENTS))]
+
+
+def test_page_load_reads_root_and_shards(fakes):
+    import document_catalog
+
+    seed_documents(fakes)
+    reads, storage_calls = fakes.db.stats.reads, fakes.storage.calls
+    page = document_catalog.list_documents(USER_ID, BUCKET, document_catalog.MAX_PAGE_SIZE)
+    entry = page['data']['documents'][0]
+
+    assert fakes.storage.calls == storage_calls
+    assert fakes.db.stats.reads - reads == 1 + catalog_of(fakes)['shard_count']
+    assert entry['status'] == 'completed'
+    assert entry['file_id']
+    assert entry['size']
+    assert entry['content_type'] == 'application/pdf'
+
+
+def test_status_updates_leave_root_alone(fakes):
+    from vectorize_file import update_processing_status
+
+    seed_documents(fakes, 3)
+    root = dict(catalog_of(fakes))
+    update_processing_status(fakes.db, USER_ID, 'doc0000.pdf', 'completed', progress_percentage=100)
+
+    assert catalog_of(fakes) == root
+
+
+def test_deletions_remove_entries(fakes):
+    from delete_file import delete_file_from_openai
+
+    seed_documents(fakes)
+    for index in range(0, DOCUMENTS, 2):
+        delete_file_from_openai(USER_ID, f'doc{index:04d}.pdf')
+        fakes.storage.objects.pop((BUCKET, f'user-documents/{USER_ID}/doc{index:04d}.pdf'))
+    remaining = list_all()
+
+    assert len(remaining) == DOCUMENTS // 2
+    assert catalog_of(fakes)['document_count'] == len(remaining)
+
+
+def test_missing_catalog_built_on_first_listing(fakes, monkeypatch):
+    import document_catalog
+
+    seed_documents(fakes, 10)
+    for path in [path for path in fakes.db.documents if path.startswith('document_catalogs/')]:
+        del fakes.db.documents[path]
+    list_blobs = type(fakes.storage).list_blobs
+
+    def list_blobs_during_upload(storage, *args, **kwargs):
+        # The pipeline writes an entry while the catalog is being built from storage
+        blobs = list_blobs(storage, *args, **kwargs)
+        document_catalog.upsert_catalog_entry(fakes.db, USER_ID, 'late.pdf', {'status': 'uploading', 'size': 42})
+        return blobs
+
+    monkeypatch.setattr(type(fakes.storage), 'list_blobs', list_blobs_during_upload)
+
+    assert sorted(list_all()) == sorted([f'doc{index:04d}.pdf' for index in range(10)] + ['late.pdf'])
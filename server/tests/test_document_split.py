@@ -0,0 +1,201 @@
+"""Tests of the ingestion of oversized documents as split parts."""
+import io
+import time
+
+import pytest
+
+BUCKET = 'split-bucket'
+USER_ID = 'split-user'
+FILE_NAME = 'ledger.csv'
+FILE_PATH = f'user-documents/{USER_ID}/{FILE_NAME}'
+HEADER = b'date,account,description,amount\n'
+ROWS = 20000
+PART_BYTES = 64 * 1024
+
+
+def ledger_bytes(rows: int) -> bytes:
+    lines = [HEADER] + [
+        f'2025-{index % 12 + 1:02d}-{index % 28 + 1:02d},ACC{index % 97:03d},"Invoice {index}, net 30",{index * 7 % 10000}.50\n'.encode()
+        for index in range(rows)
+    ]
+    return b''.join(lines)
+
+
+DATA = ledger_bytes(ROWS)
+
+
+@pytest.fixture(autouse=True)
+def part_size(monkeypatch):
+    import document_splitter
+
+    monkeypatch.setattr(document_splitter, 'SPLIT_MAX_PART_BYTES', PART_BYTES)
+
+
+def ingest(fakes, generation: str) -> str:
+    from vectorize_file import run_vectorize_file
+
+    fakes.storage.put(BUCKET, FILE_PATH, DATA, 'text/csv')
+    return run_vectorize_file(FILE_PATH, BUCKET, generation)
+
+
+def status_of(fakes, file_name: str) -> dict:
+    from path_handling import get_status_document_id
+
+    return fakes.db.documents.get(f'document_processing_status/{get_status_document_id(USER_ID, file_name)}') or {}
+
+
+def expected_parts() -> int:
+    return len(DATA) // PART_BYTES + 1
+
+
+def test_parts_cover_the_document(fakes):
+    message = ingest(fakes, '1')
+    parts = status_of(fakes, FILE_NAME).get('archive_members') or []
+    contents = list(fakes.openai.file_contents.values())
+
+    assert 'successful' in message
+    assert len(parts) == len(contents) > 1
+    assert max(len(content) for content in contents) <= PART_BYTES
+    assert all(content.startswith(HEADER) for content in contents)
+    assert sum(content.count(b'\n') - 1 for content in contents) == ROWS
+    assert all(status_of(fakes, part).get('status') == 'completed' for part in parts)
+
+
+def test_parts_carry_the_parent_name(fakes):
+    ingest(fakes, '1')
+    attributes = [vector_store_file.attributes for vector_store_file in fakes.openai.vector_store_files.values()]
+
+    assert attributes
+    assert all(item.get('file_name') == FILE_NAME and item.get('part') for item in attributes)
+
+
+def test_parts_uploaded_concurrently(fakes, config):
+    import document_splitter
+
+    config(openai_latency=0.02)
+    ingest(fakes, '1')
+    parts = len(status_of(fakes, FILE_NAME).get('archive_members') or [])
+
+    assert fakes.openai.stats.peak_in_flight['files.create'] == min(document_splitter.SPLIT_UPLOAD_CONCURRENCY, parts)
+
+
+def test_failed_attach_resumes_without_uploads(fakes):
+    failures = {'left': 1}
+
+    def fail_batch_once(endpoint: str) -> None:
+        if endpoint == 'vector_stores.file_batches.create' and failures['left']:
+            failures['left'] -= 1
+            raise RuntimeError('injected batch failure')
+
+    fakes.openai.fault_injector = fail_batch_once
+    first = ingest(fakes, '2')
+    second = ingest(fakes, '2')
+    parts = status_of(fakes, FILE_NAME).get('archive_members') or []
+
+    assert 'failed' in first
+    assert 'successful' in second
+    assert fakes.openai.stats.calls['files.create'] == len(parts)
+
+
+def test_delete_removes_every_part(fakes):
+    from delete_file import delete_file_from_openai
+
+    ingest(fakes, '1')
+    deleted = delete_file_from_openai(USER_ID, FILE_NAME)
+
+    assert deleted['success']
+    assert not fakes.openai.files
+    assert not [path for path in fakes.db.documents if path.startswith('document_processing_status/')]
+
+
+def test_interrupted_split_resumes_from_checkpoint(fakes, monkeypatch):
+    import document_splitter
+
+    cut_parts = document_splitter.cut_parts
+    interrupt_after = expected_parts() // 2
+
+    def interrupted_once(file_name, source, plan):
+        monkeypatch.setattr(document_splitter, 'cut_parts', cut_parts)
+        for index, part in enumerate(cut_parts(file_name, source, plan)):
+            if index == interrupt_after:
+                raise ConnectionError('injected split failure')
+            yield part
+
+    monkeypatch.setattr(document_splitter, 'cut_parts', interrupted_once)
+    first = ingest(fakes, '3')
+    checkpointed = (status_of(fakes, FILE_NAME).get('checkpoint') or {}).get('member_file_ids') or {}
+    second = ingest(fakes, '3')
+
+    assert 'failed' in first
+    assert len(checkpointed) == interrupt_after
+    assert 'successful' in second
+    assert fakes.openai.stats.calls['files.create'] == len(status_of(fakes, FILE_NAME)['archive_members'])
+
+
+def test_part_limit_checked_before_upload(fakes, monkeypatch):
+    import document_splitter
+
+    monkeypatch.setattr(document_splitter, 'SPLIT_MAX_PARTS', 2)
+
+    assert 'failed' in ingest(fakes, '4')
+    assert fakes.openai.stats.calls.get('files.create', 0) == 0
+
+
+def test_each_part_cut_once(fakes, monkeypatch):
+    import document_splitter
+
+    cut_parts = document_splitter.cut_parts
+    cut = []
+
+    def counted(file_name, source, plan):
+        for part in cut_parts(file_name, source, plan):
+            cut.append(part[0])
+            yield part
+
+    monkeypatch.setattr(document_splitter, 'cut_parts', counted)
+    ingest(fakes, '5')
+
+    assert sorted(cut) == sorted(status_of(fakes, FILE_NAME)['archive_members'])
+
+
+def test_pdf_planned_from_page_count(monkeypatch):
+    pypdf = pytest.importorskip('pypdf')
+    import document_splitter
+
+    writer = pypdf.PdfWriter()
+    for _ in range(30):
+        writer.add_blank_page(width=612, height=792)
+    source = io.BytesIO()
+    writer.write(source)
+    monkeypatch.setattr(document_splitter, 'SPLIT_MAX_PART_PAGES', 8)
+    plan = document_splitter.plan_parts('scan.pdf', source, PART_BYTES)
+    parts = list(document_splitter.cut_parts('scan.pdf', source, plan[1:]))
+
+    assert [part[0] for part in plan] == [
+        'scan.pdf/pages-1-8.pdf', 'scan.pdf/pages-9-16.pdf', 'scan.pdf/pages-17-24.pdf', 'scan.pdf/pages-25-30.pdf']
+    assert [name for name, _ in parts] == [part[0] for part in plan[1:]]
+    assert [len(pypdf.PdfReader(io.BytesIO(data)).pages) for _, data in parts] == [8, 8, 6]
+
+
+def test_lost_lease_stops_before_attach(fakes, monkeypatch):
+    import leases
+    from vectorize_file import run_vectorize_file
+
+    monkeypatch.setattr(leases, 'RENEW_INTERVAL_SECONDS', 0.05)
+
+    def take_over_during_upload(endpoint: str) -> None:
+        if endpoint == 'files.create':
+            fakes.openai.fault_injector = None
+            for path, data in fakes.db.documents.items():
+                if path.startswith('processing_leases/'):
+                    data['owner'] = 'another-invocation'
+            time.sleep(0.2)
+
+    fakes.storage.put(BUCKET, FILE_PATH, DATA, 'text/csv')
+    fakes.openai.fault_injector = take_over_during_upload
+    result = run_vectorize_file(FILE_PATH, BUCKET, '6')
+
+    assert 'taken over' in result
+    assert fakes.openai.stats.calls.get('vector_stores.file_batches.create', 0) == 0
+    assert status_of(fakes, FILE_NAME)['status'] == 'processing'
+    assert not status_of(fakes, FILE_NAME).get('archive_members')
@@ -0,0 +1,249 @@
+"""Tests of the per-document summaries and the overview tool of the chat agent."""
+import json
+import re
+
+import pytest
+
+from fakes import FakeChange, FakeCloudEvent
+
+BUCKET = 'summaries-bucket'
+USER_ID = 'summaries-user'
+SECTIONS = 8
+LONG_SECTIONS = 24
+TITLES = [f"{index + 1}. Clause {index + 1}" for index in range(LONG_SECTIONS)]
+
+
+def summarizer(runs: dict):
+    """
+    Scripted answers of the summarizer and combiner agents, default answers for the other agents.
+
+    A window summary outlines the '## ' headings of its text, or SECTIONS
+    numbered sections when there are none; a combined summary concatenates the
+    outlines of its parts. Runs are counted by agent name in runs.
+    """
+    def respond(agent, prompt: str):
+        if agent.name not in ('Document Summarizer', 'Summary Combiner'):
+            return None
+        runs[agent.name] = runs.get(agent.name, 0) + 1
+        first_line, _, body = prompt.partition('\n\n')
+        if agent.name == 'Summary Combiner':
+            outline = [section for part in json.loads(body) for section in part['outline']]
+        else:
+            headings = re.findall(r'^## (.+)$', body, flags=re.MULTILINE)
+            outline = [{'title': title, 'summary': f"Terms of {title}."} for title in headings] or [
+                {'title': f"{index + 1}. Section", 'summary': f"Terms of part {index + 1}."}
+                for index in range(SECTIONS)]
+        return '```json\n' + json.dumps({
+            'summary': f"{first_line} A contract between two parties.",
+            'outline': outline,
+        }) + '\n```'
+    return respond
+
+
+def long_document(sections: int, section_chars: int) -> bytes:
+    """A markdown document of numbered sections of about section_chars each."""
+    return ''.join(
+        f"## {index + 1}. Clause {index + 1}\n" + f"Clause {index + 1} sets out the terms. " * (section_chars // 35) + '\n'
+        for index in range(sections)
+    ).encode()
+
+
+@pytest.fixture
+def runs(fakes):
+    runs = {}
+    fakes.runner.responder = summarizer(runs)
+    return runs
+
+
+def upload(fakes, name: str, generation: str, data: bytes = None) -> str:
+    from vectorize_file import run_vectorize_file
+
+    path = f'user-documents/{USER_ID}/{name}'
+    if data is None:
+        fakes.storage.put(BUCKET, path, b'%PDF-1.7\n' + name.encode() * 200, 'application/pdf')
+    else:
+        fakes.storage.put(BUCKET, path, data, 'text/markdown')
+    return run_vectorize_file(path, BUCKET, generation)
+
+
+def summary_id(name: str) -> str:
+    from path_handling import get_status_document_id
+
+    return get_status_document_id(USER_ID, name)
+
+
+def deliver_trigger(fakes, name: str) -> None:
+    import main
+
+    snapshot = fakes.db.collection('document_summaries').document(summary_id(name)).get()
+    main.summarize_document(FakeCloudEvent(FakeChange(None, snapshot), params={'summaryId': summary_id(name)}))
+
+
+def summary_of(fakes, name: str) -> dict:
+    return fakes.db.documents.get(f'document_summaries/{summary_id(name)}') or {}
+
+
+def summarized(fakes, name: str, generation: str = '1', data: bytes = None) -> dict:
+    upload(fakes, name, generation, data)
+    deliver_trigger(fakes, name)
+    return summary_of(fakes, name)
+
+
+def test_pending_after_indexing(fakes, runs):
+    message = upload(fakes, 'contract.pdf', '1')
+
+    assert 'successful' in message
+    assert summary_of(fakes, 'contract.pdf')['status'] == 'pending'
+    assert fakes.runner.stats.runs == 0
+
+
+def test_trigger_stores_summary_and_outline(fakes, runs):
+    summary = summarized(fakes, 'contract.pdf')
+
+    assert summary['status'] == 'completed'
+    assert len(summary['outline']) == SECTIONS
+    assert 'contract.pdf' in summary['summary']
+
+
+def test_long_document_summarized_over_full_text(fakes, runs, monkeypatch):
+    import document_summaries
+
+    monkeypatch.setattr(document_summaries, 'SUMMARY_WINDOW_CHARS', 4000)
+    data = long_document(LONG_SECTIONS, 1000)
+    windows = len(document_summaries.split_windows(data.decode()))
+    summary = summarized(fakes, 'long.md', data=data)
+
+    assert windows > 1
+    assert summary['status'] == 'completed'
+    assert runs['Document Summarizer'] == windows
+    assert runs['Summary Combiner'] >= 1
+    assert [section['title'] for section in summary['outline']] == TITLES[:document_summaries.OUTLINE_MAX_SECTIONS]
+    assert summary['partial'] is False
+
+
+def test_split_document_summarized_over_all_parts(fakes, runs, monkeypatch):
+    import document_splitter
+    import document_summaries
+
+    monkeypatch.setattr(document_summaries, 'SUMMARY_WINDOW_CHARS', 4000)
+    data = long_document(LONG_SECTIONS, 1000)
+    monkeypatch.setattr(document_splitter, 'SPLIT_MAX_PART_BYTES', len(data) // 5)
+    summary = summarized(fakes, 'split.md', data=data)
+    coverage = summary['coverage']
+
+    assert coverage['files_read'] == coverage['files_total'] > 1
+    assert [section['title'] for section in summary['outline']] == TITLES[:document_summaries.OUTLINE_MAX_SECTIONS]
+    assert summary['partial'] is False
+
+
+def test_windows_left_out_marked_partial(fakes, runs, monkeypatch):
+    import document_summaries
+    from document_summaries import load_document_overview
+
+    monkeypatch.setattr(document_summaries, 'SUMMARY_WINDOW_CHARS', 4000)
+    monkeypatch.setattr(document_summaries, 'SUMMARY_MAX_WINDOWS', 2)
+    data = long_document(LONG_SECTIONS, 1000)
+    windows = len(document_summaries.split_windows(data.decode()))
+    coverage = summarized(fakes, 'long.md', data=data)['coverage']
+    overview = load_document_overview(fakes.db, USER_ID, 'long.md')
+
+    assert overview['partial'] is True
+    assert 'FileSearchTool' in overview['message']
+    assert coverage['windows_summarized'] == 2
+    assert coverage['windows_total'] == windows
+
+
+def test_duplicate_deliveries_skipped(fakes, runs):
+    summarized(fakes, 'contract.pdf')
+    calls = fakes.runner.stats.runs
+    deliver_trigger(fakes, 'contract.pdf')
+    # A pending mark of the same generation finds the lease completed
+    fakes.db.documents[f"document_summaries/{summary_id('contract.pdf')}"]['status'] = 'pending'
+    deliver_trigger(fakes, 'contract.pdf')
+
+    assert fakes.runner.stats.runs == calls
+
+
+def test_result_of_replaced_generation_dropped(fakes, runs):
+    from document_summaries import save_summary
+
+    summarized(fakes, 'contract.pdf')
+    upload(fakes, 'contract.pdf', '2')
+    reference = fakes.db.collection('document_summaries').document(summary_id('contract.pdf'))
+    stale_saved = save_summary(fakes.db, reference, '1', {'status': 'completed', 'summary': 'stale'})
+    deliver_trigger(fakes, 'contract.pdf')
+    replaced = summary_of(fakes, 'contract.pdf')
+
+    assert not stale_saved
+    assert replaced['generation'] == '2'
+    assert replaced['status'] == 'completed'
+    assert replaced['summary'] != 'stale'
+
+
+def overview_tool(fakes):
+    from chat import build_agent
+    from chat_routing import route_prompt
+
+    route = route_prompt('What is contract0.pdf about?', None)
+    agent = build_agent(route, ['vs'], None, None, db=fakes.db, uid=USER_ID)
+    assert route.use_retrieval
+    return {getattr(tool, 'name', type(tool).__name__): tool for tool in agent.tools}.get('get_document_overview')
+
+
+def test_overview_tool_reads_once(fakes, runs):
+    from document_summaries import load_document_overview
+
+    names = [f'contract{index}.pdf' for index in range(3)]
+    for name in names:
+        summarized(fakes, name)
+    tool = overview_tool(fakes)
+    before = fakes.db.stats.snapshot()
+    one = json.loads(tool.function(names[0]))
+    one_reads = (fakes.db.stats - before).reads
+    before = fakes.db.stats.snapshot()
+    every = json.loads(tool.function(''))
+    every_rpcs = (fakes.db.stats - before).rpcs
+
+    assert one_reads == 1
+    assert one['status'] == 'completed'
+    assert len(one['outline']) == SECTIONS
+    assert len(every['documents']) == len(names)
+    assert every_rpcs == 1
+    assert len(load_document_overview(fakes.db, USER_ID, None, names[:2])['documents']) == 2
+
+
+def test_missing_overview_falls_back_to_file_search(fakes):
+    missing = json.loads(overview_tool(fakes).function('unknown.pdf'))
+
+    assert missing['status'] == 'missing'
+    assert 'FileSearchTool' in missing['message']
+
+
+def test_parse_fallback():
+    from document_summaries import parse_summary_output
+
+    assert parse_summary_output('Plain text summary.') == ('Plain text summary.', [])
+    assert parse_summary_output('{"summary": "S", "outline": [{"title": "1. A"}, "bad"]}') \
+        == ('S', [{'title': '1. A', 'summary': ''}])
+
+
+def test_delete_removes_summary(fakes, runs):
+    from delete_file import delete_file_from_openai
+
+    summarized(fakes, 'contract.pdf')
+    deleted = delete_file_from_openai(USER_ID, 'contract.pdf')
+
+    assert deleted['success']
+    assert not summary_of(fakes, 'contract.pdf')
+
+
+def test_flag_off(fakes, monkeypatch):
+    from chat import build_agent
+    from chat_routing import route_prompt
+
+    monkeypatch.setenv('DOCUMENT_SUMMARIES', '0')
+    upload(fakes, 'disabled.pdf', '1')
+    agent = build_agent(route_prompt('What is disabled.pdf about?', None), ['vs'], None, None, db=fakes.db, uid=USER_ID)
+
+    assert not summary_of(fakes, 'disabled.pdf')
+    assert len(agent.tools) == 1
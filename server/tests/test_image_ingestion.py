@@ -0,0 +1,135 @@
+"""Tests of the ingestion of images through their vision model description."""
+import base64
+import io
+import threading
+import zipfile
+
+import pytest
+
+import fakes as fake_services
+from fakes import APIStatusError
+
+Image = pytest.importorskip('PIL.Image')
+
+BUCKET = 'image-bucket'
+USER_ID = 'image-user'
+IMAGES = 8
+
+
+def photo(width: int, height: int, seed: int) -> bytes:
+    """A noisy PNG photo, which compresses badly like a real one."""
+    image = Image.effect_noise((width, height), 40 + seed).convert('RGB')
+    output = io.BytesIO()
+    image.save(output, format='PNG')
+    return output.getvalue()
+
+
+@pytest.fixture
+def vision(monkeypatch):
+    """
+    Record the (width, height, format, bytes) of every image sent to the fake
+    vision model, and the highest number of vision calls in flight.
+    """
+    sent = []
+    in_flight = {'now': 0, 'peak': 0}
+    lock = threading.Lock()
+    create = fake_services._FakeChatCompletions.create
+
+    def recording_create(self, model: str, messages: list, **kwargs):
+        for part in messages[0]['content']:
+            if part.get('type') == 'image_url':
+                data = base64.b64decode(part['image_url']['url'].split(',', 1)[1])
+                with Image.open(io.BytesIO(data)) as image:
+                    sent.append((image.width, image.height, image.format, len(data)))
+        with lock:
+            in_flight['now'] += 1
+            in_flight['peak'] = max(in_flight['peak'], in_flight['now'])
+        try:
+            return create(self, model, messages, **kwargs)
+        finally:
+            with lock:
+                in_flight['now'] -= 1
+
+    monkeypatch.setattr(fake_services._FakeChatCompletions, 'create', recording_create)
+    return sent, in_flight
+
+
+def upload(fakes, name: str, data: bytes, content_type: str) -> str:
+    from vectorize_file import run_vectorize_file
+
+    path = f'user-documents/{USER_ID}/{name}'
+    stored = fakes.storage.put(BUCKET, path, data, content_type)
+    return run_vectorize_file(path, BUCKET, str(stored['generation']), size_bytes=len(data), content_type=content_type)
+
+
+def vision_calls(fakes) -> int:
+    return fakes.openai.stats.calls.get('chat.completions.create', 0)
+
+
+def test_photo_downscaled_and_description_indexed(fakes, vision):
+    from image_to_description import MAX_IMAGE_DIMENSION
+
+    sent, _ = vision
+    original = photo(3000, 2000, 0)
+    message = upload(fakes, 'holiday.png', original, 'image/png')
+    status = fakes.db.documents[f'document_processing_status/{USER_ID}_holiday.png']
+    indexed = [content for content in fakes.openai.file_contents.values() if content.startswith(b'# holiday.png')]
+    width, height, image_format, sent_bytes = sent[0]
+
+    assert max(width, height) == MAX_IMAGE_DIMENSION
+    assert image_format == 'JPEG'
+    assert sent_bytes < len(original)
+    assert 'successful' in message
+    assert status['status'] == 'completed'
+    assert len(indexed) == 1
+    assert 'Fake completion' in indexed[0].decode()
+
+
+def test_cached_description_reused(fakes, vision):
+    original = photo(800, 600, 0)
+    upload(fakes, 'holiday.png', original, 'image/png')
+    calls = vision_calls(fakes)
+    upload(fakes, 'holiday-copy.png', original, 'image/png')
+
+    assert vision_calls(fakes) == calls
+    assert fakes.db.documents[f'document_processing_status/{USER_ID}_holiday-copy.png']['status'] == 'completed'
+
+
+def test_rate_limited_vision_call_retried(fakes, vision):
+    def rate_limit_once(endpoint: str) -> None:
+        if endpoint == 'chat.completions.create':
+            fakes.openai.fault_injector = None
+            raise APIStatusError('Rate limit reached', 429, {'retry-after-ms': '10'})
+
+    fakes.openai.fault_injector = rate_limit_once
+    retried = upload(fakes, 'receipt.png', photo(800, 600, 1), 'image/png')
+
+    assert 'successful' in retried
+    assert vision_calls(fakes) == 2
+
+
+def test_archive_images_described_concurrently(fakes, vision, config):
+    from image_to_description import MAX_CONCURRENT_DESCRIPTIONS
+
+    _, in_flight = vision
+    config(openai_latency=0.05)
+    photos = [photo(640, 480, index + 2) for index in range(IMAGES)]
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for index, data in enumerate(photos):
+            archive.writestr(f'album/photo{index}.png', data)
+        archive.writestr('album/duplicate.png', photos[0])
+        archive.writestr('album/corrupt.jpg', b'\xff\xd8\xff\xe0 not a jpeg')
+        archive.writestr('album/notes.txt', b'Trip notes')
+    message = upload(fakes, 'album.zip', buffer.getvalue(), 'application/zip')
+    members = {
+        data.get('file_name'): data.get('status') for path, data in fakes.db.documents.items()
+        if path.startswith(f'document_processing_status/{USER_ID}_album.zip%2F')
+    }
+
+    assert 'successful' in message
+    # Identical images are described once, the corrupt one fails alone
+    assert vision_calls(fakes) == IMAGES
+    assert sorted(name for name, status in members.items() if status == 'failed') == ['album.zip/album/corrupt.jpg']
+    assert len(members) == IMAGES + 3
+    assert in_flight['peak'] == min(MAX_CONCURRENT_DESCRIPTIONS, IMAGES)
@@ -0,0 +1,113 @@
+"""Tests of the priority order of the ingestion queue."""
+from datetime import datetime, timezone
+
+import pytest
+
+from fakes import FakeCloudEvent
+
+BUCKET = 'queue-bucket'
+INTERACTIVE_USER = 'chatting-user'
+BACKGROUND_USER = 'background-user'
+
+# user, file name, size in KiB, in enqueue order
+UPLOADS = [
+    (BACKGROUND_USER, 'archive-scan.pdf', 8192),
+    (INTERACTIVE_USER, 'thesis.pdf', 4096),
+    (BACKGROUND_USER, 'memo.txt', 4),
+    (INTERACTIVE_USER, 'notes.txt', 2),
+    (BACKGROUND_USER, 'letter.txt', 4),
+    (INTERACTIVE_USER, 'slides.pdf', 512),
+]
+# The chatting user first, smaller files first, older jobs first among equals
+EXPECTED_ORDER = ['notes.txt', 'slides.pdf', 'thesis.pdf', 'memo.txt', 'letter.txt', 'archive-scan.pdf']
+
+
+@pytest.fixture(autouse=True)
+def chatting_session(fakes):
+    fakes.db.documents['sessions/chatting-session'] = {
+        'userId': INTERACTIVE_USER, 'sessionId': 'chatting-session', 'updatedAt': datetime.now(timezone.utc),
+    }
+
+
+def enqueue_uploads(fakes, queue=None) -> list:
+    """Store every upload and enqueue it as the storage trigger does, returning the enqueue messages."""
+    from ingestion_queue import enqueue_upload
+
+    messages = []
+    for user_id, name, size_kib in UPLOADS:
+        path = f'user-documents/{user_id}/{name}'
+        data = (b'%PDF-1.7\n' if name.endswith('.pdf') else b'') + b'x' * (size_kib * 1024)
+        stored = fakes.storage.put(BUCKET, path, data, 'application/pdf' if name.endswith('.pdf') else 'text/plain')
+        messages.append(enqueue_upload(path, BUCKET, str(stored['generation']), len(data), queue=queue))
+    return messages
+
+
+def claim_order(queue) -> list:
+    """File names of the jobs claimed one at a time until the queue is empty."""
+    order = []
+    while True:
+        job = queue.claim('test-worker')
+        if job is None:
+            return order
+        order.append(job.file_path.rsplit('/', 1)[-1])
+
+
+def jobs(fakes) -> list:
+    return [data for key, data in fakes.db.documents.items() if key.startswith('ingestion_jobs/')]
+
+
+def test_firestore_queue_order(fakes):
+    from ingestion_queue import FirestoreIngestionQueue
+
+    enqueue_uploads(fakes)
+
+    assert claim_order(FirestoreIngestionQueue()) == EXPECTED_ORDER
+
+
+def test_local_queue_order(fakes):
+    from ingestion_queue import LocalIngestionQueue
+
+    queue = LocalIngestionQueue()
+    enqueue_uploads(fakes, queue=queue)
+
+    assert claim_order(queue) == EXPECTED_ORDER
+
+
+def test_duplicate_event_not_enqueued(fakes):
+    from ingestion_queue import enqueue_upload
+
+    enqueue_uploads(fakes)
+    path = f'user-documents/{BACKGROUND_USER}/memo.txt'
+    generation = next(job['generation'] for job in jobs(fakes) if job['file_path'] == path)
+    duplicate = enqueue_upload(path, BUCKET, generation, 4096)
+
+    assert 'Already queued' in duplicate
+    assert len(jobs(fakes)) == len(UPLOADS)
+
+
+def test_worker_drains_the_queue(fakes):
+    import main
+
+    enqueue_uploads(fakes)
+    main.process_ingestion_jobs(FakeCloudEvent(None, params={'jobId': jobs(fakes)[0]['job_id']}))
+    indexed = sum(data.get('status') == 'completed' for key, data in fakes.db.documents.items()
+                  if key.startswith('document_processing_status/'))
+
+    assert {job['status'] for job in jobs(fakes)} == {'completed'}
+    assert indexed == len(UPLOADS)
+
+
+def test_worker_checks_the_queued_content_type(fakes):
+    import main
+    from ingestion_queue import enqueue_upload
+
+    path = f'user-documents/{BACKGROUND_USER}/clip.txt'
+    stored = fakes.storage.put(BUCKET, path, b'\x00\x00\x00\x18ftypmp42', 'video/mp4')
+    enqueue_upload(path, BUCKET, str(stored['generation']), 12, 'video/mp4')
+    main.process_ingestion_jobs(FakeCloudEvent(None, params={'jobId': jobs(fakes)[0]['job_id']}))
+    status = fakes.db.documents[f'document_processing_status/{BACKGROUND_USER}_clip.txt']
+
+    assert jobs(fakes)[0]['content_type'] == 'video/mp4'
+    assert status['status'] == 'failed'
+    assert 'video' in status['error_message']
+    assert fakes.storage.bytes_downloaded == 0
@@ -0,0 +1,129 @@
+"""Tests of the processing leases that keep duplicate deliveries from running the pipeline twice."""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+BUCKET = 'lease-bucket'
+FILE_PATH = 'user-documents/lease-user/report.pdf'
+STATUS_PATH = 'document_processing_status/lease-user_report.pdf'
+
+
+@pytest.fixture(autouse=True)
+def document(fakes):
+    fakes.storage.put(BUCKET, FILE_PATH, b'%PDF-1.7\n' + b'0' * 4096, 'application/pdf')
+
+
+def test_concurrent_duplicates_upload_once(fakes, config):
+    from vectorize_file import run_vectorize_file
+
+    config(firestore_latency=0.002, openai_latency=0.02)
+    invocations = 16
+    with ThreadPoolExecutor(max_workers=invocations) as executor:
+        results = list(executor.map(lambda _: run_vectorize_file(FILE_PATH, BUCKET, '1'), range(invocations)))
+
+    assert fakes.openai.stats.calls.get('files.create', 0) == 1
+    assert sum(result.endswith('skipping') for result in results) == invocations - 1
+    assert fakes.db.documents[STATUS_PATH]['status'] == 'completed'
+
+
+def test_duplicate_after_completion_reports_outcome(fakes):
+    from vectorize_file import run_vectorize_file
+
+    run_vectorize_file(FILE_PATH, BUCKET, '1')
+    calls = sum(fakes.openai.stats.calls.values())
+    result = run_vectorize_file(FILE_PATH, BUCKET, '1')
+
+    assert sum(fakes.openai.stats.calls.values()) == calls
+    assert 'successful' in result
+    assert 'already processed' in result
+
+
+def test_failed_attempt_is_retried(fakes):
+    from vectorize_file import run_vectorize_file
+
+    failures = {'left': 1}
+
+    def fail_attach_once(endpoint: str) -> None:
+        if endpoint == 'vector_stores.files.create' and failures['left']:
+            failures['left'] -= 1
+            raise RuntimeError('injected attach failure')
+
+    fakes.openai.fault_injector = fail_attach_once
+    first = run_vectorize_file(FILE_PATH, BUCKET, '2')
+    second = run_vectorize_file(FILE_PATH, BUCKET, '2')
+
+    assert 'failed' in first
+    assert 'successful' in second
+    assert fakes.openai.stats.calls.get('files.create', 0) == 1
+
+
+def test_lost_lease_stops_before_next_write(fakes, monkeypatch):
+    import leases
+    from vectorize_file import run_vectorize_file
+
+    monkeypatch.setattr(leases, 'RENEW_INTERVAL_SECONDS', 0.05)
+
+    def take_over_during_upload(endpoint: str) -> None:
+        if endpoint == 'files.create':
+            fakes.openai.fault_injector = None
+            for path, data in fakes.db.documents.items():
+                if path.startswith('processing_leases/'):
+                    data['owner'] = 'another-invocation'
+            time.sleep(0.2)
+
+    fakes.openai.fault_injector = take_over_during_upload
+    result = run_vectorize_file(FILE_PATH, BUCKET, '3')
+
+    status = fakes.db.documents[STATUS_PATH]
+    assert 'taken over' in result
+    assert fakes.openai.stats.calls.get('vector_stores.files.create', 0) == 0
+    assert status['status'] == 'processing'
+    assert not (status.get('checkpoint') or {}).get('file_id')
+
+
+def test_expired_lease_taken_over(fakes):
+    from leases import acquire_lease
+
+    abandoned = acquire_lease(fakes.db, 'expiry-check', lease_seconds=0.2)
+    blocked = acquire_lease(fakes.db, 'expiry-check', lease_seconds=0.2)
+    time.sleep(0.3)
+    takeover = acquire_lease(fakes.db, 'expiry-check', lease_seconds=0.2)
+
+    assert abandoned is not None
+    assert blocked is None
+    assert takeover is not None
+    assert not abandoned.renew()
+    assert abandoned.lost
+
+
+def test_heartbeat_keeps_lease(fakes):
+    from leases import acquire_lease
+
+    lease = acquire_lease(fakes.db, 'heartbeat-check', lease_seconds=0.3)
+    lease.start_heartbeat(interval_seconds=0.1)
+    time.sleep(0.8)
+
+    assert acquire_lease(fakes.db, 'heartbeat-check', lease_seconds=0.3) is None
+    lease.release(completed=False)
+    assert acquire_lease(fakes.db, 'heartbeat-check', lease_seconds=0.3) is not None
+
+
+def test_unexpected_error_leaves_generation_to_retry(fakes, monkeypatch):
+    import vectorize_file
+    from vectorize_file import run_vectorize_file
+
+    load_checkpoint = vectorize_file.load_checkpoint
+
+    def fail_once(*args, **kwargs):
+        monkeypatch.setattr(vectorize_file, 'load_checkpoint', load_checkpoint)
+        raise RuntimeError('injected Firestore failure')
+
+    monkeypatch.setattr(vectorize_file, 'load_checkpoint', fail_once)
+    with pytest.raises(RuntimeError):
+        run_vectorize_file(FILE_PATH, BUCKET, '4')
+    retried = run_vectorize_file(FILE_PATH, BUCKET, '4')
+
+    assert 'successful' in retried
+    assert fakes.openai.stats.calls.get('files.create', 0) == 1
+    assert fakes.db.documents[STATUS_PATH]['status'] == 'completed'
@@ -0,0 +1,157 @@
+"""Tests of the retries, circuit breakers and hedged reads of openai_calls."""
+import time
+
+import pytest
+
+from fakes import APIStatusError
+
+BUCKET = 'faults-bucket'
+USER_ID = 'faults-user'
+
+
+class Faults:
+    """Fault injector raising queued errors per endpoint, and optionally sleeping first."""
+
+    def __init__(self):
+        self.errors = {}
+        self.delays = {}
+        self.calls = {}
+
+    def fail(self, endpoint: str, *errors: Exception) -> 'Faults':
+        self.errors.setdefault(endpoint, []).extend(errors)
+        return self
+
+    def __call__(self, endpoint: str) -> None:
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        delays = self.delays.get(endpoint)
+        if delays:
+            time.sleep(delays.pop(0))
+        errors = self.errors.get(endpoint)
+        if errors:
+            error = errors[0] if len(errors) == 1 and getattr(errors[0], 'persistent', False) else errors.pop(0)
+            raise error
+
+
+def outage(status_code: int = 503) -> APIStatusError:
+    error = APIStatusError(f"Error code: {status_code}", status_code)
+    error.persistent = True
+    return error
+
+
+@pytest.fixture
+def faults(fakes):
+    faults = Faults()
+    fakes.openai.fault_injector = faults
+    return faults
+
+
+def upload(fakes, name: str) -> str:
+    from vectorize_file import run_vectorize_file
+
+    path = f'user-documents/{USER_ID}/{name}'
+    fakes.storage.put(BUCKET, path, b'%PDF-1.7\n' + name.encode() * 100, 'application/pdf')
+    return run_vectorize_file(path, BUCKET, '1')
+
+
+def test_retry_after_honored(fakes, faults):
+    faults.fail('files.create', APIStatusError('Rate limit reached', 429, {'retry-after-ms': '200'}))
+    started = time.monotonic()
+    message = upload(fakes, 'rate-limited.pdf')
+
+    assert 'successful' in message
+    assert faults.calls['files.create'] == 2
+    assert time.monotonic() - started >= 0.2
+
+
+def test_transient_errors_retried(fakes, faults):
+    faults.fail('vector_stores.files.create', APIStatusError('Bad gateway', 502), APIStatusError('Unavailable', 503))
+
+    assert 'successful' in upload(fakes, 'transient.pdf')
+    assert faults.calls['vector_stores.files.create'] == 3
+
+
+def test_deletion_retried(fakes, faults):
+    from delete_file import delete_file_from_openai
+
+    upload(fakes, 'transient.pdf')
+    faults.fail('files.delete', APIStatusError('Unavailable', 503))
+    deleted = delete_file_from_openai(USER_ID, 'transient.pdf')
+
+    assert deleted['success']
+    assert not fakes.openai.files
+    assert faults.calls['files.delete'] == 2
+
+
+def test_client_error_not_retried(fakes, faults):
+    faults.fail('files.create', APIStatusError('Invalid file', 400))
+
+    assert 'failed' in upload(fakes, 'invalid.pdf')
+    assert faults.calls['files.create'] == 1
+
+
+def test_agent_run_retried(fakes):
+    from chat import run_chat
+
+    fakes.db.documents[f'user_vector_stores/{USER_ID}'] = {'vector_store_ids': ['vs_faults']}
+    faults = Faults().fail('agent_run', APIStatusError('Internal error', 500))
+    fakes.runner.fault_injector = faults
+    response = run_chat(USER_ID, 'What is in the contract?', 'faults-session')
+
+    assert response['success']
+    assert not faults.errors['agent_run']
+
+
+def test_circuit_opens_and_closes_after_trial(fakes, faults):
+    import openai_calls
+    from openai_calls import circuit_states
+
+    faults.fail('files.create', outage())
+    first = upload(fakes, 'outage-1.pdf')
+    attempts = faults.calls['files.create']
+    second = upload(fakes, 'outage-2.pdf')
+
+    assert 'failed' in first
+    assert attempts == openai_calls.CIRCUIT_FAILURE_THRESHOLD
+    assert 'unavailable' in second
+    assert faults.calls['files.create'] == attempts
+    assert circuit_states()['files.create'] == 'open'
+
+    openai_calls.get_circuit_breaker('files.create').reset_seconds = 0.1
+    time.sleep(0.15)
+    faults.errors.clear()
+
+    assert 'successful' in upload(fakes, 'recovered.pdf')
+    assert circuit_states()['files.create'] == 'closed'
+
+
+def test_slow_read_hedged(fakes, faults, monkeypatch):
+    from openai import OpenAI
+    from openai_calls import call_openai
+
+    monkeypatch.setenv('OPENAI_HEDGE_AFTER_MS', '50')
+    client = OpenAI()
+    vector_store = client.vector_stores.create(name='hedge')
+    file_object = client.files.create(file=('hedge.txt', b'hedge'), purpose='assistants')
+    client.vector_stores.files.create(vector_store_id=vector_store.id, file_id=file_object.id)
+    faults.delays['vector_stores.files.retrieve'] = [2.0]
+    started = time.monotonic()
+    status = call_openai(
+        'vector_stores.files.retrieve', client.vector_stores.files.retrieve,
+        vector_store_id=vector_store.id, file_id=file_object.id, hedge=True)
+
+    assert status.id == file_object.id
+    assert faults.calls['vector_stores.files.retrieve'] == 2
+    # Answered by the hedge, not after the slow first request
+    assert time.monotonic() - started < 2.0
+
+
+def test_backoff_within_jitter_bounds():
+    from openai_calls import RetryPolicy, backoff_seconds
+
+    policy = RetryPolicy(max_attempts=6, base_delay_seconds=1, max_delay_seconds=8, deadline_seconds=60)
+    error = APIStatusError('Unavailable', 503)
+    for attempt in range(1, 6):
+        cap = min(policy.max_delay_seconds, policy.base_delay_seconds * 2 ** (attempt - 1))
+        delays = [backoff_seconds(policy, attempt, error) for _ in range(50)]
+        assert all(0 <= delay <= cap for delay in delays)
+        assert len(set(delays)) > 1
@@ -0,0 +1,83 @@
+"""Tests of the shared OpenAI rate limit budget and its chat reserve."""
+import pytest
+
+
+def headers(limit: int, remaining: int, reset: str = '0.2s') -> dict:
+    return {
+        'x-ratelimit-limit-requests': str(limit),
+        'x-ratelimit-remaining-requests': str(remaining),
+        'x-ratelimit-reset-requests': reset,
+    }
+
+
+@pytest.fixture
+def tracker(monkeypatch):
+    import openai_quota
+
+    monkeypatch.setenv('OPENAI_CHAT_RESERVED_SHARE', '0.2')
+    return openai_quota.get_budget_tracker()
+
+
+def test_reset_durations():
+    from openai_quota import parse_reset_duration
+
+    assert [parse_reset_duration(value) for value in ('20ms', '1.5s', '6m0s', '1h2m3s', 'soon', None)] \
+        == [0.02, 1.5, 360.0, 3723.0, None, None]
+
+
+def test_background_calls_counted_until_the_reserve(tracker):
+    tracker.observe(headers(limit=100, remaining=25, reset='10s'))
+
+    # 20 requests are reserved, the 5 above the reserve go without waiting
+    waits = [tracker.background_wait_seconds_now() for _ in range(6)]
+
+    assert waits[:5] == [0] * 5
+    assert 9 < waits[5] <= 10
+    assert tracker.state()['tight']
+
+
+def test_background_policy_waits_for_reset(tracker):
+    from openai_calls import call_openai
+
+    tracker.observe(headers(limit=100, remaining=10, reset='0.2s'))
+    call_openai('files.list', lambda: None, policy='background')
+    state = tracker.state()
+
+    assert state['background_waits'] == 1
+    assert state['background_wait_seconds'] >= 0.15
+
+
+def test_interactive_policy_uses_the_reserve(tracker):
+    from openai_calls import call_openai
+
+    tracker.observe(headers(limit=100, remaining=10, reset='10s'))
+    call_openai('chat.completions.create', lambda: None, policy='interactive')
+
+    assert tracker.state()['background_waits'] == 0
+
+
+def test_no_reserve_never_waits(tracker, monkeypatch):
+    monkeypatch.setenv('OPENAI_CHAT_RESERVED_SHARE', '0')
+    tracker.observe(headers(limit=100, remaining=0, reset='10s'))
+
+    assert tracker.background_wait_seconds_now() == 0
+
+
+def test_wait_is_bounded(tracker):
+    tracker.observe(headers(limit=100, remaining=0, reset='10s'))
+
+    assert 0.05 <= tracker.wait_for_budget(max_wait_seconds=0.05) < 1
+
+
+def test_client_responses_update_the_budget(fakes, tracker, monkeypatch):
+    from openai_quota import create_openai_client, get_budget_state
+
+    monkeypatch.setattr(fakes.config, 'openai_rate_limit_requests', 50)
+    client = create_openai_client()
+    for index in range(3):
+        client.files.create(file=(f'file{index}.txt', b'x'), purpose='assistants')
+    requests = get_budget_state()['requests']
+
+    assert requests['limit'] == 50
+    assert requests['remaining'] == 47
+    assert requests['reserved_for_chat'] == 10
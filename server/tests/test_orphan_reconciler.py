@@ -0,0 +1,98 @@
+"""Tests of the orphan reconciler."""
+import io
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+BUCKET = 'reconcile-bucket'
+USER_ID = 'reconcile-user'
+DOCUMENTS = 20
+ORPHANS = 8
+
+
+@pytest.fixture
+def reconciled(fakes, monkeypatch):
+    """
+    Seed indexed documents and the orphans that failed pipelines and deletions
+    leave behind, then run the reconciler in small slices until it completes a cycle.
+    """
+    import reconcile_orphans
+    from openai import OpenAI
+    from vectorize_file import run_vectorize_file
+
+    # Everything seeded below counts as old enough to be reconciled
+    monkeypatch.setattr(reconcile_orphans, 'ORPHAN_GRACE_SECONDS', -1)
+    monkeypatch.setattr(reconcile_orphans, 'PAGE_SIZE', 10)
+    db = fakes.db.documents
+    for index in range(DOCUMENTS):
+        path = f'user-documents/{USER_ID}/doc{index}.pdf'
+        fakes.storage.put(BUCKET, path, b'%PDF-1.7\n' + b'0' * 512, 'application/pdf')
+        run_vectorize_file(path, BUCKET, '1')
+    vector_store_id = db[f'user_vector_stores/{USER_ID}']['vector_store_ids'][0]
+    kept_files = set(fakes.openai.files)
+
+    # Uploads whose pipeline died before recording the file ID
+    client = OpenAI()
+    orphan_files = {client.files.create(file=(f'lost{index}.pdf', io.BytesIO(b'x')), purpose='assistants').id
+                    for index in range(ORPHANS)}
+    # Documents deleted from storage whose deletion never reached OpenAI
+    deleted_documents = [f'doc{index}.pdf' for index in range(0, DOCUMENTS, 10)]
+    for name in deleted_documents:
+        del fakes.storage.objects[(BUCKET, f'user-documents/{USER_ID}/{name}')]
+    deleted_file_ids = {db[f'document_processing_status/{USER_ID}_{name}']['file_id'] for name in deleted_documents}
+    # Vector store files attached without a status row
+    detached = set(list(orphan_files)[:5])
+    for file_id in detached:
+        client.vector_stores.files.create(vector_store_id=vector_store_id, file_id=file_id)
+    # A vector store that expired, and a row stuck in progress
+    db[f'user_vector_stores/{USER_ID}']['vector_store_ids'].append('vs-expired')
+    db[f'document_processing_status/{USER_ID}_doc1.pdf'].update(
+        status='vectorizing', updated_at=datetime.now(timezone.utc) - timedelta(days=1))
+
+    for runs in range(1, 200):
+        result = reconcile_orphans.run_orphan_reconciler(BUCKET, max_pages=2)
+        if result['data'] and result['data']['cycles'] >= 1:
+            break
+    return {
+        'runs': runs,
+        'vector_store_id': vector_store_id,
+        'kept_files': kept_files - deleted_file_ids,
+        'orphan_files': orphan_files,
+        'deleted_documents': deleted_documents,
+        'deleted_file_ids': deleted_file_ids,
+        'detached': detached,
+    }
+
+
+def status_names(fakes) -> set:
+    return {data['file_name'] for path, data in fakes.db.documents.items()
+            if path.startswith('document_processing_status/')}
+
+
+def test_cycle_completes_in_bounded_runs(reconciled):
+    assert reconciled['runs'] < 200
+
+
+def test_unreferenced_files_deleted_and_indexed_kept(fakes, reconciled):
+    remaining = set(fakes.openai.files)
+
+    assert not reconciled['orphan_files'] & remaining
+    assert reconciled['kept_files'] <= remaining
+
+
+def test_documents_deleted_from_storage_cleaned(fakes, reconciled):
+    assert not reconciled['deleted_file_ids'] & set(fakes.openai.files)
+    assert not set(reconciled['deleted_documents']) & status_names(fakes)
+
+
+def test_detached_vector_store_files_removed(fakes, reconciled):
+    vector_store_files = {file_id for (store_id, file_id) in fakes.openai.vector_store_files
+                          if store_id == reconciled['vector_store_id']}
+
+    assert not reconciled['detached'] & vector_store_files
+    assert vector_store_files == reconciled['kept_files']
+
+
+def test_expired_vector_store_and_stuck_row(fakes, reconciled):
+    assert fakes.db.documents[f'user_vector_stores/{USER_ID}']['vector_store_ids'] == [reconciled['vector_store_id']]
+    assert fakes.db.documents[f'document_processing_status/{USER_ID}_doc1.pdf']['status'] == 'failed'
@@ -0,0 +1,87 @@
+"""Tests of the per-user processing summary."""
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+BUCKET = 'summary-bucket'
+USER_ID = 'summary-user'
+FILES = 20
+SUMMARY_PATH = f'user_processing_status/{USER_ID}'
+
+
+def upload(fakes, name: str, data: bytes = b'%PDF-1.7\n' + b'0' * 256, content_type: str = 'application/pdf') -> str:
+    from vectorize_file import run_vectorize_file
+
+    path = f'user-documents/{USER_ID}/{name}'
+    fakes.storage.put(BUCKET, path, data, content_type)
+    return run_vectorize_file(path, BUCKET, '1')
+
+
+def bulk_upload(fakes) -> None:
+    for index in range(FILES):
+        upload(fakes, f'doc{index:04d}.pdf')
+    upload(fakes, 'notes.xyz', b'unsupported', 'application/octet-stream')
+
+
+def test_fewer_summary_writes_than_row_writes(fakes, monkeypatch):
+    writes = Counter()
+    apply_write = fakes.db._apply_write
+
+    def counting_apply_write(operation, path, data=None, merge=False):
+        writes[path.split('/')[0]] += 1
+        return apply_write(operation, path, data, merge)
+
+    monkeypatch.setattr(fakes.db, '_apply_write', counting_apply_write)
+    bulk_upload(fakes)
+
+    assert writes['user_processing_status'] < writes['document_processing_status']
+
+
+def test_only_status_changes_run_a_transaction(fakes, monkeypatch):
+    transactions = Counter()
+    reference_type = type(fakes.db.document(SUMMARY_PATH))
+    get = reference_type.get
+
+    def counting_get(reference, field_paths=None, transaction=None):
+        if reference.path.startswith('user_processing_status/'):
+            transactions['summary'] += 1
+        return get(reference, field_paths, transaction)
+
+    monkeypatch.setattr(reference_type, 'get', counting_get)
+    bulk_upload(fakes)
+
+    # uploading, processing, vectorizing and completed for each document, failed for notes.xyz
+    assert transactions['summary'] == 4 * FILES + 1
+
+
+def test_counts_and_failures(fakes):
+    bulk_upload(fakes)
+    summary = fakes.db.documents[SUMMARY_PATH]
+
+    assert summary['counts'] == {'completed': FILES, 'failed': 1}
+    assert summary['files']['notes.xyz']['error_message']
+
+
+def test_deleted_files_dropped(fakes):
+    from delete_file import delete_file_from_openai
+
+    bulk_upload(fakes)
+    delete_file_from_openai(USER_ID, 'doc0000.pdf')
+    delete_file_from_openai(USER_ID, 'notes.xyz')
+    summary = fakes.db.documents[SUMMARY_PATH]
+
+    assert 'doc0000.pdf' not in summary['files']
+    assert 'notes.xyz' not in summary['files']
+    assert summary['counts'] == {'completed': FILES - 1}
+
+
+def test_completed_files_age_out(fakes):
+    import processing_summary
+
+    bulk_upload(fakes)
+    expired = datetime.now(timezone.utc) - timedelta(seconds=processing_summary.RECENT_SECONDS + 1)
+    for entry in fakes.db.documents[SUMMARY_PATH]['files'].values():
+        entry['updated_at'] = expired
+    upload(fakes, 'late.pdf')
+
+    # Failures stay until the file is deleted
+    assert sorted(fakes.db.documents[SUMMARY_PATH]['files']) == ['late.pdf', 'notes.xyz']
@@ -0,0 +1,97 @@
+"""Tests of the resumable account purge."""
+from typing import List
+
+import pytest
+
+BUCKET = 'purge-bucket'
+USER_ID = 'purge-user'
+OTHER_USER_ID = 'other-user'
+
+
+def seed_user(fakes, user_id: str, documents: int, sessions: int, messages: int) -> None:
+    from vectorize_file import run_vectorize_file
+
+    for index in range(documents):
+        path = f'user-documents/{user_id}/doc{index}.pdf'
+        fakes.storage.put(BUCKET, path, b'%PDF-1.7\n' + b'0' * 256, 'application/pdf')
+        run_vectorize_file(path, BUCKET, '1')
+    db = fakes.db.documents
+    for session in range(sessions):
+        session_path = f'sessions/{user_id}-s{session}'
+        db[session_path] = {'userId': user_id, 'name': f'Session {session}'}
+        for message in range(messages):
+            db[f'{session_path}/messages/m{message:04d}'] = {'role': 'user', 'message': 'hi'}
+        db[f'{session_path}/transcript/000000'] = {'messages': [], 'startSeq': 0}
+        db[f'{session_path}/chat_executions/c0'] = {'status': 'completed'}
+    db[f'admission_buckets/chat_{user_id}'] = {'tokens': 1}
+    db[f'ingestion_jobs/job-{user_id}'] = {'user_id': user_id, 'status': 'completed'}
+
+
+def user_documents(fakes, user_id: str) -> List[str]:
+    return [
+        path for path, data in fakes.db.documents.items()
+        if user_id in path.split('/')[1] or data.get('user_id') == user_id or data.get('userId') == user_id
+    ]
+
+
+@pytest.fixture
+def purged(fakes, config):
+    """Purge a user, interrupted by the time budget and by an OpenAI failure, then resumed."""
+    import purge_user
+
+    seed_user(fakes, USER_ID, 30, 6, 20)
+    seed_user(fakes, OTHER_USER_ID, 5, 2, 3)
+    other_before = sorted(user_documents(fakes, OTHER_USER_ID))
+    other_files = {
+        data['file_id'] for path, data in fakes.db.documents.items()
+        if path.startswith('document_processing_status/') and data.get('user_id') == OTHER_USER_ID
+    }
+    config(firestore_latency=0.001)
+    first = purge_user.purge_user_data(USER_ID, BUCKET, max_seconds=0.0001)
+
+    failures = {'left': 1}
+
+    def fail_delete_once(endpoint: str) -> None:
+        if endpoint == 'files.delete' and failures['left']:
+            failures['left'] -= 1
+            raise RuntimeError('injected delete failure')
+
+    fakes.openai.fault_injector = fail_delete_once
+    second = purge_user.purge_user_data(USER_ID, BUCKET)
+    fakes.openai.fault_injector = None
+    progress_after_failure = dict(fakes.db.documents[f'user_purges/{USER_ID}'])
+    final = purge_user.purge_user_data(USER_ID, BUCKET)
+    return {
+        'first': first,
+        'second': second,
+        'progress_after_failure': progress_after_failure,
+        'final': final,
+        'other_before': other_before,
+        'other_files': other_files,
+    }
+
+
+def test_budget_interruption_reports_progress(purged):
+    assert purged['first']['success']
+    assert purged['first']['data']['status'] == 'running'
+
+
+def test_failure_recorded_and_resumed(purged):
+    assert not purged['second']['success']
+    assert purged['progress_after_failure']['status'] == 'failed'
+    assert purged['final']['success']
+    assert purged['final']['data']['status'] == 'completed'
+
+
+def test_nothing_left(fakes, purged):
+    left = [path for path in user_documents(fakes, USER_ID) if not path.startswith('user_purges/')]
+
+    assert not left
+    assert f'user_vector_stores/{USER_ID}' not in fakes.db.documents
+    assert not [name for (_, name) in fakes.storage.objects if f'/{USER_ID}/' in name]
+    assert set(fakes.openai.files) == purged['other_files']
+    assert len(fakes.openai.vector_stores) == 1
+
+
+def test_other_user_untouched(fakes, purged):
+    assert sorted(user_documents(fakes, OTHER_USER_ID)) == purged['other_before']
@@ -0,0 +1,115 @@
+"""Tests of the rolling summary that bounds the history of long chat sessions."""
+import asyncio
+
+import pytest
+
+from fakes import FakeChange, FakeCloudEvent
+
+USER_ID = 'compaction-user'
+TURNS = 40
+PROMPT_CHARS = 2000
+
+
+def summarizer(calls: list):
+    """Scripted answers of the summarizer agent, default answers for the chat agent."""
+    def respond(agent, prompt: str):
+        if agent.name != 'Conversation Summarizer':
+            return None
+        calls.append(prompt)
+        return f"SUMMARY-{len(calls)}"
+    return respond
+
+
+def deliver_pending(fakes, session_id: str) -> bool:
+    """Deliver the compact_session trigger if the session has a pending request."""
+    import main
+
+    path = f'sessions/{session_id}/memory/compaction'
+    if (fakes.db.documents.get(path) or {}).get('status') != 'pending':
+        return False
+    snapshot = fakes.db.document(path).get()
+    main.compact_session(FakeCloudEvent(FakeChange(None, snapshot), params={'sessionId': session_id}))
+    return True
+
+
+def stored_messages(fakes, session_id: str) -> int:
+    prefix = f'sessions/{session_id}/'
+    messages = sum(path.startswith(prefix + 'messages/') for path in fakes.db.documents)
+    segments = sum(len(data.get('messages') or []) for path, data in fakes.db.documents.items()
+                   if path.startswith(prefix + 'transcript/'))
+    return messages + segments
+
+
+@pytest.fixture(params=['messages', 'segments'])
+def long_session(request, fakes, monkeypatch):
+    """A long session in each storage layout, compacted whenever a turn requests it."""
+    from chat import run_chat
+    from firestore_session import FirestoreSession
+
+    monkeypatch.setenv('SESSION_STORAGE_LAYOUT', request.param)
+    fakes.db.documents[f'user_vector_stores/{USER_ID}'] = {'vector_store_ids': ['vs_compaction']}
+    calls: list = []
+    fakes.runner.responder = summarizer(calls)
+    session_id = f'long-{request.param}'
+    inline_summaries = compactions = 0
+    for turn in range(TURNS):
+        before = len(calls)
+        run_chat(USER_ID, f"Question {turn} about clause {turn}: " + 'x' * PROMPT_CHARS, session_id)
+        inline_summaries += len(calls) - before
+        compactions += deliver_pending(fakes, session_id)
+
+    storage_layout = (fakes.db.documents.get(f'sessions/{session_id}') or {}).get('storageLayout') or 'messages'
+    session = FirestoreSession(USER_ID, session_id, compaction=True, storage_layout=storage_layout)
+    return {
+        'inline_summaries': inline_summaries,
+        'compactions': compactions,
+        'calls': calls,
+        'summary': fakes.db.documents.get(f'sessions/{session_id}/memory/summary') or {},
+        'items': asyncio.run(session.get_items()),
+        'stored': stored_messages(fakes, session_id),
+        'history': fakes.runner.stats.history_items,
+        'request_left': f'sessions/{session_id}/memory/compaction' in fakes.db.documents,
+    }
+
+
+def test_summarizer_runs_off_the_turn(long_session):
+    assert long_session['inline_summaries'] == 0
+    assert long_session['compactions'] >= 2
+    assert not long_session['request_left']
+
+
+def test_summary_extends_the_previous_one(long_session):
+    calls = long_session['calls']
+
+    assert len(calls) == long_session['compactions']
+    assert f"Previous summary:\nSUMMARY-{len(calls) - 1}\n" in calls[-1]
+    assert long_session['summary']['summary'] == f"SUMMARY-{len(calls)}"
+
+
+def test_history_trimmed_while_transcript_kept(long_session):
+    from firestore_session import COMPACTION_KEEP_RECENT_MESSAGES
+
+    items, summary = long_session['items'], long_session['summary']
+
+    assert items[0]['role'] == 'system'
+    assert summary['summary'] in items[0]['content']
+    assert len(items) - 1 == long_session['stored'] - summary['coveredMessageCount']
+    assert len(items) - 1 >= COMPACTION_KEEP_RECENT_MESSAGES
+    assert long_session['stored'] == 2 * TURNS
+    assert long_session['history'][-1] < 2 * TURNS - 2
+
+
+def test_single_pending_request_and_capped_compaction(fakes):
+    from firestore_session import COMPACTION_MAX_MESSAGES, FirestoreSession
+
+    fakes.runner.responder = summarizer([])
+    session = FirestoreSession(USER_ID, 'capped', compaction=True)
+    fakes.db.documents['sessions/capped'] = {'userId': USER_ID, 'sessionId': 'capped'}
+    turns = [{'role': role, 'content': f"{role} message {index}"}
+             for index in range(COMPACTION_MAX_MESSAGES + 100) for role in ('user', 'assistant')]
+    for start in range(0, len(turns), 100):
+        asyncio.run(session.add_items(turns[start:start + 100]))
+
+    assert [session.request_compaction(), session.request_compaction()] == [True, False]
+    deliver_pending(fakes, 'capped')
+    assert fakes.db.documents['sessions/capped/memory/summary']['coveredMessageCount'] == COMPACTION_MAX_MESSAGES
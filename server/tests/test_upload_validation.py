@@ -0,0 +1,147 @@
+"""Tests of the rejection of invalid uploads before any download or OpenAI call."""
+import pytest
+
+from fakes import FakeCloudEvent, FakeStorageObjectData
+
+BUCKET = 'validation-bucket'
+USER_ID = 'validation-user'
+BINARY = b'MZ\x90\x00\x03\x00\x00\x00' + bytes(range(256)) * 4096
+
+
+def deliver(fakes, monkeypatch, name: str, data: bytes, content_type: str, size: int = None,
+            size_in_event: bool = True, generation: int = None) -> dict:
+    """Upload an object, deliver its storage event and measure what the pipeline did."""
+    import main
+
+    path = f'user-documents/{USER_ID}/{name}'
+    stored = fakes.storage.put(BUCKET, path, data, content_type)
+    storage_calls, storage_bytes = fakes.storage.calls, fakes.storage.bytes_downloaded
+    openai_calls = sum(fakes.openai.stats.calls.values())
+    status_path = f'document_processing_status/{USER_ID}_{name}'
+    statuses = []
+    reference_type = type(fakes.db.document(status_path))
+    original_set = reference_type.set
+
+    def record_set(reference, fields, merge=False):
+        if reference.path == status_path:
+            statuses.append(fields.get('status'))
+        return original_set(reference, fields, merge)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(reference_type, 'set', record_set)
+        event = FakeCloudEvent(FakeStorageObjectData(
+            name=path, bucket=BUCKET, size=(len(data) if size is None else size) if size_in_event else None,
+            content_type=content_type, generation=generation or stored['generation']))
+        message = main.vectorize_file(event)
+    return {
+        'message': message,
+        'storage_calls': fakes.storage.calls - storage_calls,
+        'storage_bytes': fakes.storage.bytes_downloaded - storage_bytes,
+        'openai_calls': sum(fakes.openai.stats.calls.values()) - openai_calls,
+        'statuses': statuses,
+        'generation': stored['generation'],
+    }
+
+
+def rejections():
+    import file_handling
+
+    # label, file name, content, content type, size in the event, rejected from the metadata alone
+    return [
+        ('renamed executable', 'report.pdf', BINARY, 'application/pdf', None, False),
+        ('oversized', 'huge.docx', b'PK\x03\x04', 'application/vnd.openxmlformats-officedocument',
+         file_handling.MAX_DOCUMENT_BYTES + 1, True),
+        ('oversized splittable', 'huge.pdf', b'%PDF-1.7\n', 'application/pdf',
+         file_handling.MAX_SPLIT_DOCUMENT_BYTES + 1, True),
+        ('video', 'notes.txt', b'\x00\x00\x00\x18ftypmp42', 'video/mp4', None, True),
+        ('unsupported extension', 'setup.exe', BINARY[:4096], 'application/x-msdownload', None, True),
+        ('empty', 'empty.docx', b'', 'application/octet-stream', None, True),
+    ]
+
+
+@pytest.mark.parametrize('label', [rejection[0] for rejection in rejections()])
+def test_rejected_before_openai(fakes, monkeypatch, label):
+    from file_handling import SNIFF_BYTES
+
+    _, name, data, content_type, size, from_metadata = next(item for item in rejections() if item[0] == label)
+    result = deliver(fakes, monkeypatch, name, data, content_type, size=size)
+
+    assert result['openai_calls'] == 0
+    assert result['statuses'] == ['failed']
+    assert result['storage_bytes'] <= SNIFF_BYTES
+    if from_metadata:
+        assert result['storage_calls'] == 0
+
+
+def test_renamed_binary_sniffed(fakes, monkeypatch):
+    result = deliver(fakes, monkeypatch, 'report.pdf', BINARY, 'application/pdf')
+
+    assert 'does not match' in result['message']
+
+
+@pytest.mark.parametrize('name, data, content_type', [
+    ('contract.pdf', b'%PDF-1.7\n' + b'page ' * 2000, 'application/pdf'),
+    ('letter.docx', b'PK\x03\x04\x14\x00\x06\x00' + b'word/document.xml' * 64,
+     'application/vnd.openxmlformats-officedocument'),
+    ('ledger.csv', 'date;caf\xe9;montant\n2025-01-01;cr\xe8me;3,50\n'.encode('cp1252') * 50, 'text/csv'),
+    ('notes.md', '# Notes\n\n- Überblick\n'.encode('utf-8') * 100, 'text/markdown'),
+])
+def test_valid_upload_indexed(fakes, monkeypatch, name, data, content_type):
+    message = deliver(fakes, monkeypatch, name, data, content_type)['message']
+    [attributes] = [vector_store_file.attributes for vector_store_file in fakes.openai.vector_store_files.values()]
+
+    assert 'successful' in message
+    assert attributes['file_name'] == name
+    assert attributes['file_type'] == name.rsplit('.', 1)[-1].upper()
+
+
+def test_splittable_documents_held_to_larger_limit():
+    import file_handling
+    from file_handling import check_upload_metadata
+
+    assert check_upload_metadata('scan.pdf', file_handling.MAX_DOCUMENT_BYTES + 1, 'application/pdf') is None
+    assert check_upload_metadata('scan.docx', file_handling.MAX_DOCUMENT_BYTES + 1, None) is not None
+    assert check_upload_metadata('scan.pdf', file_handling.MAX_SPLIT_DOCUMENT_BYTES + 1, 'application/pdf') is not None
+
+
+def test_size_read_from_metadata(fakes, monkeypatch):
+    import file_handling
+
+    monkeypatch.setattr(file_handling, 'MAX_DOCUMENT_BYTES', 1024)
+    result = deliver(fakes, monkeypatch, 'big.json', b'{"line": 1}\n' * 1000, 'application/json', size_in_event=False)
+
+    assert 'larger than' in result['message']
+    assert result['storage_bytes'] == 0
+
+
+def test_rejection_not_retried(fakes, monkeypatch):
+    rejected = deliver(fakes, monkeypatch, 'report.pdf', BINARY, 'application/pdf')
+    redelivered = deliver(fakes, monkeypatch, 'report.pdf', BINARY, 'application/pdf', generation=rejected['generation'])
+
+    assert 'does not match' in redelivered['message']
+    assert 'already processed' in redelivered['message']
+    assert redelivered['storage_calls'] == 0
+
+
+@pytest.mark.parametrize('expected, header', [
+    ('pdf', b'%PDF-1.4'),
+    ('png', b'\x89PNG\r\n\x1a\n'),
+    ('zip', b'PK\x03\x04'),
+    ('ole', b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'),
+    ('rtf', b'{\\rtf1'),
+    ('jpeg', b'\xff\xd8\xff\xe0'),
+    ('gif', b'GIF89a'),
+    ('webp', b'RIFF\x00\x00\x00\x00WEBPVP8 '),
+    ('gzip', b'\x1f\x8b\x08'),
+    ('tar', b'a.txt'.ljust(257, b'\x00') + b'ustar'),
+    ('mobi', b' ' * 60 + b'BOOKMOBI'),
+    ('bmp', b'BM\x36\x00\x0c\x00\x00\x00\x00\x00'),
+    ('executable', b'\x7fELF\x02\x01'),
+    ('text', 'Überblick\n'.encode('utf-8')),
+    ('text', b'BMW annual report'),
+    ('binary', bytes(range(256))),
+])
+def test_format_sniffing(expected, header):
+    from file_handling import sniff_format
+
+    assert sniff_format(header) == expected
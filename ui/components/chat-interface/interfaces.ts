@@ -30,6 +30,25 @@ export interface IAssistantMessage {
   createdAt: Timestamp
 }
 
+export interface ITranscriptMessage {
+  id: string
+  seq: number
+  role: TMessageRole
+  message: string | IMessageItem[]
+  createdAt: Timestamp
+  clientMessageId?: string
+}
+
+export interface ITranscriptSegment {
+  sessionId: string
+  userId: string
+  segment: number
+  startSeq: number
+  endSeq: number
+  messages: ITranscriptMessage[]
+  updatedAt: Timestamp
+}
+
 export interface IMessageItem {
     annotations: any[]
     logprobs: any[]
@@ -2,17 +2,24 @@ import { db } from '@/lib/firebase';
 import { collection, onSnapshot, orderBy, query, Timestamp } from 'firebase/firestore';
 import { httpsCallable, getFunctions } from 'firebase/functions';
 
-import { TMessage, IUserMessage, IAssistantMessage, ISession } from './interfaces';
+import { TMessage, IUserMessage, IAssistantMessage, ISession, ITranscriptSegment } from './interfaces';
 
 
 export function subscribeToSessionMessages(
   sessionId: string,
   onChange: (messages: TMessage[]) => void
 ) {
+  // Sessions are stored either as one document per message (legacy layout) or as
+  // transcript segments holding many messages. Both are listened to and merged,
+  // so sessions keep rendering while they are migrated between layouts.
+  let legacyMessages: TMessage[] = [];
+  let transcriptMessages: TMessage[] = [];
+  const emit = () => onChange(transcriptMessages.length > 0 ? transcriptMessages : legacyMessages);
+
   const messagesRef = collection(db, 'sessions', sessionId, 'messages');
   const q = query(messagesRef, orderBy('createdAt'));
-  const unsubscribe = onSnapshot(q, (snapshot) => {
-    const nextMessages: TMessage[] = snapshot.docs.map((doc) => {
+  const unsubscribeMessages = onSnapshot(q, (snapshot) => {
+    legacyMessages = snapshot.docs.map((doc) => {
       const message = doc.data() as TMessage;
       const createdAt = message.createdAt as Timestamp | undefined;
       
@@ -25,9 +32,29 @@ export function subscribeToSessionMessages(
         return assistantMessage        
       } 
     });
-    onChange(nextMessages);
+    emit();
+  });
+
+  const transcriptRef = collection(db, 'sessions', sessionId, 'transcript');
+  const transcriptQuery = query(transcriptRef, orderBy('endSeq'));
+  const unsubscribeTranscript = onSnapshot(transcriptQuery, (snapshot) => {
+    transcriptMessages = snapshot.docs
+      .flatMap((doc) => {
+        const segment = doc.data() as ITranscriptSegment;
+        return segment.messages.map((message) => ({
+          ...message,
+          sessionId: segment.sessionId,
+          userId: segment.userId,
+        }));
+      })
+      .sort((a, b) => a.seq - b.seq) as TMessage[];
+    emit();
   });
-  return unsubscribe;
+
+  return () => {
+    unsubscribeMessages();
+    unsubscribeTranscript();
+  };
 }
 
 export async function createNewSession(): Promise<{ success: boolean; data?: { sessionId: string; name: string | null }; message?: string }> {
@@ -167,6 +167,8 @@ export function DocumentManagement() {
     // If we have real-time processing status, use that instead
     if (processingStatus) {
       switch (processingStatus.status) {
+        case 'queued':
+          return <Clock className="h-4 w-4 text-gray-500" />;
         case 'uploading':
           return <Clock className="h-4 w-4 text-yellow-500" />;
         case 'processing':
@@ -193,6 +195,10 @@ export function DocumentManagement() {
       return <CheckCircle className="h-4 w-4 text-green-500" />;
     }
     
+    if (status === 'error') {
+      return <AlertCircle className="h-4 w-4 text-red-500" />;
+    }
+    
     // If no processing status exists yet, show uploading icon
     // This happens when a file is uploaded but the Cloud Function hasn't started yet
     return <Clock className="h-4 w-4 text-yellow-500" />;
@@ -206,6 +212,8 @@ export function DocumentManagement() {
         : '';
         
       switch (processingStatus.status) {
+        case 'queued':
+          return 'Waiting to be processed...';
         case 'uploading':
           return `Uploading...${progressText}`;
         case 'processing':
@@ -232,6 +240,10 @@ export function DocumentManagement() {
       return 'Document ready to be queried on chat.';
     }
     
+    if (status === 'error') {
+      return 'Processing failed';
+    }
+    
     // If no processing status exists yet, show uploading state
     // This happens when a file is uploaded but the Cloud Function hasn't started yet
     return 'Uploading...';
@@ -283,7 +295,7 @@ export function DocumentManagement() {
             ref={fileInputRef}
             type="file"
             multiple
-            accept=".pdf,.doc,.docx,.txt"
+            accept=".pdf,.doc,.docx,.txt,.zip,.tar.gz,.tgz"
             onChange={(e) => handleFileUpload(e.target.files)}
             className="hidden"
           />
@@ -336,7 +348,7 @@ export function DocumentManagement() {
                         </p>
                                                  {/* Show progress bar for processing documents */}
                          {((processingStatus && processingStatus.status !== 'completed' && processingStatus.status !== 'failed') || 
-                           (!processingStatus)) && (
+                           (!processingStatus && document.status === 'uploading')) && (
                            <div className="mt-2 w-full bg-gray-200 rounded-full h-1.5">
                              <div 
                                className={`h-1.5 rounded-full transition-all duration-300 ${
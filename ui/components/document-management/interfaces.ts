@@ -10,11 +10,13 @@ export interface Document {
 export interface DocumentProcessingStatus {
   user_id: string;
   file_name: string;
-  status: 'uploading' | 'processing' | 'vectorizing' | 'completed' | 'failed' | 'deleting';
+  status: 'queued' | 'uploading' | 'processing' | 'vectorizing' | 'completed' | 'failed' | 'deleting';
   error_message?: string;
   progress_percentage?: number;
   file_id?: string;
   vector_store_id?: string;
+  archive?: string; // Archive the document was extracted from
+  archive_members?: string[]; // Documents extracted from this archive
   started_at?: Date;
   completed_at?: Date;
   updated_at?: Date;
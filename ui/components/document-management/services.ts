@@ -1,10 +1,33 @@
-import { storage } from '@/lib/firebase';
-import { ref, listAll, getMetadata } from 'firebase/storage';
-import { getFirestore, collection, onSnapshot, query, orderBy, where } from 'firebase/firestore';
+import { getFunctions, httpsCallable } from 'firebase/functions';
+import { getFirestore, collection, doc, onSnapshot, Timestamp } from 'firebase/firestore';
 
 import { Document, DocumentProcessingStatus } from './interfaces';
 
 
+// Entry of the document catalog, as stored in the document_catalogs/{userId}/shards documents
+interface CatalogDocument {
+  name: string;
+  size?: number;
+  status: string;
+  uploaded_at?: Timestamp;
+  updated_at?: Timestamp;
+}
+
+// Catalog statuses as document statuses
+function toDocumentStatus(status: string): Document['status'] {
+  switch (status) {
+    case 'failed':
+      return 'error';
+    case 'deleting':
+      return 'deleting';
+    case 'queued':
+    case 'uploading':
+      return 'uploading';
+    default:
+      return 'completed';
+  }
+}
+
 export function subscribeToDocuments(
   userId: string,
   onChange: (documents: Document[]) => void
@@ -14,52 +37,54 @@ export function subscribeToDocuments(
     return () => {};
   }
 
-  const userDocumentsRef = ref(storage, `user-documents/${userId}`);
+  const firestore = getFirestore();
+  const listDocuments = httpsCallable<{ pageSize: number }, unknown>(getFunctions(), 'list_documents');
+  let catalogRequested = false;
   
-  // Function to fetch and process documents
-  const fetchDocuments = async () => {
-    try {
-      const result = await listAll(userDocumentsRef);
-      const documents: Document[] = [];
-      
-      for (const itemRef of result.items) {
-        try {
-          const metadata = await getMetadata(itemRef);
-          const document: Document = {
-            id: itemRef.name, // Use filename as ID
-            name: itemRef.name,
-            size: metadata.size,
-            status: 'completed' as const, // Default status, will be overridden by processing status if available
-            uploadedAt: new Date(metadata.timeCreated),
-            processedAt: new Date(metadata.updated),
-          };
-          documents.push(document);
-        } catch (error) {
-          console.error(`Error getting metadata for ${itemRef.name}:`, error);
+  // Listen to the catalog shards maintained by the backend; a status change rewrites
+  // a single shard, so only that shard is read again
+  const shardsRef = collection(firestore, 'document_catalogs', userId, 'shards');
+  
+  const unsubscribe = onSnapshot(shardsRef, (snapshot) => {
+    // The catalog of a user who uploaded before it existed is built by the first listing
+    if (snapshot.empty && !catalogRequested) {
+      catalogRequested = true;
+      listDocuments({ pageSize: 1 }).catch((error) => console.error('Error building document catalog:', error));
+    }
+    
+    // An entry briefly sits in two shards while the shards are redistributed, keep the newest
+    const entries = new Map<string, CatalogDocument>();
+    snapshot.forEach((shard) => {
+      const shardEntries: Record<string, CatalogDocument> = shard.data().documents ?? {};
+      for (const entry of Object.values(shardEntries)) {
+        const known = entries.get(entry.name);
+        if (!known || (entry.updated_at?.toMillis() ?? 0) >= (known.updated_at?.toMillis() ?? 0)) {
+          entries.set(entry.name, entry);
         }
       }
-      
-      // Sort documents by upload date (most recent first)
-      documents.sort((a, b) => b.uploadedAt.getTime() - a.uploadedAt.getTime());
-      
-      onChange(documents);
-    } catch (error) {
-      console.error('Error fetching documents:', error);
-      onChange([]);
-    }
-  };
-
-  // Initial fetch
-  fetchDocuments();
-
-  // Set up polling for changes (Firebase Storage doesn't have real-time listeners like Firestore)
-  // We'll poll every 5 seconds to check for new documents
-  const intervalId = setInterval(fetchDocuments, 5000);
+    });
+    
+    const documents: Document[] = Array.from(entries.values()).map((entry) => {
+      const uploadedAt = (entry.uploaded_at ?? entry.updated_at)?.toDate() ?? new Date(0);
+      return {
+        id: entry.name, // Use filename as ID
+        name: entry.name,
+        size: entry.size ?? 0,
+        status: toDocumentStatus(entry.status), // Overridden by the processing status while in flight
+        uploadedAt,
+        processedAt: entry.updated_at?.toDate() ?? uploadedAt,
+      };
+    });
+    
+    // Most recent uploads first, then by name, as the catalog is served by list_documents
+    documents.sort((a, b) => b.uploadedAt.getTime() - a.uploadedAt.getTime() || a.name.localeCompare(b.name));
+    onChange(documents);
+  }, (error) => {
+    console.error('Error listening to document catalog:', error);
+    onChange([]);
+  });
 
-  // Return unsubscribe function
-  return () => {
-    clearInterval(intervalId);
-  };
+  return unsubscribe;
 }
 
 
@@ -74,33 +99,23 @@ export function subscribeToDocumentProcessingStatus(
 
   const firestore = getFirestore();
   
-  // Query the document_processing_status collection and filter by user_id at the database level
-  const statusRef = collection(firestore, 'document_processing_status');
-  const statusQuery = query(
-    statusRef, 
-    where('user_id', '==', userId),
-    orderBy('updated_at', 'desc')
-  );
+  // Listen to the single processing summary of the user, maintained by the pipeline,
+  // instead of every document_processing_status row of the user
+  const summaryRef = doc(firestore, 'user_processing_status', userId);
   
-  const unsubscribe = onSnapshot(statusQuery, (snapshot) => {
-    const statuses: DocumentProcessingStatus[] = [];
-    
-    snapshot.forEach((doc) => {
-      const data = doc.data();
-      statuses.push({
-        user_id: data.user_id,
-        file_name: data.file_name,
-        status: data.status,
-        error_message: data.error_message,
-        progress_percentage: data.progress_percentage,
-        file_id: data.file_id,
-        vector_store_id: data.vector_store_id,
-        started_at: data.started_at?.toDate(),
-        completed_at: data.completed_at?.toDate(),
-        updated_at: data.updated_at?.toDate(),
-      });
-    });
+  const unsubscribe = onSnapshot(summaryRef, (snapshot) => {
+    const files: Record<string, any> = snapshot.data()?.files ?? {};
+    const statuses: DocumentProcessingStatus[] = Object.entries(files).map(([fileName, data]) => ({
+      user_id: userId,
+      file_name: fileName,
+      status: data.status,
+      error_message: data.error_message,
+      progress_percentage: data.progress_percentage,
+      updated_at: data.updated_at?.toDate(),
+    }));
     
+    // Most recently updated first
+    statuses.sort((a, b) => (b.updated_at?.getTime() ?? 0) - (a.updated_at?.getTime() ?? 0));
     onChange(statuses);
   }, (error) => {
     console.error('Error listening to document processing status:', error);